@@ -4,6 +4,7 @@ import eventlet
 from flask import Flask, request, jsonify, render_template, redirect, url_for, g, session, current_app
 from flask_socketio import SocketIO
 from flask_cors import CORS  # Added CORS import
+from werkzeug.middleware.proxy_fix import ProxyFix
 import atexit
 from datetime import datetime, timedelta
 
@@ -13,10 +14,16 @@ import config
 # Import services
 from services.coffee_system import CoffeeOrderSystem
 from services.messaging import MessagingService
+from services.sms_outbox import SmsOutbox, PostgresOutboxStore, TwilioTransport, FakeTwilioTransport
+from services.sms_inbox import SmsInbox, PostgresInboxStore
 from services.nlp import NLPService
+from services.settings_service import get_settings_service
+from services.order_events import get_order_event_stream
+from services.wait_time_predictor import get_wait_time_predictor
+from services.user_cache import get_user_cache
 
 # Import JWT authentication
-from auth import init_app as init_jwt, jwt, generate_tokens
+from auth import init_app as init_jwt, jwt, generate_tokens, login_throttled, record_login_result
 
 # Import models
 try:
@@ -31,14 +38,15 @@ from models.stations import Station, StationSchedule
 from models.inventory import InventoryItem  # Add inventory model import
 
 # Import utils for database connection
-from utils.database import get_db_connection, close_connection
+from utils.database import get_db_connection, close_connection, get_schema_capabilities, init_app as init_request_db
+from utils.log_queue import get_log_queue
 
 # Import routes
 # from routes.admin_routes import bp as admin_bp  # Disabled - causes template errors
 from routes.admin_redirect import bp as admin_bp  # Simple redirect to avoid errors
 from routes.barista_routes import bp as barista_bp  
 from routes.customer_routes import bp as customer_bp
-from routes.sms_routes import bp as sms_bp
+from routes.sms_routes import bp as sms_bp, handle_queued_sms
 from routes.inventory_routes import bp as inventory_bp  # Add inventory routes import
 from routes.station_api_routes import bp as station_api_bp  # Add station API routes import
 
@@ -182,6 +190,13 @@ def create_app():
     app = Flask(__name__, static_folder='static', static_url_path='/static')
     app.secret_key = config.SECRET_KEY
     
+    # Behind a proxy every request comes from the proxy's address; take the
+    # client address and scheme from the headers the trusted hops add, so
+    # per-address login throttling sees real clients
+    if config.PROXY_FIX_HOPS:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config.PROXY_FIX_HOPS, x_proto=config.PROXY_FIX_HOPS)
+        logger.info(f"Trusting forwarded headers from {config.PROXY_FIX_HOPS} proxy hop(s)")
+    
     # JWT configuration - use the JWT_SECRET_KEY from config
     app.config['JWT_SECRET_KEY'] = config.JWT_SECRET_KEY
     app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(seconds=config.JWT_ACCESS_TOKEN_EXPIRES)
@@ -232,6 +247,10 @@ def create_app():
         logger.error(f"Error initializing security features: {e}")
         # Don't fail startup for security feature errors in development
     
+    # Log files and the console are written from one background thread from
+    # here on; security monitoring has added its file loggers by now
+    get_log_queue().start()
+    
     # Production CORS configuration - restrictive by default
     allowed_origins = config.CORS_ALLOWED_ORIGINS
     if isinstance(allowed_origins, str):
@@ -262,7 +281,7 @@ def create_app():
         response.headers.add('Access-Control-Allow-Credentials', 'true')
         # Only log CORS headers for non-OPTIONS requests to reduce log noise
         if request.method != 'OPTIONS':
-            logger.info(f"Added CORS headers to response for: {request.path}")
+            logger.debug("Added CORS headers to response for: %s", request.path)
         return response
     
     # Handle OPTIONS requests explicitly for CORS preflight
@@ -290,6 +309,10 @@ def create_app():
         
         coffee_system = CoffeeOrderSystem(db, vars(config))
         logger.info(f"Database initialized successfully using PostgreSQL")
+        
+        # Give each request its own pooled connection, returned on teardown
+        init_request_db(app)
+        logger.info("Request-scoped database connections enabled")
     except Exception as e:
         logger.error(f"Error initializing database with PostgreSQL: {str(e)}")
         raise # Re-raise to fail fast - PostgreSQL is required
@@ -301,6 +324,54 @@ def create_app():
         testing_mode=config.TESTING_MODE
     )
     
+    # Deliver outbound SMS from a background queue so handlers never wait on Twilio
+    sms_outbox = None
+    if config.SMS_OUTBOX_ENABLED and not config.TESTING_MODE:
+        if config.SMS_FAKE_TRANSPORT:
+            transport = FakeTwilioTransport()
+            logger.warning("SMS outbox using fake Twilio transport - no real messages will be sent")
+        elif messaging_service.client:
+            transport = TwilioTransport(messaging_service.client, config.TWILIO_PHONE_NUMBER)
+        else:
+            transport = None
+        
+        if transport:
+            sms_outbox = SmsOutbox(
+                transport,
+                store=PostgresOutboxStore(),
+                workers=config.SMS_OUTBOX_WORKERS,
+                rate_limit=config.SMS_RATE_LIMIT,
+                max_attempts=config.SMS_MAX_ATTEMPTS,
+                retry_base_delay=config.SMS_RETRY_BASE_DELAY,
+                lease_seconds=config.SMS_OUTBOX_LEASE
+            )
+            sms_outbox.start()
+            messaging_service.attach_outbox(sms_outbox)
+    
+    # Store inbound SMS and process them on worker threads so the webhook can ack Twilio at once.
+    # Testing mode has no REST delivery for replies, so it keeps the inline TwiML path.
+    sms_inbox = None
+    if config.SMS_INBOX_ENABLED and not config.TESTING_MODE:
+        sms_inbox = SmsInbox(
+            lambda message: handle_queued_sms(app, message),
+            store=PostgresInboxStore(),
+            workers=config.SMS_INBOX_WORKERS,
+            lease_seconds=config.SMS_INBOX_LEASE
+        )
+        sms_inbox.start()
+    
+    # Reload settings as soon as another worker changes one, instead of at the next poll
+    if config.SETTINGS_LISTEN_ENABLED and not config.TESTING_MODE:
+        get_settings_service().start_listener(config.DATABASE_URL)
+    
+    # Drop cached conversations as soon as another worker writes them
+    if config.CONVERSATION_LISTEN_ENABLED and not config.TESTING_MODE:
+        coffee_system.conversation_store.start_listener(config.DATABASE_URL)
+    
+    # Drop cached users as soon as any worker changes or revokes them
+    if config.USER_CACHE_LISTEN_ENABLED and not config.TESTING_MODE:
+        get_user_cache().start_listener(config.DATABASE_URL)
+    
     # Register route blueprints
     app.register_blueprint(admin_bp)
     app.register_blueprint(barista_bp)
@@ -404,6 +475,8 @@ def create_app():
     app.config.update({
         'coffee_system': coffee_system,
         'messaging_service': messaging_service,
+        'sms_outbox': sms_outbox,
+        'sms_inbox': sms_inbox,
         'config': vars(config),
         'socketio': socketio  # Add socketio to app config
     })
@@ -421,6 +494,12 @@ def create_app():
         except ImportError:
             logger.warning("WebSocket routes not found, real-time updates disabled")
     
+    # Push committed order changes to barista and display clients as sequenced deltas
+    if config.ORDER_EVENTS_ENABLED and not config.TESTING_MODE:
+        # Completions heard on the stream keep wait time estimates current
+        get_order_event_stream().subscribe(get_wait_time_predictor().observe)
+        get_order_event_stream().start(socketio, config.DATABASE_URL)
+    
     # Initialize database and create tables if they don't exist
     with app.app_context():
         db = coffee_system.db
@@ -446,6 +525,9 @@ def create_app():
         db.commit()
         logger.info("Settings table created or already exists")
         
+        # Handlers check tables and columns against this instead of the catalog
+        get_schema_capabilities().load(db)
+        
         # Check if we need to create a default admin user
         cursor = db.cursor()
         
@@ -475,42 +557,25 @@ def create_app():
     # Make context available to templates
     @app.context_processor
     def inject_context():
-        # Get coffee system from app context
-        coffee_system = current_app.config.get('coffee_system')
-        db = coffee_system.db
-        
-        # Get settings from database
-        cursor = db.cursor()
+        # Settings are served from memory by the settings service
+        settings = get_settings_service()
         
         # System name (default to 'Coffee Cue')
-        cursor.execute("SELECT value FROM settings WHERE key = %s", ('system_name',))
-        system_name_result = cursor.fetchone()
-        system_name = system_name_result[0] if system_name_result else 'Coffee Cue'
+        system_name = settings.get('system_name', 'Coffee Cue')
         
         # Event name
-        cursor.execute("SELECT value FROM settings WHERE key = %s", ('event_name',))
-        event_name_result = cursor.fetchone()
-        event_name = event_name_result[0] if event_name_result else config.EVENT_NAME
+        event_name = settings.get('event_name', config.EVENT_NAME)
         
         # Check if JWT is enabled
-        cursor.execute("SELECT value FROM settings WHERE key = %s", ('jwt_enabled',))
-        jwt_enabled_result = cursor.fetchone()
-        jwt_enabled = jwt_enabled_result[0].lower() in ('true', 'yes', '1', 't', 'y') if jwt_enabled_result else True
+        jwt_enabled = settings.get_bool('jwt_enabled', True)
         
         # Sponsor info if enabled
-        cursor.execute("SELECT value FROM settings WHERE key = %s", ('sponsor_display_enabled',))
-        sponsor_display_result = cursor.fetchone()
-        sponsor_display_enabled = sponsor_display_result[0].lower() in ('true', 'yes', '1', 't', 'y') if sponsor_display_result else False
+        sponsor_display_enabled = settings.get_bool('sponsor_display_enabled', False)
         
         sponsor_info = None
         if sponsor_display_enabled:
-            cursor.execute("SELECT value FROM settings WHERE key = %s", ('sponsor_name',))
-            sponsor_name_result = cursor.fetchone()
-            sponsor_name = sponsor_name_result[0] if sponsor_name_result else ''
-            
-            cursor.execute("SELECT value FROM settings WHERE key = %s", ('sponsor_message',))
-            sponsor_message_result = cursor.fetchone()
-            sponsor_message = sponsor_message_result[0] if sponsor_message_result else 'Coffee service proudly sponsored by {sponsor}'
+            sponsor_name = settings.get('sponsor_name', '')
+            sponsor_message = settings.get('sponsor_message', 'Coffee service proudly sponsored by {sponsor}')
         
         # Format sponsor message
         if sponsor_display_enabled and sponsor_name and '{sponsor}' in sponsor_message:
@@ -560,6 +625,12 @@ def create_app():
                     'message': 'Username and password are required'
                 }), 400
             
+            if login_throttled(username):
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Too many failed login attempts. Please try again later.'
+                }), 429
+            
             # Get database connection
             conn = get_db_connection()
             cursor = conn.cursor()
@@ -570,6 +641,7 @@ def create_app():
             
             if not user:
                 logger.warning(f"Failed login attempt for non-existent user: {username}")
+                record_login_result(username, False)
                 return jsonify({
                     'status': 'error',
                     'message': 'Invalid username or password'
@@ -599,11 +671,14 @@ def create_app():
             
             if not password_correct:
                 logger.warning(f"Failed login attempt for user: {username}")
+                record_login_result(username, False)
                 return jsonify({
                     'status': 'error',
                     'message': 'Invalid username or password'
                 }), 401
             
+            record_login_result(username, True)
+            
             # Get user ID, username, email, and role
             user_id = user[0]
             username = user[1]
@@ -619,7 +694,9 @@ def create_app():
                     account_locked = FALSE,
                     account_locked_until = NULL
                 WHERE id = %s
+                RETURNING token_version
             ''', (datetime.now(), user_id))
+            token_version = cursor.fetchone()[0]
             conn.commit()
             
             # Create user data for token generation
@@ -628,7 +705,8 @@ def create_app():
                 'username': username,
                 'email': email,
                 'role': role,
-                'full_name': full_name
+                'full_name': full_name,
+                'token_version': token_version
             }
             
             # Generate tokens
@@ -668,54 +746,15 @@ def create_app():
         try:
             # Get coffee system from app context
             coffee_system = current_app.config.get('coffee_system')
-            db = coffee_system.db
             
-            # Query database for pending orders
-            cursor = db.cursor()
-            cursor.execute('''
-                SELECT id, order_number, status, station_id, 
-                       created_at, phone, order_details, queue_priority
-                FROM orders 
-                WHERE status = 'pending'
-                ORDER BY queue_priority, created_at DESC
-            ''')
+            # One joined query for the whole queue (no per-order name lookups)
+            orders = Order.get_queue(coffee_system.db, 'pending', ordering='priority_newest')
             
-            # Process orders
             pending_orders = []
-            for order in cursor.fetchall():
-                # Extract order details
-                order_id, order_number, status, station_id, created_at, phone, order_details_json, priority = order
-                
-                # Parse order details
-                import json
-                if isinstance(order_details_json, str):
-                    order_details = json.loads(order_details_json)
-                else:
-                    order_details = order_details_json
-                
-                # Calculate wait time
-                created_dt = datetime.fromisoformat(created_at) if isinstance(created_at, str) else created_at
-                wait_time = int((datetime.now() - created_dt).total_seconds() / 60)
-                
-                # Get customer name
-                cursor.execute("SELECT name FROM customer_preferences WHERE phone = %s", (phone,))
-                customer_result = cursor.fetchone()
-                customer_name = customer_result[0] if customer_result else order_details.get('name', 'Customer')
-                
-                # Format order for frontend
-                pending_orders.append({
-                    'id': f'order_{order_id}',  # Keep same format as original
-                    'order_number': order_number,
-                    'customerName': customer_name,
-                    'coffeeType': order_details.get('type', 'Coffee'),
-                    'milkType': order_details.get('milk', 'Standard'),
-                    'sugar': order_details.get('sugar', 'No sugar'),
-                    'status': status,
-                    'createdAt': created_at,
-                    'waitTime': wait_time,
-                    'promisedTime': 15,  # Default to 15 minutes
-                    'priority': priority == 1  # Convert 1/0 to True/False
-                })
+            for order in orders:
+                order_json = Order.to_queue_json(order, camel_case=True)
+                order_json['id'] = f"order_{order['id']}"  # Keep same format as original
+                pending_orders.append(order_json)
             
             return jsonify(pending_orders)
         
@@ -733,63 +772,14 @@ def create_app():
         try:
             # Get coffee system from app context
             coffee_system = current_app.config.get('coffee_system')
-            db = coffee_system.db
             
-            # Query database for in-progress orders
-            cursor = db.cursor()
-            cursor.execute('''
-                SELECT id, order_number, status, station_id, 
-                       created_at, phone, order_details, queue_priority
-                FROM orders 
-                WHERE status = 'in-progress'
-                ORDER BY created_at
-            ''')
+            orders = Order.get_queue(coffee_system.db, 'in-progress', ordering='oldest')
             
-            # Process orders
             in_progress_orders = []
-            for order in cursor.fetchall():
-                # Extract order details
-                order_id, order_number, status, station_id, created_at, phone, order_details_json, priority = order
-                
-                # Parse order details
-                import json
-                if isinstance(order_details_json, str):
-                    order_details = json.loads(order_details_json)
-                else:
-                    order_details = order_details_json
-                
-                # Calculate wait time
-                created_dt = datetime.fromisoformat(created_at) if isinstance(created_at, str) else created_at
-                wait_time = int((datetime.now() - created_dt).total_seconds() / 60)
-                
-                # Get customer name
-                cursor.execute("SELECT name FROM customer_preferences WHERE phone = %s", (phone,))
-                customer_result = cursor.fetchone()
-                customer_name = customer_result[0] if customer_result else order_details.get('name', 'Customer')
-                
-                # Check for extra hot
-                extra_hot = False
-                if 'temp' in order_details and order_details['temp'] == 'extra hot':
-                    extra_hot = True
-                # Also check the notes field for "extra hot" text
-                elif 'notes' in order_details and order_details['notes'] and 'extra hot' in order_details['notes'].lower():
-                    extra_hot = True
-                
-                # Format order for frontend
-                in_progress_orders.append({
-                    'id': f'order_in_progress_{order_id}',
-                    'order_number': order_number,
-                    'customerName': customer_name,
-                    'phoneNumber': phone,
-                    'coffeeType': order_details.get('type', 'Coffee'),
-                    'milkType': order_details.get('milk', 'Standard'),
-                    'sugar': order_details.get('sugar', 'No sugar'),
-                    'extraHot': extra_hot,
-                    'priority': priority == 1,
-                    'createdAt': created_at,
-                    'waitTime': wait_time,
-                    'promisedTime': 15  # Default to 15 minutes
-                })
+            for order in orders:
+                order_json = Order.to_queue_json(order, camel_case=True)
+                order_json['id'] = f"order_in_progress_{order['id']}"
+                in_progress_orders.append(order_json)
             
             return jsonify(in_progress_orders)
         
@@ -807,49 +797,14 @@ def create_app():
         try:
             # Get coffee system from app context
             coffee_system = current_app.config.get('coffee_system')
-            db = coffee_system.db
             
-            # Query database for completed orders
-            cursor = db.cursor()
-            cursor.execute('''
-                SELECT id, order_number, status, station_id, 
-                       created_at, completed_at, picked_up_at, phone, order_details, queue_priority
-                FROM orders 
-                WHERE status = 'completed'
-                ORDER BY completed_at DESC
-                LIMIT 20
-            ''')
+            orders = Order.get_queue(coffee_system.db, 'completed', ordering='recently_completed', limit=20)
             
-            # Process orders
             completed_orders = []
-            for order in cursor.fetchall():
-                # Extract order details
-                order_id, order_number, status, station_id, created_at, completed_at, picked_up_at, phone, order_details_json, priority = order
-                
-                # Parse order details
-                import json
-                if isinstance(order_details_json, str):
-                    order_details = json.loads(order_details_json)
-                else:
-                    order_details = order_details_json
-                
-                # Get customer name
-                cursor.execute("SELECT name FROM customer_preferences WHERE phone = %s", (phone,))
-                customer_result = cursor.fetchone()
-                customer_name = customer_result[0] if customer_result else order_details.get('name', 'Customer')
-                
-                # Format order for frontend
-                completed_orders.append({
-                    'id': f'order_completed_{order_id}',
-                    'order_number': order_number,
-                    'customerName': customer_name,
-                    'phoneNumber': phone,
-                    'coffeeType': order_details.get('type', 'Coffee'),
-                    'milkType': order_details.get('milk', 'Standard'),
-                    'completedAt': completed_at,
-                    'pickedUpAt': picked_up_at,
-                    'pickedUp': picked_up_at is not None
-                })
+            for order in orders:
+                order_json = Order.to_queue_json(order, camel_case=True)
+                order_json['id'] = f"order_completed_{order['id']}"
+                completed_orders.append(order_json)
             
             return jsonify(completed_orders)
         
@@ -869,10 +824,8 @@ def create_app():
             coffee_system = current_app.config.get('coffee_system')
             db = coffee_system.db
             
-            # Check if chat_messages table exists
             cursor = db.cursor()
-            cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'chat_messages')")
-            table_exists = cursor.fetchone()[0]
+            table_exists = get_schema_capabilities().has_table('chat_messages')
             
             if table_exists:
                 # Query database for chat messages
@@ -1359,7 +1312,18 @@ def create_app():
     @atexit.register
     def cleanup():
         logger.info("Application shutting down, cleaning up resources...")
+        sms_inbox = app.config.get('sms_inbox')
+        if sms_inbox:
+            sms_inbox.stop()
+            logger.info("SMS inbox workers stopped")
+        sms_outbox = app.config.get('sms_outbox')
+        if sms_outbox:
+            sms_outbox.stop()
+            logger.info("SMS outbox workers stopped")
         coffee_system = app.config.get('coffee_system')
+        if coffee_system and hasattr(coffee_system, 'conversation_store'):
+            coffee_system.conversation_store.close()
+            logger.info("Pending conversation states flushed")
         if coffee_system and hasattr(coffee_system, 'db'):
             close_connection(coffee_system.db)
             logger.info("Database connection closed")
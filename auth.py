@@ -9,6 +9,7 @@ from datetime import datetime, timedelta
 import hashlib
 import secrets
 from utils.database import get_db_connection, close_connection
+from services.user_cache import get_user_cache
 from functools import wraps
 
 # Configure logging
@@ -70,38 +71,12 @@ def init_app(app):
     # Register user loader
     @jwt.user_lookup_loader
     def user_lookup_callback(_jwt_header, jwt_data):
-        """Load user from database based on JWT identity"""
+        """Load user for the JWT identity from the user cache"""
         identity = jwt_data["sub"]
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            # Get user from database
-            cursor.execute('SELECT id, username, email, role, full_name FROM users WHERE id = %s', (identity,))
-            user = cursor.fetchone()
-            
-            if user:
-                user_data = {
-                    'id': user[0],
-                    'username': user[1],
-                    'email': user[2],
-                    'role': user[3],
-                    'full_name': user[4] if len(user) > 4 else None
-                }
-                
-                return user_data
-            
-            logger.warning(f"User with ID {identity} not found in database")
-            return None
-        
-        except Exception as e:
-            logger.error(f"Error looking up user: {str(e)}")
-            return None
-        finally:
-            if 'cursor' in locals() and cursor:
-                cursor.close()
-            if 'conn' in locals() and conn:
-                close_connection(conn)
+        user_data = get_user_cache().get(identity, jwt_data.get('token_version', 0))
+        if user_data is None:
+            logger.warning(f"User with ID {identity} not found or token revoked")
+        return user_data
     
     # Handle user lookup errors
     @jwt.user_lookup_error_loader
@@ -202,7 +177,8 @@ def generate_tokens(user_data):
     Generate access and refresh tokens for a user
     
     Args:
-        user_data: Dictionary with user information (id, username, email, role)
+        user_data: Dictionary with user information (id, username, email, role,
+            token_version)
         
     Returns:
         Dictionary with tokens and expiration
@@ -217,7 +193,8 @@ def generate_tokens(user_data):
             'username': user_data.get('username', ''),
             'email': user_data.get('email', ''),
             'role': user_data.get('role', 'user'),
-            'full_name': user_data.get('full_name', '')
+            'full_name': user_data.get('full_name', ''),
+            'token_version': user_data.get('token_version', 0)
         }
         
         # Create tokens
@@ -239,6 +216,71 @@ def generate_tokens(user_data):
         logger.error(f"Error generating tokens: {str(e)}")
         raise
 
+# Failed logins allowed per hour before further attempts are refused. The
+# username limit is per client address too, so guessing at someone's password
+# never locks them out from their own address. The counters live in each
+# worker process (services/rate_counters.py), so with N workers a client can
+# make up to N times as many attempts before every worker refuses it
+LOGIN_USER_THRESHOLD = 5        # Per username and client address
+LOGIN_ADDRESS_THRESHOLD = 20    # Per client address, across usernames
+
+def _login_user_prefix(username):
+    return f"user:{(username or '').lower()}|"
+
+def _login_identifiers(username):
+    return f"{_login_user_prefix(username)}{request.remote_addr}", f"ip:{request.remote_addr}"
+
+def login_throttled(username):
+    """
+    Check whether a login should be refused without checking the password
+    
+    Args:
+        username: Username being logged in as
+        
+    Returns:
+        True if the username from this client address, or the client
+        address across usernames, has failed too often in the last hour
+    """
+    from security_monitoring import BruteForceProtection
+    user_key, address_key = _login_identifiers(username)
+    return (BruteForceProtection.is_blocked(user_key, LOGIN_USER_THRESHOLD)
+            or BruteForceProtection.is_blocked(address_key, LOGIN_ADDRESS_THRESHOLD))
+
+def record_login_result(username, success):
+    """
+    Count a failed login against the username and client address, or
+    clear the username's failures from this address after a successful one
+    
+    Args:
+        username: Username being logged in as
+        success: Whether the password was correct
+    """
+    from security_monitoring import BruteForceProtection
+    user_key, address_key = _login_identifiers(username)
+    if success:
+        BruteForceProtection.clear_attempts(user_key)
+    else:
+        BruteForceProtection.record_failed_attempt(user_key, LOGIN_USER_THRESHOLD)
+        BruteForceProtection.record_failed_attempt(address_key, LOGIN_ADDRESS_THRESHOLD)
+
+def clear_login_lockout(username=None, address=None):
+    """
+    Forget failed logins so a locked-out username or client address can
+    try again straight away. Only clears this worker's counters
+    
+    Args:
+        username: Username to unlock (from the given address, or from
+            every address if none is given)
+        address: Client address to unlock
+    """
+    from security_monitoring import BruteForceProtection
+    if username and address:
+        BruteForceProtection.clear_attempts(f"{_login_user_prefix(username)}{address}")
+    elif username:
+        BruteForceProtection.clear_attempts_prefix(_login_user_prefix(username))
+    if address:
+        BruteForceProtection.clear_attempts(f"ip:{address}")
+
 def verify_login(username, password):
     """
     Verify login credentials and return user data if valid
@@ -251,19 +293,24 @@ def verify_login(username, password):
         User data dictionary if credentials are valid, None otherwise
     """
     try:
+        if login_throttled(username):
+            logger.warning(f"Refusing login for {username}: too many recent failures")
+            return None
+        
         # Get database connection
         conn = get_db_connection()
         cursor = conn.cursor()
         
         # Get user from database
-        cursor.execute('SELECT id, username, email, password_hash, role, full_name FROM users WHERE username = %s', (username,))
+        cursor.execute('SELECT id, username, email, password_hash, role, full_name, token_version FROM users WHERE username = %s', (username,))
         user = cursor.fetchone()
         
         if not user:
             logger.warning(f"Failed login attempt for non-existent user: {username}")
+            record_login_result(username, False)
             return None
             
-        user_id, user_username, user_email, password_hash, user_role, user_full_name = user
+        user_id, user_username, user_email, password_hash, user_role, user_full_name, token_version = user
         
         # Check if it's a werkzeug hash (starts with known prefixes)
         if password_hash and any(password_hash.startswith(prefix) for prefix in ['pbkdf2:', 'scrypt:', 'argon2:']):
@@ -282,8 +329,11 @@ def verify_login(username, password):
             
         if not password_correct:
             logger.warning(f"Failed login attempt for user: {username}")
+            record_login_result(username, False)
             return None
         
+        record_login_result(username, True)
+        
         # Update last login
         cursor.execute('''
             UPDATE users 
@@ -301,7 +351,8 @@ def verify_login(username, password):
             'username': user_username,
             'email': user_email,
             'role': user_role,
-            'full_name': user_full_name if user_full_name else ''
+            'full_name': user_full_name if user_full_name else '',
+            'token_version': token_version
         }
         
         logger.info(f"User {username} login credentials verified")
@@ -376,27 +427,13 @@ def refresh_access_token(refresh_token):
         decoded_token = decode_token(refresh_token)
         user_id = decoded_token['sub']
         
-        # Get database connection
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        # Get user from the user cache; revoked refresh tokens get None
+        user_data = get_user_cache().get(user_id, decoded_token.get('token_version', 0))
         
-        # Get user from database
-        cursor.execute('SELECT id, username, email, role, full_name FROM users WHERE id = %s', (user_id,))
-        user = cursor.fetchone()
-        
-        if not user:
-            logger.warning(f"Refresh token for non-existent user: {user_id}")
+        if not user_data:
+            logger.warning(f"Refresh token for non-existent user or revoked token: {user_id}")
             return None
         
-        # Create user data for token generation
-        user_data = {
-            'id': user[0],
-            'username': user[1],
-            'email': user[2],
-            'role': user[3],
-            'full_name': user[4] if len(user) > 4 else ""
-        }
-        
         # Generate new access token
         identity = user_data['id']
         
@@ -405,7 +442,8 @@ def refresh_access_token(refresh_token):
             'username': user_data.get('username', ''),
             'email': user_data.get('email', ''),
             'role': user_data.get('role', 'user'),
-            'full_name': user_data.get('full_name', '')
+            'full_name': user_data.get('full_name') or '',
+            'token_version': user_data['token_version']
         }
         
         # Create new access token
@@ -425,11 +463,6 @@ def refresh_access_token(refresh_token):
     except Exception as e:
         logger.error(f"Error refreshing token: {str(e)}")
         return None
-    finally:
-        if 'cursor' in locals() and cursor:
-            cursor.close()
-        if 'conn' in locals() and conn:
-            close_connection(conn)
 
 def jwt_required_with_demo(optional=False):
     """
@@ -20,6 +20,7 @@ DATABASE_URL = os.getenv('DATABASE_URL', 'postgresql://localhost/expresso')
 # Database connection pool settings
 DB_POOL_MIN_CONNECTIONS = int(os.getenv('DB_POOL_MIN_CONNECTIONS', 1))
 DB_POOL_MAX_CONNECTIONS = int(os.getenv('DB_POOL_MAX_CONNECTIONS', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))  # Seconds to wait for a free pooled connection
 
 # PostgreSQL specific settings
 PG_SCHEMA = os.getenv('PG_SCHEMA', 'public')
@@ -32,10 +33,36 @@ TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
 TESTING_MODE = os.getenv('TESTING_MODE', 'False').lower() == 'true'
 
+# Outbound SMS queue
+SMS_OUTBOX_ENABLED = os.getenv('SMS_OUTBOX_ENABLED', 'True').lower() == 'true'
+SMS_OUTBOX_WORKERS = int(os.getenv('SMS_OUTBOX_WORKERS', 4))
+SMS_RATE_LIMIT = float(os.getenv('SMS_RATE_LIMIT', 10))  # Messages per second
+SMS_MAX_ATTEMPTS = int(os.getenv('SMS_MAX_ATTEMPTS', 5))
+SMS_RETRY_BASE_DELAY = float(os.getenv('SMS_RETRY_BASE_DELAY', 2))  # Seconds, doubled per attempt
+SMS_OUTBOX_LEASE = float(os.getenv('SMS_OUTBOX_LEASE', 600))  # Seconds before a stopped worker's messages are taken over
+SMS_FAKE_TRANSPORT = os.getenv('SMS_FAKE_TRANSPORT', 'False').lower() == 'true'  # Offline load testing
+
+# Inbound SMS processing
+SMS_INBOX_ENABLED = os.getenv('SMS_INBOX_ENABLED', 'True').lower() == 'true'
+SMS_INBOX_WORKERS = int(os.getenv('SMS_INBOX_WORKERS', 4))
+SMS_INBOX_LEASE = float(os.getenv('SMS_INBOX_LEASE', 600))  # Seconds before a stopped worker's messages are taken over
+
+# Settings cache
+SETTINGS_LISTEN_ENABLED = os.getenv('SETTINGS_LISTEN_ENABLED', 'True').lower() == 'true'  # LISTEN for changes from other workers
+
+# Authenticated user cache
+USER_CACHE_LISTEN_ENABLED = os.getenv('USER_CACHE_LISTEN_ENABLED', 'True').lower() == 'true'  # LISTEN for user changes from other workers
+
+# Live order events over Socket.IO
+ORDER_EVENTS_ENABLED = os.getenv('ORDER_EVENTS_ENABLED', 'True').lower() == 'true'
+
 # Flask configuration
 SECRET_KEY = os.getenv('SECRET_KEY', hashlib.sha256(os.urandom(32)).hexdigest())
 DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
 PORT = int(os.getenv('PORT', 5001))  # Changed from default 5000 to avoid macOS AirPlay conflict
+# Reverse proxies in front of the app whose X-Forwarded-For/-Proto to trust;
+# Railway's edge proxy is one hop
+PROXY_FIX_HOPS = int(os.getenv('PROXY_FIX_HOPS', 1 if os.getenv('RAILWAY_ENVIRONMENT') else 0))
 
 # JWT Configuration
 JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', SECRET_KEY)
@@ -68,6 +95,12 @@ MAX_QUEUE_SIZE = int(os.getenv('MAX_QUEUE_SIZE', 50))
 RUSH_THRESHOLD = int(os.getenv('RUSH_THRESHOLD', 10))
 NUM_STATIONS = int(os.getenv('NUM_STATIONS', 3))
 
+# SMS conversation state cache
+CONVERSATION_CACHE_SIZE = int(os.getenv('CONVERSATION_CACHE_SIZE', 5000))
+CONVERSATION_CACHE_TTL = int(os.getenv('CONVERSATION_CACHE_TTL', 21600))  # 6 hours in seconds
+CONVERSATION_FLUSH_INTERVAL = float(os.getenv('CONVERSATION_FLUSH_INTERVAL', 1.0))  # Seconds between batched writes
+CONVERSATION_LISTEN_ENABLED = os.getenv('CONVERSATION_LISTEN_ENABLED', 'True').lower() == 'true'  # LISTEN for other workers' writes
+
 # Loyalty program settings
 LOYALTY_POINTS_PER_ORDER = int(os.getenv('LOYALTY_POINTS_PER_ORDER', 10))
 LOYALTY_POINTS_FOR_FREE_COFFEE = int(os.getenv('LOYALTY_POINTS_FOR_FREE_COFFEE', 100))
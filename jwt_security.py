@@ -8,71 +8,76 @@ from flask import current_app
 from flask_jwt_extended import get_jwt, get_jwt_identity
 import logging
 
+from utils.expiring_store import ExpiringStore
+
 logger = logging.getLogger(__name__)
 
+def _connect_store(redis_url, name):
+    """Redis client for redis_url, or an in-process ExpiringStore without one
+    (or if Redis is unreachable); both answer the same calls"""
+    if redis_url:
+        try:
+            client = redis.from_url(redis_url, decode_responses=True)
+            client.ping()  # Test connection
+            logger.info(f"{name} initialized with Redis")
+            return client, True
+        except Exception as e:
+            logger.warning(f"Redis connection failed for {name}, using memory store: {e}")
+    else:
+        logger.info(f"{name} initialized with memory store")
+    return ExpiringStore(), False
+
 class TokenBlacklist:
-    """JWT token blacklisting service"""
+    """JWT token blacklisting service
+    
+    Entries expire when the token itself would, so the blacklist only ever
+    holds tokens that could still be presented.
+    """
     
     def __init__(self, redis_url=None):
         """Initialize with Redis or in-memory fallback"""
-        self.use_redis = False
-        self.memory_blacklist = set()
-        
-        if redis_url:
-            try:
-                self.redis_client = redis.from_url(redis_url)
-                self.redis_client.ping()  # Test connection
-                self.use_redis = True
-                logger.info("TokenBlacklist initialized with Redis")
-            except Exception as e:
-                logger.warning(f"Redis connection failed, using memory store: {e}")
-                self.use_redis = False
-        else:
-            logger.info("TokenBlacklist initialized with memory store")
+        self.store, self.use_redis = _connect_store(redis_url, "TokenBlacklist")
     
     def blacklist_token(self, jti, expires_at):
-        """Add token to blacklist"""
-        if self.use_redis:
-            # Calculate TTL based on token expiry
-            ttl = int((expires_at - datetime.utcnow()).total_seconds())
-            if ttl > 0:
-                self.redis_client.setex(f"blacklist:{jti}", ttl, "true")
-        else:
-            self.memory_blacklist.add(jti)
+        """Add token to blacklist until expires_at (UTC)"""
+        ttl = int((expires_at - datetime.utcnow()).total_seconds())
+        if ttl > 0:
+            self.store.setex(f"blacklist:{jti}", ttl, "true")
         
         logger.info(f"Token {jti} blacklisted")
     
     def is_blacklisted(self, jti):
         """Check if token is blacklisted"""
-        if self.use_redis:
-            return self.redis_client.exists(f"blacklist:{jti}")
-        else:
-            return jti in self.memory_blacklist
+        return bool(self.store.exists(f"blacklist:{jti}"))
     
     def cleanup_expired(self):
-        """Clean up expired tokens (for memory store)"""
+        """Purge expired entries now (Redis and the memory store also purge on their own)"""
         if not self.use_redis:
-            # This is a simplified cleanup - in production you'd track expiry times
-            # For now, clear all after 24 hours (you'd implement proper expiry tracking)
-            pass
+            self.store.purge()
 
 class SessionManager:
-    """Enhanced session management with timeout tracking"""
+    """Enhanced session management with timeout tracking
+    
+    Each session key's TTL is the idle timeout and is pushed back on
+    activity. user_sessions:<user_id> sets index sessions by user; members
+    whose session has gone are dropped when the set is next read or added to.
+    """
     
     def __init__(self, redis_url=None, session_timeout_minutes=60):
         """Initialize session manager"""
         self.session_timeout = timedelta(minutes=session_timeout_minutes)
-        self.use_redis = False
-        self.memory_sessions = {}
-        
-        if redis_url:
-            try:
-                self.redis_client = redis.from_url(redis_url)
-                self.redis_client.ping()
-                self.use_redis = True
-                logger.info("SessionManager initialized with Redis")
-            except Exception as e:
-                logger.warning(f"Redis connection failed for sessions: {e}")
+        self.store, self.use_redis = _connect_store(redis_url, "SessionManager")
+    
+    def _live_sessions(self, user_key):
+        """Session data for each live member of a user's set, pruning the rest"""
+        sessions = []
+        for jti in self.store.smembers(user_key):
+            session_data = self.store.get(f"session:{jti}")
+            if session_data:
+                sessions.append(json.loads(session_data))
+            else:
+                self.store.srem(user_key, jti)
+        return sessions
     
     def create_session(self, user_id, jti, additional_data=None):
         """Create a new session"""
@@ -84,76 +89,43 @@ class SessionManager:
             'additional_data': additional_data or {}
         }
         
-        if self.use_redis:
-            ttl = int(self.session_timeout.total_seconds())
-            self.redis_client.setex(
-                f"session:{jti}", 
-                ttl, 
-                json.dumps(session_data)
-            )
-        else:
-            self.memory_sessions[jti] = session_data
+        ttl = int(self.session_timeout.total_seconds())
+        self.store.setex(f"session:{jti}", ttl, json.dumps(session_data))
+        
+        user_key = f"user_sessions:{user_id}"
+        self._live_sessions(user_key)
+        self.store.sadd(user_key, jti)
+        self.store.expire(user_key, ttl)
         
         logger.info(f"Session created for user {user_id}, token {jti}")
     
     def update_activity(self, jti):
-        """Update last activity timestamp"""
-        if self.use_redis:
-            session_data = self.redis_client.get(f"session:{jti}")
-            if session_data:
-                data = json.loads(session_data)
-                data['last_activity'] = datetime.utcnow().isoformat()
-                
-                ttl = int(self.session_timeout.total_seconds())
-                self.redis_client.setex(
-                    f"session:{jti}", 
-                    ttl, 
-                    json.dumps(data)
-                )
-        else:
-            if jti in self.memory_sessions:
-                self.memory_sessions[jti]['last_activity'] = datetime.utcnow().isoformat()
+        """Update last activity timestamp and push back the session's expiry"""
+        session_data = self.store.get(f"session:{jti}")
+        if session_data:
+            data = json.loads(session_data)
+            data['last_activity'] = datetime.utcnow().isoformat()
+            
+            ttl = int(self.session_timeout.total_seconds())
+            self.store.setex(f"session:{jti}", ttl, json.dumps(data))
+            self.store.expire(f"user_sessions:{data['user_id']}", ttl)
     
     def is_session_valid(self, jti):
         """Check if session is still valid"""
-        if self.use_redis:
-            return self.redis_client.exists(f"session:{jti}")
-        else:
-            if jti not in self.memory_sessions:
-                return False
-            
-            session = self.memory_sessions[jti]
-            last_activity = datetime.fromisoformat(session['last_activity'])
-            return datetime.utcnow() - last_activity < self.session_timeout
+        return bool(self.store.exists(f"session:{jti}"))
     
     def destroy_session(self, jti):
         """Destroy a session"""
-        if self.use_redis:
-            self.redis_client.delete(f"session:{jti}")
-        else:
-            self.memory_sessions.pop(jti, None)
+        session_data = self.store.get(f"session:{jti}")
+        self.store.delete(f"session:{jti}")
+        if session_data:
+            self.store.srem(f"user_sessions:{json.loads(session_data)['user_id']}", jti)
         
         logger.info(f"Session destroyed for token {jti}")
     
     def get_user_sessions(self, user_id):
         """Get all active sessions for a user"""
-        sessions = []
-        
-        if self.use_redis:
-            # This is simplified - in production you'd maintain a user->sessions mapping
-            keys = self.redis_client.keys("session:*")
-            for key in keys:
-                session_data = self.redis_client.get(key)
-                if session_data:
-                    data = json.loads(session_data)
-                    if data.get('user_id') == user_id:
-                        sessions.append(data)
-        else:
-            for jti, session in self.memory_sessions.items():
-                if session.get('user_id') == user_id:
-                    sessions.append(session)
-        
-        return sessions
+        return self._live_sessions(f"user_sessions:{user_id}")
 
 # Global instances
 token_blacklist = TokenBlacklist()
@@ -169,34 +141,23 @@ def init_jwt_security(app):
         token_blacklist = TokenBlacklist(redis_url)
         session_manager = SessionManager(redis_url)
     
-    @app.before_request
-    def check_token_blacklist():
-        """Check if current token is blacklisted"""
-        try:
-            jwt_data = get_jwt()
-            jti = jwt_data.get('jti')
-            
-            if jti and token_blacklist.is_blacklisted(jti):
-                from flask import jsonify
-                return jsonify({
-                    'success': False,
-                    'message': 'Token has been revoked'
-                }), 401
-            
-            # Update session activity
-            if jti:
-                session_manager.update_activity(jti)
-                
-                # Check session validity
-                if not session_manager.is_session_valid(jti):
-                    return jsonify({
-                        'success': False,
-                        'message': 'Session has expired'
-                    }), 401
-                    
-        except Exception:
-            # No JWT token present, continue
-            pass
+    jwt_manager = app.extensions.get('flask-jwt-extended')
+    if jwt_manager is None:
+        logger.warning("JWTManager not initialized; token blacklist not enforced")
+        return app
+    
+    @jwt_manager.token_in_blocklist_loader
+    def check_token_blacklist(_jwt_header, jwt_data):
+        """Refuse blacklisted tokens; runs once for each token a request verifies"""
+        jti = jwt_data.get('jti')
+        if not jti:
+            return False
+        if token_blacklist.is_blacklisted(jti):
+            return True
+        
+        # Update session activity
+        session_manager.update_activity(jti)
+        return False
     
     return app
 
@@ -205,7 +166,7 @@ def revoke_token(jti=None):
     if jti is None:
         jwt_data = get_jwt()
         jti = jwt_data.get('jti')
-        expires_at = datetime.fromtimestamp(jwt_data.get('exp'))
+        expires_at = datetime.utcfromtimestamp(jwt_data.get('exp'))
     else:
         # For manual revocation, assume standard expiry
         expires_at = datetime.utcnow() + timedelta(hours=24)
@@ -225,6 +186,16 @@ def revoke_token(jti=None):
 
 def revoke_all_user_tokens(user_id):
     """Revoke all tokens for a specific user"""
+    # Bumping the token version refuses every token issued so far, including
+    # ones without a tracked session; the user cache drops the user here
+    from models.users import User
+    from utils.database import get_db_connection, close_connection
+    conn = get_db_connection()
+    try:
+        User.bump_token_version(conn, user_id)
+    finally:
+        close_connection(conn)
+    
     sessions = session_manager.get_user_sessions(user_id)
     
     for session in sessions:
@@ -10,6 +10,13 @@ from psycopg2.extras import RealDictCursor
 
 logger = logging.getLogger("expresso.models.inventory")
 
+
+def _invalidate_menu():
+    """Drop the cached menu snapshot after inventory_items changes"""
+    from services.menu_snapshot import get_menu_cache
+    get_menu_cache().invalidate()
+
+
 class InventoryItem:
     """Model for inventory items and stock management"""
     
@@ -326,6 +333,7 @@ class InventoryItem:
             cursor.execute(query, values)
             item_id = cursor.fetchone()[0]
             db.commit()
+            _invalidate_menu()
             
             logger.info(f"Created inventory item {item_id}: {item_data['name']}")
             return item_id
@@ -401,6 +409,7 @@ class InventoryItem:
             # Execute query
             cursor.execute(query, values)
             db.commit()
+            _invalidate_menu()
             
             logger.info(f"Updated inventory item {item_id}")
             return True
@@ -427,6 +436,7 @@ class InventoryItem:
             
             if cursor.rowcount > 0:
                 db.commit()
+                _invalidate_menu()
                 logger.info(f"Deleted inventory item {item_id}")
                 return True
             else:
@@ -555,6 +565,7 @@ class InventoryItem:
             ))
             
             db.commit()
+            _invalidate_menu()
             
             logger.info(f"Adjusted stock for item {item_id} from {previous_amount} to {new_amount}")
             return True
@@ -311,6 +311,164 @@ class Order:
             logger.error(f"Error getting active orders: {str(e)}")
             return []
     
+    # Sort orders used by the queue endpoints
+    QUEUE_ORDERINGS = {
+        'priority': 'o.queue_priority, o.created_at',
+        'priority_newest': 'o.queue_priority, o.created_at DESC',
+        'oldest': 'o.created_at',
+        'recently_completed': 'o.completed_at DESC NULLS LAST'
+    }
+    
+    # order_details keys rebuilt from the columns get_queue selects
+    QUEUE_DETAIL_FIELDS = [
+        ('name', 'customer_name'),
+        ('type', 'coffee_type'),
+        ('milk', 'milk_type'),
+        ('size', 'size'),
+        ('sugar', 'sugar'),
+        ('notes', 'notes'),
+        ('temp', 'temp')
+    ]
+    
+    @classmethod
+    def get_queue(cls, db, statuses, station_id=None, ordering='priority', limit=None):
+        """
+        Get orders for the barista queue in a single query
+        
+        The customer's saved name is joined in rather than looked up per
+        order, so one poll costs one query however long the queue is.
+        
+        Args:
+            db: Database connection
+            statuses: Status or list of statuses to include
+            station_id: Optional station ID filter
+            ordering: Key into QUEUE_ORDERINGS
+            limit: Optional maximum number of orders
+            
+        Returns:
+            List of order dictionaries with order_details (only the fields
+            the queue shows), customer_name and wait_time (minutes)
+        """
+        if isinstance(statuses, str):
+            statuses = [statuses]
+        
+        # The promoted detail columns and two extracted keys, rather than
+        # the whole order_details document
+        query = '''
+            SELECT o.id, o.order_number, o.status, o.station_id, o.created_at,
+                   o.completed_at, o.picked_up_at, o.phone, o.queue_priority,
+                   o.customer_name, o.coffee_type, o.milk_type, o.size, o.sugar,
+                   o.order_details->>'notes' AS notes, o.order_details->>'temp' AS temp,
+                   cp.name AS profile_name
+            FROM orders o
+            LEFT JOIN customer_preferences cp ON cp.phone = o.phone
+            WHERE o.status = ANY(%s)
+        '''
+        params = [list(statuses)]
+        
+        if station_id:
+            query += ' AND o.station_id = %s'
+            params.append(station_id)
+        
+        query += f' ORDER BY {cls.QUEUE_ORDERINGS.get(ordering, cls.QUEUE_ORDERINGS["priority"])}'
+        
+        if limit:
+            query += ' LIMIT %s'
+            params.append(limit)
+        
+        cursor = db.cursor(cursor_factory=RealDictCursor)
+        try:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        
+        now = datetime.now()
+        result = []
+        for row in rows:
+            order = dict(row)
+            profile_name = order.pop('profile_name', None)
+            
+            details = {}
+            for key, column in cls.QUEUE_DETAIL_FIELDS:
+                value = order.pop(column, None)
+                if value is not None:
+                    details[key] = value
+            order['order_details'] = details
+            
+            # The name on the order wins (friend orders carry the friend's name)
+            order['customer_name'] = details.get('name') or profile_name or 'Customer'
+            
+            created_at = order.get('created_at')
+            if isinstance(created_at, str):
+                created_at = datetime.fromisoformat(created_at)
+            order['wait_time'] = int((now - created_at).total_seconds() / 60) if created_at else 0
+            
+            result.append(order)
+        
+        return result
+    
+    @staticmethod
+    def to_queue_json(order, camel_case=False):
+        """
+        Serialize an order from get_queue for the queue endpoints
+        
+        Args:
+            order: Order dictionary returned by get_queue
+            camel_case: Use the camelCase keys of the legacy /api/orders/* routes
+            
+        Returns:
+            JSON-ready dictionary
+        """
+        details = order.get('order_details') or {}
+        coffee_type = details.get('type', 'Coffee')
+        milk_type = details.get('milk', 'Standard')
+        
+        # Extra hot can be a temperature option or mentioned in the notes
+        notes = details.get('notes') or ''
+        extra_hot = details.get('temp') == 'extra hot' or 'extra hot' in notes.lower()
+        
+        # Orders with the same drink and milk can be made together
+        batch_group = None
+        if details.get('type') and details.get('milk'):
+            batch_group = f"{details['type'].lower()}-{details['milk'].lower()}"
+        
+        if camel_case:
+            return {
+                'id': f"order_{order['id']}",
+                'order_number': order['order_number'],
+                'customerName': order['customer_name'],
+                'phoneNumber': order['phone'],
+                'coffeeType': coffee_type,
+                'milkType': milk_type,
+                'sugar': details.get('sugar', 'No sugar'),
+                'extraHot': extra_hot,
+                'status': order['status'],
+                'createdAt': order['created_at'],
+                'completedAt': order.get('completed_at'),
+                'pickedUpAt': order.get('picked_up_at'),
+                'pickedUp': order.get('picked_up_at') is not None,
+                'waitTime': order['wait_time'],
+                'promisedTime': 15,  # Default to 15 minutes
+                'priority': order['queue_priority'] == 1
+            }
+        
+        return {
+            'id': order['order_number'],  # Use order_number as id for consistency
+            'order_number': order['order_number'],
+            'customer_name': order['customer_name'],
+            'phone_number': order['phone'],
+            'coffee_type': coffee_type,
+            'milk_type': milk_type,
+            'sugar': details.get('sugar', 'No sugar'),
+            'extra_hot': extra_hot,
+            'status': order['status'],
+            'created_at': order['created_at'],
+            'wait_time': order['wait_time'],
+            'priority': order['queue_priority'] == 1,  # Convert 1/0 to True/False
+            'batch_group': batch_group
+        }
+    
     @classmethod
     def get_price_by_number(cls, db, order_number):
         """
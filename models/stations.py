@@ -9,7 +9,6 @@ import calendar
 import random
 import os
 import psycopg2
-from psycopg2.extras import RealDictCursor
 
 from utils.database import execute_query
 
@@ -656,6 +655,8 @@ class StationSchedule:
         """
         Check if any station (or a specific station) is available at the given time
         
+        Reads the compiled schedule timeline rather than scanning station_schedule.
+        
         Args:
             conn: Database connection
             station_id: Specific station to check, or None to check any station
@@ -664,75 +665,40 @@ class StationSchedule:
         Returns:
             Tuple of (available, message, next_open_time)
         """
+        from services.schedule_timeline import get_schedule_timeline
+        
         if check_time is None:
             check_time = datetime.now()
         
-        # Get day of week (0=Monday, 6=Sunday)
-        day_of_week = check_time.weekday()
+        if station_id is not None:
+            station_id = int(station_id)
         
-        # Format time as HH:MM for comparison
-        current_time_str = check_time.strftime("%H:%M")
+        timeline = get_schedule_timeline()
         
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        # No schedules at all, assume always available
+        if not timeline.has_shifts(conn):
+            return True, "Stations are available", None
         
-        # Build query based on whether we're checking a specific station
-        if station_id:
-            query = '''
-                SELECT station_id, start_time, end_time, break_start, break_end, notes
-                FROM station_schedule
-                WHERE station_id = %s AND day_of_week = %s
-                ORDER BY start_time
-            '''
-            params = (station_id, day_of_week)
-        else:
-            query = '''
-                SELECT station_id, start_time, end_time, break_start, break_end, notes
-                FROM station_schedule
-                WHERE day_of_week = %s
-                ORDER BY start_time
-            '''
-            params = (day_of_week,)
+        day = timeline.day(conn, check_time.weekday())
+        minute = check_time.hour * 60 + check_time.minute
         
-        cursor.execute(query, params)
-        schedules = cursor.fetchall()
+        # No schedule for today specifically
+        if not day.has_shifts(station_id):
+            return False, "No stations are scheduled for today", StationSchedule.find_next_available_time(conn, check_time)
         
-        # If no schedules found for today
-        if not schedules:
-            # Check if there are schedules for any day
-            cursor.execute("SELECT COUNT(*) FROM station_schedule")
-            result = cursor.fetchone()
-            if result['count'] == 0:
-                # No schedules at all, assume always available
-                return True, "Stations are available", None
-            else:
-                # No schedule for today specifically
-                return False, "No stations are scheduled for today", StationSchedule.find_next_available_time(conn, check_time)
+        open_stations = day.open_stations(minute)
+        if station_id is not None:
+            open_stations = [s for s in open_stations if s == station_id]
+        
+        if open_stations:
+            return True, f"Station {open_stations[0]} is available", None
         
-        # Check each schedule
+        # No stations are currently available - find when the next one opens today
         next_open_time = None
+        next_minute = day.next_open_minute(minute, station_id)
+        if next_minute is not None:
+            next_open_time = datetime.combine(check_time.date(), datetime.min.time()) + timedelta(minutes=next_minute)
         
-        for schedule in schedules:
-            s_station_id, start_time, end_time = schedule['station_id'], schedule['start_time'], schedule['end_time']
-            break_start, break_end, notes = schedule['break_start'], schedule['break_end'], schedule['notes']
-            
-            # Check if current time is within operating hours
-            if start_time <= current_time_str <= end_time:
-                # Check if during a break
-                if break_start and break_end and break_start <= current_time_str <= break_end:
-                    # On break - update next open time
-                    break_end_time = datetime.combine(check_time.date(), datetime.strptime(break_end, "%H:%M").time())
-                    if next_open_time is None or break_end_time < next_open_time:
-                        next_open_time = break_end_time
-                else:
-                    # Not on break - station is available!
-                    return True, f"Station {s_station_id} is available", None
-            elif current_time_str < start_time:
-                # Station opens later today
-                start_time_dt = datetime.combine(check_time.date(), datetime.strptime(start_time, "%H:%M").time())
-                if next_open_time is None or start_time_dt < next_open_time:
-                    next_open_time = start_time_dt
-        
-        # If we got here, no stations are currently available
         message = "Stations are currently closed"
         if next_open_time:
             formatted_time = next_open_time.strftime("%I:%M %p")
@@ -752,37 +718,6 @@ class StationSchedule:
         Returns:
             Datetime of next available time, or None if no schedule found
         """
-        if from_time is None:
-            from_time = datetime.now()
-        
-        # Check for the next 7 days
-        for days_ahead in range(7):
-            check_date = from_time.date() + timedelta(days=days_ahead)
-            day_of_week = check_date.weekday()
-            
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT station_id, start_time, end_time 
-                FROM station_schedule
-                WHERE day_of_week = %s
-                ORDER BY start_time
-            ''', (day_of_week,))
-            
-            schedules = cursor.fetchall()
-            if not schedules:
-                continue
-            
-            # If checking today, only consider times after current time
-            if days_ahead == 0:
-                current_time_str = from_time.strftime("%H:%M")
-                
-                for _, start_time, end_time in schedules:
-                    if start_time > current_time_str:
-                        # Station opens later today
-                        return datetime.combine(check_date, datetime.strptime(start_time, "%H:%M").time())
-            else:
-                # For future days, return the first opening time
-                return datetime.combine(check_date, datetime.strptime(schedules[0][1], "%H:%M").time())
+        from services.schedule_timeline import get_schedule_timeline
         
-        # No available times found in the next 7 days
-        return None
\ No newline at end of file
+        return get_schedule_timeline().next_shift_start(conn, from_time)
@@ -12,6 +12,20 @@ from psycopg2.extras import RealDictCursor
 
 logger = logging.getLogger("expresso.models.users")
 
+
+def _invalidate_settings():
+    """Drop this worker's cached settings after a write; other workers hear the trigger"""
+    from services.settings_service import get_settings_service
+    get_settings_service().invalidate()
+
+
+def _invalidate_user(user_id):
+    """Drop this worker's cached user after a write; other workers hear it
+    from the users_changed trigger"""
+    from services.user_cache import get_user_cache
+    get_user_cache().invalidate(user_id)
+
+
 class User:
     """
     Model for user management with PostgreSQL support
@@ -266,6 +280,7 @@ class User:
             ''', values)
             
             db.commit()
+            _invalidate_user(user_id)
             logger.info(f"Updated user {user_id}")
             return True
             
@@ -300,6 +315,7 @@ class User:
             ''', (password_hash, datetime.now(), user_id))
             
             db.commit()
+            _invalidate_user(user_id)
             logger.info(f"Changed password for user {user_id}")
             return True
             
@@ -324,6 +340,7 @@ class User:
             cursor = db.cursor()
             cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
             db.commit()
+            _invalidate_user(user_id)
             logger.info(f"Deleted user {user_id}")
             return True
             
@@ -332,6 +349,42 @@ class User:
             logger.error(f"Error deleting user: {str(e)}")
             return False
     
+    @classmethod
+    def bump_token_version(cls, db, user_id):
+        """
+        Invalidate every token issued to a user so far
+        
+        Tokens carry the token_version they were issued under; the user
+        cache refuses any older than the user's current one.
+        
+        Args:
+            db: Database connection
+            user_id: User ID
+            
+        Returns:
+            New token version, or None if the user does not exist or the
+            update failed
+        """
+        try:
+            cursor = db.cursor()
+            cursor.execute('''
+                UPDATE users 
+                SET token_version = token_version + 1
+                WHERE id = %s
+                RETURNING token_version
+            ''', (user_id,))
+            row = cursor.fetchone()
+            db.commit()
+            _invalidate_user(user_id)
+            if row is None:
+                return None
+            return row['token_version'] if isinstance(row, dict) else row[0]
+            
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error bumping token version: {str(e)}")
+            return None
+    
     @classmethod
     def generate_reset_token(cls, db, email):
         """
@@ -435,6 +488,7 @@ class User:
             ''', (password_hash, datetime.now(), user_id))
             
             db.commit()
+            _invalidate_user(user_id)
             logger.info(f"Reset password for user {user_id}")
             return True
             
@@ -491,6 +545,7 @@ class User:
             ''', (user_id, permission_name))
             
             db.commit()
+            _invalidate_user(user_id)
             logger.info(f"Added permission {permission_name} to user {user_id}")
             return True
             
@@ -520,6 +575,7 @@ class User:
             ''', (user_id, permission_name))
             
             db.commit()
+            _invalidate_user(user_id)
             logger.info(f"Removed permission {permission_name} from user {user_id}")
             return True
             
@@ -606,6 +662,7 @@ class Settings:
                 ''', (key, value, description, datetime.now(), updated_by))
             
             db.commit()
+            _invalidate_settings()
             logger.info(f"Set setting {key} = {value}")
             return True
             
@@ -630,6 +687,7 @@ class Settings:
             cursor = db.cursor()
             cursor.execute("DELETE FROM settings WHERE key = %s", (key,))
             db.commit()
+            _invalidate_settings()
             
             logger.info(f"Deleted setting {key}")
             return True
@@ -2,7 +2,6 @@
 Admin routes for Expresso Coffee Ordering System
 """
 import os
-import json
 from datetime import datetime, timedelta
 import logging
 import calendar
@@ -16,7 +15,8 @@ from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from models.users import AdminUser, Settings
 from models.stations import Station, StationSchedule
 from models.orders import CustomerPreference
-from auth import admin_required, role_required
+from utils.database import day_range
+from auth import admin_required, role_required, clear_login_lockout
 
 # Create blueprint
 bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -136,22 +136,22 @@ def dashboard():
         avg_time = round(avg_time_seconds / 60, 1) if avg_time_seconds else 0  # minutes
         
         # Get today's statistics
-        today = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute('SELECT COUNT(*) FROM orders WHERE DATE(created_at) = %s', (today,))
+        today_start, today_end = day_range(datetime.now())
+        cursor.execute('SELECT COUNT(*) FROM orders WHERE created_at >= %s AND created_at < %s', (today_start, today_end))
         today_orders = cursor.fetchone()['count']
         
-        cursor.execute('SELECT COUNT(*) FROM orders WHERE status = %s AND DATE(created_at) = %s', 
-                     ('completed', today))
+        cursor.execute('SELECT COUNT(*) FROM orders WHERE status = %s AND created_at >= %s AND created_at < %s', 
+                     ('completed', today_start, today_end))
         today_completed = cursor.fetchone()['count']
         
         # Get hourly breakdown for today
         cursor.execute('''
             SELECT EXTRACT(HOUR FROM created_at) as hour, COUNT(*) as count 
             FROM orders 
-            WHERE DATE(created_at) = %s
+            WHERE created_at >= %s AND created_at < %s
             GROUP BY hour 
             ORDER BY hour
-        ''', (today,))
+        ''', (today_start, today_end))
         hourly_orders = cursor.fetchall()
         
         hourly_data = {str(i).zfill(2): 0 for i in range(24)}
@@ -165,52 +165,31 @@ def dashboard():
                    COUNT(o.id) as total_orders,
                    SUM(CASE WHEN o.status = 'completed' THEN 1 ELSE 0 END) as completed_orders
             FROM station_stats s
-            LEFT JOIN orders o ON s.station_id = o.station_id AND DATE(o.created_at) = %s
+            LEFT JOIN orders o ON s.station_id = o.station_id AND o.created_at >= %s AND o.created_at < %s
             GROUP BY s.station_id, s.barista_name, s.current_load, s.avg_completion_time
             ORDER BY s.station_id
-        ''', (today,))
+        ''', (today_start, today_end))
         station_stats = cursor.fetchall()
         
-        # Get popular drinks
+        # Get popular drinks, counted by the database on the detail columns
         cursor.execute('''
-            SELECT order_details FROM orders WHERE DATE(created_at) = %s
-        ''', (today,))
-        orders = cursor.fetchall()
+            SELECT coffee_type, milk_type, sugar, COUNT(*) AS count
+            FROM orders
+            WHERE created_at >= %s AND created_at < %s
+            GROUP BY coffee_type, milk_type, sugar
+        ''', (today_start, today_end))
         
         drink_counts = {}
         milk_counts = {}
         sugar_counts = {}
         
-        for order in orders:
-            try:
-                order_details = order['order_details']
-                if isinstance(order_details, str):
-                    details = json.loads(order_details)
-                else:
-                    details = order_details
-                
-                # Count drinks
-                drink_type = details.get('type', 'unknown')
-                if drink_type in drink_counts:
-                    drink_counts[drink_type] += 1
-                else:
-                    drink_counts[drink_type] = 1
-                
-                # Count milk types
-                milk_type = details.get('milk', 'unknown')
-                if milk_type in milk_counts:
-                    milk_counts[milk_type] += 1
-                else:
-                    milk_counts[milk_type] = 1
-                
-                # Count sugar preferences
-                sugar_pref = details.get('sugar', 'unknown')
-                if sugar_pref in sugar_counts:
-                    sugar_counts[sugar_pref] += 1
-                else:
-                    sugar_counts[sugar_pref] = 1
-            except:
-                continue
+        for row in cursor.fetchall():
+            drink_type = row['coffee_type'] or 'unknown'
+            milk_type = row['milk_type'] or 'unknown'
+            sugar_pref = row['sugar'] or 'unknown'
+            drink_counts[drink_type] = drink_counts.get(drink_type, 0) + row['count']
+            milk_counts[milk_type] = milk_counts.get(milk_type, 0) + row['count']
+            sugar_counts[sugar_pref] = sugar_counts.get(sugar_pref, 0) + row['count']
         
         popular_drinks = sorted(drink_counts.items(), key=lambda x: x[1], reverse=True)[:5]
         popular_milks = sorted(milk_counts.items(), key=lambda x: x[1], reverse=True)[:3]
@@ -229,12 +208,12 @@ def dashboard():
             FROM 
                 orders 
             WHERE 
-                status = 'completed' AND DATE(created_at) = %s
+                status = 'completed' AND created_at >= %s AND created_at < %s
             GROUP BY 
                 hour 
             ORDER BY 
                 hour
-        ''', (today,))
+        ''', (today_start, today_end))
         wait_times = cursor.fetchall()
         
         wait_time_data = {str(i).zfill(2): 0 for i in range(24)}
@@ -593,6 +572,20 @@ def user_management():
         current_user_id=session.get('admin_id')
     )
 
+@bp.route('/clear_login_lockout', methods=['POST'])
+@admin_required
+def clear_lockout():
+    """Let a username or client address locked out by failed logins try again"""
+    username = (request.form.get('username') or '').strip()
+    address = (request.form.get('address') or '').strip()
+    
+    if not username and not address:
+        return jsonify({'success': False, 'message': 'Username or address is required'})
+    
+    clear_login_lockout(username=username, address=address)
+    logger.info(f"Login lockout cleared for username={username or '-'} address={address or '-'}")
+    return jsonify({'success': True})
+
 @bp.route('/settings', methods=['GET', 'POST'])
 @admin_required
 def settings():
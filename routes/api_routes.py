@@ -5,6 +5,9 @@ import json
 import logging
 import re
 
+from services.order_numbers import next_order_number
+from utils.database import get_schema_capabilities
+
 # Set up logging
 logger = logging.getLogger("expresso.routes.api")
 
@@ -247,8 +250,7 @@ def orders():
             
             # Generate a unique order number
             now = datetime.now()
-            prefix = "W" if data.get('order_type') == 'walk-in' else "O"
-            order_number = f"{prefix}{now.strftime('%H%M%S')}{now.microsecond // 10000}"
+            order_number = next_order_number()
             
             # Prepare order details
             order_details = {
@@ -603,10 +605,8 @@ def get_chat_messages():
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Check if chat_messages table exists
         cursor = db.cursor()
-        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'chat_messages')")
-        table_exists = cursor.fetchone()[0]
+        table_exists = get_schema_capabilities().has_table('chat_messages')
         
         if table_exists:
             # Query database for chat messages
@@ -939,23 +939,6 @@ def send_message(order_id):
             
         logger.info(f"Found phone number {phone_number} for order {clean_id}")
         
-        # Create order_messages table if it doesn't exist
-        try:
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS order_messages (
-                    id SERIAL PRIMARY KEY,
-                    order_number VARCHAR(50) NOT NULL,
-                    phone VARCHAR(50) NOT NULL,
-                    message TEXT NOT NULL,
-                    message_sid VARCHAR(100),
-                    sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            db.commit()
-        except Exception as e:
-            logger.warning(f"Could not create order_messages table: {str(e)}")
-            # Continue anyway
-        
         # Send the message using messaging service
         try:
             result = messaging_service.send_message(phone_number, message)
@@ -1090,8 +1073,7 @@ def create_test_order():
         
         # Generate a unique order number
         now = datetime.now()
-        prefix = "A" if now.hour < 12 else "P"
-        order_number = f"{prefix}{now.strftime('%H%M%S')}{now.microsecond // 10000}"
+        order_number = next_order_number()
         
         # Default order details
         order_details = {
@@ -8,8 +8,8 @@ import logging
 from datetime import datetime
 import hashlib
 
-from utils.database import get_db_connection, close_connection
-from auth import generate_tokens, verify_login
+from auth import generate_tokens, verify_login, login_throttled
+from services.user_cache import get_user_cache
 
 # Create a blueprint
 bp = Blueprint('auth', __name__)
@@ -38,6 +38,12 @@ def api_login():
             'message': 'Missing username or password'
         }), 400
     
+    if login_throttled(username):
+        return jsonify({
+            'status': 'error',
+            'message': 'Too many failed login attempts. Please try again later.'
+        }), 429
+    
     # Use verify_login from auth module
     user_data = verify_login(username, password)
     
@@ -105,29 +111,15 @@ def refresh_token():
             user_id_int = int(user_id) if isinstance(user_id, str) else user_id
             logger.debug(f"Successfully decoded refresh token for user ID: {user_id_int}")
             
-            # Get database connection
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            # Get user from the user cache; revoked refresh tokens get None
+            user_data = get_user_cache().get(user_id_int, decoded_token.get('token_version', 0))
             
-            # Get user from database
-            cursor.execute('SELECT id, username, email, role, full_name FROM users WHERE id = %s', (user_id_int,))
-            user_record = cursor.fetchone()
-            
-            if not user_record:
+            if not user_data:
                 return jsonify({
                     'status': 'error',
                     'message': 'Invalid refresh token'
                 }), 401
             
-            # Create user data for token generation
-            user_data = {
-                'id': user_record[0],
-                'username': user_record[1],
-                'email': user_record[2],
-                'role': user_record[3],
-                'full_name': user_record[4] if len(user_record) > 4 else ""
-            }
-            
             # Generate new access token
             tokens = generate_tokens(user_data)
             
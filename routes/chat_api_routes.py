@@ -8,6 +8,8 @@ from flask import Blueprint, jsonify, request, current_app
 from datetime import datetime
 import json
 
+from utils.database import get_schema_capabilities
+
 # Create blueprint
 bp = Blueprint('chat_api', __name__, url_prefix='/api/chat')
 
@@ -22,41 +24,8 @@ def get_chat_messages():
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Check if chat_messages table exists
+        # chat_messages and its station_id column come from schema migrations
         cursor = db.cursor()
-        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'chat_messages')")
-        table_exists = cursor.fetchone()[0]
-        
-        if not table_exists:
-            # Create the table if it doesn't exist
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS chat_messages (
-                    id SERIAL PRIMARY KEY,
-                    sender VARCHAR(100) NOT NULL,
-                    content TEXT NOT NULL,
-                    is_urgent BOOLEAN DEFAULT FALSE,
-                    station_id INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            db.commit()
-            logger.info("Created chat_messages table")
-        else:
-            # Check if station_id column exists, add it if needed
-            cursor.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name='chat_messages' AND column_name='station_id'
-            """)
-            has_station_id = cursor.fetchone() is not None
-            
-            if not has_station_id:
-                cursor.execute("""
-                    ALTER TABLE chat_messages 
-                    ADD COLUMN station_id INTEGER
-                """)
-                db.commit()
-                logger.info("Added station_id column to chat_messages table")
         
         # Get limit from query params (default to 50)
         limit = request.args.get('limit', 50, type=int)
@@ -206,27 +175,17 @@ def get_stations():
         
         # First check if the table exists
         cursor = db.cursor()
+        schema = get_schema_capabilities()
         try:
-            cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'station_stats')")
-            table_exists = cursor.fetchone()[0]
-            
-            if not table_exists:
-                db.rollback()  # Reset transaction
+            if not schema.has_table('station_stats'):
                 return jsonify({
                     'success': True,
                     'stations': default_stations
                 })
             
-            # Try to get the column names
-            cursor.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name = 'station_stats'
-            """)
-            columns = [col[0] for col in cursor.fetchall()]
-            
             # Build a query based on available columns
-            if 'name' in columns and 'barista_name' in columns:
+            has_names = schema.has_column('station_stats', 'name') and schema.has_column('station_stats', 'barista_name')
+            if has_names:
                 # All columns available
                 cursor.execute('''
                     SELECT station_id, name, status, barista_name
@@ -234,7 +193,7 @@ def get_stations():
                     WHERE status = 'active'
                     ORDER BY station_id
                 ''')
-            elif 'station_id' in columns:
+            elif schema.has_column('station_stats', 'station_id'):
                 # Only station_id available
                 cursor.execute('''
                     SELECT station_id
@@ -262,7 +221,7 @@ def get_stations():
                 })
             
             # Process based on the columns we selected
-            if 'name' in columns and 'barista_name' in columns:
+            if has_names:
                 # All columns available
                 for row in station_rows:
                     station_id, name, status, barista_name = row
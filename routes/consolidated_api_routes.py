@@ -10,7 +10,15 @@ from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from datetime import datetime, timedelta
 import json
 import re
+import base64
 from auth import jwt_required_with_demo, role_required_with_demo
+from models.orders import Order
+from services.menu_snapshot import get_menu_cache
+from services.settings_service import get_settings_service
+from services.display_snapshot import get_display_snapshots
+from services import order_rollups, order_transitions
+from services.order_numbers import next_order_number
+from utils.database import day_range, get_schema_capabilities
 
 # Configure logging
 logger = logging.getLogger("expresso.routes.consolidated_api")
@@ -252,7 +260,13 @@ def auth_login():
             }), 400
         
         # Import function to keep consistent with existing code
-        from auth import verify_login, generate_tokens
+        from auth import verify_login, generate_tokens, login_throttled
+        
+        if login_throttled(username):
+            return jsonify({
+                'success': False,
+                'message': 'Too many failed login attempts. Please try again later.'
+            }), 429
         
         # Verify login directly with the database
         user_data = verify_login(username, password)
@@ -485,8 +499,7 @@ def orders():
             
             # Generate a unique order number
             now = datetime.now()
-            prefix = "W" if data.get('order_type') == 'walk-in' else "O"
-            order_number = f"{prefix}{now.strftime('%H%M%S')}{now.microsecond // 10000}"
+            order_number = next_order_number()
             
             # Prepare order details
             order_details = {
@@ -560,61 +573,13 @@ def get_pending_orders():
     try:
         # Get coffee system from app context
         coffee_system = current_app.config.get('coffee_system')
-        db = coffee_system.db
-        
-        # Query database for pending orders
-        cursor = db.cursor()
-        cursor.execute('''
-            SELECT id, order_number, status, station_id, 
-                   created_at, phone, order_details, queue_priority
-            FROM orders 
-            WHERE status = 'pending'
-            ORDER BY queue_priority, created_at DESC
-        ''')
         
-        # Process orders
-        pending_orders = []
-        for order in cursor.fetchall():
-            # Extract order details
-            order_id, order_number, status, station_id, created_at, phone, order_details_json, priority = order
-            
-            # Parse order details
-            if isinstance(order_details_json, str):
-                order_details = json.loads(order_details_json)
-            else:
-                order_details = order_details_json
-            
-            # Calculate wait time
-            created_dt = datetime.fromisoformat(created_at) if isinstance(created_at, str) else created_at
-            wait_time = int((datetime.now() - created_dt).total_seconds() / 60)
-            
-            # Get batch group if present in order details
-            batch_group = None
-            if order_details and 'type' in order_details and 'milk' in order_details:
-                # Create a batch group key based on coffee type and milk type
-                coffee_type = order_details.get('type', '').lower()
-                milk_type = order_details.get('milk', '').lower()
-                if coffee_type and milk_type:
-                    batch_group = f"{coffee_type}-{milk_type}"
-            
-            # Format order for frontend
-            pending_orders.append({
-                'id': order_number,  # Use order_number as id for consistency
-                'order_number': order_number,
-                'customer_name': order_details.get('name', 'Customer'),
-                'coffee_type': order_details.get('type', 'Coffee'),
-                'milk_type': order_details.get('milk', 'Standard'),
-                'sugar': order_details.get('sugar', 'No sugar'),
-                'status': status,
-                'created_at': created_at,
-                'wait_time': wait_time,
-                'priority': priority == 1,  # Convert 1/0 to True/False
-                'batch_group': batch_group
-            })
+        # Single joined query for the whole queue
+        orders = Order.get_queue(coffee_system.db, 'pending', ordering='priority_newest')
         
         return jsonify({
             'success': True,
-            'orders': pending_orders
+            'orders': [Order.to_queue_json(order) for order in orders]
         })
     
     except Exception as e:
@@ -631,60 +596,12 @@ def get_in_progress_orders():
     try:
         # Get coffee system from app context
         coffee_system = current_app.config.get('coffee_system')
-        db = coffee_system.db
-        
-        # Query database for in-progress orders
-        cursor = db.cursor()
-        cursor.execute('''
-            SELECT id, order_number, status, station_id, 
-                   created_at, phone, order_details, queue_priority
-            FROM orders 
-            WHERE status = 'in-progress'
-            ORDER BY created_at
-        ''')
         
-        # Process orders
-        in_progress_orders = []
-        for order in cursor.fetchall():
-            # Extract order details
-            order_id, order_number, status, station_id, created_at, phone, order_details_json, priority = order
-            
-            # Parse order details
-            if isinstance(order_details_json, str):
-                order_details = json.loads(order_details_json)
-            else:
-                order_details = order_details_json
-            
-            # Calculate wait time
-            created_dt = datetime.fromisoformat(created_at) if isinstance(created_at, str) else created_at
-            wait_time = int((datetime.now() - created_dt).total_seconds() / 60)
-            
-            # Check for extra hot
-            extra_hot = False
-            if 'temp' in order_details and order_details['temp'] == 'extra hot':
-                extra_hot = True
-            # Also check the notes field for "extra hot" text
-            elif 'notes' in order_details and order_details['notes'] and 'extra hot' in order_details['notes'].lower():
-                extra_hot = True
-            
-            # Format order for frontend
-            in_progress_orders.append({
-                'id': order_number,  # Use order_number as id for consistency
-                'order_number': order_number,
-                'customer_name': order_details.get('name', 'Customer'),
-                'phone_number': phone,
-                'coffee_type': order_details.get('type', 'Coffee'),
-                'milk_type': order_details.get('milk', 'Standard'),
-                'sugar': order_details.get('sugar', 'No sugar'),
-                'extra_hot': extra_hot,
-                'priority': priority == 1,
-                'created_at': created_at,
-                'wait_time': wait_time
-            })
+        orders = Order.get_queue(coffee_system.db, 'in-progress', ordering='oldest')
         
         return jsonify({
             'success': True,
-            'orders': in_progress_orders
+            'orders': [Order.to_queue_json(order) for order in orders]
         })
     
     except Exception as e:
@@ -756,11 +673,41 @@ def get_completed_orders():
             'message': f"Error fetching completed orders: {str(e)}"
         }), 500
 
+def encode_history_cursor(created_at, order_id):
+    """Opaque /orders/history cursor for the page after this (created_at, id)"""
+    raw = f"{created_at.isoformat()}|{order_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_history_cursor(token):
+    """
+    Parse a cursor from encode_history_cursor
+    
+    Returns:
+        Tuple of (created_at, id)
+        
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        created_at, order_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(order_id)
+    except ValueError as e:
+        # Bad base64, text, timestamp or id all raise ValueError
+        raise ValueError(f"Invalid cursor: {token}") from e
+
 @bp.route('/orders/history', methods=['GET'])
 @jwt_required_with_demo()
 @role_required_with_demo(['admin', 'staff', 'barista'])
 def get_order_history():
-    """Get order history with filtering options"""
+    """Get order history with filtering options
+    
+    Pages are keyed on (created_at, id): pass the previous response's
+    pagination.next_cursor as ?cursor= for the next page, which costs the
+    same however deep it is. ?offset= still works for older clients.
+    ?count=exact|estimate|none picks how the total is computed; the default
+    is exact on the first page and none after it.
+    """
     try:
         # Get query parameters for filtering
         start_date = request.args.get('start_date')
@@ -770,19 +717,28 @@ def get_order_history():
         customer_name = request.args.get('customer_name')
         limit = request.args.get('limit', 50, type=int)
         offset = request.args.get('offset', 0, type=int)
+        page_cursor = request.args.get('cursor')
+        count_mode = request.args.get('count', 'none' if page_cursor or offset else 'exact')
+        
+        if count_mode not in ('exact', 'estimate', 'none'):
+            return jsonify({
+                'success': False,
+                'message': "count must be one of exact, estimate or none"
+            }), 400
+        
+        after = None
+        if page_cursor:
+            try:
+                after = decode_history_cursor(page_cursor)
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)}), 400
         
         # Get coffee system from app context
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Build dynamic query with filters
-        query = '''
-            SELECT id, order_number, status, station_id,
-                   created_at, updated_at, completed_at, phone, order_details
-            FROM orders 
-            WHERE 1=1
-        '''
-        
+        # Build the filters; the name search is served by the trigram index
+        conditions = []
         params = []
         
         # Add date range filter
@@ -790,87 +746,120 @@ def get_order_history():
             try:
                 # Validate date format
                 datetime.strptime(start_date, '%Y-%m-%d')
-                query += " AND DATE(created_at) >= %s"
+                conditions.append("created_at >= %s")
                 params.append(start_date)
             except ValueError:
                 logger.warning(f"Invalid start_date format: {start_date}")
         
         if end_date:
             try:
-                # Validate date format
-                datetime.strptime(end_date, '%Y-%m-%d')
-                query += " AND DATE(created_at) <= %s"
-                params.append(end_date)
+                # Validate date format; the whole end day is included
+                end_bound = day_range(end_date)[1]
+                conditions.append("created_at < %s")
+                params.append(end_bound)
             except ValueError:
                 logger.warning(f"Invalid end_date format: {end_date}")
         
         # Add status filter
         if status:
-            query += " AND status = %s"
+            conditions.append("status = %s")
             params.append(status)
         
         # Add station filter
         if station_id:
-            query += " AND station_id = %s"
+            conditions.append("station_id = %s")
             params.append(station_id)
         
-        # Add customer name filter (search in JSON)
+        # Add customer name filter
         if customer_name:
-            # PostgreSQL JSON search using ->> operator
-            query += " AND (order_details->>'name' ILIKE %s OR order_details->>'name' ILIKE %s)"
+            conditions.append("(customer_name ILIKE %s OR customer_name ILIKE %s)")
             params.append(f"{customer_name}%")  # Starts with
             params.append(f"% {customer_name}%")  # Contains after space
         
+        where = " AND ".join(conditions) if conditions else "TRUE"
+        
+        # A window count rides along with the page instead of a second scan
+        total_column = ", COUNT(*) OVER () AS total_count" if count_mode == 'exact' else ""
+        query = f'''
+            SELECT id, order_number, status, station_id,
+                   created_at, updated_at, completed_at, phone,
+                   customer_name, coffee_type, milk_type, sugar,
+                   order_details->>'notes' AS notes{total_column}
+            FROM orders
+            WHERE {where}
+        '''
+        page_params = list(params)
+        
+        if after:
+            query += " AND (created_at, id) < (%s, %s)"
+            page_params.extend(after)
+        
         # Add ordering and pagination
-        query += " ORDER BY created_at DESC LIMIT %s OFFSET %s"
-        params.append(limit)
-        params.append(offset)
+        query += " ORDER BY created_at DESC, id DESC LIMIT %s"
+        page_params.append(limit)
+        if offset and not after:
+            query += " OFFSET %s"
+            page_params.append(offset)
         
         # Execute query
         cursor = db.cursor()
-        cursor.execute(query, params)
+        cursor.execute(query, page_params)
+        rows = cursor.fetchall()
         
         # Process orders
         orders = []
-        for order in cursor.fetchall():
+        for order in rows:
             # Extract order details
-            order_id, order_number, status, station_id, created_at, updated_at, completed_at, phone, order_details_json = order
-            
-            # Parse order details
-            if isinstance(order_details_json, str):
-                order_details = json.loads(order_details_json)
-            else:
-                order_details = order_details_json
+            (order_id, order_number, status, station_id, created_at, updated_at, completed_at, phone,
+             customer_name, coffee_type, milk_type, sugar, notes) = order[:13]
             
             # Format order for frontend
             orders.append({
                 'id': order_number,  # Use order_number as id for consistency
                 'order_number': order_number,
-                'customer_name': order_details.get('name', 'Customer'),
+                'customer_name': customer_name or 'Customer',
                 'phone_number': phone,
-                'coffee_type': order_details.get('type', 'Coffee'),
-                'milk_type': order_details.get('milk', 'Standard'),
-                'sugar': order_details.get('sugar', 'No sugar'),
+                'coffee_type': coffee_type or 'Coffee',
+                'milk_type': milk_type or 'Standard',
+                'sugar': sugar or 'No sugar',
                 'status': status,
                 'station_id': station_id,
                 'created_at': created_at,
                 'updated_at': updated_at,
                 'completed_at': completed_at,
-                'notes': order_details.get('notes', '')
+                'notes': notes or ''
             })
         
-        # Count total matching records (without pagination)
-        count_query = query.split('ORDER BY')[0].replace('SELECT id, order_number, status, station_id, created_at, updated_at, completed_at, phone, order_details', 'SELECT COUNT(*)')
-        cursor.execute(count_query, params[:-2])  # Remove limit and offset params
-        total_count = cursor.fetchone()[0]
+        total_count = None
+        if count_mode == 'exact':
+            if rows:
+                total_count = rows[0][13]
+            elif not after and not offset:
+                total_count = 0
+            else:
+                # Paged past the end, so the window count has no row to ride on
+                cursor.execute(f"SELECT COUNT(*) FROM orders WHERE {where}", params)
+                total_count = cursor.fetchone()[0]
+        elif count_mode == 'estimate':
+            cursor.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM orders WHERE {where}", params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            total_count = int(plan[0]['Plan']['Plan Rows'])
+        
+        next_cursor = None
+        if len(rows) == limit and rows[-1][4] is not None:
+            next_cursor = encode_history_cursor(rows[-1][4], rows[-1][0])
         
         return jsonify({
             'success': True,
             'orders': orders,
             'pagination': {
                 'total': total_count,
+                'total_is_estimate': count_mode == 'estimate',
                 'offset': offset,
-                'limit': limit
+                'limit': limit,
+                'next_cursor': next_cursor
             }
         })
     
@@ -896,8 +885,6 @@ def get_order_statistics():
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        cursor = db.cursor()
-        
         # Set default date range based on time period if not provided
         if not start_date:
             if time_period == 'day':
@@ -922,78 +909,11 @@ def get_order_statistics():
                 'message': 'Invalid date format. Use YYYY-MM-DD.'
             }), 400
         
-        # Generate statistics
-        
-        # 1. Total orders by status
-        cursor.execute('''
-            SELECT status, COUNT(*) as count
-            FROM orders
-            WHERE DATE(created_at) BETWEEN %s AND %s
-            GROUP BY status
-        ''', (start_date, end_date))
-        
-        status_counts = {}
-        for row in cursor.fetchall():
-            status, count = row
-            status_counts[status] = count
-        
-        # 2. Orders by day
-        cursor.execute('''
-            SELECT DATE(created_at) as day, COUNT(*) as count
-            FROM orders
-            WHERE DATE(created_at) BETWEEN %s AND %s
-            GROUP BY DATE(created_at)
-            ORDER BY day
-        ''', (start_date, end_date))
-        
-        daily_counts = {}
-        for row in cursor.fetchall():
-            day, count = row
-            daily_counts[day.strftime('%Y-%m-%d')] = count
-        
-        # 3. Orders by coffee type
-        cursor.execute('''
-            SELECT order_details->>'type' as coffee_type, COUNT(*) as count
-            FROM orders
-            WHERE DATE(created_at) BETWEEN %s AND %s
-            AND order_details->>'type' IS NOT NULL
-            GROUP BY order_details->>'type'
-            ORDER BY count DESC
-        ''', (start_date, end_date))
-        
-        coffee_type_counts = {}
-        for row in cursor.fetchall():
-            coffee_type, count = row
-            coffee_type_counts[coffee_type] = count
-        
-        # 4. Orders by milk type
-        cursor.execute('''
-            SELECT order_details->>'milk' as milk_type, COUNT(*) as count
-            FROM orders
-            WHERE DATE(created_at) BETWEEN %s AND %s
-            AND order_details->>'milk' IS NOT NULL
-            GROUP BY order_details->>'milk'
-            ORDER BY count DESC
-        ''', (start_date, end_date))
-        
-        milk_type_counts = {}
-        for row in cursor.fetchall():
-            milk_type, count = row
-            milk_type_counts[milk_type] = count
-        
-        # 5. Busiest hours
-        cursor.execute('''
-            SELECT EXTRACT(HOUR FROM created_at) as hour, COUNT(*) as count
-            FROM orders
-            WHERE DATE(created_at) BETWEEN %s AND %s
-            GROUP BY EXTRACT(HOUR FROM created_at)
-            ORDER BY hour
-        ''', (start_date, end_date))
-        
-        hourly_counts = {}
-        for row in cursor.fetchall():
-            hour, count = row
-            hourly_counts[int(hour)] = count
+        # Generate statistics over [start of start_date, end of end_date)
+        # from the hourly rollups rather than five scans of orders
+        range_start, range_end = day_range(start_dt, end_dt)
+        statistics = order_rollups.get_order_statistics(db, range_start, range_end)
+        status_counts = statistics['by_status']
         
         # Return compiled statistics
         return jsonify({
@@ -1004,10 +924,10 @@ def get_order_statistics():
                     'end_date': end_date
                 },
                 'by_status': status_counts,
-                'by_day': daily_counts,
-                'by_coffee_type': coffee_type_counts,
-                'by_milk_type': milk_type_counts,
-                'by_hour': hourly_counts,
+                'by_day': statistics['by_day'],
+                'by_coffee_type': statistics['by_coffee_type'],
+                'by_milk_type': statistics['by_milk_type'],
+                'by_hour': statistics['by_hour'],
                 'total_orders': sum(status_counts.values()) if status_counts else 0
             }
         })
@@ -1295,40 +1215,32 @@ def batch_process_orders():
         clean_ids = [clean_order_id(order_id) for order_id in order_ids]
         logger.info(f"Cleaned order IDs: {clean_ids}")
         
-        # Update orders
-        cursor = db.cursor()
-        current_time = datetime.now().isoformat()
-        
-        success_count = 0
-        for order_id in clean_ids:
-            try:
-                if action == 'start':
-                    cursor.execute('''
-                        UPDATE orders
-                        SET status = 'in-progress', updated_at = %s
-                        WHERE order_number = %s
-                    ''', (current_time, order_id))
-                elif action == 'complete':
-                    cursor.execute('''
-                        UPDATE orders
-                        SET status = 'completed', updated_at = %s, completed_at = %s
-                        WHERE order_number = %s
-                    ''', (current_time, current_time, order_id))
-                
-                if cursor.rowcount > 0:
-                    success_count += 1
-                    logger.info(f"Successfully processed order {order_id} in batch")
-                else:
-                    logger.warning(f"Order {order_id} not found or not updated")
-            except Exception as e:
-                logger.error(f"Error processing order {order_id}: {str(e)}")
-        
-        db.commit()
-        
+        status = order_transitions.BATCH_ACTIONS.get(action)
+        if not status:
+            return jsonify({"success": False, "message": f"Unknown batch action: {action}"})
+
+        # One UPDATE for the whole batch, station stats per station, one notification dispatch
+        result = order_transitions.transition_orders(
+            db, clean_ids, status,
+            editor='batch_process',
+            messaging_service=current_app.config.get('messaging_service'),
+            socketio=current_app.config.get('socketio'),
+            station_index=coffee_system.station_index
+        )
+
+        if not result['success']:
+            return jsonify({"success": False, "message": f"Error processing request: {result['error']}"}), 500
+
+        if result['not_found']:
+            logger.warning(f"Batch orders not found: {result['not_found']}")
+
         return jsonify({
-            "success": True, 
-            "processed": success_count,
-            "total": len(order_ids)
+            "success": True,
+            "processed": len(result['transitioned']),
+            "total": len(order_ids),
+            "unchanged": result['unchanged'],
+            "not_found": result['not_found'],
+            "notified": result['notified']
         })
     
     except Exception as e:
@@ -1400,23 +1312,6 @@ def send_message(order_id):
                 "message": error_msg
             })
         
-        # Create order_messages table if it doesn't exist
-        try:
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS order_messages (
-                    id SERIAL PRIMARY KEY,
-                    order_number VARCHAR(50) NOT NULL,
-                    phone VARCHAR(50) NOT NULL,
-                    message TEXT NOT NULL,
-                    message_sid VARCHAR(100),
-                    sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            db.commit()
-        except Exception as e:
-            logger.warning(f"Could not create order_messages table: {str(e)}")
-            # Continue anyway
-        
         # Send the message using messaging service
         try:
             result = messaging_service.send_message(phone_number, message)
@@ -1446,7 +1341,7 @@ def send_message(order_id):
             
             return jsonify({
                 "success": True, 
-                "message": "Message sent successfully",
+                "message": "Message queued for delivery" if str(result).startswith('outbox-') else "Message sent successfully",
                 "message_sid": result
             })
         except Exception as e:
@@ -1517,8 +1412,13 @@ def get_display_config():
 
 @bp.route('/display/orders', methods=['GET'])
 def get_display_orders():
-    """Get orders for the display screen"""
-    try:
+    """Get orders for the display screen
+
+    Every screen shares one cached board, rebuilt when an order changes.
+    Send the ETag back in If-None-Match for a 304, and add ?wait=<seconds>
+    to hold the request until the board changes.
+    """
+    def build_board():
         # Get coffee system from app context
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
@@ -1529,7 +1429,7 @@ def get_display_orders():
         # Get in-progress orders
         cursor.execute('''
             SELECT id, order_number, status, station_id, 
-                   created_at, phone, order_details
+                   created_at, phone, customer_name, coffee_type
             FROM orders 
             WHERE status = 'in-progress'
             ORDER BY created_at DESC
@@ -1540,16 +1440,7 @@ def get_display_orders():
         in_progress_orders = []
         for order in cursor.fetchall():
             # Extract order details
-            order_id, order_number, status, station_id, created_at, phone, order_details_json = order
-            
-            # Parse order details
-            if isinstance(order_details_json, str):
-                order_details = json.loads(order_details_json)
-            else:
-                order_details = order_details_json
-            
-            # Extract customer name
-            customer_name = order_details.get('name', 'Customer')
+            order_id, order_number, status, station_id, created_at, phone, customer_name, coffee_type = order
             
             # Format display phone (last 4 digits)
             display_phone = "****"
@@ -1560,9 +1451,9 @@ def get_display_orders():
             in_progress_orders.append({
                 'id': order_number,
                 'order_number': order_number,
-                'customerName': customer_name,
+                'customerName': customer_name or 'Customer',
                 'displayPhone': display_phone,
-                'coffeeType': order_details.get('type', 'Coffee'),
+                'coffeeType': coffee_type or 'Coffee',
                 'status': status,
                 'stationId': station_id
             })
@@ -1570,10 +1461,10 @@ def get_display_orders():
         # Get completed orders that are ready for pickup (limited to most recent 10)
         cursor.execute('''
             SELECT id, order_number, status, station_id, 
-                   created_at, completed_at, phone, order_details
+                   created_at, completed_at, phone, customer_name, coffee_type
             FROM orders 
-            WHERE status = 'completed' AND (picked_up_at IS NULL OR picked_up_at = '')
-            ORDER BY completed_at DESC
+            WHERE status = 'completed' AND picked_up_at IS NULL
+            ORDER BY completed_at DESC NULLS LAST
             LIMIT 10
         ''')
         
@@ -1581,16 +1472,7 @@ def get_display_orders():
         ready_orders = []
         for order in cursor.fetchall():
             # Extract order details
-            order_id, order_number, status, station_id, created_at, completed_at, phone, order_details_json = order
-            
-            # Parse order details
-            if isinstance(order_details_json, str):
-                order_details = json.loads(order_details_json)
-            else:
-                order_details = order_details_json
-            
-            # Extract customer name
-            customer_name = order_details.get('name', 'Customer')
+            order_id, order_number, status, station_id, created_at, completed_at, phone, customer_name, coffee_type = order
             
             # Format display phone (last 4 digits)
             display_phone = "****"
@@ -1601,22 +1483,24 @@ def get_display_orders():
             ready_orders.append({
                 'id': order_number,
                 'order_number': order_number,
-                'customerName': customer_name,
+                'customerName': customer_name or 'Customer',
                 'displayPhone': display_phone,
-                'coffeeType': order_details.get('type', 'Coffee'),
+                'coffeeType': coffee_type or 'Coffee',
                 'status': status,
                 'stationId': station_id
             })
         
-        # Return real order data
-        return jsonify({
+        return {
             "success": True,
             "orders": {
                 "inProgress": in_progress_orders,
                 "ready": ready_orders
             },
             "timestamp": datetime.now().isoformat()
-        })
+        }
+
+    try:
+        return get_display_snapshots().respond('display_orders', build_board)
     
     except Exception as e:
         logger.error(f"Error getting display orders: {str(e)}")
@@ -1686,19 +1570,6 @@ def get_settings():
         # Query database for settings
         cursor = db.cursor()
         
-        # Create settings table if it doesn't exist
-        try:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS settings (
-                    key VARCHAR(100) PRIMARY KEY,
-                    value TEXT NOT NULL,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            db.commit()
-        except Exception as e:
-            logger.warning(f"Error creating settings table: {str(e)}")
-        
         # Try to fetch all settings
         try:
             cursor.execute("SELECT key, value FROM settings")
@@ -1773,19 +1644,7 @@ def update_all_settings():
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Create settings table if it doesn't exist
         cursor = db.cursor()
-        try:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS settings (
-                    key VARCHAR(100) PRIMARY KEY,
-                    value TEXT NOT NULL,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            db.commit()
-        except Exception as e:
-            logger.warning(f"Error creating settings table: {str(e)}")
         
         # Update settings
         updated_settings = {}
@@ -1809,6 +1668,7 @@ def update_all_settings():
                 logger.error(f"Error updating setting {key}: {str(e)}")
         
         db.commit()
+        get_settings_service().invalidate()
         
         # Return updated settings
         return jsonify({
@@ -1862,6 +1722,7 @@ def update_setting():
         ''', (key, str_value, now, str_value, now))
         
         db.commit()
+        get_settings_service().invalidate()
         
         # Return updated setting
         return jsonify({
@@ -1891,6 +1752,7 @@ def reset_settings():
         cursor = db.cursor()
         cursor.execute("DELETE FROM settings")
         db.commit()
+        get_settings_service().invalidate()
         
         # Default settings
         default_settings = {
@@ -1968,6 +1830,7 @@ def update_wait_time():
         ''', (str(wait_time), now, str(wait_time), now))
         
         db.commit()
+        get_settings_service().invalidate()
         
         logger.info(f"Updated wait time to {wait_time} minutes for all active stations")
         return jsonify({"success": True, "message": f"Wait time updated to {wait_time} minutes"})
@@ -2198,6 +2061,7 @@ def update_station_status(station_id):
         # Check if station was found
         station = cursor.fetchone()
         db.commit()
+        coffee_system.station_index.invalidate()
         
         if not station:
             return jsonify({
@@ -2275,7 +2139,7 @@ def get_station_stats(station_id):
                 EXTRACT(HOUR FROM created_at) as hour,
                 COUNT(*) as order_count
             FROM orders
-            WHERE station_id = %s AND DATE(created_at) = CURRENT_DATE
+            WHERE station_id = %s AND created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + 1
             GROUP BY EXTRACT(HOUR FROM created_at)
             ORDER BY hour
         ''', (station_id,))
@@ -2389,56 +2253,6 @@ def create_station():
 # INVENTORY ENDPOINTS
 # ============================================================================
 
-# Low stock notifications and restock requests tables creation
-def ensure_inventory_management_tables(db):
-    """Ensure inventory management related tables exist"""
-    try:
-        cursor = db.cursor()
-        
-        # Create low stock reports table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS inventory_low_stock_reports (
-                id SERIAL PRIMARY KEY,
-                item_id INTEGER REFERENCES inventory_items(id),
-                reporter_id INTEGER,
-                reporter_name VARCHAR(100),
-                report_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                urgency VARCHAR(20) DEFAULT 'normal',
-                notes TEXT,
-                status VARCHAR(20) DEFAULT 'open'
-            )
-        ''')
-        
-        # Create restock requests table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS inventory_restock_requests (
-                id SERIAL PRIMARY KEY,
-                request_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                requester_id INTEGER,
-                requester_name VARCHAR(100),
-                status VARCHAR(20) DEFAULT 'pending',
-                notes TEXT,
-                delivery_expected_date DATE
-            )
-        ''')
-        
-        # Create restock request items table (many-to-many relationship)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS inventory_restock_request_items (
-                id SERIAL PRIMARY KEY,
-                request_id INTEGER REFERENCES inventory_restock_requests(id),
-                item_id INTEGER REFERENCES inventory_items(id),
-                quantity_requested DECIMAL(10, 2) NOT NULL,
-                quantity_received DECIMAL(10, 2) DEFAULT 0
-            )
-        ''')
-        
-        db.commit()
-        return True
-    except Exception as e:
-        logger.error(f"Error creating inventory management tables: {str(e)}")
-        return False
-
 @bp.route('/inventory', methods=['GET'])
 @jwt_required_with_demo()
 @role_required_with_demo(['admin', 'staff', 'barista'])
@@ -2453,40 +2267,7 @@ def get_inventory_items():
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Create inventory tables if they don't exist
         cursor = db.cursor()
-        try:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS inventory_items (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(100) NOT NULL,
-                    category VARCHAR(50) NOT NULL,
-                    current_quantity DECIMAL(10, 2) NOT NULL DEFAULT 0,
-                    unit VARCHAR(20) NOT NULL,
-                    station_id INTEGER,
-                    minimum_threshold DECIMAL(10, 2) NOT NULL DEFAULT 0,
-                    status VARCHAR(20) DEFAULT 'in_stock',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS inventory_adjustments (
-                    id SERIAL PRIMARY KEY,
-                    item_id INTEGER REFERENCES inventory_items(id),
-                    previous_quantity DECIMAL(10, 2) NOT NULL,
-                    new_quantity DECIMAL(10, 2) NOT NULL,
-                    adjustment_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    reason VARCHAR(50) NOT NULL,
-                    notes TEXT,
-                    user_id INTEGER
-                )
-            ''')
-            
-            db.commit()
-        except Exception as e:
-            logger.warning(f"Error creating inventory tables: {str(e)}")
         
         # Check if there are any inventory items
         cursor.execute("SELECT COUNT(*) FROM inventory_items")
@@ -2514,6 +2295,7 @@ def get_inventory_items():
                 ''')
                 
                 db.commit()
+                get_menu_cache().invalidate()
             except Exception as e:
                 logger.warning(f"Error inserting sample inventory data: {str(e)}")
                 db.rollback()
@@ -2899,6 +2681,7 @@ def update_inventory_item(item_id):
         # Get the updated item
         updated_row = cursor.fetchone()
         db.commit()
+        get_menu_cache().invalidate()
         
         if not updated_row:
             return jsonify({
@@ -2960,6 +2743,7 @@ def delete_inventory_item(item_id):
             
             # Commit the transaction
             db.commit()
+            get_menu_cache().invalidate()
             
             return jsonify({
                 'success': True,
@@ -3008,9 +2792,6 @@ def adjust_inventory_item(item_id):
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Ensure inventory management tables exist
-        ensure_inventory_management_tables(db)
-        
         # Start a transaction
         cursor = db.cursor()
         
@@ -3067,6 +2848,7 @@ def adjust_inventory_item(item_id):
             
             # Commit transaction
             db.commit()
+            get_menu_cache().invalidate()
             
             return jsonify({
                 'success': True,
@@ -3108,9 +2890,6 @@ def report_low_stock(item_id):
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Ensure inventory management tables exist
-        ensure_inventory_management_tables(db)
-        
         # Start a transaction
         cursor = db.cursor()
         
@@ -3205,9 +2984,6 @@ def create_restock_request():
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Ensure inventory management tables exist
-        ensure_inventory_management_tables(db)
-        
         # Start a transaction
         cursor = db.cursor()
         
@@ -3284,9 +3060,6 @@ def get_restock_requests():
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Ensure inventory management tables exist
-        ensure_inventory_management_tables(db)
-        
         # Build query
         query = "SELECT * FROM inventory_restock_requests"
         params = []
@@ -3475,10 +3248,8 @@ def get_chat_messages():
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Check if chat_messages table exists
         cursor = db.cursor()
-        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'chat_messages')")
-        table_exists = cursor.fetchone()[0]
+        table_exists = get_schema_capabilities().has_table('chat_messages')
         
         if table_exists:
             # Build query based on parameters
@@ -3553,18 +3324,7 @@ def create_chat_message():
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Create chat_messages table if it doesn't exist
         cursor = db.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chat_messages (
-                id SERIAL PRIMARY KEY,
-                sender VARCHAR(100) NOT NULL,
-                content TEXT NOT NULL,
-                is_urgent BOOLEAN DEFAULT FALSE,
-                station_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
         
         # Insert message
         cursor.execute('''
@@ -3776,56 +3536,7 @@ def get_today_schedule():
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Create schedule tables if they don't exist
         cursor = db.cursor()
-        try:
-            # Create shifts table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS schedule_shifts (
-                    id SERIAL PRIMARY KEY,
-                    barista_id INTEGER,
-                    barista_name VARCHAR(100),
-                    station_id INTEGER,
-                    date DATE,
-                    start_time TIME,
-                    end_time TIME,
-                    status VARCHAR(20) DEFAULT 'upcoming',
-                    notes TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Create breaks table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS schedule_breaks (
-                    id SERIAL PRIMARY KEY,
-                    barista_id INTEGER,
-                    barista_name VARCHAR(100),
-                    date DATE,
-                    start_time TIME,
-                    end_time TIME,
-                    break_type VARCHAR(20),
-                    status VARCHAR(20) DEFAULT 'upcoming',
-                    notes TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Create rush periods table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS schedule_rush_periods (
-                    id SERIAL PRIMARY KEY,
-                    date DATE,
-                    start_time TIME,
-                    end_time TIME,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            db.commit()
-        except Exception as e:
-            logger.warning(f"Error creating schedule tables: {str(e)}")
         
         # Get today's date
         today = datetime.now().date()
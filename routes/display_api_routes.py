@@ -6,7 +6,9 @@ This module provides API endpoints specifically for the React display screen
 import logging
 from flask import Blueprint, jsonify, request, current_app
 from datetime import datetime
-import json
+
+from services.settings_service import get_settings_service
+from services.wait_time_predictor import get_wait_time_predictor
 
 # Create blueprint
 bp = Blueprint('display_api', __name__, url_prefix='/api/display')
@@ -22,31 +24,20 @@ def get_display_config():
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Get settings from database
+        # Get settings from the settings service
+        settings = get_settings_service()
         cursor = db.cursor()
         
         # System name (default to 'Coffee Cue')
-        cursor.execute("SELECT value FROM settings WHERE key = %s", ('system_name',))
-        system_name_result = cursor.fetchone()
-        system_name = system_name_result[0] if system_name_result else 'Coffee Cue'
+        system_name = settings.get('system_name', 'Coffee Cue')
         
         # Event name
-        cursor.execute("SELECT value FROM settings WHERE key = %s", ('event_name',))
-        event_name_result = cursor.fetchone()
-        event_name = event_name_result[0] if event_name_result else current_app.config.get('config', {}).get('EVENT_NAME', 'Coffee Event')
+        event_name = settings.get('event_name', current_app.config.get('config', {}).get('EVENT_NAME', 'Coffee Event'))
         
         # Sponsor info
-        cursor.execute("SELECT value FROM settings WHERE key = %s", ('sponsor_display_enabled',))
-        sponsor_display_result = cursor.fetchone()
-        sponsor_display_enabled = sponsor_display_result[0].lower() in ('true', 'yes', '1', 't', 'y') if sponsor_display_result else False
-        
-        cursor.execute("SELECT value FROM settings WHERE key = %s", ('sponsor_name',))
-        sponsor_name_result = cursor.fetchone()
-        sponsor_name = sponsor_name_result[0] if sponsor_name_result and sponsor_display_enabled else ''
-        
-        cursor.execute("SELECT value FROM settings WHERE key = %s", ('sponsor_message',))
-        sponsor_message_result = cursor.fetchone()
-        sponsor_message = sponsor_message_result[0] if sponsor_message_result and sponsor_display_enabled else 'Coffee service proudly sponsored by {sponsor}'
+        sponsor_display_enabled = settings.get_bool('sponsor_display_enabled', False)
+        sponsor_name = settings.get('sponsor_name', '') if sponsor_display_enabled else ''
+        sponsor_message = settings.get('sponsor_message', 'Coffee service proudly sponsored by {sponsor}') if sponsor_display_enabled else 'Coffee service proudly sponsored by {sponsor}'
         
         # Format sponsor message
         if sponsor_display_enabled and sponsor_name and '{sponsor}' in sponsor_message:
@@ -55,18 +46,13 @@ def get_display_config():
         # SMS configuration
         twilio_number = current_app.config.get('config', {}).get('TWILIO_PHONE_NUMBER', '')
         
-        # Wait time
-        cursor.execute("""
-            SELECT wait_time FROM station_stats 
-            WHERE status = 'active' 
-            ORDER BY station_id LIMIT 1
-        """)
-        wait_time_result = cursor.fetchone()
-        wait_time = wait_time_result[0] if wait_time_result else "8-10"
+        # Wait for a new order at each station, from its queue and recent throughput
+        predictor = get_wait_time_predictor()
+        predictor.ensure_loaded()
         
         # Get active stations
         cursor.execute("""
-            SELECT station_id, name, location, status, barista_name 
+            SELECT station_id, name, location, status, barista_name, COALESCE(current_load, 0)
             FROM station_stats 
             WHERE status = 'active'
             ORDER BY station_id
@@ -76,7 +62,7 @@ def get_display_config():
         try:
             station_rows = cursor.fetchall()
             for row in station_rows:
-                station_id, name, location, status, barista_name = row
+                station_id, name, location, status, barista_name, current_load = row
                 station_name = name or f"Station #{station_id}"
                 station_location = location or "Main Venue"
                 
@@ -85,7 +71,8 @@ def get_display_config():
                     "name": station_name,
                     "location": station_location,
                     "status": status,
-                    "barista": barista_name or "Unassigned"
+                    "barista": barista_name or "Unassigned",
+                    "wait_time": predictor.estimate(station_id, current_load + 1)
                 })
         except Exception as e:
             logger.error(f"Error processing station data: {str(e)}")
@@ -97,6 +84,9 @@ def get_display_config():
                 "status": "active",
                 "barista": "Unassigned"
             }]
+        
+        # New orders go to the shortest queue
+        wait_time = min((station["wait_time"] for station in stations if "wait_time" in station), default="8-10")
             
         # Return display configuration
         return jsonify({
@@ -136,28 +126,30 @@ def get_display_orders():
         
         # Base query for orders
         query = """
-            SELECT id, order_number, status, station_id, 
-                   created_at, completed_at, phone, order_details
-            FROM orders 
-            WHERE status IN ('in-progress', 'completed')
-            AND completed_at > (NOW() - INTERVAL '2 hours')
+            SELECT o.id, o.order_number, o.status, o.station_id, 
+                   o.created_at, o.completed_at, o.phone, o.customer_name,
+                   o.coffee_type, cp.name AS profile_name
+            FROM orders o
+            LEFT JOIN customer_preferences cp ON cp.phone = o.phone
+            WHERE o.status IN ('in-progress', 'completed')
+            AND o.completed_at > (NOW() - INTERVAL '2 hours')
         """
         
         params = []
         
         # Filter by station if specified
         if station_id:
-            query += " AND station_id = %s"
+            query += " AND o.station_id = %s"
             params.append(station_id)
         
         # Add order clause
         query += """
             ORDER BY 
                 CASE 
-                    WHEN status = 'completed' THEN 2
-                    WHEN status = 'in-progress' THEN 1
+                    WHEN o.status = 'completed' THEN 2
+                    WHEN o.status = 'in-progress' THEN 1
                 END,
-                created_at DESC
+                o.created_at DESC
             LIMIT 20
         """
         
@@ -171,23 +163,16 @@ def get_display_orders():
         
         for order in cursor.fetchall():
             # Extract order details
-            order_id, order_number, status, order_station_id, created_at, completed_at, phone, order_details_json = order
-            
-            # Parse order details
-            if isinstance(order_details_json, str):
-                order_details = json.loads(order_details_json)
-            else:
-                order_details = order_details_json or {}
+            (order_id, order_number, status, order_station_id, created_at, completed_at, phone,
+             order_customer_name, coffee_type, profile_name) = order
             
             # Format phone number for display (show only last 4 digits)
             display_phone = "xxxx"
             if phone and len(phone) >= 4:
                 display_phone = phone[-4:]
             
-            # Get customer name from preferences or order details
-            cursor.execute("SELECT name FROM customer_preferences WHERE phone = %s", (phone,))
-            customer_result = cursor.fetchone()
-            customer_name = customer_result[0] if customer_result else order_details.get('name', 'Customer')
+            # Customer name from preferences, else the name on the order
+            customer_name = profile_name or order_customer_name or 'Customer'
             
             # Format order
             formatted_order = {
@@ -195,7 +180,7 @@ def get_display_orders():
                 "order_number": order_number,
                 "customerName": customer_name,
                 "displayPhone": display_phone,
-                "coffeeType": order_details.get('type', 'Coffee'),
+                "coffeeType": coffee_type or 'Coffee',
                 "status": status,
                 "stationId": order_station_id
             }
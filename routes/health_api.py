@@ -1,10 +1,20 @@
 """
 Health check API endpoint
 """
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, current_app
 from datetime import datetime
 import logging
 
+from services.settings_service import get_settings_service
+from services.order_events import get_order_event_stream
+from services.display_snapshot import get_display_snapshots
+from services.order_numbers import get_order_number_allocator
+from services.wait_time_predictor import get_wait_time_predictor
+from services.user_cache import get_user_cache
+from services.rate_counters import get_rate_counters
+from utils.database import get_pool_metrics, get_schema_capabilities
+from utils.log_queue import get_log_queue
+
 logger = logging.getLogger(__name__)
 
 bp = Blueprint('health_api', __name__, url_prefix='/api')
@@ -15,12 +25,30 @@ def health_check():
     Health check endpoint for API connectivity verification
     """
     try:
+        coffee_system = current_app.config.get('coffee_system')
+        conversation_store = getattr(coffee_system, 'conversation_store', None)
+        sms_outbox = current_app.config.get('sms_outbox')
+        sms_inbox = current_app.config.get('sms_inbox')
+        
         return jsonify({
             'status': 'success',
             'message': 'API is healthy',
             'timestamp': datetime.utcnow().isoformat(),
             'service': 'expresso-api',
-            'version': '1.0.0'
+            'version': '1.0.0',
+            'database_pool': get_pool_metrics(),
+            'schema': get_schema_capabilities().get_metrics(),
+            'conversation_store': conversation_store.get_metrics() if conversation_store else None,
+            'settings': get_settings_service().get_metrics(),
+            'order_events': get_order_event_stream().get_metrics(),
+            'display_snapshots': get_display_snapshots().get_metrics(),
+            'order_numbers': get_order_number_allocator().get_metrics(),
+            'wait_times': get_wait_time_predictor().get_metrics(),
+            'user_cache': get_user_cache().get_metrics(),
+            'rate_counters': get_rate_counters().get_metrics(),
+            'log_queue': get_log_queue().get_metrics(),
+            'sms_outbox': sms_outbox.get_metrics() if sms_outbox else None,
+            'sms_inbox': sms_inbox.get_metrics() if sms_inbox else None
         }), 200
     except Exception as e:
         logger.error(f"Health check failed: {e}")
@@ -10,6 +10,7 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 
 from models.inventory import InventoryItem
+from services.menu_snapshot import get_menu_cache
 from utils.helpers import role_required
 from auth import jwt_required_with_demo, role_required_with_demo
 
@@ -32,87 +33,6 @@ def get_current_user_id():
             return g.user['id']
         return None
 
-# Ensure inventory management tables exist
-def ensure_inventory_management_tables(db):
-    """Ensure inventory management related tables exist"""
-    try:
-        cursor = db.cursor()
-        
-        # Check and create inventory_alerts table
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_name = 'inventory_alerts'
-            )
-        """)
-        if not cursor.fetchone()[0]:
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS inventory_alerts (
-                id SERIAL PRIMARY KEY,
-                item_id INTEGER NOT NULL REFERENCES inventory_items(id) ON DELETE CASCADE,
-                alert_type VARCHAR(50) NOT NULL,
-                urgency VARCHAR(20) DEFAULT 'normal',
-                notes TEXT,
-                status VARCHAR(20) DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                created_by INTEGER,
-                resolved_at TIMESTAMP,
-                resolved_by INTEGER
-            )
-            ''')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_inventory_alerts_item_id ON inventory_alerts(item_id)')
-            logger.info("Created inventory_alerts table")
-        
-        # Check and create restock_requests table
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_name = 'restock_requests'
-            )
-        """)
-        if not cursor.fetchone()[0]:
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS restock_requests (
-                id SERIAL PRIMARY KEY,
-                status VARCHAR(20) DEFAULT 'pending',
-                notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                created_by INTEGER,
-                completed_at TIMESTAMP,
-                completed_by INTEGER
-            )
-            ''')
-            logger.info("Created restock_requests table")
-        
-        # Check and create restock_request_items table
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_name = 'restock_request_items'
-            )
-        """)
-        if not cursor.fetchone()[0]:
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS restock_request_items (
-                id SERIAL PRIMARY KEY,
-                restock_id INTEGER NOT NULL REFERENCES restock_requests(id) ON DELETE CASCADE,
-                item_id INTEGER NOT NULL REFERENCES inventory_items(id) ON DELETE CASCADE,
-                requested_amount DECIMAL(10,2) NOT NULL,
-                received_amount DECIMAL(10,2),
-                notes TEXT,
-                status VARCHAR(20) DEFAULT 'pending'
-            )
-            ''')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_restock_request_items_restock_id ON restock_request_items(restock_id)')
-            logger.info("Created restock_request_items table")
-        
-        db.commit()
-        return True
-    except Exception as e:
-        db.rollback()
-        logger.error(f"Error ensuring inventory management tables: {str(e)}")
-        return False
-
 # Get event-level inventory
 @bp.route('/api/inventory/event', methods=['GET'])
 @jwt_required_with_demo(optional=True)
@@ -171,6 +91,37 @@ def get_event_inventory():
             'message': 'Failed to fetch event inventory'
         }), 500
 
+# Get the current orderable menu
+@bp.route('/api/menu', methods=['GET'])
+@jwt_required_with_demo(optional=True)
+def get_menu():
+    """Get available drinks, milks, sweeteners and sizes from the shared menu snapshot
+
+    Pass ?version=N to get a small unchanged response when the client
+    already has that version.
+    """
+    try:
+        coffee_system = current_app.config.get('coffee_system')
+        snapshot = get_menu_cache().get(coffee_system.db)
+
+        if request.args.get('version') == str(snapshot.version):
+            return jsonify({
+                'success': True,
+                'unchanged': True,
+                'version': snapshot.version
+            })
+
+        return jsonify({
+            'success': True,
+            'menu': snapshot.to_dict()
+        })
+    except Exception as e:
+        logger.error(f"Error getting menu: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 # Get all inventory items
 @bp.route('/api/inventory', methods=['GET'])
 @jwt_required_with_demo(optional=True)
@@ -435,9 +386,6 @@ def report_low_stock(item_id):
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Ensure inventory management tables exist
-        ensure_inventory_management_tables(db)
-        
         # Verify the item exists
         cursor = db.cursor(cursor_factory=RealDictCursor)
         cursor.execute("SELECT * FROM inventory_items WHERE id = %s", (item_id,))
@@ -780,22 +728,6 @@ def add_coffee_types():
         # Get user ID for tracking
         user_id = get_current_user_id()
         
-        # Create the stock_items table if it doesn't exist
-        cursor = db.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS stock_items (
-                id SERIAL PRIMARY KEY,
-                category VARCHAR(50) NOT NULL,
-                name VARCHAR(100) NOT NULL,
-                notes TEXT,
-                is_active BOOLEAN DEFAULT TRUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                created_by INTEGER
-            )
-        """)
-        db.commit()
-        
         # Add each coffee type if it doesn't already exist
         added_coffees = []
         existing_coffees = []
@@ -834,6 +766,9 @@ def add_coffee_types():
             if coffee_id:
                 added_coffees.append(coffee['name'])
         
+        if added_coffees:
+            get_menu_cache().invalidate()
+        
         return jsonify({
             'success': True,
             'message': f'Added {len(added_coffees)} coffee types',
@@ -894,9 +829,6 @@ def create_restock_request():
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Ensure inventory management tables exist
-        ensure_inventory_management_tables(db)
-        
         # Start transaction
         cursor = db.cursor(cursor_factory=RealDictCursor)
         
@@ -1010,9 +942,6 @@ def get_restock_requests():
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Ensure inventory management tables exist
-        ensure_inventory_management_tables(db)
-        
         # Start query
         cursor = db.cursor(cursor_factory=RealDictCursor)
         
@@ -1087,9 +1016,6 @@ def get_restock_request(restock_id):
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Ensure inventory management tables exist
-        ensure_inventory_management_tables(db)
-        
         # Get restock request
         cursor = db.cursor(cursor_factory=RealDictCursor)
         cursor.execute("""
@@ -1170,9 +1096,6 @@ def complete_restock_request(restock_id):
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
-        # Ensure inventory management tables exist
-        ensure_inventory_management_tables(db)
-        
         # Start transaction
         cursor = db.cursor(cursor_factory=RealDictCursor)
         
@@ -1273,6 +1196,7 @@ def complete_restock_request(restock_id):
         """, (notes, datetime.now(), user_id, restock_id))
         
         db.commit()
+        get_menu_cache().invalidate()
         
         # Get updated restock request
         cursor.execute("""
@@ -8,6 +8,8 @@ from datetime import datetime, timedelta
 import json
 import logging
 
+from services.settings_service import get_settings_service
+
 logger = logging.getLogger(__name__)
 
 settings_api_bp = Blueprint('settings_api', __name__, url_prefix='/api/settings')
@@ -219,6 +221,7 @@ def update_branding_settings():
             """, (json.dumps(data), current_user_id))
         
         db.commit()
+        get_settings_service().invalidate()
         
         return jsonify({
             'success': True,
@@ -465,6 +468,7 @@ def update_wait_time():
             ''', (str(wait_time), datetime.now(), str(wait_time), datetime.now()))
             
             conn.commit()
+            get_settings_service().invalidate()
             
             logger.info(f"Updated wait time to {wait_time} minutes for all active stations")
             return jsonify({
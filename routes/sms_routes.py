@@ -1,21 +1,33 @@
 """
 Routes for handling SMS messages from Twilio with PostgreSQL support
 """
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, Response
 from twilio.twiml.messaging_response import MessagingResponse
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from psycopg2.extras import RealDictCursor
 import logging
 import json
 import os
+import re
 from twilio.request_validator import RequestValidator
 
+from services.rate_counters import get_rate_counters
+from utils.database import get_schema_capabilities
+
 # Create blueprint
 bp = Blueprint("sms_routes", __name__)
 
 # Set up logging
 logger = logging.getLogger("expresso.routes.sms")
 
+# Inbound messages accepted per phone number; later ones in the window are
+# dropped, with one reply when the limit is first passed
+SMS_PHONE_LIMIT = 20
+SMS_PHONE_WINDOW_MINUTES = 10
+SMS_THROTTLE_REPLY = ("You're sending messages faster than we can handle. "
+                      "Please wait a few minutes before texting again.")
+inbound_per_phone = get_rate_counters().counter('inbound_sms', window_minutes=SMS_PHONE_WINDOW_MINUTES)
+
 @bp.route('/sms/debug', methods=['GET', 'POST'])
 def sms_debug():
     """Debug endpoint to test SMS webhook delivery"""
@@ -26,75 +38,203 @@ def sms_debug():
     logger.info(f"JSON data: {request.get_json() if request.is_json else 'None'}")
     return {"status": "SMS debug endpoint working", "method": request.method}, 200
 
+def _throttle_response(from_number):
+    """
+    Count a new inbound message against its number's limit
+
+    Call only for messages that are not duplicate deliveries, so Twilio's
+    retries don't use up a customer's allowance.
+
+    Returns:
+        None if the message may be processed, otherwise the TwiML to return:
+        the throttle reply the first time the limit is passed, empty after
+        that (never an error, so Twilio does not retry)
+    """
+    received = inbound_per_phone.hit(from_number)
+    if received <= SMS_PHONE_LIMIT:
+        return None
+    resp = MessagingResponse()
+    if received == SMS_PHONE_LIMIT + 1:
+        logger.warning(f"Throttling SMS from {from_number}: over {SMS_PHONE_LIMIT} "
+                       f"messages in {SMS_PHONE_WINDOW_MINUTES} minutes")
+        resp.message(SMS_THROTTLE_REPLY)
+    return Response(str(resp), mimetype='text/xml')
+
+def _validate_twilio_signature():
+    """Check the X-Twilio-Signature header against the request
+
+    Returns:
+        True if the request is from Twilio (or validation is disabled)
+    """
+    auth_token = os.getenv('TWILIO_AUTH_TOKEN')
+    if not auth_token or auth_token == 'test_token':  # Skip validation if using test token
+        logger.debug("Twilio auth token not configured or in test mode, skipping webhook validation")
+        return True
+    
+    validator = RequestValidator(auth_token)
+    signature = request.headers.get('X-Twilio-Signature', '')
+    
+    # Get the full URL - handle Railway HTTPS proxy correctly
+    forwarded_proto = request.headers.get('X-Forwarded-Proto', '')
+    forwarded_host = request.headers.get('X-Forwarded-Host', request.host)
+    
+    if forwarded_proto == 'https':
+        url = f"https://{forwarded_host}{request.path}"
+        if request.query_string:
+            url += f"?{request.query_string.decode()}"
+    else:
+        url = request.url
+        # Railway serves HTTPS externally but shows HTTP internally
+        if 'railway.app' in url and url.startswith('http://'):
+            url = url.replace('http://', 'https://', 1)
+    
+    if not validator.validate(url, request.form.to_dict(), signature):
+        logger.warning(f"Invalid Twilio webhook signature from {request.remote_addr} (URL used: {url})")
+        return False
+    
+    return True
+
+def _detect_station(body):
+    """Find a station number mentioned in an SMS body, or None"""
+    body_lower = body.lower()
+    station_pattern = r'(?:(?:for|to|at)\s+)?(?:station|st|station\s*id|station\s*\#)[^0-9]*([0-9]+)'
+    station_match = re.search(station_pattern, body_lower)
+    if station_match:
+        try:
+            return int(station_match.group(1))
+        except (ValueError, TypeError):
+            logger.warning(f"Invalid station number format detected in message: '{body}'")
+            return None
+    
+    # Additional check for common station patterns
+    for station_id, word in ((1, 'one'), (2, 'two'), (3, 'three')):
+        if f"station {station_id}" in body_lower or f"station {word}" in body_lower or f"station#{station_id}" in body_lower:
+            return station_id
+    return None
+
+def process_inbound_sms(message):
+    """
+    Run an inbound SMS through the ordering state machine
+    
+    Must be called inside an app context. Used by the inbox workers and,
+    when no inbox is running, inline by the webhook.
+    
+    Args:
+        message: Dict with from, body and sender_name
+        
+    Returns:
+        Reply text, or None when no reply should be sent (Twilio keywords)
+    """
+    from_number = message['from']
+    body = message['body']
+    sender_name = message.get('sender_name') or ''
+    
+    coffee_system = current_app.config.get('coffee_system')
+    messaging_service = current_app.config.get('messaging_service')
+    
+    if not coffee_system or not messaging_service:
+        logger.error("Coffee system or messaging service not available")
+        return "Sorry, our ordering system is currently unavailable. Please try again later."
+    
+    # Check for Twilio reserved keywords
+    body_upper = body.strip().upper()
+    if body_upper == 'STOP':
+        # Handled by Twilio automatically, which sends its own reply
+        logger.info(f"Received STOP command from {from_number}, will be handled by Twilio")
+        return None
+    
+    if body_upper == 'START':
+        logger.info(f"Received START command from {from_number}")
+        try:
+            # Reset the conversation to a clean state
+            coffee_system._set_conversation_state(from_number, 'awaiting_name')
+        except Exception as reset_err:
+            logger.error(f"Failed to reset conversation state: {str(reset_err)}")
+        return "You have successfully been re-subscribed to coffee order messages. What's your first name?"
+    
+    if body_upper == 'HELP':
+        # HELP is handled by Twilio; INFO falls through to our own handler
+        logger.info(f"Received HELP command from {from_number}, letting Twilio handle it")
+        return None
+    
+    if body_upper == 'CANCEL':
+        # Our own CANCEL keyword, kept distinct from Twilio's opt-out handling
+        body = 'CANCELORDER'
+    
+    metadata = {'sender_name': sender_name} if sender_name else {}
+    station_id = _detect_station(body)
+    if station_id:
+        metadata['station_id'] = station_id
+    
+    # Add the message to the database for debugging and tracking
+    message_id = None
+    db = coffee_system.db
+    try:
+        cursor = db.cursor()
+        
+        cursor.execute("""
+            INSERT INTO sms_messages (phone_number, message_body, sender_name, station_id)
+            VALUES (%s, %s, %s, %s)
+            RETURNING id
+        """, (from_number, body, sender_name, station_id))
+        
+        message_id = cursor.fetchone()[0]
+        db.commit()
+    except Exception as db_err:
+        logger.error(f"Failed to save SMS to database: {str(db_err)}")
+        db.rollback()
+    
+    response_message = coffee_system.handle_sms(from_number, body, messaging_service, metadata)
+    logger.info(f"Processed SMS from {from_number}")
+    
+    # Update the database with the response
+    try:
+        if message_id is not None:
+            cursor = db.cursor()
+            cursor.execute("""
+                UPDATE sms_messages 
+                SET processed = TRUE, response_sent = %s
+                WHERE id = %s
+            """, (response_message, message_id))
+            db.commit()
+    except Exception as update_err:
+        logger.error(f"Failed to update SMS record: {str(update_err)}")
+    
+    return response_message
+
+def handle_queued_sms(app, message):
+    """
+    SmsInbox handler: process one message and reply through the REST API
+    
+    Args:
+        app: Flask application, for an app context (and pooled connection) per message
+        message: Dict with sid, from, body and sender_name
+    """
+    with app.app_context():
+        reply = process_inbound_sms(message)
+        if reply:
+            messaging_service = current_app.config.get('messaging_service')
+            messaging_service.send_message(message['from'], reply)
+
 @bp.route('/sms', methods=['POST'])
 def sms_webhook():
     """
     Handle incoming SMS messages from Twilio
-    This is the main webhook that Twilio will POST to when a new SMS is received
-    """
-    # FIRST: Log that we received ANY request to this endpoint
-    logger.info("🚨 SMS WEBHOOK CALLED! 🚨")
-    logger.info(f"Request method: {request.method}")
-    logger.info(f"Request URL: {request.url}")
-    logger.info(f"Request headers: {dict(request.headers)}")
-    logger.info(f"Request form data: {dict(request.form)}")
-    logger.info(f"Remote address: {request.remote_addr}")
+    This is the main webhook that Twilio will POST to when a new SMS is received.
     
-    # Log proxy headers specifically
-    logger.info(f"X-Forwarded-Proto: {request.headers.get('X-Forwarded-Proto', 'NOT SET')}")
-    logger.info(f"X-Forwarded-Host: {request.headers.get('X-Forwarded-Host', 'NOT SET')}")
-    logger.info(f"X-Forwarded-For: {request.headers.get('X-Forwarded-For', 'NOT SET')}")
+    When the SMS inbox is running this only validates and stores the message,
+    returning empty TwiML once it is committed (duplicate deliveries are
+    dropped by the insert); the reply is sent later via the REST API.
+    Without an inbox (testing mode) the message is processed inline and the
+    reply returned as TwiML.
+    """
+    logger.debug("SMS webhook called from %s, form data: %s", request.remote_addr, request.form)
     
     try:
         # SECURITY: Validate Twilio webhook signature
-        auth_token = os.getenv('TWILIO_AUTH_TOKEN')
-        if auth_token and auth_token != 'test_token':  # Skip validation if using test token
-            validator = RequestValidator(auth_token)
-            
-            # Get the signature from headers
-            signature = request.headers.get('X-Twilio-Signature', '')
-            
-            # Get the full URL - handle Railway HTTPS proxy correctly
-            # Check for forwarded headers first
-            forwarded_proto = request.headers.get('X-Forwarded-Proto', '')
-            forwarded_host = request.headers.get('X-Forwarded-Host', request.host)
-            
-            if forwarded_proto == 'https':
-                # Use the forwarded protocol
-                url = f"https://{forwarded_host}{request.path}"
-                if request.query_string:
-                    url += f"?{request.query_string.decode()}"
-                logger.info(f"Using forwarded URL for validation: {url}")
-            else:
-                # Fallback to request URL
-                url = request.url
-                # Railway serves HTTPS externally but shows HTTP internally
-                if 'railway.app' in url and url.startswith('http://'):
-                    url = url.replace('http://', 'https://', 1)
-                    logger.info(f"Corrected Railway URL for signature validation: {url}")
-            
-            # Get POST parameters
-            params = request.form.to_dict()
-            
-            logger.info(f"Validating signature with URL: {url}")
-            logger.info(f"Signature received: {signature[:20]}...")
-            
-            # Validate the request
-            if not validator.validate(url, params, signature):
-                logger.warning(f"Invalid Twilio webhook signature from {request.remote_addr}")
-                logger.warning(f"URL used for validation: {url}")
-                logger.warning(f"Parameters: {params}")
-                return "Unauthorized", 403
-            else:
-                logger.info("✅ Twilio webhook signature validation successful")
-        else:
-            logger.warning("Twilio auth token not configured or in test mode, skipping webhook validation")
-        # Log all request information for debugging
-        logger.info(f"SMS webhook called with request method: {request.method}")
-        logger.info(f"Request form data: {request.form}")
-        logger.info(f"Request values: {request.values}")
+        if not _validate_twilio_signature():
+            return "Unauthorized", 403
         
-        # Get POST data
         from_number = request.values.get('From', '')
         body = request.values.get('Body', '')
         
@@ -105,167 +245,44 @@ def sms_webhook():
             resp.message("Sorry, we couldn't process your message. Please try again.")
             return str(resp)
         
-        # Capture metadata - look for sender name in ProfileName field if available
-        sender_name = request.values.get('ProfileName', '')
-        
-        # Check for station mentions in the message - improved pattern matching
-        import re
-        station_id = None
-        station_pattern = r'(?:(?:for|to|at)\s+)?(?:station|st|station\s*id|station\s*\#)[^0-9]*([0-9]+)'
-        station_match = re.search(station_pattern, body.lower())
-        if station_match:
-            try:
-                station_id = int(station_match.group(1))
-                logger.info(f"Detected station {station_id} in SMS: '{body}'")
-            except (ValueError, TypeError):
-                logger.warning(f"Invalid station number format detected in message: '{body}'")
-        else:
-            # Additional check for common station patterns
-            if "station 1" in body.lower() or "station one" in body.lower() or "station#1" in body.lower():
-                station_id = 1
-                logger.info(f"Detected station 1 from text pattern in SMS: '{body}'")
-            elif "station 2" in body.lower() or "station two" in body.lower() or "station#2" in body.lower():
-                station_id = 2
-                logger.info(f"Detected station 2 from text pattern in SMS: '{body}'")
-            elif "station 3" in body.lower() or "station three" in body.lower() or "station#3" in body.lower():
-                station_id = 3
-                logger.info(f"Detected station 3 from text pattern in SMS: '{body}'")
-            else:
-                logger.info(f"No station detected in SMS: '{body}'")
-        
-        logger.info(f"Received SMS from {from_number}: {body}")
-        if sender_name:
-            logger.info(f"Sender profile name: {sender_name}")
-        
-        # Get coffee system from app context
-        coffee_system = current_app.config.get('coffee_system')
-        messaging_service = current_app.config.get('messaging_service')
-        
-        if not coffee_system or not messaging_service:
-            logger.error("Coffee system or messaging service not available")
-            resp = MessagingResponse()
-            resp.message("Sorry, our ordering system is currently unavailable. Please try again later.")
-            return str(resp)
+        message = {
+            'sid': request.values.get('MessageSid', ''),
+            'from': from_number,
+            'body': body,
+            # Sender name from the ProfileName field if available
+            'sender_name': request.values.get('ProfileName', '')
+        }
         
-        # Check for Twilio reserved keywords
-        body_upper = body.strip().upper()
-        if body_upper == 'STOP':
-            # This is handled by Twilio automatically, but we should log it
-            logger.info(f"Received STOP command from {from_number}, will be handled by Twilio")
-            # We'll just return None and let Twilio handle it
-            resp = MessagingResponse()
-            # We don't add a message because Twilio will add its own
-            return str(resp)
-            
-        if body_upper == 'START':
-            # This is handled by Twilio automatically, but we'll also handle it
-            logger.info(f"Received START command from {from_number}")
-            
-            # Instead of responding directly, we'll reset the conversation state
+        sms_inbox = current_app.config.get('sms_inbox')
+        if sms_inbox is not None:
             try:
-                # Get the coffee system to reset the conversation state to a clean state
-                coffee_system._set_conversation_state(from_number, 'awaiting_name')
-                logger.info(f"Reset conversation state for {from_number} after START command")
-            except Exception as reset_err:
-                logger.error(f"Failed to reset conversation state: {str(reset_err)}")
-            
-            resp = MessagingResponse()
-            resp.message("You have successfully been re-subscribed to coffee order messages. What's your first name?")
-            return str(resp)
-            
-        if body_upper == 'HELP' or body_upper == 'INFO':
-            # HELP is handled by Twilio, but we'll handle INFO ourselves
-            if body_upper == 'HELP':
-                logger.info(f"Received HELP command from {from_number}, letting Twilio handle it")
-                resp = MessagingResponse()
-                # We don't add a message because Twilio will add its own
-                return str(resp)
-            else:
-                # For INFO, we'll provide our own custom response
-                logger.info(f"Received INFO command from {from_number}")
-                # We'll pass this to our system to handle
-            
-        # Check if this is our own CANCEL keyword, which should be handled differently from Twilio's STOP
-        if body_upper == 'CANCEL':
-            logger.info(f"Received CANCEL command from {from_number}, will be handled by our system")
-            # We need to make sure this goes through our system, not Twilio's opt-out
-            body = 'CANCELORDER'  # Change the command to avoid collision with Twilio
-            
-        # Process message and get response, including sender_name if available
-        metadata = {'sender_name': sender_name} if sender_name else {}
-        
-        # Add the message to the database for debugging and tracking
-        message_id = None
-        try:
-            db = coffee_system.db
-            cursor = db.cursor()
-            
-            # Create sms_messages table if it doesn't exist
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS sms_messages (
-                    id SERIAL PRIMARY KEY,
-                    phone_number VARCHAR(20) NOT NULL,
-                    message_body TEXT NOT NULL,
-                    sender_name VARCHAR(100),
-                    station_id INTEGER,
-                    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    processed BOOLEAN DEFAULT FALSE,
-                    response_sent TEXT
-                )
-            """)
+                received = sms_inbox.receive(message)
+            except Exception as e:
+                # Not stored, so don't ack: Twilio tries again (or its fallback URL)
+                logger.error(f"Could not store SMS {message['sid']} from {from_number}: {str(e)}")
+                return Response(status=503)
+            if not received:
+                logger.info(f"Ignoring duplicate delivery of SMS {message['sid']}")
+                return Response(str(MessagingResponse()), mimetype='text/xml')
             
-            # Insert the message with station ID if detected
-            cursor.execute("""
-                INSERT INTO sms_messages (phone_number, message_body, sender_name, station_id)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id
-            """, (from_number, body, sender_name, station_id))
-            
-            message_id = cursor.fetchone()[0]
-            db.commit()
+            throttled = _throttle_response(from_number)
+            if throttled is not None:
+                sms_inbox.drop(message, 'throttled')
+                return throttled
             
-            logger.info(f"Saved SMS message to database with ID: {message_id}, station: {station_id}")
-        except Exception as db_err:
-            logger.error(f"Failed to save SMS to database: {str(db_err)}")
-            # Continue processing even if database save fails
-        
-        # Add station ID to metadata if detected
-        if metadata is None:
-            metadata = {}
-        
-        if station_id:
-            metadata['station_id'] = station_id
-            logger.info(f"Added station_id={station_id} to SMS metadata")
-        
-        # Log the message metadata for debugging
-        logger.info(f"Processing SMS with metadata: {metadata}")
-        
-        # Process the message and get a response
-        response_message = coffee_system.handle_sms(from_number, body, messaging_service, metadata)
-        
-        logger.info(f"Coffee system returned message: {response_message}")
-        
-        # Update the database with the response
-        try:
-            if message_id is not None:
-                cursor = db.cursor()
-                cursor.execute("""
-                    UPDATE sms_messages 
-                    SET processed = TRUE, response_sent = %s
-                    WHERE id = %s
-                """, (response_message, message_id))
-                db.commit()
-                logger.info(f"Updated SMS record {message_id} with response")
-        except Exception as update_err:
-            logger.error(f"Failed to update SMS record: {str(update_err)}")
-        
-        # Return TwiML response
-        response = messaging_service.create_response(response_message)
-        logger.info(f"Creating TwiML response: {response}")
-        
-        # Make sure we're returning the response with correct content type
-        from flask import Response
-        return Response(response, mimetype='text/xml')
+            sms_inbox.enqueue(message)
+            logger.info(f"Queued SMS {message['sid']} from {from_number}")
+            return Response(str(MessagingResponse()), mimetype='text/xml')
+        
+        # No inbox running: process now and reply in the TwiML
+        throttled = _throttle_response(from_number)
+        if throttled is not None:
+            return throttled
+        response_message = process_inbound_sms(message)
+        resp = MessagingResponse()
+        if response_message:
+            resp.message(response_message)
+        return Response(str(resp), mimetype='text/xml')
     except Exception as e:
         logger.error(f"Error processing SMS: {str(e)}", exc_info=True)
         
@@ -411,18 +428,6 @@ def send_test_sms():
                     db = coffee_system.db
                     cursor = db.cursor()
                     
-                    # Create order_messages table if it doesn't exist
-                    cursor.execute("""
-                        CREATE TABLE IF NOT EXISTS order_messages (
-                            id SERIAL PRIMARY KEY,
-                            order_number VARCHAR(50) NOT NULL,
-                            phone VARCHAR(50) NOT NULL,
-                            message TEXT NOT NULL,
-                            message_sid VARCHAR(100),
-                            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                    """)
-                    
                     # Insert message record
                     cursor.execute("""
                         INSERT INTO order_messages 
@@ -529,18 +534,6 @@ def send_sms():
                     db = coffee_system.db
                     cursor = db.cursor()
                     
-                    # Create order_messages table if it doesn't exist
-                    cursor.execute("""
-                        CREATE TABLE IF NOT EXISTS order_messages (
-                            id SERIAL PRIMARY KEY,
-                            order_number VARCHAR(50) NOT NULL,
-                            phone VARCHAR(50) NOT NULL,
-                            message TEXT NOT NULL,
-                            message_sid VARCHAR(100),
-                            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                    """)
-                    
                     # Insert message record
                     cursor.execute("""
                         INSERT INTO order_messages 
@@ -588,16 +581,7 @@ def sms_history():
         db = coffee_system.db
         cursor = db.cursor(cursor_factory=RealDictCursor)
         
-        # Check if the table exists
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_name = 'sms_messages'
-            )
-        """)
-        table_exists = cursor.fetchone()['exists']
-        
-        if not table_exists:
+        if not get_schema_capabilities().has_table('sms_messages'):
             return jsonify({
                 "status": "success",
                 "messages": [],
@@ -649,16 +633,6 @@ def sms_status_callback():
             db = coffee_system.db
             cursor = db.cursor()
             
-            # Check if sms_status_logs table exists, create if not
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS sms_status_logs (
-                    id SERIAL PRIMARY KEY,
-                    message_sid TEXT NOT NULL,
-                    status TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
             # Log status update
             cursor.execute(
                 "INSERT INTO sms_status_logs (message_sid, status) VALUES (%s, %s)",
@@ -11,6 +11,7 @@ from psycopg2.extras import RealDictCursor
 
 from models.stations import Station, StationSchedule
 from utils.helpers import role_required
+from utils.database import day_range
 from auth import jwt_required_with_demo, role_required_with_demo
 
 # Set up logging
@@ -211,6 +212,7 @@ def create_station():
         # Get the inserted station
         result = cursor.fetchone()
         db.commit()
+        coffee_system.station_index.invalidate()
         
         # Format response
         cursor = db.cursor(cursor_factory=RealDictCursor)
@@ -277,6 +279,8 @@ def update_station_status(station_id):
                 'error': f'Failed to update status for station {station_id}'
             }), 400
         
+        coffee_system.station_index.invalidate()
+        
         # Get updated station
         station = Station.get_by_id(db, station_id)
         
@@ -335,6 +339,8 @@ def assign_barista(station_id):
                 'error': f'Failed to assign barista to station {station_id}'
             }), 400
         
+        coffee_system.schedule_timeline.invalidate()
+        
         # Get updated station
         station = Station.get_by_id(db, station_id)
         
@@ -416,6 +422,7 @@ def update_station_capabilities(station_id):
         """, (json.dumps(capabilities), datetime.now(), station_id))
         
         db.commit()
+        coffee_system.station_index.invalidate()
         
         # Get updated station
         updated_station = Station.get_by_id(db, station_id)
@@ -493,6 +500,8 @@ def update_station(station_id):
                 'error': f'Failed to update station {station_id}'
             }), 400
         
+        coffee_system.station_index.invalidate()
+        
         # Get updated station
         updated_station = Station.get_by_id(db, station_id)
         
@@ -552,13 +561,9 @@ def delete_station(station_id):
                 'error': f'Failed to delete station {station_id}. It may have active orders.'
             }), 400
         
-        # Clear any cached station data
-        try:
-            # Try to clear station caches if any exist
-            if hasattr(g, 'station_cache'):
-                g.station_cache.pop(station_id, None)
-        except Exception as e:
-            logger.warning(f"Error clearing station cache: {str(e)}")
+        # Drop the deleted station from the assignment index and schedule timeline
+        coffee_system.station_index.invalidate()
+        coffee_system.schedule_timeline.invalidate()
         
         return jsonify({
             'success': True,
@@ -606,14 +611,14 @@ def get_station_stats(station_id):
         orders_by_status = cursor.fetchall()
         
         # Get order counts by hour for today
-        today = datetime.now().strftime('%Y-%m-%d')
+        today_start, today_end = day_range(datetime.now())
         cursor.execute("""
             SELECT EXTRACT(HOUR FROM created_at) as hour, COUNT(*) as count
             FROM orders
-            WHERE station_id = %s AND DATE(created_at) = %s
+            WHERE station_id = %s AND created_at >= %s AND created_at < %s
             GROUP BY hour
             ORDER BY hour
-        """, (station_id, today))
+        """, (station_id, today_start, today_end))
         
         orders_by_hour = cursor.fetchall()
         
@@ -641,7 +646,7 @@ def get_station_stats(station_id):
             SELECT AVG(EXTRACT(EPOCH FROM (completed_at - created_at))) as avg_completion_time
             FROM orders
             WHERE station_id = %s AND status = 'completed' AND completed_at IS NOT NULL
-            AND DATE(created_at) >= %s
+            AND created_at >= %s
         """, (station_id, one_week_ago))
         
         avg_completion_result = cursor.fetchone()
@@ -685,19 +690,8 @@ def get_todays_schedule():
         # Get today's day of week (0=Monday, 6=Sunday)
         today = datetime.now().weekday()
         
-        # Get schedules for today
-        schedules = StationSchedule.get_schedules_by_day(db, today)
-        
-        # Format time values
-        for schedule in schedules:
-            for time_field in ['start_time', 'end_time', 'break_start', 'break_end']:
-                if time_field in schedule and schedule[time_field]:
-                    try:
-                        # Format as 12-hour time for display
-                        time_obj = datetime.strptime(schedule[time_field], "%H:%M").time()
-                        schedule[f"{time_field}_formatted"] = time_obj.strftime("%I:%M %p").lstrip("0").replace(" 0", " ")
-                    except Exception:
-                        pass
+        # Get schedules for today from the compiled timeline (times already formatted)
+        schedules = coffee_system.schedule_timeline.shifts_for_day(db, today)
         
         # Add shifts, breaks, and rush periods for demonstration
         if len(schedules) == 0:
@@ -826,18 +820,8 @@ def get_todays_schedule():
             db.commit()
             
             # Get updated schedules
-            schedules = StationSchedule.get_schedules_by_day(db, today)
-            
-            # Format time values again
-            for schedule in schedules:
-                for time_field in ['start_time', 'end_time', 'break_start', 'break_end']:
-                    if time_field in schedule and schedule[time_field]:
-                        try:
-                            # Format as 12-hour time for display
-                            time_obj = datetime.strptime(schedule[time_field], "%H:%M").time()
-                            schedule[f"{time_field}_formatted"] = time_obj.strftime("%I:%M %p").lstrip("0").replace(" 0", " ")
-                        except Exception:
-                            pass
+            coffee_system.schedule_timeline.invalidate()
+            schedules = coffee_system.schedule_timeline.shifts_for_day(db, today)
         
         # Get stations for additional info
         cursor = db.cursor(cursor_factory=RealDictCursor)
@@ -1058,6 +1042,8 @@ def add_shift():
                 'error': 'Failed to add shift to schedule'
             }), 400
         
+        coffee_system.schedule_timeline.invalidate()
+        
         # Get the new schedule
         cursor = db.cursor(cursor_factory=RealDictCursor)
         cursor.execute("""
@@ -1147,6 +1133,8 @@ def update_shift(shift_id):
                 'error': f'Failed to update shift {shift_id}'
             }), 400
         
+        coffee_system.schedule_timeline.invalidate()
+        
         # Get the updated schedule
         cursor = db.cursor(cursor_factory=RealDictCursor)
         cursor.execute("""
@@ -1213,6 +1201,8 @@ def delete_shift(shift_id):
                 'error': f'Failed to delete shift {shift_id}'
             }), 400
         
+        coffee_system.schedule_timeline.invalidate()
+        
         return jsonify({
             'success': True,
             'message': f'Shift {shift_id} deleted successfully'
@@ -1293,6 +1283,8 @@ def add_break():
                 'error': f'Failed to add break to shift {data["shift_id"]}'
             }), 400
         
+        coffee_system.schedule_timeline.invalidate()
+        
         # Get the updated schedule
         cursor.execute("""
             SELECT s.*, st.barista_name 
@@ -1392,6 +1384,8 @@ def update_break(shift_id):
                 'error': f'Failed to update break for shift {shift_id}'
             }), 400
         
+        coffee_system.schedule_timeline.invalidate()
+        
         # Get the updated schedule
         cursor.execute("""
             SELECT s.*, st.barista_name 
@@ -1462,6 +1456,8 @@ def delete_break(shift_id):
                 'error': f'Failed to delete break for shift {shift_id}'
             }), 400
         
+        coffee_system.schedule_timeline.invalidate()
+        
         # Get the updated schedule
         cursor = db.cursor(cursor_factory=RealDictCursor)
         cursor.execute("""
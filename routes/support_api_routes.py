@@ -14,6 +14,8 @@ import json
 import os
 from functools import wraps
 
+from services.settings_service import get_settings_service
+
 support_api_bp = Blueprint('support_api', __name__)
 logger = logging.getLogger(__name__)
 
@@ -188,6 +190,7 @@ def emergency_stop():
             WHERE status IN ('pending', 'in_progress')
         """)
         db.commit()
+        get_settings_service().invalidate()
         cursor.close()
         
         logger.warning("Emergency stop activated by user")
@@ -222,6 +225,7 @@ def emergency_resume():
             WHERE status = 'paused'
         """)
         db.commit()
+        get_settings_service().invalidate()
         cursor.close()
         
         logger.info("System operations resumed")
@@ -2,6 +2,8 @@ from flask import Blueprint, render_template, request, jsonify, abort
 from models.orders import Order, OrderStatus
 from datetime import datetime
 
+from services.wait_time_predictor import get_wait_time_predictor
+
 track_bp = Blueprint('track', __name__)
 
 @track_bp.route('/<string:tracking_code>')
@@ -30,12 +32,8 @@ def order(tracking_code):
             Order.created_at < order.created_at
         ).count()
         
-        # Estimate 3 minutes per order ahead
-        estimated_wait = orders_ahead * 3
-        
-        # Add station's base wait time
-        if station:
-            estimated_wait += station.base_wait_time
+        # The station's recent throughput for the orders ahead plus this one
+        estimated_wait = get_wait_time_predictor().estimate(order.station_id, orders_ahead + 1)
     else:
         estimated_wait = None
     
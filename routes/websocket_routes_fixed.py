@@ -10,6 +10,39 @@ from flask import request
 
 logger = logging.getLogger(__name__)
 
+def orders_sync(data):
+    """Replay or snapshot for a request_sync of type 'orders'
+
+    A client that passes the stream and since_seq of the last order_event it
+    applied gets just the events it missed, while they are still buffered.
+    Otherwise it gets a snapshot of the live queue to apply later events to.
+    """
+    from services.order_events import get_order_event_stream
+    from utils.database import get_db_connection, close_connection
+
+    stream = get_order_event_stream()
+    since_seq = data.get('since_seq')
+    if since_seq is not None:
+        try:
+            events = stream.events_since(int(since_seq), data.get('stream'))
+        except (TypeError, ValueError):
+            events = None
+        if events is not None:
+            return {'type': 'orders', 'mode': 'replay', 'stream': stream.stream_id,
+                    'seq': events[-1]['seq'] if events else int(since_seq), 'events': events}
+
+    db = get_db_connection()
+    try:
+        snapshot = stream.snapshot(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        close_connection(db)
+    snapshot.update({'type': 'orders', 'mode': 'snapshot'})
+    return snapshot
+
 def init_websocket_handlers(socketio):
     """Initialize WebSocket event handlers"""
     
@@ -187,7 +220,12 @@ def init_websocket_handlers(socketio):
         """Handle sync requests from clients"""
         try:
             sync_type = data.get('type')
-            
+
+            if sync_type == 'orders':
+                # Only the requesting client needs the snapshot
+                emit('sync_orders', orders_sync(data))
+                return
+
             emit('sync_' + sync_type, {
                 'type': sync_type,
                 'timestamp': datetime.utcnow().isoformat()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Script to rebuild the hourly order_rollups table from orders
+The rollups are built once by schema migration 3 and then kept current by a
+trigger; run this after restoring orders from a backup or editing them with
+the trigger disabled, or to check the rollups against the orders table
+"""
+
+import sys
+import os
+import argparse
+import logging
+
+# Add parent directory to path so we can import from the project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Import dependencies
+import config
+from utils.database import get_db_connection, close_connection
+from services.order_rollups import rebuild_order_rollups
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("expresso.scripts.backfill_order_rollups")
+
+# Rollup rows that disagree with a fresh aggregate of orders
+DRIFT_QUERY = '''
+    WITH actual AS (
+        SELECT date_trunc('hour', COALESCE(created_at, 'epoch'::timestamp)) AS hour,
+               COALESCE(station_id, 0) AS station_id, COALESCE(coffee_type, '') AS coffee_type,
+               COALESCE(milk_type, '') AS milk_type, status, COUNT(*) AS order_count
+        FROM orders
+        GROUP BY 1, 2, 3, 4, 5
+    )
+    SELECT COUNT(*)
+    FROM actual a
+    FULL JOIN (SELECT * FROM order_rollups WHERE order_count <> 0) r
+      USING (hour, station_id, coffee_type, milk_type, status)
+    WHERE a.order_count IS DISTINCT FROM r.order_count
+'''
+
+def backfill(check_only=False):
+    """Rebuild order_rollups, or with check_only just report drift"""
+    db = None
+    try:
+        logger.info("Connecting to database...")
+        db = get_db_connection(config.DATABASE_URL)
+
+        cursor = db.cursor()
+        cursor.execute(DRIFT_QUERY)
+        drift = cursor.fetchone()[0]
+        db.commit()
+        logger.info(f"{drift} rollup rows differ from the orders table")
+
+        if check_only:
+            return drift
+
+        rows = rebuild_order_rollups(db)
+        logger.info(f"order_rollups rebuilt with {rows} rows")
+        return 0
+
+    except Exception as e:
+        logger.error(f"Error rebuilding order rollups: {str(e)}")
+        if db:
+            db.rollback()
+        raise
+    finally:
+        if db:
+            close_connection(db)
+            logger.info("Database connection closed")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild order_rollups from orders")
+    parser.add_argument('--check', action='store_true', help="Only report rows that have drifted")
+    args = parser.parse_args()
+
+    sys.exit(1 if backfill(check_only=args.check) else 0)
@@ -6,9 +6,16 @@ import json
 from datetime import datetime
 from flask import request, g, current_app
 from flask_jwt_extended import get_jwt_identity, get_jwt
-from functools import wraps
+from functools import wraps, lru_cache
 import hashlib
 import os
+import random
+import time
+
+from services.rate_counters import get_rate_counters
+
+# Ensure logs directory exists
+os.makedirs('logs', exist_ok=True)
 
 # Configure security audit logger
 security_logger = logging.getLogger('security_audit')
@@ -30,9 +37,6 @@ api_handler.setFormatter(api_formatter)
 api_logger.addHandler(api_handler)
 api_logger.setLevel(logging.INFO)
 
-# Ensure logs directory exists
-os.makedirs('logs', exist_ok=True)
-
 class SecurityAuditLogger:
     """Security event logging and monitoring"""
     
@@ -125,84 +129,118 @@ class SecurityAuditLogger:
         
         security_logger.error(f"SUSPICIOUS_ACTIVITY: {json.dumps(event)}")
 
+# Share of ordinary requests whose log entry is written, by path prefix
+# (first match wins). Sensitive paths, errors and slow requests are always
+# logged; the busiest polling endpoints are sampled hardest.
+API_LOG_SAMPLE_RATES = [
+    ('/api/health', 0.01),
+    ('/api/display', 0.05),
+    ('/api/orders', 0.1),
+    ('/api/', 0.25),
+]
+API_LOG_SLOW_MS = 1000
+SENSITIVE_PATHS = ('/api/auth/', '/api/admin/', '/api/users/', '/sms')
+
+@lru_cache(maxsize=4096)
+def _request_fingerprint(method, path, query_string, content_length, user_agent):
+    """MD5 of the request's shape; polling clients repeat the same few shapes"""
+    request_data = {
+        'method': method,
+        'path': path,
+        'query_string': query_string,
+        'content_length': content_length,
+        'user_agent': user_agent,
+    }
+    return hashlib.md5(json.dumps(request_data, sort_keys=True).encode()).hexdigest()
+
+@lru_cache(maxsize=1024)
+def _route_policy(path):
+    """(sensitive, sample rate) for a path"""
+    if any(prefix in path for prefix in SENSITIVE_PATHS):
+        return True, 1.0
+    for prefix, rate in API_LOG_SAMPLE_RATES:
+        if path.startswith(prefix):
+            return False, rate
+    return False, 1.0
+
 class APIRequestLogger:
-    """API request logging and monitoring"""
+    """API request logging and monitoring
+    
+    Each request gets one api_access entry, written after the response, and
+    only for the sampled share of its route (see API_LOG_SAMPLE_RATES).
+    Sizes come from Content-Length headers, so bodies are never buffered.
+    """
     
     @staticmethod
     def log_api_request():
-        """Log all API requests"""
-        user_id = None
-        try:
-            user_id = get_jwt_identity()
-        except:
-            pass
-        
-        # Create request fingerprint
-        request_data = {
-            'method': request.method,
-            'path': request.path,
-            'query_string': request.query_string.decode(),
-            'content_length': request.content_length or 0,
-            'user_agent': request.headers.get('User-Agent', '')[:200],  # Truncate
-        }
-        
-        fingerprint = hashlib.md5(
-            json.dumps(request_data, sort_keys=True).encode()
-        ).hexdigest()
-        
-        log_entry = {
-            'timestamp': datetime.utcnow().isoformat(),
-            'method': request.method,
-            'path': request.path,
-            'query_params': dict(request.args),
-            'user_id': user_id,
-            'ip_address': request.remote_addr,
-            'user_agent': request.headers.get('User-Agent', 'Unknown')[:200],
-            'content_length': request.content_length or 0,
-            'fingerprint': fingerprint
-        }
+        """Start timing an API request and decide whether it is sampled"""
+        sensitive, rate = _route_policy(request.path)
+        g.api_log_started = time.perf_counter()
+        g.api_log_sampled = rate >= 1.0 or random.random() < rate
         
         # Log sensitive endpoints with higher priority
-        sensitive_paths = ['/api/auth/', '/api/admin/', '/api/users/', '/sms']
-        is_sensitive = any(path in request.path for path in sensitive_paths)
-        
-        if is_sensitive:
-            log_entry['sensitive'] = True
+        if sensitive:
+            user_id = None
+            try:
+                user_id = get_jwt_identity()
+            except:
+                pass
             SecurityAuditLogger.log_data_access(
                 user_id, request.path, request.method, sensitive=True
             )
-        
-        api_logger.info(json.dumps(log_entry))
     
     @staticmethod
     def log_api_response(response):
         """Log API responses with security context"""
+        # Log security-relevant errors
+        if response.status_code in [401, 403, 429]:
+            SecurityAuditLogger.log_security_event(
+                f'http_{response.status_code}',
+                f'{response.status_code} response for {request.path}',
+                severity='medium'
+            )
+        
+        started = g.get('api_log_started')
+        duration_ms = (time.perf_counter() - started) * 1000 if started is not None else None
+        slow = duration_ms is not None and duration_ms >= API_LOG_SLOW_MS
+        if not (g.get('api_log_sampled', True) or response.status_code >= 400 or slow):
+            return
+        if not api_logger.isEnabledFor(logging.INFO):
+            return
+        
         user_id = None
         try:
             user_id = get_jwt_identity()
         except:
             pass
         
+        user_agent = request.headers.get('User-Agent', '')[:200]  # Truncate
+        content_length = request.content_length or 0
+        sensitive, rate = _route_policy(request.path)
         log_entry = {
             'timestamp': datetime.utcnow().isoformat(),
-            'status_code': response.status_code,
+            'method': request.method,
+            'path': request.path,
+            'query_params': request.args.to_dict(),
             'user_id': user_id,
             'ip_address': request.remote_addr,
-            'path': request.path,
-            'response_size': len(response.get_data()),
+            'user_agent': user_agent or 'Unknown',
+            'content_length': content_length,
+            'fingerprint': _request_fingerprint(
+                request.method, request.path, request.query_string.decode(),
+                content_length, user_agent
+            ),
+            'status_code': response.status_code,
+            'response_size': response.content_length,   # None when streamed
+            'duration_ms': round(duration_ms, 1) if duration_ms is not None else None,
+            'sample_rate': rate,
         }
+        if sensitive:
+            log_entry['sensitive'] = True
         
         # Log error responses for security analysis
         if response.status_code >= 400:
             log_entry['error'] = True
-            
-            # Log security-relevant errors
-            if response.status_code in [401, 403, 429]:
-                SecurityAuditLogger.log_security_event(
-                    f'http_{response.status_code}',
-                    f'{response.status_code} response for {request.path}',
-                    severity='medium'
-                )
         
         api_logger.info(json.dumps(log_entry))
 
@@ -278,44 +316,39 @@ def init_security_monitoring(app):
 
 # Brute force protection tracking
 class BruteForceProtection:
-    """Track and prevent brute force attacks"""
+    """Track and prevent brute force attacks
+    
+    Failed attempts are counted per identifier over the last hour in the
+    shared sliding-window counters, which cap how many identifiers are kept.
+    """
     
-    failed_attempts = {}  # In production, use Redis or database
+    failed_attempts = get_rate_counters().counter('failed_logins', window_minutes=60)
     
     @classmethod
-    def record_failed_attempt(cls, identifier):
-        """Record a failed login attempt"""
-        now = datetime.utcnow()
-        if identifier not in cls.failed_attempts:
-            cls.failed_attempts[identifier] = []
-        
-        cls.failed_attempts[identifier].append(now)
-        
-        # Clean old attempts (older than 1 hour)
-        cutoff = now.replace(hour=now.hour-1) if now.hour > 0 else now.replace(day=now.day-1, hour=23)
-        cls.failed_attempts[identifier] = [
-            attempt for attempt in cls.failed_attempts[identifier]
-            if attempt > cutoff
-        ]
+    def record_failed_attempt(cls, identifier, threshold=5):
+        """Record a failed login attempt; returns attempts in the last hour"""
+        attempts = cls.failed_attempts.hit(identifier)
         
         # Log if threshold exceeded
-        if len(cls.failed_attempts[identifier]) >= 5:
+        if attempts >= threshold:
             SecurityAuditLogger.log_security_event(
                 'brute_force_detected',
                 f"Brute force attack detected from {identifier}",
                 severity='high'
             )
+        return attempts
     
     @classmethod
     def is_blocked(cls, identifier, threshold=5):
         """Check if identifier should be blocked"""
-        if identifier not in cls.failed_attempts:
-            return False
-        
-        return len(cls.failed_attempts[identifier]) >= threshold
+        return cls.failed_attempts.count(identifier) >= threshold
     
     @classmethod
     def clear_attempts(cls, identifier):
         """Clear failed attempts for successful login"""
-        if identifier in cls.failed_attempts:
-            del cls.failed_attempts[identifier]
\ No newline at end of file
+        cls.failed_attempts.reset(identifier)
+    
+    @classmethod
+    def clear_attempts_prefix(cls, prefix):
+        """Clear failed attempts for every identifier starting with prefix"""
+        cls.failed_attempts.reset_prefix(prefix)
@@ -15,6 +15,19 @@ import sqlite3
 from models.orders import Order, CustomerPreference
 from models.stations import Station
 from services.nlp import NLPService
+from services.station_index import StationIndex
+from services.wait_time_predictor import get_wait_time_predictor
+from services.order_transitions import BATCH_ACTIONS, transition_orders
+from services.order_numbers import next_order_number
+from services.schedule_timeline import get_schedule_timeline
+from services.menu_snapshot import get_menu_cache
+from services.settings_service import get_settings_service
+from services import order_rollups
+from services.conversation_store import (
+    ConversationStore, PostgresConversationBackend,
+    DEFAULT_MAX_ENTRIES, DEFAULT_TTL, DEFAULT_FLUSH_INTERVAL
+)
+from utils.database import day_range, get_schema_capabilities, insert_order, transition_order
 
 logger = logging.getLogger("expresso.services.coffee_system")
 
@@ -26,19 +39,33 @@ class CoffeeOrderSystem:
         Initialize the coffee ordering system
         
         Args:
-            db: Database connection
+            db: Database connection used outside of requests (startup, background work)
             config: Configuration dictionary
         """
-        self.db = db
+        self._db = db
         self.config = config
         self.nlp = NLPService()
         self.event_name = config.get('EVENT_NAME', 'ANZCA ASM 2025 Cairns')
         
-        # Initialize conversation states dictionary
-        self.conversation_states = {}
+        # Conversation states: bounded memory tier with write-behind to conversation_states
+        self.conversation_store = ConversationStore(
+            backend=PostgresConversationBackend(),
+            max_entries=config.get('CONVERSATION_CACHE_SIZE', DEFAULT_MAX_ENTRIES),
+            ttl=config.get('CONVERSATION_CACHE_TTL', DEFAULT_TTL),
+            flush_interval=config.get('CONVERSATION_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+        )
+        
+        # Settings served from memory, shared with the routes
+        self.settings = get_settings_service()
+        
+        # Station capabilities and load, used by _assign_station
+        self.station_index = StationIndex()
         
-        # Initialize settings cache
-        self.settings_cache = {}
+        # Compiled break/shift timeline, shared with the schedule routes
+        self.schedule_timeline = get_schedule_timeline()
+        
+        # Menu and availability snapshot, shared with the NLP parser and routes
+        self.menu_cache = get_menu_cache()
         
         # Load sponsor information
         self._load_sponsor_info()
@@ -54,6 +81,28 @@ class CoffeeOrderSystem:
         
         logger.info("Coffee Order System initialized")
     
+    @property
+    def db(self):
+        """Database connection for the current context
+        
+        Inside a Flask request this is the request's own pooled connection, so
+        concurrent requests never share a socket or transaction. Outside a
+        request it falls back to the connection the system was created with.
+        """
+        try:
+            from utils.database import get_request_connection
+            conn = get_request_connection()
+            if conn is not None:
+                return conn
+        except Exception as e:
+            logger.error(f"Error getting request connection, using shared connection: {str(e)}")
+        
+        return self._db
+    
+    @db.setter
+    def db(self, conn):
+        self._db = conn
+    
     def _load_sponsor_info(self):
         """Load sponsor information from database"""
         try:
@@ -103,17 +152,6 @@ class CoffeeOrderSystem:
         try:
             cursor = self.db.cursor()
             
-            # Create settings table if needed
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
             # Define default settings
             default_settings = [
                 ('sms_welcome_message', f"Welcome to {self.event_name}! I'll take your coffee order. What's your first name?", 
@@ -138,8 +176,8 @@ class CoffeeOrderSystem:
             
             self.db.commit()
             
-            # Clear and reload settings cache
-            self.settings_cache = {}
+            # Load every setting at once
+            self.settings.preload()
             
         except Exception as e:
             logger.error(f"Error initializing settings: {str(e)}")
@@ -160,23 +198,10 @@ class CoffeeOrderSystem:
             logger.error(f"Error initializing stations: {str(e)}")
     
     def _init_event_scheduling(self):
-        """Initialize event scheduling tables and data"""
+        """Seed default event breaks (the table comes from schema migration 7)"""
         try:
             cursor = self.db.cursor()
             
-            # Create event_breaks table if it doesn't exist
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS event_breaks (
-                    id SERIAL PRIMARY KEY,
-                    title VARCHAR(100) NOT NULL,
-                    day_of_week INTEGER NOT NULL,
-                    start_time TIME NOT NULL,
-                    end_time TIME NOT NULL,
-                    stations JSONB,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
             # Check if we have any breaks defined
             cursor.execute("SELECT COUNT(*) FROM event_breaks")
             count = cursor.fetchone()[0]
@@ -203,35 +228,6 @@ class CoffeeOrderSystem:
                 self.db.commit()
                 logger.info("Created default event breaks schedule")
             
-            # Update station_stats table to include capabilities field if needed
-            cursor.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name='station_stats' AND column_name='capabilities'
-            """)
-            
-            if cursor.fetchone() is None:
-                # Add capabilities field to station_stats
-                cursor.execute("""
-                    ALTER TABLE station_stats 
-                    ADD COLUMN IF NOT EXISTS capabilities JSONB DEFAULT '{}',
-                    ADD COLUMN IF NOT EXISTS capacity INTEGER DEFAULT 10
-                """)
-                
-                # Update defaults for existing stations
-                cursor.execute("""
-                    UPDATE station_stats
-                    SET capabilities = json_build_object(
-                        'alt_milk', TRUE,
-                        'high_volume', station_id = 1,  -- Make station 1 high volume by default
-                        'vip_service', station_id = 3   -- Make station 3 VIP service by default
-                    )
-                    WHERE capabilities IS NULL OR capabilities = '{}'
-                """)
-                
-                self.db.commit()
-                logger.info("Updated station stats with capabilities information")
-            
         except Exception as e:
             logger.error(f"Error initializing event scheduling: {str(e)}")
     
@@ -584,16 +580,20 @@ class CoffeeOrderSystem:
             
             # Add estimated time for pending orders
             if status == 'pending':
-                # Get station estimated wait time
-                cursor.execute("SELECT wait_time FROM station_stats WHERE station_id = %s", (station_id,))
-                station_result = cursor.fetchone()
-                
-                if station_result:
-                    estimated_wait = station_result[0]
-                else:
-                    estimated_wait = 15  # Default
-                
-                time_left = max(0, estimated_wait - wait_time_minutes)
+                # Orders the station will make before this one, plus this one
+                cursor.execute("""
+                    SELECT COUNT(*)
+                    FROM orders o, orders mine
+                    WHERE mine.id = %s
+                      AND o.station_id = mine.station_id
+                      AND o.status IN ('pending', 'in-progress')
+                      AND (o.queue_priority, o.created_at, o.id) <= (mine.queue_priority, mine.created_at, mine.id)
+                """, (order_id,))
+                queue_position = cursor.fetchone()[0]
+                
+                predictor = get_wait_time_predictor()
+                predictor.ensure_loaded()
+                time_left = predictor.estimate(station_id, queue_position)
                 response += f" Estimated completion in {time_left} more minutes."
             
             # Add linked order info if any
@@ -601,7 +601,7 @@ class CoffeeOrderSystem:
                 response += "\n\nRelated orders:\n" + "\n".join(friend_orders)
                 
             # Add URL for web tracking if enabled
-            if self._get_setting('enable_web_tracking', 'false').lower() in ('true', 'yes', '1'):
+            if self.settings.get_bool('enable_web_tracking'):
                 base_url = self._get_setting('web_tracking_url', 'https://coffee.example.com/track/')
                 tracking_url = f"{base_url}?id={order_number}"
                 response += f"\n\nTrack your order here: {tracking_url}"
@@ -647,6 +647,7 @@ class CoffeeOrderSystem:
             """, (datetime.now(), station_id))
             
             self.db.commit()
+            self.station_index.adjust_load(station_id, -1)
             
             # Reset conversation state
             self._set_conversation_state(phone, 'completed')
@@ -731,26 +732,20 @@ class CoffeeOrderSystem:
                         logger.error(f"Error parsing station {station_id} capabilities: {str(e)}")
             
             # Check event-specific settings
-            cursor.execute("SELECT value FROM settings WHERE key = 'available_coffee_types'")
-            event_coffee_setting = cursor.fetchone()
-            if event_coffee_setting:
+            event_coffees = self.settings.get_json('available_coffee_types')
+            if event_coffees:
                 try:
-                    import json
-                    event_coffees = json.loads(event_coffee_setting[0]) if event_coffee_setting[0] else []
                     # Filter to only include coffee types that are both in event settings AND station capabilities
-                    all_coffee_types = all_coffee_types.intersection(event_coffees) if event_coffees else all_coffee_types
-                except:
+                    all_coffee_types = all_coffee_types.intersection(event_coffees)
+                except TypeError:
                     pass
             
-            cursor.execute("SELECT value FROM settings WHERE key = 'available_milk_types'")
-            event_milk_setting = cursor.fetchone()
-            if event_milk_setting:
+            event_milks = self.settings.get_json('available_milk_types')
+            if event_milks:
                 try:
-                    import json
-                    event_milks = json.loads(event_milk_setting[0]) if event_milk_setting[0] else []
                     # Filter to only include milk types that are both in event settings AND station capabilities
-                    all_milk_types = all_milk_types.intersection(event_milks) if event_milks else all_milk_types
-                except:
+                    all_milk_types = all_milk_types.intersection(event_milks)
+                except TypeError:
                     pass
             
             # Build the menu message
@@ -809,17 +804,7 @@ class CoffeeOrderSystem:
             # Get available menu items from inventory
             cursor = self.db.cursor()
             
-            # Check if inventory_items table exists
-            cursor.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables 
-                    WHERE table_name = 'inventory_items'
-                )
-            """)
-            
-            has_inventory_table = cursor.fetchone()[0]
-            
-            if has_inventory_table:
+            if get_schema_capabilities().has_table('inventory_items'):
                 # Get available drink types based on ingredient availability
                 coffee_types = self._get_available_coffee_types()
                 
@@ -859,23 +844,17 @@ class CoffeeOrderSystem:
         """Check if this is a valid VIP code"""
         try:
             # First check for default VIP code
-            cursor = self.db.cursor()
-            cursor.execute("SELECT value FROM settings WHERE key = 'vip_code'")
-            result = cursor.fetchone()
+            vip_code = self.settings.get('vip_code')
             
-            if result and (code == result[0] or code == 'VIP'):
+            if vip_code and (code == vip_code or code == 'VIP'):
                 return True
                 
             # Next check for custom VIP codes from vip_codes setting
-            cursor.execute("SELECT value FROM settings WHERE key = 'vip_codes'")
-            result = cursor.fetchone()
+            # Value should be a JSON array of objects with code and enabled properties
+            vip_codes = self.settings.get_json('vip_codes')
             
-            if result:
+            if vip_codes:
                 try:
-                    # Value should be a JSON array of objects with code and enabled properties
-                    import json
-                    vip_codes = json.loads(result[0])
-                    
                     if isinstance(vip_codes, list):
                         # Check if the provided code matches any enabled VIP code
                         for vip_code_entry in vip_codes:
@@ -1074,30 +1053,7 @@ class CoffeeOrderSystem:
     
     def _get_available_coffee_types(self):
         """Get list of available coffee drink types based on ingredient availability"""
-        try:
-            cursor = self.db.cursor()
-            
-            # Check if we have coffee beans available
-            cursor.execute("""
-                SELECT COUNT(*) FROM inventory_items 
-                WHERE category = 'coffee' 
-                AND (amount IS NULL OR amount > COALESCE(minimum_threshold, 0))
-            """)
-            coffee_available = cursor.fetchone()[0] > 0
-            
-            # Standard drink menu - only return if we have coffee beans
-            if coffee_available:
-                drink_types = ["latte", "cappuccino", "flat white", "long black", "espresso", "mocha"]
-                logger.info(f"Coffee beans available, offering drink types: {drink_types}")
-                return drink_types
-            else:
-                logger.warning("No coffee beans in stock, cannot offer coffee drinks")
-                return []
-            
-        except Exception as e:
-            logger.error(f"Error checking coffee availability: {str(e)}")
-            # Return basic menu if there's an error
-            return ["latte", "cappuccino", "flat white", "long black", "espresso"]
+        return list(self.menu_cache.get(self.db).coffee_types)
 
     def _is_valid_coffee_type(self, requested_type, available_types):
         """Check if the requested coffee type is valid"""
@@ -1116,28 +1072,7 @@ class CoffeeOrderSystem:
 
     def _get_available_milk_types(self):
         """Get list of available milk types from inventory management"""
-        try:
-            cursor = self.db.cursor()
-            # Use correct table name and check stock levels
-            cursor.execute("""
-                SELECT name FROM inventory_items 
-                WHERE category = 'milk' 
-                AND (amount IS NULL OR amount > COALESCE(minimum_threshold, 0))
-                ORDER BY name
-            """)
-            milk_types = [row[0].lower() for row in cursor.fetchall()]
-            
-            # If no milk types defined, return basic default list
-            if not milk_types:
-                logger.warning("No milk types found in inventory_items table, using defaults")
-                return ["full cream", "skim"]
-            
-            logger.info(f"Available milk types: {milk_types}")
-            return milk_types
-        except Exception as e:
-            logger.error(f"Error getting available milk types: {str(e)}")
-            # Return basic default list if there's an error
-            return ["full cream", "skim"]
+        return list(self.menu_cache.get(self.db).milk_types)
 
     def _is_valid_milk_type(self, requested_milk, available_milks):
         """Check if the requested milk type is valid and in stock"""
@@ -1159,29 +1094,8 @@ class CoffeeOrderSystem:
         return False
 
     def _get_available_sweeteners(self):
-        """Get list of available sweeteners from inventory management"""
-        try:
-            cursor = self.db.cursor()
-            # Check for both 'sweetener' and 'sugar' categories
-            cursor.execute("""
-                SELECT name, category FROM inventory_items 
-                WHERE category IN ('sweetener', 'sugar', 'artificial_sweetener') 
-                AND (amount IS NULL OR amount > COALESCE(minimum_threshold, 0))
-                ORDER BY category, name
-            """)
-            sweeteners = [(row[0].lower(), row[1]) for row in cursor.fetchall()]
-            
-            # If no sweeteners defined, return basic defaults
-            if not sweeteners:
-                logger.warning("No sweeteners found in inventory_items table, using defaults")
-                return [("sugar", "sugar"), ("no sugar", "sugar")]
-            
-            logger.info(f"Available sweeteners: {sweeteners}")
-            return sweeteners
-        except Exception as e:
-            logger.error(f"Error getting available sweeteners: {str(e)}")
-            # Return basic defaults if there's an error
-            return [("sugar", "sugar"), ("no sugar", "sugar")]
+        """Get list of available (name, category) sweeteners from inventory management"""
+        return list(self.menu_cache.get(self.db).sweeteners)
 
     def _is_valid_sweetener(self, requested_sweetener, available_sweeteners):
         """Check if the requested sweetener is valid and properly categorized"""
@@ -1208,24 +1122,7 @@ class CoffeeOrderSystem:
 
     def _get_available_sizes(self, coffee_type):
         """Get available sizes for a specific coffee type"""
-        try:
-            cursor = self.db.cursor()
-            cursor.execute("""
-                SELECT DISTINCT size FROM size_options 
-                WHERE coffee_type = %s AND is_active = TRUE
-                ORDER BY size
-            """, (coffee_type,))
-            sizes = [row[0].lower() for row in cursor.fetchall()]
-            
-            # If no sizes defined, return default list
-            if not sizes:
-                return ["small", "medium", "large"]
-            
-            return sizes
-        except Exception as e:
-            logger.error(f"Error getting available sizes: {str(e)}")
-            # Return default list if there's an error
-            return ["small", "medium", "large"]
+        return self.menu_cache.get(self.db).sizes_for(coffee_type)
 
     def _handle_awaiting_coffee_type(self, phone, message, state):
         """Handle coffee type input"""
@@ -1963,8 +1860,11 @@ class CoffeeOrderSystem:
             
             # Generate order number
             now = datetime.now()
-            prefix = "A" if now.hour < 12 else "P"
-            order_number = f"{prefix}{now.strftime('%H%M%S')}{now.microsecond // 10000}"
+            if db_type == "sqlite":
+                prefix = "A" if now.hour < 12 else "P"
+                order_number = f"{prefix}{now.strftime('%H%M%S')}{now.microsecond // 10000}"
+            else:
+                order_number = next_order_number()
             
             # Check for station assignment in the order details
             specified_station = order_details.get('station_id') or order_details.get('stationId')
@@ -2077,30 +1977,20 @@ class CoffeeOrderSystem:
                     cursor.execute("SELECT last_insert_rowid()")
                     order_id = cursor.fetchone()[0]
                 else:
-                    cursor.execute("""
-                        INSERT INTO orders 
-                        (order_number, phone, order_details, status, station_id, created_at, updated_at, queue_priority)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                        RETURNING id
-                    """, (
-                        order_number,
-                        phone,
-                        json.dumps(processed_details),
-                        'pending',
-                        station_id,
-                        now,
-                        now,
-                        queue_priority
-                    ))
-                    result = cursor.fetchone()
-                    
-                    # Handle different result formats
-                    if isinstance(result, dict):
-                        order_id = result.get('id')
-                    elif isinstance(result, (list, tuple)) and len(result) > 0:
-                        order_id = result[0]
+                    # The order and its station's load increment commit together
+                    order_id = insert_order(cursor, {
+                        'order_number': order_number,
+                        'phone': phone,
+                        'order_details': json.dumps(processed_details),
+                        'status': 'pending',
+                        'station_id': station_id,
+                        'created_at': now,
+                        'updated_at': now,
+                        'queue_priority': queue_priority
+                    })
                     
                     fresh_conn.commit()
+                    self.station_index.adjust_load(station_id, 1)
                 
                 logger.info(f"Created order {order_number} with ID {order_id}")
                 
@@ -2218,63 +2108,54 @@ class CoffeeOrderSystem:
                     except:
                         pass
             
-            # Step 3: Update station stats (increment load)
-            try:
-                if db_type == "sqlite":
-                    cursor.execute("""
-                        INSERT INTO station_stats (station_id, current_load, last_updated)
-                        VALUES (?, 1, ?)
-                        ON CONFLICT(station_id) DO UPDATE SET
-                            current_load = station_stats.current_load + 1,
-                            last_updated = ?
-                    """, (station_id, now, now))
-            except Exception as sqlite_error:
-                # Fallback for older SQLite versions that don't support ON CONFLICT
-                logger.warning(f"Advanced SQLite upsert failed, trying basic approach: {str(sqlite_error)}")
+            # Step 3: Update station stats (increment load). PostgreSQL counted
+            # the order in its station's load in the insert statement above
+            if db_type == "sqlite":
                 try:
-                    # Check if stats record exists
-                    cursor.execute("SELECT station_id FROM station_stats WHERE station_id = ?", (station_id,))
-                    if cursor.fetchone():
-                        # Update existing record
-                        cursor.execute("""
-                            UPDATE station_stats 
-                            SET current_load = current_load + 1, last_updated = ?
-                            WHERE station_id = ?
-                        """, (now, station_id))
-                    else:
-                        # Insert new record
+                    try:
                         cursor.execute("""
                             INSERT INTO station_stats (station_id, current_load, last_updated)
                             VALUES (?, 1, ?)
-                        """, (station_id, now))
-                except Exception as e:
-                    logger.error(f"Error updating station stats in SQLite (fallback): {str(e)}")
-                    # Continue despite this error
-                if db_type != "sqlite":
-                    # For PostgreSQL
-                    cursor.execute("""
-                        INSERT INTO station_stats (station_id, current_load, last_updated)
-                        VALUES (%s, 1, %s)
-                        ON CONFLICT (station_id) DO UPDATE SET
-                            current_load = station_stats.current_load + 1,
-                            last_updated = %s
-                    """, (station_id, now, now))
-                
-                # Try to commit, but continue if it fails
-                try:
+                            ON CONFLICT(station_id) DO UPDATE SET
+                                current_load = station_stats.current_load + 1,
+                                last_updated = ?
+                        """, (station_id, now, now))
+                    except Exception as sqlite_error:
+                        # Fallback for older SQLite versions that don't support ON CONFLICT
+                        logger.warning(f"Advanced SQLite upsert failed, trying basic approach: {str(sqlite_error)}")
+                        # Check if stats record exists
+                        cursor.execute("SELECT station_id FROM station_stats WHERE station_id = ?", (station_id,))
+                        if cursor.fetchone():
+                            # Update existing record
+                            cursor.execute("""
+                                UPDATE station_stats 
+                                SET current_load = current_load + 1, last_updated = ?
+                                WHERE station_id = ?
+                            """, (now, station_id))
+                        else:
+                            # Insert new record
+                            cursor.execute("""
+                                INSERT INTO station_stats (station_id, current_load, last_updated)
+                                VALUES (?, 1, ?)
+                            """, (station_id, now))
+                    
                     fresh_conn.commit()
+                    self.station_index.adjust_load(station_id, 1)
                     logger.info(f"Updated station {station_id} load")
-                except Exception as commit_err:
-                    logger.error(f"Error committing station stats update: {str(commit_err)}")
-                    # No rollback here - we want to preserve the order creation
-            except Exception as stats_error:
-                logger.error(f"Error updating station stats: {str(stats_error)}")
-                # Continue despite this error - it's non-critical
+                except Exception as stats_error:
+                    logger.error(f"Error updating station stats: {str(stats_error)}")
+                    # Continue despite this error - it's non-critical
             
             # Get wait time - use separate try block to ensure failures don't affect order
             wait_time = 10  # Default wait time
             try:
                 wait_time = self._get_station_wait_time(station_id)
+                
+                # Orders held for the next break can't be ready before it starts
+                if is_delayed:
+                    minutes_to_break = self.schedule_timeline.minutes_until_next_break(self.db)
+                    if minutes_to_break is not None:
+                        wait_time = max(wait_time, minutes_to_break)
             except Exception as wait_err:
                 logger.error(f"Error getting wait time: {str(wait_err)}")
             
@@ -2321,7 +2202,7 @@ class CoffeeOrderSystem:
                 )
             
             # Add tracking URL if enabled
-            if self._get_setting('enable_web_tracking', 'false').lower() in ('true', 'yes', '1'):
+            if self.settings.get_bool('enable_web_tracking'):
                 try:
                     base_url = self._get_setting('web_tracking_url', 'https://coffee.example.com/track/')
                     tracking_url = f"{base_url}?id={order_number}"
@@ -2371,113 +2252,14 @@ class CoffeeOrderSystem:
             bool: Whether this order will be delayed until next break
         """
         try:
-            cursor = self.db.cursor()
-            
             # Log station assignment request
             logger.info(f"Station assignment requested: VIP={is_vip}, milk_type={milk_type}")
             
-            # First check if we're in a break period or not
-            current_time = datetime.now()
-            current_hour = current_time.hour
-            current_minute = current_time.minute
-            current_day = current_time.weekday()  # 0=Monday, 6=Sunday
-            
-            # Check for any scheduled breaks that include the current time
-            cursor.execute("""
-                SELECT id, start_time, end_time, stations 
-                FROM event_breaks 
-                WHERE day_of_week = %s
-                ORDER BY start_time
-            """, (current_day,))
+            # First check if we're in a break period or not, from the compiled schedule timeline
+            current_break, next_break = self.schedule_timeline.breaks_at(self.db)
             
-            current_break = None
-            next_break = None
-            
-            for break_info in cursor.fetchall():
-                break_id, start_str, end_str, stations_json = break_info
-                
-                # Parse the time strings (format: "HH:MM")
-                start_hour, start_minute = map(int, start_str.split(':'))
-                end_hour, end_minute = map(int, end_str.split(':'))
-                
-                # Check if current time is within the break
-                if ((current_hour > start_hour) or 
-                    (current_hour == start_hour and current_minute >= start_minute)) and \
-                   ((current_hour < end_hour) or 
-                    (current_hour == end_hour and current_minute <= end_minute)):
-                    # We're in a break period now
-                    current_break = {
-                        'id': break_id,
-                        'start': (start_hour, start_minute),
-                        'end': (end_hour, end_minute),
-                        'stations': json.loads(stations_json) if stations_json else []
-                    }
-                    break
-                
-                # Check if this is the next upcoming break
-                if (current_hour < start_hour) or \
-                   (current_hour == start_hour and current_minute < start_minute):
-                    next_break = {
-                        'id': break_id,
-                        'start': (start_hour, start_minute),
-                        'end': (end_hour, end_minute),
-                        'stations': json.loads(stations_json) if stations_json else []
-                    }
-                    break
-            
-            # Get all stations with their current load and capabilities
-            cursor.execute("""
-                SELECT station_id, COALESCE(current_load, 0), 
-                       COALESCE(equipment_notes, '{}') as capabilities, 
-                       COALESCE(status, 'active') as current_status
-                FROM station_stats
-                WHERE status IN ('active', 'open') OR status IS NULL
-                ORDER BY COALESCE(current_load, 0)
-            """)
-            
-            stations = []
-            stations_with_milk = {}  # Track which stations have specific milk types
-            
-            for station_data in cursor.fetchall():
-                station_id, load, capabilities_json, status = station_data
-                try:
-                    capabilities = json.loads(capabilities_json) if capabilities_json and capabilities_json != '{}' else {}
-                except (json.JSONDecodeError, TypeError):
-                    capabilities = {}
-                
-                # Set minimal default capabilities for stations that don't have them configured
-                if not capabilities:
-                    # Use minimal defaults - organizer should configure these properly
-                    capabilities = {
-                        'milk_types': ['full cream', 'skim'],
-                        'coffee_types': ['espresso', 'latte', 'cappuccino'],
-                        'capacity': 10,
-                        'high_volume': False,
-                        'vip_service': False
-                    }
-                    logger.warning(f"Station {station_id} has no capabilities configured. Using minimal defaults.")
-                
-                # Extract milk types for this station
-                milk_types = capabilities.get('milk_types', ['full cream', 'skim'])
-                
-                # Track which stations have this milk
-                for milk in milk_types:
-                    if milk not in stations_with_milk:
-                        stations_with_milk[milk] = []
-                    stations_with_milk[milk].append(station_id)
-                
-                stations.append({
-                    'id': station_id,
-                    'load': load,
-                    'capacity': capabilities.get('capacity', 10),  # Default capacity if none set
-                    'status': status,
-                    'capabilities': capabilities,
-                    'milk_types': milk_types,
-                    'coffee_types': capabilities.get('coffee_types', []),
-                    'alt_milk_available': any(m in milk_types for m in ['soy', 'almond', 'oat', 'lactose free', 'coconut']),
-                    'high_volume': capabilities.get('high_volume', False),
-                    'vip_service': capabilities.get('vip_service', False)
-                })
+            # Active stations with their load and capabilities come from the in-memory index
+            stations = self.station_index.stations(self.db)
             
             if not stations:
                 # No stations found
@@ -2506,15 +2288,14 @@ class CoffeeOrderSystem:
             
             # Check if the requested milk type requires specific station
             milk_type_normalized = milk_type.lower().replace(' milk', '') if milk_type else None
-            stations_for_milk = stations_with_milk.get(milk_type_normalized, []) if milk_type_normalized else []
+            stations_for_milk = self.station_index.stations_for_milk(milk_type_normalized) if milk_type_normalized else []
             
             # If only one station has this milk type, we must use that station
             if milk_type_normalized and len(stations_for_milk) == 1:
                 station_id = stations_for_milk[0]
                 station = next((s for s in stations if s['id'] == station_id), None)
                 if station:
-                    wait_time = self._get_station_wait_time(station_id)
-                    logger.info(f"Only station {station_id} has {milk_type}, assigning order there (wait: {wait_time} min)")
+                    logger.info(f"Only station {station_id} has {milk_type}, assigning order there (load: {station['load']})")
                     return station_id, False
             
             # Check if this is alternative milk
@@ -2681,116 +2462,23 @@ class CoffeeOrderSystem:
             logger.warning("Could not find any active station, defaulting to station 1")
             return 1, False
     
-    def _update_station_load(self, station_id, increment=True):
-        """Update station load count"""
-        try:
-            cursor = self.db.cursor()
-            
-            if increment:
-                cursor.execute("""
-                    UPDATE station_stats
-                    SET current_load = current_load + 1, last_updated = %s
-                    WHERE station_id = %s
-                """, (datetime.now(), station_id))
-            else:
-                cursor.execute("""
-                    UPDATE station_stats
-                    SET current_load = GREATEST(0, current_load - 1), last_updated = %s
-                    WHERE station_id = %s
-                """, (datetime.now(), station_id))
-            
-            self.db.commit()
-            
-        except Exception as e:
-            logger.error(f"Error updating station load: {str(e)}")
-    
     def _get_station_wait_time(self, station_id):
-        """Get estimated wait time for a station"""
+        """Estimated minutes until an order just assigned to a station is ready
+
+        Uses the station's cached load, which already counts the new order,
+        and the station's recent throughput (see services/wait_time_predictor.py).
+        Falls back to 10 minutes for a station missing from the index.
+        """
         try:
-            db_type = "sqlite" if isinstance(self.db, sqlite3.Connection) else "postgres"
-            cursor = self.db.cursor()
-            
-            # First check if the station_stats table exists
-            if db_type == "sqlite":
-                cursor.execute("""
-                    SELECT 1 FROM sqlite_master WHERE type='table' AND name='station_stats'
-                """)
-            else:
-                cursor.execute("""
-                    SELECT 1 FROM information_schema.tables 
-                    WHERE table_schema = 'public' AND table_name = 'station_stats'
-                """)
-            
-            if cursor.fetchone() is None:
-                # Table doesn't exist, return default wait time
-                logger.info("station_stats table doesn't exist, using default wait time")
-                return 10  # Default wait time
-            
-            # Get station wait time
-            if db_type == "sqlite":
-                cursor.execute("""
-                    SELECT current_load, avg_completion_time, wait_time
-                    FROM station_stats
-                    WHERE station_id = ?
-                """, (station_id,))
-            else:
-                cursor.execute("""
-                    SELECT current_load, avg_completion_time, wait_time
-                    FROM station_stats
-                    WHERE station_id = %s
-                """, (station_id,))
-            
-            result = cursor.fetchone()
-            
-            if not result:
-                # No statistics for this station, check if it has a configured wait time in stations table
-                try:
-                    # Check if the stations table exists
-                    if db_type == "sqlite":
-                        cursor.execute("""
-                            SELECT 1 FROM sqlite_master WHERE type='table' AND name='stations'
-                        """)
-                    else:
-                        cursor.execute("""
-                            SELECT 1 FROM information_schema.tables 
-                            WHERE table_schema = 'public' AND table_name = 'stations'
-                        """)
-                    
-                    if cursor.fetchone() is not None:
-                        # Try to get waitTime from stations table
-                        if db_type == "sqlite":
-                            cursor.execute("""
-                                SELECT waitTime FROM stations WHERE id = ?
-                            """, (station_id,))
-                        else:
-                            cursor.execute("""
-                                SELECT waitTime FROM stations WHERE id = %s
-                            """, (station_id,))
-                        
-                        wait_time_result = cursor.fetchone()
-                        if wait_time_result and wait_time_result[0]:
-                            return wait_time_result[0]
-                except Exception as e:
-                    logger.error(f"Error getting wait time from stations table: {str(e)}")
-                
-                # If we couldn't get a wait time from the stations table either, use default
-                return 10  # Default wait time
-            
-            current_load, avg_completion_time, wait_time = result
-            
-            # If station has set a specific wait time, use that
-            if wait_time:
-                return wait_time
-            
-            # Otherwise calculate based on load and avg completion time
-            if avg_completion_time:
-                # Calculate wait time in minutes
-                calculated_wait = max(1, (current_load * avg_completion_time) // 60)
-                return min(calculated_wait, 30)  # Cap at 30 minutes
-            
-            # Default fallback
-            return max(5, min(current_load * 2, 20))
-            
+            load = self.station_index.station_load(station_id)
+            if load is None:
+                # Not an active station in the index (e.g. the station 1 fallback),
+                # so there is no queue to quote from
+                logger.warning(f"No cached load for station {station_id}, using default wait time")
+                return 10
+            predictor = get_wait_time_predictor()
+            predictor.ensure_loaded()
+            return predictor.estimate(station_id, load)
         except Exception as e:
             logger.error(f"Error getting station wait time: {str(e)}")
             return 10  # Default wait time
@@ -3027,7 +2715,7 @@ class CoffeeOrderSystem:
         return welcome_message.replace('{event_name}', self.event_name)
     
     def _get_setting(self, key, default_value=None):
-        """Get a setting from the database
+        """Get a setting from the settings service
         
         Args:
             key: Setting key
@@ -3036,31 +2724,10 @@ class CoffeeOrderSystem:
         Returns:
             Setting value or default value if not found
         """
-        # Check cache first if available
-        if hasattr(self, 'settings_cache') and key in self.settings_cache:
-            return self.settings_cache[key]
-            
-        try:
-            cursor = self.db.cursor()
-            cursor.execute("SELECT value FROM settings WHERE key = %s", (key,))
-            result = cursor.fetchone()
-            
-            if result and result[0]:
-                # Cache the result if cache exists
-                if hasattr(self, 'settings_cache'):
-                    self.settings_cache[key] = result[0]
-                return result[0]
-            else:
-                # Cache the default if cache exists
-                if hasattr(self, 'settings_cache'):
-                    self.settings_cache[key] = default_value
-                return default_value
-        except Exception as e:
-            logger.error(f"Error getting setting {key}: {str(e)}")
-            return default_value
+        return self.settings.get(key, default_value)
     
     def _set_setting(self, key, value):
-        """Save a setting to the database and update the cache
+        """Save a setting through the settings service
         
         Args:
             key: Setting key
@@ -3069,31 +2736,7 @@ class CoffeeOrderSystem:
         Returns:
             bool: Success or failure
         """
-        try:
-            cursor = self.db.cursor()
-            
-            # Check if setting exists
-            cursor.execute("SELECT key FROM settings WHERE key = %s", (key,))
-            exists = cursor.fetchone() is not None
-            
-            if exists:
-                # Update existing setting
-                cursor.execute("UPDATE settings SET value = %s WHERE key = %s", (value, key))
-            else:
-                # Insert new setting
-                cursor.execute("INSERT INTO settings (key, value) VALUES (%s, %s)", (key, value))
-                
-            self.db.commit()
-            
-            # Update cache if it exists
-            if hasattr(self, 'settings_cache'):
-                self.settings_cache[key] = value
-                
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error saving setting '{key}': {str(e)}")
-            return False
+        return self.settings.set(key, value)
     
     def _normalize_phone(self, phone):
         """Normalize phone number format"""
@@ -3110,157 +2753,16 @@ class CoffeeOrderSystem:
     
     def _get_conversation_state(self, phone):
         """Get the conversation state for a phone number"""
-        # Check in-memory cache first
-        if phone in self.conversation_states:
-            return self.conversation_states[phone]
-        
-        # Check if we're using SQLite or PostgreSQL
-        is_sqlite = isinstance(self.db, sqlite3.Connection)
-        db_type = "sqlite" if is_sqlite else "postgres"
-        
-        # Otherwise, check database
-        try:
-            cursor = self.db.cursor()
-            
-            # Use the appropriate parameter style for the database type
-            if is_sqlite:
-                cursor.execute("""
-                    SELECT state, temp_data, last_interaction, message_count
-                    FROM conversation_states
-                    WHERE phone = ?
-                """, (phone,))
-            else:
-                cursor.execute("""
-                    SELECT state, temp_data, last_interaction, message_count
-                    FROM conversation_states
-                    WHERE phone = %s
-                """, (phone,))
-            
-            result = cursor.fetchone()
-            
-            if result:
-                # Get values from result - may be a tuple or a dict depending on cursor type
-                if isinstance(result, dict):
-                    state = result.get('state')
-                    temp_data_str = result.get('temp_data')
-                    last_interaction = result.get('last_interaction')
-                    message_count = result.get('message_count', 0)
-                else:
-                    state, temp_data_str, last_interaction, message_count = result
-                
-                # Parse JSON temp data
-                try:
-                    temp_data = json.loads(temp_data_str) if temp_data_str else {}
-                except Exception as json_err:
-                    logger.error(f"Error parsing JSON in conversation state: {str(json_err)}")
-                    temp_data = {}
-                
-                # Create state object
-                state_obj = {
-                    'state': state,
-                    'temp_data': temp_data,
-                    'last_interaction': last_interaction,
-                    'message_count': int(message_count) if message_count else 0
-                }
-                
-                # Cache in memory
-                self.conversation_states[phone] = state_obj
-                
-                return state_obj
-            
-            # No state found - return empty state
-            return {'state': None, 'temp_data': {}, 'message_count': 0}
-            
-        except Exception as e:
-            logger.error(f"Error getting conversation state: {str(e)}")
-            return {'state': None, 'temp_data': {}, 'message_count': 0}
+        return self.conversation_store.get(phone)
     
     def _set_conversation_state(self, phone, state, temp_data=None):
-        """Update the conversation state for a phone number"""
-        # Update in-memory cache
-        now = datetime.now()
-        
-        # Get existing state to update message count
-        existing = self._get_conversation_state(phone)
-        message_count = existing.get('message_count', 0) + 1
-        
-        # Create state object
-        state_obj = {
-            'state': state,
-            'temp_data': temp_data or {},
-            'last_interaction': now,
-            'message_count': message_count
-        }
-        
-        # Update in-memory cache
-        self.conversation_states[phone] = state_obj
+        """Update the conversation state for a phone number
         
-        # Check if we're using SQLite or PostgreSQL
-        is_sqlite = isinstance(self.db, sqlite3.Connection)
-        db_type = "sqlite" if is_sqlite else "postgres"
-        
-        # Use a separate connection to update the state to avoid transaction isolation issues
-        try:
-            # Get a fresh connection from the pool
-            from utils.database import get_db_connection, close_connection
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            # Convert temp_data to JSON
-            temp_data_json = json.dumps(temp_data) if temp_data else None
-            
-            # Check if state exists - use database-appropriate paramstyle
-            if is_sqlite:
-                cursor.execute("SELECT phone FROM conversation_states WHERE phone = ?", (phone,))
-            else:
-                cursor.execute("SELECT phone FROM conversation_states WHERE phone = %s", (phone,))
-                
-            result = cursor.fetchone()
-            
-            if result:
-                # Update existing state
-                if is_sqlite:
-                    cursor.execute("""
-                        UPDATE conversation_states
-                        SET state = ?, temp_data = ?, last_interaction = ?, message_count = ?
-                        WHERE phone = ?
-                    """, (state, temp_data_json, now, message_count, phone))
-                else:
-                    cursor.execute("""
-                        UPDATE conversation_states
-                        SET state = %s, temp_data = %s, last_interaction = %s, message_count = %s
-                        WHERE phone = %s
-                    """, (state, temp_data_json, now, message_count, phone))
-            else:
-                # Insert new state
-                if is_sqlite:
-                    cursor.execute("""
-                        INSERT INTO conversation_states
-                        (phone, state, temp_data, last_interaction, message_count)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (phone, state, temp_data_json, now, message_count))
-                else:
-                    cursor.execute("""
-                        INSERT INTO conversation_states
-                        (phone, state, temp_data, last_interaction, message_count)
-                        VALUES (%s, %s, %s, %s, %s)
-                    """, (phone, state, temp_data_json, now, message_count))
-            
-            conn.commit()
-            logger.info(f"Updated conversation state for {phone} to '{state}'")
-            
-        except Exception as e:
-            logger.error(f"Error setting conversation state: {str(e)}")
-            
-        finally:
-            # Always clean up resources
-            try:
-                if cursor:
-                    cursor.close()
-                if conn:
-                    close_connection(conn)
-            except Exception as close_err:
-                logger.error(f"Error closing connection: {str(close_err)}")
+        The new state is visible immediately; the database write is batched
+        by the conversation store's write-behind flusher.
+        """
+        self.conversation_store.set(phone, state, temp_data)
+        logger.info(f"Updated conversation state for {phone} to '{state}'")
 
     # ==== Order Management Methods ====
     
@@ -3275,39 +2777,7 @@ class CoffeeOrderSystem:
             List of pending orders
         """
         try:
-            cursor = self.db.cursor(cursor_factory=RealDictCursor)
-            
-            if station_id:
-                cursor.execute("""
-                    SELECT * FROM orders 
-                    WHERE status = 'pending' AND station_id = %s
-                    ORDER BY queue_priority, created_at
-                """, (station_id,))
-            else:
-                cursor.execute("""
-                    SELECT * FROM orders 
-                    WHERE status = 'pending'
-                    ORDER BY queue_priority, created_at
-                """)
-            
-            orders = cursor.fetchall()
-            
-            # Process orders
-            result = []
-            for order in orders:
-                # Parse order details
-                if order['order_details'] and isinstance(order['order_details'], str):
-                    order['order_details'] = json.loads(order['order_details'])
-                
-                # Calculate wait time
-                if order['created_at']:
-                    created_at = order['created_at']
-                    order['wait_time'] = int((datetime.now() - created_at).total_seconds() / 60)
-                
-                result.append(dict(order))
-            
-            return result
-            
+            return Order.get_queue(self.db, 'pending', station_id=station_id, ordering='priority')
         except Exception as e:
             logger.error(f"Error getting pending orders: {str(e)}")
             return []
@@ -3323,39 +2793,7 @@ class CoffeeOrderSystem:
             List of in-progress orders
         """
         try:
-            cursor = self.db.cursor(cursor_factory=RealDictCursor)
-            
-            if station_id:
-                cursor.execute("""
-                    SELECT * FROM orders 
-                    WHERE status = 'in-progress' AND station_id = %s
-                    ORDER BY created_at
-                """, (station_id,))
-            else:
-                cursor.execute("""
-                    SELECT * FROM orders 
-                    WHERE status = 'in-progress'
-                    ORDER BY created_at
-                """)
-            
-            orders = cursor.fetchall()
-            
-            # Process orders
-            result = []
-            for order in orders:
-                # Parse order details
-                if order['order_details'] and isinstance(order['order_details'], str):
-                    order['order_details'] = json.loads(order['order_details'])
-                
-                # Calculate wait time
-                if order['created_at']:
-                    created_at = order['created_at']
-                    order['wait_time'] = int((datetime.now() - created_at).total_seconds() / 60)
-                
-                result.append(dict(order))
-            
-            return result
-            
+            return Order.get_queue(self.db, 'in-progress', station_id=station_id, ordering='oldest')
         except Exception as e:
             logger.error(f"Error getting in-progress orders: {str(e)}")
             return []
@@ -3475,53 +2913,18 @@ class CoffeeOrderSystem:
             True if successful, False otherwise
         """
         try:
-            # Get current order state
+            # Order, completion time and station counters change in one statement
             cursor = self.db.cursor()
-            cursor.execute("""
-                SELECT status, station_id, created_at 
-                FROM orders 
-                WHERE id = %s
-            """, (order_id,))
-            
-            result = cursor.fetchone()
+            result = transition_order(cursor, order_id, status, editor)
             
             if not result:
+                self.db.rollback()
                 logger.error(f"Order {order_id} not found")
                 return False
             
-            current_status, station_id, created_at = result
-            
-            # Calculate completion time if completing
-            completion_time = None
-            if status == 'completed' and current_status != 'completed':
-                completion_time = int((datetime.now() - created_at).total_seconds())
-            
-            # Update order status
-            cursor.execute("""
-                UPDATE orders 
-                SET status = %s, 
-                    updated_at = %s, 
-                    last_modified_by = %s
-                WHERE id = %s
-            """, (status, datetime.now(), editor or 'system', order_id))
-            
-            # If completing order, update completion time and completion date
-            if completion_time:
-                cursor.execute("""
-                    UPDATE orders 
-                    SET completion_time = %s, 
-                        completed_at = %s
-                    WHERE id = %s
-                """, (completion_time, datetime.now(), order_id))
-            
-            # Update station load
-            if status in ['completed', 'cancelled'] and current_status not in ['completed', 'cancelled']:
-                self._update_station_load(station_id, increment=False)
-            elif status == 'in-progress' and current_status == 'pending':
-                # No need to update load when moving from pending to in-progress
-                pass
-            
             self.db.commit()
+            if result['load_delta']:
+                self.station_index.adjust_load(result['station_id'], result['load_delta'])
             return True
             
         except Exception as e:
@@ -3542,8 +2945,7 @@ class CoffeeOrderSystem:
         try:
             # Generate order number
             now = datetime.now()
-            prefix = "W" if now.hour < 12 else "E"  # W for Walk-in Morning, E for walk-in Evening
-            order_number = f"{prefix}{now.strftime('%H%M%S')}{now.microsecond // 10000}"
+            order_number = next_order_number()
             
             # Assign to a station
             station_id = order_data.get('station_id', None)
@@ -3570,8 +2972,9 @@ class CoffeeOrderSystem:
             if 'name' not in order_data['order_details']:
                 order_data['order_details']['name'] = order_data.get('customer_name', 'Walk-in Customer')
             
-            # Add order number
+            # Add order number and station
             order_data['order_number'] = order_number
+            order_data['station_id'] = station_id
             
             # Set timestamps
             order_data['created_at'] = now
@@ -3584,36 +2987,21 @@ class CoffeeOrderSystem:
             cursor = self.db.cursor()
             
             # Prepare data for insertion
-            fields = []
-            placeholders = []
-            values = []
-            
+            columns = {}
             for key, value in order_data.items():
                 if key == 'order_details':
                     # JSON encode order details
-                    fields.append(key)
-                    placeholders.append('%s')
-                    values.append(json.dumps(value))
-                elif key not in ['id']:  # Skip fields that shouldn't be inserted
-                    fields.append(key)
-                    placeholders.append('%s')
-                    values.append(value)
-            
-            # Create SQL query
-            query = f"""
-                INSERT INTO orders ({', '.join(fields)})
-                VALUES ({', '.join(placeholders)})
-                RETURNING id
-            """
+                    columns[key] = json.dumps(value)
+                # Skip fields that shouldn't be inserted; the drink columns are
+                # generated from order_details
+                elif key not in ['id', 'customer_name', 'coffee_type', 'milk_type', 'size', 'sugar']:
+                    columns[key] = value
             
-            # Execute query
-            cursor.execute(query, values)
-            order_id = cursor.fetchone()[0]
-            
-            # Update station load
-            self._update_station_load(station_id, increment=True)
+            # Insert the order and count it in its station's load together
+            order_id = insert_order(cursor, columns)
             
             self.db.commit()
+            self.station_index.adjust_load(station_id, 1)
             return order_id
             
         except Exception as e:
@@ -3872,31 +3260,31 @@ class CoffeeOrderSystem:
                 'error': str(e)
             }
     
-    def batch_process_orders(self, order_ids, action='start'):
+    def batch_process_orders(self, order_numbers, action='start', messaging_service=None, socketio=None):
         """
         Process a batch of orders
         
         Args:
-            order_ids: List of order IDs
-            action: Action to perform ('start' or 'complete')
+            order_numbers: List of order numbers
+            action: Action to perform ('start', 'complete', 'cancel' or 'requeue')
+            messaging_service: Optional MessagingService for ready notifications
+            socketio: Optional SocketIO instance for the batch update event
             
         Returns:
             Number of successfully processed orders
         """
-        success_count = 0
+        status = BATCH_ACTIONS.get(action)
+        if not status:
+            logger.error(f"Unknown batch action: {action}")
+            return 0
         
-        for order_id in order_ids:
-            try:
-                if action == 'start':
-                    if self.update_order_status(order_id, 'in-progress', 'batch_process'):
-                        success_count += 1
-                elif action == 'complete':
-                    if self.update_order_status(order_id, 'completed', 'batch_process'):
-                        success_count += 1
-            except Exception as e:
-                logger.error(f"Error processing order {order_id} in batch: {str(e)}")
+        result = transition_orders(self.db, order_numbers, status, 'batch_process',
+                                   messaging_service, socketio, self.station_index)
+        if not result['success']:
+            logger.error(f"Error processing batch of {len(order_numbers)} orders: {result['error']}")
+            return 0
         
-        return success_count
+        return len(result['transitioned'])
     
     def send_sms_notification(self, phone, message, messaging_service=None):
         """
@@ -4020,30 +3408,21 @@ class CoffeeOrderSystem:
         try:
             cursor = self.db.cursor()
             
-            # Get order counts
-            cursor.execute("""
-                SELECT
-                    COUNT(*) as total_orders,
-                    SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END) as pending_count,
-                    SUM(CASE WHEN status = 'in-progress' THEN 1 ELSE 0 END) as in_progress_count,
-                    SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed_count,
-                    AVG(completion_time) as avg_completion_time
-                FROM orders
-            """)
-            
-            order_stats = cursor.fetchone()
+            # Get order counts from the rollups instead of scanning every order
+            totals = order_rollups.get_order_totals(self.db)
+            by_status = totals['by_status']
             
             # Get customer count
             cursor.execute("SELECT COUNT(*) FROM customer_preferences")
             customer_count = cursor.fetchone()[0]
             
             # Get today's orders
-            today = datetime.now().date()
+            today_start, today_end = day_range(datetime.now())
             cursor.execute("""
                 SELECT COUNT(*) 
                 FROM orders 
-                WHERE DATE(created_at) = %s
-            """, (today,))
+                WHERE created_at >= %s AND created_at < %s
+            """, (today_start, today_end))
             
             todays_orders = cursor.fetchone()[0]
             
@@ -4057,11 +3436,11 @@ class CoffeeOrderSystem:
             active_stations = cursor.fetchone()[0]
             
             return {
-                'total_orders': order_stats[0] or 0,
-                'pending_count': order_stats[1] or 0,
-                'in_progress_count': order_stats[2] or 0,
-                'completed_count': order_stats[3] or 0,
-                'avg_completion_time': order_stats[4] or 0,
+                'total_orders': totals['total_orders'],
+                'pending_count': by_status.get('pending', 0),
+                'in_progress_count': by_status.get('in-progress', 0),
+                'completed_count': by_status.get('completed', 0),
+                'avg_completion_time': totals['avg_completion_time'] or 0,
                 'customer_count': customer_count or 0,
                 'todays_orders': todays_orders or 0,
                 'active_stations': active_stations or 0
@@ -0,0 +1,442 @@
+"""
+Conversation state store for SMS ordering
+
+Keeps recent conversations in a bounded LRU/TTL memory tier and persists
+changes to the conversation_states table with batched write-behind upserts.
+
+Every flush also sends the phones it wrote on NOTIFY_CHANNEL, in the same
+transaction, so the notification arrives once the rows are visible. Other
+workers listening on the channel drop those phones from memory and read the
+new state on the next message. A worker can only serve another worker's
+conversation stale during that worker's flush interval.
+"""
+import json
+import logging
+import select
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger("expresso.services.conversation_store")
+
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_TTL = 6 * 60 * 60      # Seconds a conversation stays cached without activity
+DEFAULT_FLUSH_INTERVAL = 1.0   # Seconds between write-behind flushes
+DEFAULT_FLUSH_BATCH = 200      # Dirty conversations that trigger an early flush
+NOTIFY_CHANNEL = 'conversation_states_changed'
+NOTIFY_PHONES = 200            # Phones per notification; payloads are capped at 8000 bytes
+
+
+def empty_state():
+    """State returned for phones with no conversation on record"""
+    return {'state': None, 'temp_data': {}, 'message_count': 0}
+
+
+class PostgresConversationBackend:
+    """Persists conversation states to the conversation_states table"""
+
+    def __init__(self, get_connection=None, release_connection=None):
+        if get_connection is None or release_connection is None:
+            from utils.database import get_db_connection, close_connection
+            get_connection = get_connection or get_db_connection
+            release_connection = release_connection or close_connection
+        self._get_connection = get_connection
+        self._release_connection = release_connection
+        self.writer = uuid.uuid4().hex   # Tells this worker's notifications from others'
+
+    def load(self, phone):
+        """
+        Load a single conversation state
+
+        Args:
+            phone: Customer phone number
+
+        Returns:
+            State dict, or None if the phone has no stored conversation
+        """
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT state, temp_data, last_interaction, message_count
+                FROM conversation_states
+                WHERE phone = %s
+            """, (phone,))
+            result = cursor.fetchone()
+            conn.commit()
+        finally:
+            self._release_connection(conn)
+
+        if not result:
+            return None
+
+        if isinstance(result, dict):
+            state = result.get('state')
+            temp_data = result.get('temp_data')
+            last_interaction = result.get('last_interaction')
+            message_count = result.get('message_count', 0)
+        else:
+            state, temp_data, last_interaction, message_count = result
+
+        # JSONB comes back already decoded; TEXT columns need parsing
+        if isinstance(temp_data, str):
+            try:
+                temp_data = json.loads(temp_data) if temp_data else {}
+            except Exception as json_err:
+                logger.error(f"Error parsing JSON in conversation state: {str(json_err)}")
+                temp_data = {}
+
+        return {
+            'state': state,
+            'temp_data': temp_data or {},
+            'last_interaction': last_interaction,
+            'message_count': int(message_count) if message_count else 0
+        }
+
+    def save_many(self, states):
+        """
+        Upsert a batch of conversation states in one statement
+
+        Args:
+            states: Dictionary of phone -> state dict
+        """
+        phones = list(states)
+        rows = [
+            (
+                phone,
+                state_obj['state'],
+                json.dumps(state_obj['temp_data']) if state_obj.get('temp_data') else None,
+                state_obj.get('last_interaction'),
+                state_obj.get('message_count', 0)
+            )
+            for phone, state_obj in states.items()
+        ]
+
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            execute_values(cursor, """
+                INSERT INTO conversation_states
+                (phone, state, temp_data, last_interaction, message_count)
+                VALUES %s
+                ON CONFLICT (phone) DO UPDATE SET
+                    state = EXCLUDED.state,
+                    temp_data = EXCLUDED.temp_data,
+                    last_interaction = EXCLUDED.last_interaction,
+                    message_count = EXCLUDED.message_count
+            """, rows)
+            for i in range(0, len(phones), NOTIFY_PHONES):
+                cursor.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, json.dumps({
+                    'writer': self.writer, 'phones': phones[i:i + NOTIFY_PHONES]})))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._release_connection(conn)
+
+
+class ConversationStore:
+    """Bounded in-memory conversation cache with write-behind persistence
+
+    Reads are served from memory when possible. Writes update memory at once
+    and are queued; repeated writes for the same phone between flushes are
+    coalesced so only the latest state is written. A background thread
+    flushes the queue every flush_interval seconds, or sooner when
+    flush_batch conversations are waiting.
+    """
+
+    def __init__(self, backend=None, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, flush_batch=DEFAULT_FLUSH_BATCH):
+        """
+        Initialize the store
+
+        Args:
+            backend: Persistence backend with load(phone) and save_many(states),
+                or None for a memory-only store
+            max_entries: Maximum conversations held in memory
+            ttl: Seconds of inactivity before a cached conversation expires
+            flush_interval: Seconds between write-behind flushes
+            flush_batch: Pending writes that trigger an immediate flush
+        """
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._entries = OrderedDict()  # phone -> (state_obj, expires_at)
+        self._dirty = {}               # phone -> latest unflushed state_obj
+        self._generation = 0           # Bumped whenever other workers' writes drop entries
+
+        self._metrics = {
+            'hits': 0,
+            'misses': 0,
+            'loads': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'writes': 0,
+            'coalesced_writes': 0,
+            'flushes': 0,
+            'flushed_rows': 0,
+            'flush_errors': 0,
+            'last_flush_ms': 0.0,
+            'notifications': 0,
+            'remote_invalidations': 0
+        }
+
+        self._listener = None
+        self._listening = False
+
+        self._wake = threading.Event()
+        self._stopped = False
+        self._flusher = None
+        if self.backend is not None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='conversation-store-flush', daemon=True)
+            self._flusher.start()
+
+    def get(self, phone):
+        """
+        Get the conversation state for a phone number
+
+        Args:
+            phone: Customer phone number
+
+        Returns:
+            State dict with state, temp_data, last_interaction and message_count
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(phone)
+            if entry is not None:
+                state_obj, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(phone)
+                    self._metrics['hits'] += 1
+                    return state_obj
+                del self._entries[phone]
+                self._metrics['expirations'] += 1
+
+            # An unflushed write is newer than anything in the database
+            pending = self._dirty.get(phone)
+            if pending is not None:
+                self._metrics['hits'] += 1
+                self._put(phone, pending, now)
+                return pending
+
+            self._metrics['misses'] += 1
+            generation = self._generation
+
+        if self.backend is None:
+            return empty_state()
+
+        try:
+            state_obj = self.backend.load(phone)
+            with self._lock:
+                self._metrics['loads'] += 1
+        except Exception as e:
+            logger.error(f"Error getting conversation state: {str(e)}")
+            return empty_state()
+
+        if state_obj is None:
+            return empty_state()
+
+        with self._lock:
+            if phone in self._entries:
+                # Don't clobber a write that raced with the load
+                return self._entries[phone][0]
+            # A drop during the load means it may have read the old row;
+            # use it for this message but don't cache it
+            if generation == self._generation:
+                self._put(phone, state_obj, time.monotonic())
+            return state_obj
+
+    def set(self, phone, state, temp_data=None):
+        """
+        Update the conversation state for a phone number
+
+        Args:
+            phone: Customer phone number
+            state: New conversation state
+            temp_data: Partial order data carried between messages
+
+        Returns:
+            The new state dict
+        """
+        existing = self.get(phone)
+
+        state_obj = {
+            'state': state,
+            'temp_data': temp_data or {},
+            'last_interaction': datetime.now(),
+            'message_count': existing.get('message_count', 0) + 1
+        }
+
+        with self._lock:
+            self._put(phone, state_obj, time.monotonic())
+            self._metrics['writes'] += 1
+            if self.backend is not None:
+                if phone in self._dirty:
+                    self._metrics['coalesced_writes'] += 1
+                self._dirty[phone] = state_obj
+                if len(self._dirty) >= self.flush_batch:
+                    self._wake.set()
+
+        return state_obj
+
+    def _put(self, phone, state_obj, now):
+        """Insert or refresh a cache entry and evict beyond max_entries (lock held)"""
+        self._entries[phone] = (state_obj, now + self.ttl)
+        self._entries.move_to_end(phone)
+        while len(self._entries) > self.max_entries:
+            # Evicting a dirty entry is safe: _dirty keeps it until flushed
+            self._entries.popitem(last=False)
+            self._metrics['evictions'] += 1
+
+    def flush(self):
+        """
+        Write all pending conversation states to the backend
+
+        Returns:
+            Number of conversations written
+        """
+        if self.backend is None:
+            return 0
+
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return 0
+                batch, self._dirty = self._dirty, {}
+
+            started = time.perf_counter()
+            try:
+                self.backend.save_many(batch)
+            except Exception as e:
+                logger.error(f"Error flushing {len(batch)} conversation states: {str(e)}")
+                with self._lock:
+                    self._metrics['flush_errors'] += 1
+                    # Requeue, keeping anything written since the batch was taken
+                    for phone, state_obj in batch.items():
+                        self._dirty.setdefault(phone, state_obj)
+                return 0
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self._metrics['flushes'] += 1
+                self._metrics['flushed_rows'] += len(batch)
+                self._metrics['last_flush_ms'] = round(elapsed_ms, 3)
+
+            logger.debug(f"Flushed {len(batch)} conversation states in {elapsed_ms:.1f}ms")
+            return len(batch)
+
+    def _flush_loop(self):
+        """Background write-behind loop"""
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Conversation store flush loop error: {str(e)}")
+
+    def drop(self, phones):
+        """
+        Forget cached conversations another worker has written
+
+        Phones with an unflushed write here keep it; it is newer as far as
+        this worker knows.
+
+        Args:
+            phones: Phone numbers to drop, or None for every clean entry
+
+        Returns:
+            Number of conversations dropped
+        """
+        dropped = 0
+        with self._lock:
+            for phone in (list(self._entries) if phones is None else phones):
+                if phone in self._dirty:
+                    continue
+                if self._entries.pop(phone, None) is not None:
+                    dropped += 1
+            self._generation += 1
+            self._metrics['remote_invalidations'] += dropped
+        return dropped
+
+    def start_listener(self, db_url):
+        """Start a thread that drops conversations as soon as another worker flushes them
+
+        Args:
+            db_url: Database URL for the dedicated LISTEN connection
+        """
+        if self._listener is not None or self.backend is None:
+            return
+        self._listener = threading.Thread(target=self._listen, args=(db_url,),
+                                          name='conversation-store-listener', daemon=True)
+        self._listener.start()
+
+    def _listen(self, db_url):
+        import psycopg2
+
+        writer = getattr(self.backend, 'writer', None)
+        while not self._stopped:
+            conn = None
+            try:
+                conn = psycopg2.connect(db_url)
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # Flushes made while we were not listening were never heard
+                self.drop(None)
+                self._listening = True
+                logger.info("Listening for conversation changes")
+
+                while not self._stopped:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        with self._lock:
+                            self._metrics['notifications'] += 1
+                        try:
+                            payload = json.loads(notify.payload)
+                        except ValueError:
+                            continue
+                        if payload.get('writer') != writer:
+                            self.drop(payload.get('phones') or [])
+            except Exception as e:
+                self._listening = False
+                logger.warning(f"Conversation listener disconnected: {str(e)}")
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(5)
+
+    def close(self):
+        """Stop the background flusher and write anything still pending"""
+        self._stopped = True
+        self._wake.set()
+        self.flush()
+
+    def get_metrics(self):
+        """Snapshot of cache and write-behind metrics"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['size'] = len(self._entries)
+            metrics['pending_writes'] = len(self._dirty)
+        lookups = metrics['hits'] + metrics['misses']
+        metrics['hit_rate'] = round(metrics['hits'] / lookups, 3) if lookups else 0.0
+        metrics['max_entries'] = self.max_entries
+        metrics['ttl'] = self.ttl
+        metrics['listening'] = self._listening
+        return metrics
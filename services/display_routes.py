@@ -8,6 +8,9 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
 
+from services.settings_service import get_settings_service
+from services.display_snapshot import get_display_snapshots
+
 # Create blueprint
 bp = Blueprint('display', __name__, url_prefix='/display')
 
@@ -118,21 +121,11 @@ def display_index():
                     orders_by_station[station_id][status].append(order)
         
         # Get settings for display
-        cursor.execute("SELECT value FROM settings WHERE key = 'event_name'")
-        event_name_result = cursor.fetchone()
-        event_name = event_name_result['value'] if event_name_result else 'Coffee Service'
-        
-        cursor.execute("SELECT value FROM settings WHERE key = 'sponsor_display_enabled'")
-        sponsor_display_result = cursor.fetchone()
-        sponsor_display_enabled = sponsor_display_result['value'].lower() in ('true', 'yes', '1', 't', 'y') if sponsor_display_result else False
-        
-        cursor.execute("SELECT value FROM settings WHERE key = 'sponsor_name'")
-        sponsor_name_result = cursor.fetchone()
-        sponsor_name = sponsor_name_result['value'] if sponsor_name_result and sponsor_display_enabled else ''
-        
-        cursor.execute("SELECT value FROM settings WHERE key = 'sponsor_message'")
-        sponsor_message_result = cursor.fetchone()
-        sponsor_message = sponsor_message_result['value'] if sponsor_message_result and sponsor_display_enabled else ''
+        settings = get_settings_service()
+        event_name = settings.get('event_name', 'Coffee Service')
+        sponsor_display_enabled = settings.get_bool('sponsor_display_enabled', False)
+        sponsor_name = settings.get('sponsor_name', '') if sponsor_display_enabled else ''
+        sponsor_message = settings.get('sponsor_message', '') if sponsor_display_enabled else ''
         
         if sponsor_name and '{sponsor}' in sponsor_message:
             sponsor_message = sponsor_message.replace('{sponsor}', sponsor_name)
@@ -153,8 +146,12 @@ def display_index():
 
 @bp.route('/api/orders')
 def api_orders():
-    """API endpoint to get order data for displays"""
-    try:
+    """API endpoint to get order data for displays
+
+    Served from the shared display board cache with ETag/If-None-Match
+    and optional ?wait=<seconds> long-polling
+    """
+    def build_board():
         coffee_system = current_app.config.get('coffee_system')
         db = coffee_system.db
         
@@ -227,13 +224,16 @@ def api_orders():
                 'load': current_load or 0
             })
         
-        return jsonify({
+        return {
             'success': True,
             'orders': orders,
             'stations': stations,
             'timestamp': coffee_system.current_time_formatted()
-        })
-        
+        }
+
+    try:
+        return get_display_snapshots().respond('display_screen', build_board)
+
     except Exception as e:
         logger.error(f"Error in API: {str(e)}")
         return jsonify({
@@ -311,9 +311,7 @@ def station_display(station_id):
             })
         
         # Get settings for display
-        cursor.execute("SELECT value FROM settings WHERE key = 'event_name'")
-        event_name_result = cursor.fetchone()
-        event_name = event_name_result['value'] if event_name_result else 'Coffee Service'
+        event_name = get_settings_service().get('event_name', 'Coffee Service')
         
         # Group orders by status
         orders_by_status = {
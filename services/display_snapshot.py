@@ -0,0 +1,166 @@
+"""
+Shared display board snapshots with ETag and long-poll support
+
+Every wall screen polls the same board, so each board is built once and
+served from memory until the order event stream (services/order_events.py)
+moves on, i.e. until an order a board can show changes. Boards also expire
+after SNAPSHOT_MAX_AGE for their time windows, and after
+SNAPSHOT_UNTRACKED_MAX_AGE while no event listener is running.
+
+Responses carry an ETag of the board contents. A screen that sends it back
+in If-None-Match gets 304 Not Modified; with ?wait=<seconds> as well, the
+request is held until the board changes or the wait runs out.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from flask import request, jsonify, make_response, current_app
+
+from services.order_events import get_order_event_stream
+
+logger = logging.getLogger("expresso.services.display_snapshot")
+
+SNAPSHOT_MAX_AGE = 30.0            # Seconds; time windows ("last 2 hours") still move
+SNAPSHOT_UNTRACKED_MAX_AGE = 2.0   # Seconds, while order events are not being heard
+LONG_POLL_MAX_WAIT = 30.0          # Cap on ?wait=
+LONG_POLL_INTERVAL = 0.5           # Seconds between checks while waiting
+
+
+class DisplaySnapshotCache:
+    """Named display boards rebuilt only when orders change"""
+
+    def __init__(self, max_age=SNAPSHOT_MAX_AGE, untracked_max_age=SNAPSHOT_UNTRACKED_MAX_AGE):
+        """
+        Initialize the cache
+
+        Args:
+            max_age: Seconds a board is served while order events are tracked
+            untracked_max_age: Seconds a board is served otherwise
+        """
+        self.max_age = max_age
+        self.untracked_max_age = untracked_max_age
+        self._lock = threading.Lock()
+        self._build_locks = {}
+        self._boards = {}   # name -> (version, built_at, payload, etag)
+
+        self._metrics = {
+            'hits': 0,
+            'builds': 0,
+            'not_modified': 0,
+            'long_polls': 0,
+            'errors': 0
+        }
+
+    @staticmethod
+    def _version():
+        stream = get_order_event_stream()
+        return (stream.stream_id, stream.seq) if stream.listening else None
+
+    def _fresh(self, entry, version):
+        if entry is None:
+            return False
+        entry_version, built_at, _, _ = entry
+        max_age = self.max_age if version is not None else self.untracked_max_age
+        return entry_version == version and time.monotonic() - built_at < max_age
+
+    def get(self, name, build):
+        """
+        Current board, building it if orders changed since the last build
+
+        Args:
+            name: Board name
+            build: Callable returning the board payload (a JSON-able dict)
+
+        Returns:
+            Tuple of (payload, etag)
+        """
+        version = self._version()
+        entry = self._boards.get(name)
+        if self._fresh(entry, version):
+            with self._lock:
+                self._metrics['hits'] += 1
+            return entry[2], entry[3]
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(name, threading.Lock())
+
+        # One build per change, however many screens ask at once
+        with build_lock:
+            entry = self._boards.get(name)
+            if self._fresh(entry, version):
+                with self._lock:
+                    self._metrics['hits'] += 1
+                return entry[2], entry[3]
+
+            try:
+                payload = build()
+            except Exception:
+                with self._lock:
+                    self._metrics['errors'] += 1
+                raise
+            etag = self._etag(payload)
+            self._boards[name] = (version, time.monotonic(), payload, etag)
+            with self._lock:
+                self._metrics['builds'] += 1
+            return payload, etag
+
+    @staticmethod
+    def _etag(payload):
+        # The build timestamp changes every build; the board may not have
+        content = {key: value for key, value in payload.items() if key != 'timestamp'}
+        digest = hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+        return f'"{digest[:20]}"'
+
+    def respond(self, name, build):
+        """
+        Flask response for a board, honouring If-None-Match and ?wait=
+
+        Args:
+            name: Board name
+            build: Callable returning the board payload
+
+        Returns:
+            200 response with the board and its ETag, or 304 if the client's
+            copy is current
+        """
+        payload, etag = self.get(name, build)
+        client_etags = {tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')}
+
+        wait = min(request.args.get('wait', 0, type=float) or 0, LONG_POLL_MAX_WAIT)
+        if etag in client_etags and wait > 0:
+            with self._lock:
+                self._metrics['long_polls'] += 1
+            # socketio.sleep yields to other requests under eventlet
+            sleep = getattr(current_app.config.get('socketio'), 'sleep', time.sleep)
+            deadline = time.monotonic() + wait
+            while etag in client_etags and time.monotonic() < deadline:
+                sleep(LONG_POLL_INTERVAL)
+                payload, etag = self.get(name, build)
+
+        if etag in client_etags:
+            with self._lock:
+                self._metrics['not_modified'] += 1
+            response = make_response('', 304)
+        else:
+            response = jsonify(payload)
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def get_metrics(self):
+        """Snapshot of display snapshot metrics"""
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics['boards'] = sorted(self._boards)
+        return metrics
+
+
+_display_snapshots = DisplaySnapshotCache()
+
+
+def get_display_snapshots():
+    """Process-wide display board cache shared by the display routes"""
+    return _display_snapshots
@@ -0,0 +1,245 @@
+"""
+Versioned menu and availability snapshot built from the inventory tables
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger("expresso.services.menu_snapshot")
+
+# Safety net for inventory rows written outside the inventory routes
+MENU_SNAPSHOT_MAX_AGE = 30
+
+# Drinks offered while coffee beans are in stock
+DRINK_TYPES = ["latte", "cappuccino", "flat white", "long black", "espresso", "mocha"]
+
+# Fallbacks used when a section of the menu can't be read
+FALLBACK_DRINK_TYPES = ["latte", "cappuccino", "flat white", "long black", "espresso"]
+DEFAULT_MILK_TYPES = ["full cream", "skim"]
+DEFAULT_SWEETENERS = [("sugar", "sugar"), ("no sugar", "sugar")]
+DEFAULT_SIZES = ["small", "medium", "large"]
+
+
+class MenuSnapshot:
+    """What can be ordered right now, read from inventory_items,
+    size_options and stock_items in one pass
+
+    Snapshots are never modified after they are built; a refresh produces a
+    new snapshot. The version only changes when the menu contents do, so
+    clients can compare versions to skip re-rendering.
+    """
+
+    def __init__(self, coffee_types, milk_types, sweeteners, sizes_by_type,
+                 stock_coffee_types=None, cup_sizes=None, version=0):
+        """
+        Args:
+            coffee_types: Drink types available given coffee bean stock
+            milk_types: In-stock milk names, lowercased
+            sweeteners: List of (name, category) tuples in stock
+            sizes_by_type: Dictionary of coffee_type -> active sizes
+            stock_coffee_types: Active coffee_type names from stock_items,
+                or None if unavailable
+            cup_sizes: Active cup sizes from stock_items, or None
+            version: Snapshot version
+        """
+        self.coffee_types = coffee_types
+        self.milk_types = milk_types
+        self.sweeteners = sweeteners
+        self.sizes_by_type = sizes_by_type
+        self.stock_coffee_types = stock_coffee_types
+        self.cup_sizes = cup_sizes
+        self.version = version
+        self.built_at = datetime.now()
+
+    def sizes_for(self, coffee_type):
+        """Sizes offered for a coffee type, or the default sizes"""
+        return list(self.sizes_by_type.get(coffee_type) or DEFAULT_SIZES)
+
+    def content_key(self):
+        """Hashable view of the menu contents, used to decide on a new version"""
+        return (
+            tuple(self.coffee_types),
+            tuple(self.milk_types),
+            tuple(self.sweeteners),
+            tuple(sorted((key, tuple(sizes)) for key, sizes in self.sizes_by_type.items())),
+            tuple(self.stock_coffee_types) if self.stock_coffee_types is not None else None,
+            tuple(self.cup_sizes) if self.cup_sizes is not None else None
+        )
+
+    def to_dict(self):
+        """Serializable form for the ordering UI"""
+        return {
+            'version': self.version,
+            'coffee_types': list(self.coffee_types),
+            'milk_types': list(self.milk_types),
+            'sweeteners': [{'name': name, 'category': category} for name, category in self.sweeteners],
+            'sizes': {coffee_type: list(sizes) for coffee_type, sizes in self.sizes_by_type.items()},
+            'default_sizes': list(DEFAULT_SIZES),
+            'stock_coffee_types': list(self.stock_coffee_types or []),
+            'built_at': self.built_at.isoformat()
+        }
+
+
+class MenuCache:
+    """Holds the current MenuSnapshot and rebuilds it when it goes stale
+
+    Inventory writes call invalidate(); otherwise the snapshot is rebuilt
+    after max_age seconds. A conversation turn that reads the menu several
+    times therefore costs no queries in the steady state.
+    """
+
+    def __init__(self, max_age=MENU_SNAPSHOT_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._loaded_at = None
+        self._version = 0
+
+    def invalidate(self):
+        """Force a rebuild on the next lookup"""
+        self._loaded_at = None
+        logger.debug("Menu snapshot invalidated")
+
+    def is_stale(self):
+        """Whether the snapshot needs to be rebuilt before use"""
+        loaded_at = self._loaded_at
+        return loaded_at is None or (time.monotonic() - loaded_at) > self.max_age
+
+    def load(self, db):
+        """Rebuild the snapshot from the database
+
+        Each section falls back to its defaults on its own, so a missing
+        optional table doesn't take the whole menu down.
+
+        Args:
+            db: Database connection
+
+        Returns:
+            The current MenuSnapshot
+        """
+        coffee_types = self._query(db, self._load_coffee_types, FALLBACK_DRINK_TYPES, "coffee availability")
+        milk_types = self._query(db, self._load_milk_types, DEFAULT_MILK_TYPES, "milk types")
+        sweeteners = self._query(db, self._load_sweeteners, DEFAULT_SWEETENERS, "sweeteners")
+        sizes_by_type = self._query(db, self._load_sizes, {}, "size options")
+        stock_coffee_types = self._query(db, self._load_stock_coffee_types, None, "stock coffee types")
+        cup_sizes = self._query(db, self._load_cup_sizes, None, "cup sizes")
+
+        snapshot = MenuSnapshot(coffee_types, milk_types, sweeteners, sizes_by_type,
+                                stock_coffee_types, cup_sizes)
+
+        with self._lock:
+            previous = self._snapshot
+            if previous is not None and previous.content_key() == snapshot.content_key():
+                snapshot.version = previous.version
+            else:
+                self._version += 1
+                snapshot.version = self._version
+                logger.info(f"Menu snapshot v{snapshot.version}: {len(coffee_types)} drinks, "
+                            f"milks {milk_types}, {len(sweeteners)} sweeteners")
+            self._snapshot = snapshot
+            self._loaded_at = time.monotonic()
+
+        return snapshot
+
+    def get(self, db):
+        """Current snapshot, rebuilt first if invalidated or older than max_age"""
+        if self.is_stale() or self._snapshot is None:
+            return self.load(db)
+        return self._snapshot
+
+    @staticmethod
+    def _query(db, loader, default, what):
+        """Run one section's loader in a savepoint, so a failed read is undone
+        without rolling back the caller's transaction"""
+        cursor = db.cursor()
+        try:
+            cursor.execute("SAVEPOINT menu_snapshot_read")
+            result = loader(cursor)
+            cursor.execute("RELEASE SAVEPOINT menu_snapshot_read")
+            return result
+        except Exception as e:
+            logger.error(f"Error loading {what} for menu: {str(e)}")
+            try:
+                cursor.execute("ROLLBACK TO SAVEPOINT menu_snapshot_read")
+            except Exception:
+                pass
+            return default
+
+    @staticmethod
+    def _load_coffee_types(cursor):
+        cursor.execute("""
+            SELECT COUNT(*) FROM inventory_items
+            WHERE category = 'coffee'
+            AND (amount IS NULL OR amount > COALESCE(minimum_threshold, 0))
+        """)
+        if cursor.fetchone()[0] > 0:
+            return list(DRINK_TYPES)
+        logger.warning("No coffee beans in stock, cannot offer coffee drinks")
+        return []
+
+    @staticmethod
+    def _load_milk_types(cursor):
+        cursor.execute("""
+            SELECT name FROM inventory_items
+            WHERE category = 'milk'
+            AND (amount IS NULL OR amount > COALESCE(minimum_threshold, 0))
+            ORDER BY name
+        """)
+        milk_types = [row[0].lower() for row in cursor.fetchall()]
+        if not milk_types:
+            logger.warning("No milk types found in inventory_items table, using defaults")
+            return list(DEFAULT_MILK_TYPES)
+        return milk_types
+
+    @staticmethod
+    def _load_sweeteners(cursor):
+        cursor.execute("""
+            SELECT name, category FROM inventory_items
+            WHERE category IN ('sweetener', 'sugar', 'artificial_sweetener')
+            AND (amount IS NULL OR amount > COALESCE(minimum_threshold, 0))
+            ORDER BY category, name
+        """)
+        sweeteners = [(row[0].lower(), row[1]) for row in cursor.fetchall()]
+        if not sweeteners:
+            logger.warning("No sweeteners found in inventory_items table, using defaults")
+            return list(DEFAULT_SWEETENERS)
+        return sweeteners
+
+    @staticmethod
+    def _load_sizes(cursor):
+        cursor.execute("""
+            SELECT DISTINCT coffee_type, size FROM size_options
+            WHERE is_active = TRUE
+            ORDER BY coffee_type, size
+        """)
+        sizes_by_type = {}
+        for coffee_type, size in cursor.fetchall():
+            sizes_by_type.setdefault(coffee_type, []).append(size.lower())
+        return sizes_by_type
+
+    @staticmethod
+    def _load_stock_coffee_types(cursor):
+        cursor.execute("""
+            SELECT name FROM stock_items
+            WHERE category = 'coffee_type' AND is_active = TRUE
+            ORDER BY name
+        """)
+        return [row[0] for row in cursor.fetchall()]
+
+    @staticmethod
+    def _load_cup_sizes(cursor):
+        cursor.execute("""
+            SELECT DISTINCT size FROM stock_items
+            WHERE category = 'cup' AND is_active = TRUE
+            ORDER BY size
+        """)
+        return [row[0] for row in cursor.fetchall()]
+
+
+_menu_cache = MenuCache()
+
+
+def get_menu_cache():
+    """Process-wide menu cache shared by the SMS state machine, NLP and routes"""
+    return _menu_cache
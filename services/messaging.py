@@ -11,6 +11,8 @@ import qrcode
 import base64
 from io import BytesIO
 
+from services.settings_service import get_settings_service
+
 logger = logging.getLogger("expresso.services.messaging")
 
 # Ensure directory exists
@@ -34,6 +36,7 @@ class MessagingService:
         self.phone_number = phone_number
         self.testing_mode = testing_mode
         self.client = None
+        self.outbox = None
         
         if account_sid and auth_token and not testing_mode:
             try:
@@ -56,21 +59,83 @@ class MessagingService:
         resp.message(message_body)
         return str(resp)
     
+    def attach_outbox(self, outbox):
+        """
+        Route send_message through an asynchronous SmsOutbox
+        
+        Args:
+            outbox: Started SmsOutbox instance
+        """
+        self.outbox = outbox
+        logger.info("Outbound SMS will be delivered through the outbox queue")
+    
     def send_message(self, to, body):
         """
         Send an SMS message
         
+        With an outbox attached the message is queued and this returns at once
+        with an outbox reference; delivery happens on the outbox workers.
+        
         Args:
             to: Recipient phone number
             body: Message body
             
         Returns:
-            Message SID if successful, None otherwise
+            Message SID (or outbox reference) if successful, None otherwise
         """
         if self.testing_mode:
             logger.info(f"TESTING MODE - Would send to {to}: {body}")
             return "testing_mode_message_sid"
         
+        if self.outbox is not None:
+            try:
+                message_id = self.outbox.enqueue(to, body)
+                logger.info(f"Queued SMS to {to} (outbox {message_id})")
+                return f"outbox-{message_id}"
+            except Exception as e:
+                logger.error(f"Error queueing SMS to {to}, sending directly: {str(e)}")
+        
+        return self.deliver_message(to, body)
+    
+    def send_messages(self, messages):
+        """
+        Send several SMS messages, queueing them in one outbox write
+        
+        Args:
+            messages: List of (to, body) tuples
+            
+        Returns:
+            List of message SIDs (or outbox references), None where sending failed
+        """
+        if not messages:
+            return []
+        
+        if self.testing_mode:
+            for to, body in messages:
+                logger.info(f"TESTING MODE - Would send to {to}: {body}")
+            return ["testing_mode_message_sid"] * len(messages)
+        
+        if self.outbox is not None:
+            try:
+                message_ids = self.outbox.enqueue_many(messages)
+                logger.info(f"Queued {len(messages)} SMS (outbox {message_ids[0]}-{message_ids[-1]})")
+                return [f"outbox-{message_id}" for message_id in message_ids]
+            except Exception as e:
+                logger.error(f"Error queueing {len(messages)} SMS, sending directly: {str(e)}")
+        
+        return [self.deliver_message(to, body) for to, body in messages]
+    
+    def deliver_message(self, to, body):
+        """
+        Send an SMS message synchronously through Twilio
+        
+        Args:
+            to: Recipient phone number
+            body: Message body
+            
+        Returns:
+            Message SID if successful, None otherwise
+        """
         if not self.client:
             logger.warning("No Twilio client available, skipping SMS notification")
             return None
@@ -131,18 +196,8 @@ class MessagingService:
         group_msg = " (Group order)" if is_group else ""
         
         # Try to get venue map URL from settings
-        venue_map_url = None
-        try:
-            from flask import current_app
-            if hasattr(current_app, 'config'):
-                coffee_system = current_app.config.get('coffee_system')
-                if coffee_system:
-                    cursor = coffee_system.db.cursor()
-                    cursor.execute("SELECT value FROM settings WHERE key = 'venue_map_url'")
-                    result = cursor.fetchone()
-                    venue_map_url = result[0] if result else None
-        except Exception as e:
-            logger.error(f"Error retrieving venue map URL: {str(e)}")
+        settings = get_settings_service()
+        venue_map_url = settings.get('venue_map_url')
         
         # Create a tiny URL with station, ETA, order details
         station_detail_url = ""
@@ -154,14 +209,7 @@ class MessagingService:
                     order_url_params += f"&barista={barista_name}"
                 
                 # If we have a URL shortening service configured, use it
-                short_url_enabled = False
-                try:
-                    cursor = coffee_system.db.cursor()
-                    cursor.execute("SELECT value FROM settings WHERE key = 'short_url_service'")
-                    result = cursor.fetchone()
-                    short_url_enabled = result[0].lower() in ('true', 'yes', 't', 'y', '1') if result else False
-                except Exception as e:
-                    logger.error(f"Error checking short URL setting: {str(e)}")
+                short_url_enabled = settings.get_bool('short_url_service')
                 
                 if short_url_enabled:
                     # Implementation for URL shortening would go here
@@ -171,16 +219,9 @@ class MessagingService:
                     station_detail_url = f"\n\nFind your station here: {venue_map_url}{order_url_params}"
                 
                 # Generate QR code for order details if enabled
-                try:
-                    cursor = coffee_system.db.cursor()
-                    cursor.execute("SELECT value FROM settings WHERE key = 'include_qr_code'")
-                    include_qr = result[0].lower() in ('true', 'yes', 't', 'y', '1') if result else False
-                    
-                    if include_qr:
-                        # For SMS, we don't include the actual QR code, but let the user know it's available
-                        station_detail_url += "\n\nA QR code for your order is available in the venue app."
-                except Exception as e:
-                    logger.error(f"Error checking QR code setting: {str(e)}")
+                if settings.get_bool('include_qr_code'):
+                    # For SMS, we don't include the actual QR code, but let the user know it's available
+                    station_detail_url += "\n\nA QR code for your order is available in the venue app."
                 
             except Exception as e:
                 logger.error(f"Error creating station detail URL: {str(e)}")
@@ -222,9 +263,6 @@ class MessagingService:
         Returns:
             Message SID if successful, None otherwise
         """
-        # Create message with customization
-        friend_text = f" for {for_friend}" if for_friend else ""
-        
         # Get order details to make the message more specific
         coffee_type = "coffee"
         try:
@@ -240,15 +278,34 @@ class MessagingService:
         except:
             pass
         
-        message = (
+        message = self.format_order_ready_message(order_number, station_id, for_friend, coffee_type)
+        
+        # Send the message
+        return self.send_message(to, message)
+    
+    @staticmethod
+    def format_order_ready_message(order_number, station_id, for_friend=None, coffee_type=None):
+        """
+        Text of the order ready notification
+        
+        Args:
+            order_number: Order number
+            station_id: Station ID
+            for_friend: Optional friend name
+            coffee_type: Drink name (defaults to "coffee")
+            
+        Returns:
+            Message body
+        """
+        # Create message with customization
+        friend_text = f" for {for_friend}" if for_friend else ""
+        
+        return (
             f"🔔 YOUR COFFEE IS READY! 🔔\n\n"
-            f"Your {coffee_type} (order #{order_number}){friend_text} is now ready "
+            f"Your {coffee_type or 'coffee'} (order #{order_number}){friend_text} is now ready "
             f"for collection from Station {station_id}.\n\n"
             f"Enjoy! ☕"
         )
-        
-        # Send the message
-        return self.send_message(to, message)
     
     def send_reminder(self, to, order_number, station_id, wait_time):
         """
@@ -3,12 +3,84 @@ Enhanced Natural Language Processing service for parsing coffee orders
 """
 import logging
 import re
+import threading
 from collections import Counter
 import os
 import json
 
+from services.menu_snapshot import get_menu_cache
+
+try:
+    from flask import current_app, has_app_context
+except ImportError:
+    current_app = None
+
 logger = logging.getLogger("expresso.services.nlp")
 
+# Common typos and abbreviations fixed before parsing
+TYPO_CORRECTIONS = {
+    "expresso": "espresso",
+    "expressos": "espressos",
+    "cappacino": "cappuccino",
+    "capacino": "cappuccino",
+    "capuccino": "cappuccino",
+    "caffeien": "caffeine",
+    "machiato": "macchiato",
+    "mocha latte": "mocha",
+    "decaff": "decaf",
+    "venti": "large",
+    "grande": "medium",
+    "chai tea latte": "chai latte",
+    "the usual": "usual",
+    "my usual": "usual",
+    "as usual": "usual",
+    "coffee time": "usual"
+}
+
+
+class PriorityMatcher:
+    """Finds the first canonical term, in vocabulary order, mentioned in a message
+
+    Each canonical term becomes one branch of a single anchored regex:
+    ".*?(canonical|\\b(?:variation|...)\\b)". The regex engine tries the
+    branches in order and each one scans the whole message, so one match()
+    call gives the same answer as looping over every canonical and variation
+    with its own re.search, without the per-term Python overhead.
+    """
+
+    def __init__(self, vocabulary, match_canonical=True):
+        """
+        Compile the matcher
+
+        Args:
+            vocabulary: Iterable of (canonical, variations) in priority order
+            match_canonical: Also match the canonical term itself as a plain
+                substring, as the extractors always have
+        """
+        self.canonicals = []
+        branches = []
+        for canonical, variations in vocabulary:
+            alternatives = []
+            if match_canonical:
+                alternatives.append(re.escape(canonical))
+            words = sorted(set(variations), key=len, reverse=True)
+            if words:
+                alternatives.append(r'\b(?:' + '|'.join(re.escape(word) for word in words) + r')\b')
+            if not alternatives:
+                continue
+            self.canonicals.append(canonical)
+            branches.append('.*?(' + '|'.join(alternatives) + ')')
+
+        self.pattern = re.compile('(?:' + '|'.join(branches) + ')', re.DOTALL) if branches else None
+
+    def find(self, message):
+        """Canonical term with the highest priority found in the message, or None"""
+        if self.pattern is None:
+            return None
+        match = self.pattern.match(message)
+        return self.canonicals[match.lastindex - 1] if match else None
+
+
 # Ensure directory exists
 os.makedirs(os.path.dirname(__file__), exist_ok=True)
 
@@ -17,6 +89,13 @@ class NLPService:
     
     def __init__(self):
         """Initialize the NLP service with patterns and knowledge base"""
+        # Coffee types defined in stock_items, recompiled when the menu
+        # snapshot version changes
+        self._menu_lock = threading.Lock()
+        self._db_coffee_types = None
+        self._db_type_matcher = None
+        self._menu_version = None
+
         # Initialize comprehensive databases of terms
         self.load_coffee_database()
         logger.info("NLP service initialized")
@@ -138,6 +217,31 @@ class NLPService:
         self.group_pattern = re.compile(r'\b(group|multiple|many|several|team|office|bulk|everyone)\b', re.IGNORECASE)
         self.loyalty_pattern = re.compile(r'\b(loyalty|points|rewards|free coffee|redeem|use points|loyalty card)\b', re.IGNORECASE)
         self.usual_pattern = re.compile(r'\b(' + '|'.join(self.usual_order_keywords) + r')\b', re.IGNORECASE)
+
+        # Typo fixes in one pass, longest first so "expressos" beats "expresso"
+        typos = sorted(TYPO_CORRECTIONS, key=len, reverse=True)
+        self.typo_pattern = re.compile(r'\b(' + '|'.join(re.escape(typo) for typo in typos) + r')\b')
+
+        # One matcher per vocabulary. "no milk" is checked before the other
+        # milks and only through its variations, so it gets its own branch
+        # order here rather than a special case in the extractor.
+        self.coffee_type_matcher = PriorityMatcher(self.coffee_types.items())
+        self.size_matcher = PriorityMatcher(self.sizes.items())
+        self.milk_matcher = PriorityMatcher(
+            [("no milk", self.milks["no milk"])],
+            match_canonical=False
+        )
+        self.other_milk_matcher = PriorityMatcher(
+            (canonical, variations) for canonical, variations in self.milks.items() if canonical != "no milk"
+        )
+        self.sugar_matcher = PriorityMatcher(self.sugars.items())
+        self.strength_matcher = PriorityMatcher(self.strengths.items())
+        self.temperature_matcher = PriorityMatcher(self.temperatures.items())
+
+        self.num_sugar_pattern = re.compile(r'(\d+)\s*(?:sugar|sugars|sweetener)')
+        self.shot_pattern = re.compile(r'(\d+)\s*shots?')
+        self.allergy_pattern = re.compile(r'allerg(?:y|ic|ies) (?:to)?\s*([^,.!?]+)', re.IGNORECASE)
+        self.special_instructions_pattern = re.compile(r'(?:special|specific) (?:instructions?|requests?|notes?)[\s:]*([^,.!?]+)', re.IGNORECASE)
     
     def is_greeting(self, text):
         """Check if text is just a greeting without meaningful content"""
@@ -308,29 +412,7 @@ class NLPService:
         normalized = message.lower()
         
         # Replace common typos and abbreviations
-        typo_corrections = {
-            "expresso": "espresso",
-            "expressos": "espressos",
-            "cappacino": "cappuccino",
-            "capacino": "cappuccino",
-            "capuccino": "cappuccino",
-            "caffeien": "caffeine",
-            "machiato": "macchiato",
-            "mocha latte": "mocha",
-            "decaff": "decaf",
-            "venti": "large",
-            "grande": "medium",
-            "chai tea latte": "chai latte",
-            "the usual": "usual",
-            "my usual": "usual",
-            "as usual": "usual",
-            "coffee time": "usual"
-        }
-        
-        for typo, correction in typo_corrections.items():
-            normalized = re.sub(r'\b' + typo + r'\b', correction, normalized)
-        
-        return normalized
+        return self.typo_pattern.sub(lambda match: TYPO_CORRECTIONS[match.group(1)], normalized)
     
     def _extract_coffee_type(self, message):
         """Extract coffee type from message using pattern matching"""
@@ -338,47 +420,22 @@ class NLPService:
         if self.is_asking_for_usual(message):
             return None
         
+        message = message.lower()
+        
         # Try to get database-defined coffee types
         db_coffee_types = self._get_db_coffee_types()
         
         # If we have database-defined coffee types, check against those first
         if db_coffee_types:
-            # First check for exact matches
-            for coffee_type in db_coffee_types:
-                if coffee_type.lower() in message.lower():
-                    return coffee_type
-            
-            # Then check for variations and partial matches
-            extracted_type = None
-            for canonical, variations in self.coffee_types.items():
-                if canonical.lower() in message.lower():
-                    extracted_type = canonical
-                    break
-                
-                for variation in variations:
-                    # Use word boundaries to avoid partial matches
-                    if re.search(r'\b' + re.escape(variation) + r'\b', message.lower()):
-                        extracted_type = canonical
-                        break
-                        
-                if extracted_type:
-                    break
-            
-            # Check if the extracted type is in our database coffee types
-            if extracted_type and any(db_type.lower() == extracted_type.lower() for db_type in db_coffee_types):
-                return extracted_type
-            
-            # If we didn't find a match in database types, fall back to standard pattern matching
+            db_type = self._db_type_matcher.find(message)
+            if db_type:
+                return db_type
         
-        # Try exact matches first
-        for canonical, variations in self.coffee_types.items():
-            if canonical in message:
-                return canonical
-            
-            for variation in variations:
-                # Use word boundaries to avoid partial matches
-                if re.search(r'\b' + re.escape(variation) + r'\b', message.lower()):
-                    return canonical
+        # Variations and partial matches. A type missing from the database
+        # menu is still returned; validate_order reports it as unavailable.
+        coffee_type = self.coffee_type_matcher.find(message)
+        if coffee_type:
+            return coffee_type
         
         # Try matching multi-word coffee types that might not have exact boundaries
         multi_word_types = ["flat white", "long black", "hot chocolate", "chai latte", "matcha latte", "cold brew", "pour over", "filter coffee"]
@@ -389,64 +446,52 @@ class NLPService:
                 return coffee_type
         
         return None
+    
+    def set_menu(self, coffee_types, version=None):
+        """
+        Replace the database coffee types and recompile their matcher
         
-    def _get_db_coffee_types(self):
-        """Get coffee types from the database"""
-        try:
-            # Try to access the database via Flask app
-            from flask import current_app
-            if hasattr(current_app, 'config'):
-                coffee_system = current_app.config.get('coffee_system')
-                if coffee_system and hasattr(coffee_system, 'db'):
-                    cursor = coffee_system.db.cursor()
-                    cursor.execute("""
-                        SELECT name FROM stock_items 
-                        WHERE category = 'coffee_type' AND is_active = TRUE
-                        ORDER BY name
-                    """)
-                    return [row[0] for row in cursor.fetchall()]
-        except Exception as e:
-            pass  # Silently fail, will use hardcoded types
+        Args:
+            coffee_types: List of coffee type names, or None if unavailable
+            version: Menu snapshot version the names came from
+        """
+        matcher = PriorityMatcher((name.lower(), []) for name in coffee_types or [])
+        # Map matches back to the names as spelled in the database
+        matcher.canonicals = list(coffee_types or [])
+        with self._menu_lock:
+            self._db_coffee_types = coffee_types
+            self._db_type_matcher = matcher
+            self._menu_version = version
+    
+    def _get_menu_snapshot(self):
+        """Shared menu snapshot, or None outside the Flask app"""
+        if current_app is None or not has_app_context():
+            return None
+        coffee_system = current_app.config.get('coffee_system')
+        if not coffee_system or not hasattr(coffee_system, 'db'):
+            return None
+        return get_menu_cache().get(coffee_system.db)
         
-        return None
+    def _get_db_coffee_types(self):
+        """Get coffee types from the menu snapshot, falling back to the last set menu"""
+        snapshot = self._get_menu_snapshot()
+        if snapshot is not None and snapshot.version != self._menu_version:
+            self.set_menu(snapshot.stock_coffee_types, snapshot.version)
+        return self._db_coffee_types
     
     def _extract_size(self, message):
         """Extract size from message"""
-        for canonical, variations in self.sizes.items():
-            if canonical in message:
-                return canonical
-            
-            for variation in variations:
-                if re.search(r'\b' + re.escape(variation) + r'\b', message):
-                    return canonical
-        
-        return None
+        return self.size_matcher.find(message)
     
     def _extract_milk_type(self, message):
         """Extract milk type from message"""
-        # Handle explicit 'no milk' or 'black' first
-        for variation in self.milks["no milk"]:
-            if re.search(r'\b' + re.escape(variation) + r'\b', message):
-                return "no milk"
-        
-        # Match other milk types
-        for canonical, variations in self.milks.items():
-            if canonical == "no milk":  # Already handled
-                continue
-                
-            if canonical in message:
-                return canonical
-            
-            for variation in variations:
-                if re.search(r'\b' + re.escape(variation) + r'\b', message):
-                    return canonical
-        
-        return None
+        # Explicit 'no milk' or 'black' wins over any other milk mentioned
+        return self.milk_matcher.find(message) or self.other_milk_matcher.find(message)
     
     def _extract_sugar(self, message):
         """Extract sugar preference from message"""
         # Check for numeric sugar patterns (e.g., "2 sugars", "3 sugar")
-        num_sugar_match = re.search(r'(\d+)\s*(?:sugar|sugars|sweetener)', message)
+        num_sugar_match = self.num_sugar_pattern.search(message)
         if num_sugar_match:
             num = int(num_sugar_match.group(1))
             if num <= 0:
@@ -455,21 +500,12 @@ class NLPService:
                 return f"{num} sugar"
         
         # Check categorical sugar preferences
-        for canonical, variations in self.sugars.items():
-            if canonical in message:
-                return canonical
-            
-            for variation in variations:
-                # Check for variations with boundaries
-                if re.search(r'\b' + re.escape(variation) + r'\b', message):
-                    return canonical
-        
-        return None
+        return self.sugar_matcher.find(message)
     
     def _extract_strength(self, message):
         """Extract coffee strength preference from message"""
         # Check for shot counts
-        shot_match = re.search(r'(\d+)\s*shots?', message)
+        shot_match = self.shot_pattern.search(message)
         if shot_match:
             num_shots = int(shot_match.group(1))
             if num_shots == 1:
@@ -482,37 +518,21 @@ class NLPService:
                 return f"{num_shots} shots"
         
         # Check categorical strength preferences
-        for canonical, variations in self.strengths.items():
-            if canonical in message:
-                return canonical
-            
-            for variation in variations:
-                if re.search(r'\b' + re.escape(variation) + r'\b', message):
-                    return canonical
-        
-        return None
+        return self.strength_matcher.find(message)
     
     def _extract_temperature(self, message):
         """Extract temperature preference from message"""
-        for canonical, variations in self.temperatures.items():
-            if canonical in message:
-                return canonical
-            
-            for variation in variations:
-                if re.search(r'\b' + re.escape(variation) + r'\b', message):
-                    return canonical
-        
-        return None
+        return self.temperature_matcher.find(message)
     
     def _extract_notes(self, message):
         """Extract additional notes not captured by other extractors"""
         # Look for allergy information
-        allergy_match = re.search(r'allerg(?:y|ic|ies) (?:to)?\s*([^,.!?]+)', message, re.IGNORECASE)
+        allergy_match = self.allergy_pattern.search(message)
         if allergy_match:
             return f"Allergy note: {allergy_match.group(1).strip()}"
         
         # Look for special instructions
-        special_instructions = re.search(r'(?:special|specific) (?:instructions?|requests?|notes?)[\s:]*([^,.!?]+)', message, re.IGNORECASE)
+        special_instructions = self.special_instructions_pattern.search(message)
         if special_instructions:
             return special_instructions.group(1).strip()
         
@@ -658,23 +678,10 @@ class NLPService:
         Returns:
             Boolean indicating if size is valid
         """
-        # Get sizes from database if available
-        try:
-            from flask import current_app
-            if hasattr(current_app, 'config'):
-                coffee_system = current_app.config.get('coffee_system')
-                if coffee_system and hasattr(coffee_system, 'db'):
-                    cursor = coffee_system.db.cursor()
-                    cursor.execute("""
-                        SELECT DISTINCT size FROM stock_items 
-                        WHERE category = 'cup' AND is_active = TRUE
-                        ORDER BY size
-                    """)
-                    db_sizes = [row[0] for row in cursor.fetchall()]
-                    if db_sizes:
-                        return any(db_size.lower() == size.lower() for db_size in db_sizes)
-        except Exception as e:
-            pass  # Silently fail, will use hardcoded sizes
+        # Get cup sizes from the menu snapshot if available
+        snapshot = self._get_menu_snapshot()
+        if snapshot is not None and snapshot.cup_sizes:
+            return any(db_size.lower() == size.lower() for db_size in snapshot.cup_sizes)
         
         # Fallback to hardcoded sizes
         return size.lower() in [s.lower() for s in self.sizes.keys()]
@@ -0,0 +1,261 @@
+"""
+Versioned live order event stream for barista and display clients
+
+A trigger on orders (see ORDER_EVENTS_DDL in utils/database.py) notifies
+every committed create, assign, start, complete, pickup and cancel, whichever
+code path wrote it. Each worker LISTENs, stamps the events it hears with its
+own sequence number and emits them to the 'orders' room as 'order_event'.
+
+Clients call request_sync with type 'orders' for a snapshot of the live queue
+and the sequence it reflects, then apply events with a higher seq. A gap in
+seq, or a different stream id after a reconnect, means events were missed:
+sync again with since_seq to replay the recent ones, or take a new snapshot.
+Events carry the order's full queue fields, so applying one twice is harmless.
+"""
+import json
+import logging
+import threading
+import uuid
+from collections import deque
+from datetime import datetime
+
+from utils.database import ORDER_EVENT_FIELDS, ORDER_EVENTS_CHANNEL, order_event_json
+
+logger = logging.getLogger("expresso.services.order_events")
+
+ORDER_EVENT = 'order_event'
+ORDER_STREAM_RESET = 'order_stream_reset'
+ORDER_EVENTS_ROOM = 'orders'
+REPLAY_EVENTS = 1000        # Recent events kept for since_seq replay
+LISTEN_POLL_INTERVAL = 0.2  # Seconds between checks of the LISTEN connection
+
+# Orders a barista queue or display screen shows
+LIVE_ORDERS_QUERY = f'''
+    SELECT {order_event_json('o')}
+    FROM orders o
+    WHERE o.status IN ('pending', 'in-progress')
+       OR (o.status = 'completed' AND o.picked_up_at IS NULL)
+    ORDER BY o.queue_priority, o.created_at
+'''
+
+
+class OrderEventStream:
+    """Sequence-numbered order events with a short replay buffer"""
+
+    def __init__(self, replay_events=REPLAY_EVENTS):
+        """
+        Initialize the stream
+
+        Args:
+            replay_events: Number of recent events kept for replay
+        """
+        self.stream_id = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._events = deque(maxlen=replay_events)
+        self._socketio = None
+        self._subscribers = []
+        self._listening = False
+        self._started = False
+
+        self._metrics = {
+            'events': 0,
+            'snapshots': 0,
+            'replays': 0,
+            'errors': 0
+        }
+
+    @property
+    def seq(self):
+        """Sequence number of the last event published"""
+        return self._seq
+
+    @property
+    def listening(self):
+        """True while events are being heard from the database"""
+        return self._listening
+
+    def subscribe(self, callback):
+        """
+        Call back with every event published, after it is emitted
+
+        Args:
+            callback: Callable taking the event dict; must not block
+        """
+        self._subscribers.append(callback)
+
+    def publish(self, event_type, order, previous=None):
+        """
+        Stamp an event with the next sequence number and emit it
+
+        Args:
+            event_type: create, assign, start, complete, pickup, cancel,
+                requeue, update or remove
+            order: Order fields (ORDER_EVENT_FIELDS; only id for remove)
+            previous: Optional status and station_id before the change
+
+        Returns:
+            The event as emitted
+        """
+        with self._lock:
+            self._seq += 1
+            event = {
+                'stream': self.stream_id,
+                'seq': self._seq,
+                'type': event_type,
+                'order': order,
+                'previous': previous,
+                'timestamp': datetime.utcnow().isoformat()
+            }
+            self._events.append(event)
+            self._metrics['events'] += 1
+
+        if self._socketio is not None:
+            try:
+                self._socketio.emit(ORDER_EVENT, event, room=ORDER_EVENTS_ROOM)
+            except Exception as e:
+                self._metrics['errors'] += 1
+                logger.error(f"Error emitting order event {event['seq']}: {str(e)}")
+        for callback in self._subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                self._metrics['errors'] += 1
+                logger.error(f"Error in order event subscriber: {str(e)}")
+        return event
+
+    def events_since(self, seq, stream_id=None):
+        """
+        Events published after seq, for a client that missed some
+
+        Args:
+            seq: Last sequence number the client applied
+            stream_id: Stream the client's seq came from
+
+        Returns:
+            List of events, or None if they are no longer all buffered
+            (the client needs a snapshot instead)
+        """
+        with self._lock:
+            if stream_id not in (None, self.stream_id) or seq > self._seq:
+                return None
+            if seq == self._seq:
+                return []
+            if not self._events or self._events[0]['seq'] > seq + 1:
+                return None
+            self._metrics['replays'] += 1
+            return [event for event in self._events if event['seq'] > seq]
+
+    def snapshot(self, db):
+        """
+        Live orders and the sequence number they are current to
+
+        The seq is read before the query, so any event the snapshot might
+        have missed has a higher seq and is applied on top of it.
+
+        Args:
+            db: Database connection
+
+        Returns:
+            Dictionary with stream, seq, fields and orders
+        """
+        with self._lock:
+            stream_id, seq = self.stream_id, self._seq
+        cursor = db.cursor()
+        cursor.execute(LIVE_ORDERS_QUERY)
+        orders = []
+        for (row,) in cursor.fetchall():
+            orders.append(json.loads(row) if isinstance(row, str) else row)
+        with self._lock:
+            self._metrics['snapshots'] += 1
+        return {
+            'stream': stream_id,
+            'seq': seq,
+            'fields': list(ORDER_EVENT_FIELDS),
+            'orders': orders,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+
+    def start(self, socketio, db_url):
+        """Emit on socketio and start listening for order events
+
+        Args:
+            socketio: The app's SocketIO instance
+            db_url: Database URL for the dedicated LISTEN connection
+        """
+        self._socketio = socketio
+        if self._started:
+            return
+        self._started = True
+        # A SocketIO background task, so the loop runs as a green thread
+        # under eventlet and emits from the server's own event loop
+        socketio.start_background_task(self._listen, socketio, db_url)
+
+    def _listen(self, socketio, db_url):
+        import psycopg2
+
+        connected_before = False
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(db_url)
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {ORDER_EVENTS_CHANNEL}")
+                if connected_before:
+                    self._reset()
+                connected_before = True
+                self._listening = True
+                logger.info("Listening for order events")
+
+                while True:
+                    # Non-blocking read, so the loop never stalls the event loop
+                    conn.poll()
+                    while conn.notifies:
+                        self._dispatch(conn.notifies.pop(0).payload)
+                    socketio.sleep(LISTEN_POLL_INTERVAL)
+            except Exception as e:
+                self._listening = False
+                logger.warning(f"Order event listener disconnected: {str(e)}")
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            socketio.sleep(5)
+
+    def _reset(self):
+        """Start a new stream after events may have been missed while disconnected"""
+        with self._lock:
+            self.stream_id = uuid.uuid4().hex[:12]
+            self._events.clear()
+        logger.info(f"Order event stream reset to {self.stream_id}")
+        if self._socketio is not None:
+            self._socketio.emit(ORDER_STREAM_RESET, {'stream': self.stream_id}, room=ORDER_EVENTS_ROOM)
+
+    def _dispatch(self, payload):
+        try:
+            notification = json.loads(payload)
+        except ValueError:
+            self._metrics['errors'] += 1
+            logger.error(f"Malformed order event: {payload[:200]}")
+            return
+        self.publish(notification['type'], notification['order'], notification.get('previous'))
+
+    def get_metrics(self):
+        """Snapshot of order event stream metrics"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['seq'] = self._seq
+            metrics['buffered'] = len(self._events)
+        metrics['stream'] = self.stream_id
+        metrics['listening'] = self._listening
+        return metrics
+
+
+_order_event_stream = OrderEventStream()
+
+
+def get_order_event_stream():
+    """Process-wide order event stream shared by the socket handlers"""
+    return _order_event_stream
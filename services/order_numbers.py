@@ -0,0 +1,163 @@
+"""
+Collision-free order numbers from a block-allocated database sequence
+
+Each worker takes a block of ORDER_NUMBER_BLOCK numbers with one nextval on
+order_number_seq (schema migration 6) and hands them out from memory, so
+numbers are unique across workers and restarts without a retry on the
+orders UNIQUE constraint, and a burst of orders costs one round trip per
+block.
+
+Numbers are written as six Crockford base32 characters (digits and capitals
+without I, L, O or U, so they read back unambiguously over SMS). Codes are
+all the same length, so they sort as strings in allocation order. Within a
+worker that is creation order; across workers it is creation order to
+within one block.
+"""
+import logging
+import threading
+
+from utils.database import ORDER_NUMBER_BLOCK
+
+logger = logging.getLogger("expresso.services.order_numbers")
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+CODE_LENGTH = 6
+
+
+def encode_order_number(value):
+    """
+    Base32 code for an order_number_seq value
+
+    Args:
+        value: Sequence value (32^5 <= value < 32^6)
+
+    Returns:
+        Six-character order number
+    """
+    chars = []
+    for _ in range(CODE_LENGTH):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    if value:
+        raise ValueError("Order number sequence exhausted")
+    return ''.join(reversed(chars))
+
+
+def decode_order_number(code):
+    """
+    Sequence value of an order number (case-insensitive)
+
+    Args:
+        code: Six-character order number
+
+    Returns:
+        Integer sequence value
+
+    Raises:
+        ValueError: If the code is not a generated order number
+    """
+    code = code.strip().upper()
+    if len(code) != CODE_LENGTH:
+        raise ValueError(f"Order number must be {CODE_LENGTH} characters: {code!r}")
+    value = 0
+    for char in code:
+        digit = ALPHABET.find(char)
+        if digit < 0:
+            raise ValueError(f"Not an order number character: {char!r}")
+        value = value * 32 + digit
+    return value
+
+
+class OrderNumberAllocator:
+    """Hands out order numbers from sequence blocks reserved by this process"""
+
+    def __init__(self, get_connection=None, release_connection=None, block_size=ORDER_NUMBER_BLOCK):
+        """
+        Initialize the allocator
+
+        Args:
+            get_connection: Callable returning a database connection
+                (defaults to the shared pool)
+            release_connection: Callable returning a connection to the pool
+            block_size: Numbers per sequence value; must match the
+                sequence's INCREMENT BY
+        """
+        self._get_connection = get_connection
+        self._release_connection = release_connection
+        self.block_size = block_size
+
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0   # Block exhausted when _next reaches _end
+
+        self._metrics = {
+            'issued': 0,
+            'blocks': 0,
+            'errors': 0
+        }
+
+    def _connect(self):
+        if self._get_connection is None:
+            from utils.database import get_db_connection, close_connection
+            self._get_connection = get_db_connection
+            self._release_connection = close_connection
+        return self._get_connection()
+
+    def _reserve_block(self):
+        """Reserve the next block; runs on its own connection so it never
+        joins (or is rolled back with) the caller's transaction"""
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT nextval('order_number_seq')")
+            row = cursor.fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._release_connection(conn)
+        start = row['nextval'] if isinstance(row, dict) else row[0]
+        self._metrics['blocks'] += 1
+        return start
+
+    def next(self):
+        """
+        Allocate an order number
+
+        Returns:
+            Six-character order number, unique across workers
+        """
+        with self._lock:
+            if self._next >= self._end:
+                try:
+                    self._next = self._reserve_block()
+                except Exception as e:
+                    self._metrics['errors'] += 1
+                    logger.error(f"Error reserving order numbers: {str(e)}")
+                    raise
+                self._end = self._next + self.block_size
+            value = self._next
+            self._next += 1
+            self._metrics['issued'] += 1
+        return encode_order_number(value)
+
+    def get_metrics(self):
+        """Snapshot of allocator metrics"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['remaining_in_block'] = self._end - self._next
+        return metrics
+
+
+_order_numbers = OrderNumberAllocator()
+
+
+def get_order_number_allocator():
+    """Process-wide order number allocator"""
+    return _order_numbers
+
+
+def next_order_number():
+    """Allocate an order number from the process-wide allocator"""
+    return _order_numbers.next()
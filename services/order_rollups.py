@@ -0,0 +1,113 @@
+"""
+Order statistics read from the hourly order_rollups table
+
+The table is kept current by a trigger on orders (see ORDER_ROLLUPS_DDL in
+utils/database.py), so every status transition, wherever it is written,
+moves one count from the old row to the new one. Statistics for a date range
+cost one small aggregate per hour in range, however many orders there are.
+"""
+import logging
+
+from utils.database import ORDER_ROLLUPS_BACKFILL
+
+logger = logging.getLogger("expresso.services.order_rollups")
+
+
+def rebuild_order_rollups(db):
+    """
+    Recompute order_rollups from the orders table
+
+    Args:
+        db: Database connection
+
+    Returns:
+        Number of rollup rows written
+    """
+    cursor = db.cursor()
+    try:
+        for statement in ORDER_ROLLUPS_BACKFILL:
+            cursor.execute(statement)
+        rows = cursor.rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    logger.info(f"Rebuilt order rollups: {rows} rows")
+    return rows
+
+
+def get_order_statistics(db, start, end):
+    """
+    Order counts for orders created in [start, end)
+
+    Args:
+        db: Database connection
+        start: Range start (datetime)
+        end: Range end (datetime), exclusive
+
+    Returns:
+        Dictionary with by_status, by_day, by_coffee_type, by_milk_type and
+        by_hour counts, shaped like the /orders/statistics response
+    """
+    cursor = db.cursor()
+    cursor.execute('''
+        SELECT status, date_trunc('day', hour) AS day, EXTRACT(HOUR FROM hour) AS hour_of_day,
+               coffee_type, milk_type, SUM(order_count) AS count
+        FROM order_rollups
+        WHERE hour >= date_trunc('hour', %s::timestamp) AND hour < %s
+        GROUP BY status, day, hour_of_day, coffee_type, milk_type
+        HAVING SUM(order_count) > 0
+    ''', (start, end))
+
+    by_status, by_day, by_coffee_type, by_milk_type, by_hour = {}, {}, {}, {}, {}
+    for status, day, hour_of_day, coffee_type, milk_type, count in cursor.fetchall():
+        count = int(count)
+        day = day.strftime('%Y-%m-%d')
+        hour_of_day = int(hour_of_day)
+        by_status[status] = by_status.get(status, 0) + count
+        by_day[day] = by_day.get(day, 0) + count
+        by_hour[hour_of_day] = by_hour.get(hour_of_day, 0) + count
+        if coffee_type:
+            by_coffee_type[coffee_type] = by_coffee_type.get(coffee_type, 0) + count
+        if milk_type:
+            by_milk_type[milk_type] = by_milk_type.get(milk_type, 0) + count
+
+    return {
+        'by_status': by_status,
+        'by_day': dict(sorted(by_day.items())),
+        'by_coffee_type': dict(sorted(by_coffee_type.items(), key=lambda item: item[1], reverse=True)),
+        'by_milk_type': dict(sorted(by_milk_type.items(), key=lambda item: item[1], reverse=True)),
+        'by_hour': dict(sorted(by_hour.items()))
+    }
+
+
+def get_order_totals(db):
+    """
+    All-time order counts by status and average completion time
+
+    Args:
+        db: Database connection
+
+    Returns:
+        Dictionary with total_orders, by_status and avg_completion_time
+        (seconds, or None when no order has one)
+    """
+    cursor = db.cursor()
+    cursor.execute('''
+        SELECT status, SUM(order_count), SUM(completion_time_total), SUM(completion_time_count)
+        FROM order_rollups
+        GROUP BY status
+    ''')
+
+    by_status = {}
+    completion_total = completion_count = 0
+    for status, count, status_completion_total, status_completion_count in cursor.fetchall():
+        by_status[status] = int(count or 0)
+        completion_total += int(status_completion_total or 0)
+        completion_count += int(status_completion_count or 0)
+
+    return {
+        'total_orders': sum(by_status.values()),
+        'by_status': by_status,
+        'avg_completion_time': completion_total / completion_count if completion_count else None
+    }
@@ -0,0 +1,95 @@
+"""
+Bulk order status transitions with batched notifications
+
+bulk_update_order_status (utils/database.py) moves every order in one
+UPDATE and applies station stats once per station. The resulting ready
+texts are queued with one outbox write, and barista screens get one
+orders_batch_updated event for the whole batch (per-order deltas still come
+from the order event stream).
+"""
+import logging
+from datetime import datetime
+
+from utils.database import bulk_update_order_status
+
+logger = logging.getLogger("expresso.services.order_transitions")
+
+BATCH_ACTIONS = {
+    'start': 'in-progress',
+    'complete': 'completed',
+    'cancel': 'cancelled',
+    'requeue': 'pending'
+}
+
+
+def transition_orders(db, order_numbers, status, editor=None, messaging_service=None, socketio=None,
+                      station_index=None):
+    """
+    Move orders to a status and send the notifications it calls for
+
+    Args:
+        db: Database connection
+        order_numbers: Order numbers to transition
+        status: New status
+        editor: Who made the change
+        messaging_service: MessagingService for ready texts (optional)
+        socketio: SocketIO instance for the batch event (optional)
+        station_index: StationIndex whose cached loads follow the change (optional)
+
+    Returns:
+        Result of bulk_update_order_status, plus notified (texts sent)
+    """
+    result = bulk_update_order_status(db, order_numbers, status, editor)
+    if not result['success'] or not result['transitioned']:
+        result['notified'] = 0
+        return result
+
+    if station_index is not None:
+        for station_id, delta in result['load_deltas'].items():
+            station_index.adjust_load(station_id, delta)
+
+    result['notified'] = dispatch_transition_notifications(
+        result['transitioned'], status, messaging_service, socketio)
+    return result
+
+
+def dispatch_transition_notifications(transitioned, status, messaging_service=None, socketio=None):
+    """
+    Fan out one batch of transitions as a single SMS batch and socket event
+
+    Args:
+        transitioned: Orders as returned by bulk_update_order_status
+        status: Status the orders moved to
+        messaging_service: MessagingService for ready texts (optional)
+        socketio: SocketIO instance for the batch event (optional)
+
+    Returns:
+        Number of texts sent or queued
+    """
+    notified = 0
+    if status == 'completed' and messaging_service:
+        messages = [
+            (order['phone'], messaging_service.format_order_ready_message(
+                order['order_number'], order['station_id'], order['for_friend'], order['coffee_type']))
+            for order in transitioned if order['phone']
+        ]
+        try:
+            notified = sum(1 for sid in messaging_service.send_messages(messages) if sid)
+        except Exception as e:
+            logger.error(f"Error sending ready notifications for {len(messages)} orders: {str(e)}")
+
+    if socketio:
+        try:
+            socketio.emit('orders_batch_updated', {
+                'status': status,
+                'orders': [{
+                    'order_number': order['order_number'],
+                    'station_id': order['station_id'],
+                    'previous_status': order['previous_status']
+                } for order in transitioned],
+                'timestamp': datetime.utcnow().isoformat()
+            }, room='orders')
+        except Exception as e:
+            logger.error(f"Error emitting batch order update: {str(e)}")
+
+    return notified
@@ -0,0 +1,196 @@
+"""
+Sliding-window event counters shared by login and SMS throttling
+
+Each counter key holds a ring of per-minute buckets spanning the counter's
+window plus a running total, so recording an event or reading the count is
+O(1) however many events the key has seen. Buckets that slide out of the
+window are zeroed as the ring advances.
+
+Every key of every counter lives in one LRU-ordered dict capped at
+MAX_KEYS. Each hit drops least-recently-used keys whose window has emptied,
+and a new key evicts the least recently used one if still over the cap, so
+a spike of distinct usernames or phone numbers costs bounded memory and is
+released once its windows pass.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("expresso.services.rate_counters")
+
+BUCKET_SECONDS = 60
+MAX_KEYS = 20000   # Across all counters
+
+
+class _Window:
+    """Per-minute buckets for one key; minute is the newest bucket's minute"""
+    __slots__ = ('minute', 'total', 'buckets')
+
+    def __init__(self, minute, size):
+        self.minute = minute
+        self.total = 0
+        self.buckets = [0] * size
+
+    def advance(self, minute):
+        """Zero buckets for minutes that have left the window"""
+        gap = minute - self.minute
+        if gap <= 0:
+            return
+        size = len(self.buckets)
+        if gap >= size:
+            self.buckets = [0] * size
+            self.total = 0
+        else:
+            for passed in range(self.minute + 1, minute + 1):
+                index = passed % size
+                self.total -= self.buckets[index]
+                self.buckets[index] = 0
+        self.minute = minute
+
+
+class SlidingWindowCounter:
+    """Handle for one named counter in the shared engine"""
+
+    def __init__(self, engine, name, window_minutes):
+        self._engine = engine
+        self.name = name
+        self.window_minutes = window_minutes
+
+    def hit(self, key, amount=1):
+        """
+        Record events for a key
+
+        Args:
+            key: What is being counted (username, phone number, address)
+            amount: Events to add
+
+        Returns:
+            Events for the key within the window, these included
+        """
+        return self._engine._hit(self.name, key, self.window_minutes, amount)
+
+    def count(self, key):
+        """Events for a key within the window (0 if unseen or evicted)"""
+        return self._engine._count(self.name, key)
+
+    def reset(self, key):
+        """Forget a key's events"""
+        self._engine._reset(self.name, key)
+
+    def reset_prefix(self, prefix):
+        """Forget the events of every key starting with prefix; O(keys)"""
+        self._engine._reset_prefix(self.name, prefix)
+
+
+class SlidingWindowCounters:
+    """Engine holding every counter's keys under one global key cap"""
+
+    def __init__(self, max_keys=MAX_KEYS, clock=time.time):
+        """
+        Initialize the engine
+
+        Args:
+            max_keys: Most keys kept across all counters
+            clock: Seconds source; tests and benchmarks can pass a fake one
+        """
+        self.max_keys = max_keys
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._windows = OrderedDict()   # (counter name, key) -> _Window, least recently hit first
+        self._counters = {}
+
+        self._metrics = {
+            'hits': 0,
+            'expired': 0,
+            'evicted': 0
+        }
+
+    def counter(self, name, window_minutes):
+        """
+        Named counter, created on first use
+
+        Args:
+            name: Counter name, unique across the engine
+            window_minutes: Minutes of events each key counts
+
+        Returns:
+            SlidingWindowCounter
+        """
+        with self._lock:
+            counter = self._counters.get(name)
+            if counter is None:
+                counter = self._counters[name] = SlidingWindowCounter(self, name, window_minutes)
+            elif counter.window_minutes != window_minutes:
+                raise ValueError(f"Counter {name} already exists with a {counter.window_minutes} minute window")
+            return counter
+
+    def _minute(self):
+        return int(self._clock() // BUCKET_SECONDS)
+
+    def _expire(self, minute):
+        """Drop keys whose window has emptied from the LRU end"""
+        windows = self._windows
+        while windows:
+            window = next(iter(windows.values()))
+            if minute - window.minute < len(window.buckets):
+                break
+            windows.popitem(last=False)
+            self._metrics['expired'] += 1
+
+    def _hit(self, name, key, window_minutes, amount):
+        minute = self._minute()
+        with self._lock:
+            self._metrics['hits'] += 1
+            self._expire(minute)
+            entry_key = (name, key)
+            window = self._windows.get(entry_key)
+            if window is None:
+                while len(self._windows) >= self.max_keys:
+                    self._windows.popitem(last=False)
+                    self._metrics['evicted'] += 1
+                window = self._windows[entry_key] = _Window(minute, window_minutes)
+            else:
+                window.advance(minute)
+                self._windows.move_to_end(entry_key)
+            window.buckets[minute % window_minutes] += amount
+            window.total += amount
+            return window.total
+
+    def _count(self, name, key):
+        minute = self._minute()
+        with self._lock:
+            window = self._windows.get((name, key))
+            if window is None:
+                return 0
+            window.advance(minute)
+            return window.total
+
+    def _reset(self, name, key):
+        with self._lock:
+            self._windows.pop((name, key), None)
+
+    def _reset_prefix(self, name, prefix):
+        with self._lock:
+            for entry_key in [entry_key for entry_key in self._windows
+                              if entry_key[0] == name and entry_key[1].startswith(prefix)]:
+                del self._windows[entry_key]
+
+    def get_metrics(self):
+        """Snapshot of engine metrics, with live keys per counter"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['keys'] = len(self._windows)
+            keys = dict.fromkeys(self._counters, 0)
+            for name, _ in self._windows:
+                keys[name] += 1
+        metrics['counters'] = keys
+        return metrics
+
+
+_rate_counters = SlidingWindowCounters()
+
+
+def get_rate_counters():
+    """Process-wide sliding-window counters"""
+    return _rate_counters
@@ -0,0 +1,326 @@
+"""
+Compiled weekly schedule timeline for break and shift lookups
+"""
+import bisect
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger("expresso.services.schedule_timeline")
+
+# Safety net for schedule rows written outside the schedule routes
+SCHEDULE_TIMELINE_MAX_AGE = 300
+
+# station_schedule time columns and the minute-of-day keys they compile to
+TIME_FIELDS = {
+    'start_time': 'start_minute',
+    'end_time': 'end_minute',
+    'break_start': 'break_start_minute',
+    'break_end': 'break_end_minute'
+}
+
+
+def to_minute(value):
+    """Convert a TIME column or "HH:MM[:SS]" string to minute of day
+
+    Args:
+        value: datetime.time, datetime or string
+
+    Returns:
+        int minute of day, or None if the value is empty or unparseable
+    """
+    if value is None or value == '':
+        return None
+    if hasattr(value, 'hour') and hasattr(value, 'minute'):
+        return value.hour * 60 + value.minute
+    try:
+        hour, minute = str(value).split(':')[:2]
+        return int(hour) * 60 + int(minute)
+    except (ValueError, TypeError):
+        logger.warning(f"Ignoring unparseable schedule time: {value!r}")
+        return None
+
+
+def format_minute(minute):
+    """Format a minute of day as "HH:MM" """
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def _display_time(minute):
+    """Format a minute of day for display, e.g. "8:30 AM" """
+    hour = minute // 60
+    suffix = 'AM' if hour < 12 else 'PM'
+    return f"{(hour % 12) or 12}:{minute % 60:02d} {suffix}"
+
+
+class DayTimeline:
+    """Sorted minute-of-day intervals for one weekday
+
+    Event breaks and station opening segments are kept sorted by start minute
+    with a running maximum of end minutes, so "what covers minute m" is a
+    bisect plus a short backwards walk and "what starts next" is a bisect.
+    """
+
+    def __init__(self, breaks=None, shifts=None):
+        # Event breaks: (start, end, info) with closed [start, end] intervals,
+        # matching the inclusive comparison the assignment code always used
+        self.breaks = sorted(breaks or [], key=lambda b: (b[0], b[1]))
+        self.break_starts = [b[0] for b in self.breaks]
+        self.break_max_end = self._running_max(b[1] for b in self.breaks)
+
+        # Station shifts as stored in station_schedule, for display
+        self.shifts = sorted(shifts or [], key=lambda s: (s['start_minute'], s['station_id']))
+
+        # Half-open opening segments [start, end) per station, with any break
+        # cut out of the shift
+        segments = []
+        for shift in self.shifts:
+            start, end = shift['start_minute'], shift['end_minute'] + 1
+            break_start, break_end = shift['break_start_minute'], shift['break_end_minute']
+            if break_start is not None and break_end is not None and start <= break_start < break_end < end:
+                segments.append((start, break_start, shift['station_id']))
+                segments.append((break_end, end, shift['station_id']))
+            else:
+                segments.append((start, end, shift['station_id']))
+        self.segments = sorted(segments)
+        self.segment_starts = [s[0] for s in self.segments]
+        self.segment_max_end = self._running_max(s[1] for s in self.segments)
+        self.shift_starts = sorted(s['start_minute'] for s in self.shifts)
+
+    @staticmethod
+    def _running_max(values):
+        """Running maximum, used to stop backwards walks early"""
+        result = []
+        current = -1
+        for value in values:
+            current = max(current, value)
+            result.append(current)
+        return result
+
+    def current_break(self, minute):
+        """Event break covering the given minute, or None"""
+        i = bisect.bisect_right(self.break_starts, minute) - 1
+        while i >= 0 and self.break_max_end[i] >= minute:
+            if self.breaks[i][1] >= minute:
+                return self.breaks[i][2]
+            i -= 1
+        return None
+
+    def next_break(self, minute):
+        """First event break starting strictly after the given minute, or None"""
+        i = bisect.bisect_right(self.break_starts, minute)
+        return self.breaks[i][2] if i < len(self.breaks) else None
+
+    def open_stations(self, minute):
+        """IDs of stations whose shift covers the minute and who are not on break"""
+        stations = []
+        i = bisect.bisect_right(self.segment_starts, minute) - 1
+        while i >= 0 and self.segment_max_end[i] > minute:
+            start, end, station_id = self.segments[i]
+            if end > minute and station_id not in stations:
+                stations.append(station_id)
+            i -= 1
+        return stations
+
+    def next_open_minute(self, minute, station_id=None):
+        """Start of the first opening segment after the given minute, or None"""
+        i = bisect.bisect_right(self.segment_starts, minute)
+        for start, _, segment_station in self.segments[i:]:
+            if station_id is None or segment_station == station_id:
+                return start
+        return None
+
+    def has_shifts(self, station_id=None):
+        """Whether any (or the given) station has a shift on this day"""
+        if station_id is None:
+            return bool(self.shifts)
+        return any(shift['station_id'] == station_id for shift in self.shifts)
+
+    def next_shift_start(self, minute=None):
+        """First shift start after the given minute (or the first of the day)"""
+        if minute is None:
+            return self.shift_starts[0] if self.shift_starts else None
+        i = bisect.bisect_right(self.shift_starts, minute)
+        return self.shift_starts[i] if i < len(self.shift_starts) else None
+
+
+class ScheduleTimeline:
+    """Weekly schedule compiled from event_breaks and station_schedule
+
+    Built once and rebuilt only when the schedule routes change shifts or
+    breaks (they call invalidate()), so per-order lookups never touch the
+    database or re-parse time strings.
+    """
+
+    def __init__(self, max_age=SCHEDULE_TIMELINE_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._days = {day: DayTimeline() for day in range(7)}
+        self._has_shifts = False
+        self._loaded_at = None
+
+    def invalidate(self):
+        """Force a rebuild on the next lookup"""
+        self._loaded_at = None
+        logger.info("Schedule timeline invalidated")
+
+    def is_stale(self):
+        """Whether the timeline needs to be rebuilt before use"""
+        loaded_at = self._loaded_at
+        return loaded_at is None or (time.monotonic() - loaded_at) > self.max_age
+
+    def load(self, db):
+        """Rebuild the timeline from the database
+
+        Reads on the caller's connection, so schedule changes the caller has
+        just written are included. Each read runs in a savepoint: a missing
+        table only undoes that read, never the caller's transaction.
+
+        Args:
+            db: Database connection
+        """
+        breaks_by_day = {day: [] for day in range(7)}
+        shifts_by_day = {day: [] for day in range(7)}
+
+        cursor = db.cursor()
+        cursor.execute("SAVEPOINT schedule_timeline_breaks")
+        try:
+            cursor.execute("""
+                SELECT id, title, day_of_week, start_time, end_time, stations
+                FROM event_breaks
+            """)
+            for break_id, title, day, start_value, end_value, stations in cursor.fetchall():
+                start, end = to_minute(start_value), to_minute(end_value)
+                if start is None or end is None or day not in breaks_by_day:
+                    continue
+                if isinstance(stations, str):
+                    try:
+                        stations = json.loads(stations)
+                    except json.JSONDecodeError:
+                        stations = []
+                breaks_by_day[day].append((start, end, {
+                    'id': break_id,
+                    'title': title,
+                    'start': (start // 60, start % 60),
+                    'end': (end // 60, end % 60),
+                    'stations': stations or []
+                }))
+            cursor.execute("RELEASE SAVEPOINT schedule_timeline_breaks")
+        except Exception as e:
+            logger.warning(f"Could not load event breaks: {str(e)}")
+            cursor.execute("ROLLBACK TO SAVEPOINT schedule_timeline_breaks")
+
+        cursor = db.cursor()
+        cursor.execute("SAVEPOINT schedule_timeline_shifts")
+        try:
+            cursor.execute("""
+                SELECT s.id, s.station_id, s.day_of_week, s.start_time, s.end_time,
+                       s.break_start, s.break_end, s.notes, st.barista_name
+                FROM station_schedule s
+                LEFT JOIN station_stats st ON s.station_id = st.station_id
+            """)
+            for row in cursor.fetchall():
+                shift_id, station_id, day, start_value, end_value, break_start, break_end, notes, barista = row
+                start, end = to_minute(start_value), to_minute(end_value)
+                if start is None or end is None or day not in shifts_by_day:
+                    continue
+                shift = {
+                    'id': shift_id,
+                    'station_id': station_id,
+                    'day_of_week': day,
+                    'notes': notes,
+                    'barista_name': barista,
+                    'start_minute': start,
+                    'end_minute': end,
+                    'break_start_minute': to_minute(break_start),
+                    'break_end_minute': to_minute(break_end)
+                }
+                for field, minute_key in TIME_FIELDS.items():
+                    minute = shift[minute_key]
+                    shift[field] = format_minute(minute) if minute is not None else None
+                    if minute is not None:
+                        shift[f"{field}_formatted"] = _display_time(minute)
+                shifts_by_day[day].append(shift)
+            cursor.execute("RELEASE SAVEPOINT schedule_timeline_shifts")
+        except Exception as e:
+            logger.warning(f"Could not load station schedule: {str(e)}")
+            cursor.execute("ROLLBACK TO SAVEPOINT schedule_timeline_shifts")
+
+        days = {day: DayTimeline(breaks_by_day[day], shifts_by_day[day]) for day in range(7)}
+
+        with self._lock:
+            self._days = days
+            self._has_shifts = any(shifts_by_day[day] for day in range(7))
+            self._loaded_at = time.monotonic()
+
+        logger.debug("Schedule timeline rebuilt")
+
+    def ensure_loaded(self, db):
+        """Rebuild if invalidated or older than max_age"""
+        if self.is_stale():
+            self.load(db)
+
+    def day(self, db, day_of_week):
+        """DayTimeline for a weekday (0=Monday, 6=Sunday)"""
+        self.ensure_loaded(db)
+        return self._days[day_of_week]
+
+    def has_shifts(self, db):
+        """Whether any station shifts are scheduled on any day"""
+        self.ensure_loaded(db)
+        return self._has_shifts
+
+    def breaks_at(self, db, when=None):
+        """Current and next event break at a point in time
+
+        Returns:
+            Tuple of (current_break, next_break); each is a dict with id, title,
+            start, end and stations, or None. next_break is only set when no
+            break is in progress.
+        """
+        when = when or datetime.now()
+        day = self.day(db, when.weekday())
+        minute = when.hour * 60 + when.minute
+        current_break = day.current_break(minute)
+        next_break = None if current_break else day.next_break(minute)
+        return current_break, next_break
+
+    def minutes_until_next_break(self, db, when=None):
+        """Minutes from `when` until the next event break starts, or None"""
+        when = when or datetime.now()
+        _, next_break = self.breaks_at(db, when)
+        if not next_break:
+            return None
+        start_hour, start_minute = next_break['start']
+        return (start_hour * 60 + start_minute) - (when.hour * 60 + when.minute)
+
+    def shifts_for_day(self, db, day_of_week):
+        """Shift rows for a weekday, with formatted times, as copies"""
+        return [
+            {key: value for key, value in shift.items() if not key.endswith('_minute')}
+            for shift in self.day(db, day_of_week).shifts
+        ]
+
+    def next_shift_start(self, db, from_time=None):
+        """Datetime of the next shift start within the coming week, or None"""
+        from_time = from_time or datetime.now()
+        for days_ahead in range(7):
+            check_date = from_time.date() + timedelta(days=days_ahead)
+            day = self.day(db, check_date.weekday())
+            if days_ahead == 0:
+                minute = day.next_shift_start(from_time.hour * 60 + from_time.minute)
+            else:
+                minute = day.next_shift_start()
+            if minute is not None:
+                return datetime.combine(check_date, datetime.min.time()) + timedelta(minutes=minute)
+        return None
+
+
+_schedule_timeline = ScheduleTimeline()
+
+
+def get_schedule_timeline():
+    """Process-wide schedule timeline shared by assignment, models and routes"""
+    return _schedule_timeline
@@ -0,0 +1,346 @@
+"""
+Process-wide settings cache kept coherent across workers
+
+All settings rows are loaded in one query and served from memory. A trigger
+on the settings table bumps a single-row version stamp and sends a
+settings_changed notification on every write, including writes made with
+raw SQL elsewhere; migration 11 in utils/database.py installs it. Each
+worker reloads when the stamp moves, either as soon as the LISTEN thread
+hears the notification or at the next version poll.
+"""
+import json
+import logging
+import select
+import threading
+import time
+
+logger = logging.getLogger("expresso.services.settings_service")
+
+SETTINGS_POLL_INTERVAL = 5.0   # Seconds between version stamp checks
+
+TRUE_VALUES = ('true', 'yes', '1', 't', 'y', 'on')
+
+
+class SettingsService:
+    """Settings served from memory with version-stamped invalidation"""
+
+    def __init__(self, get_connection=None, release_connection=None,
+                 poll_interval=SETTINGS_POLL_INTERVAL):
+        """
+        Initialize the service
+
+        Args:
+            get_connection: Callable returning a database connection
+                (defaults to the shared pool)
+            release_connection: Callable returning a connection to the pool
+            poll_interval: Seconds between version stamp checks
+        """
+        self._get_connection = get_connection
+        self._release_connection = release_connection
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._values = {}
+        self._version = None
+        self._loaded = False     # Values have been loaded at least once
+        self._stale = True       # Reload before the next lookup
+        self._checked_at = None
+
+        self._listener = None
+        self._listening = False
+
+        self._metrics = {
+            'reloads': 0,
+            'version_checks': 0,
+            'notifications': 0,
+            'writes': 0,
+            'errors': 0
+        }
+
+    def _connect(self):
+        if self._get_connection is None:
+            from utils.database import get_db_connection, close_connection
+            self._get_connection = get_db_connection
+            self._release_connection = close_connection
+        return self._get_connection()
+
+    def _release(self, conn):
+        self._release_connection(conn)
+
+    def reload(self):
+        """Load every setting and the current version stamp in one round trip"""
+        try:
+            conn = self._connect()
+        except Exception as e:
+            logger.error(f"Error loading settings: {str(e)}")
+            self._stale = False
+            self._checked_at = time.monotonic()
+            return False
+        try:
+            version = self._read_version(conn)
+            cursor = conn.cursor()
+            cursor.execute("SELECT key, value FROM settings")
+            values = {row[0]: row[1] for row in cursor.fetchall()}
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            with self._lock:
+                self._metrics['errors'] += 1
+                # Keep serving the values we have; retry after the next poll interval
+                self._stale = False
+                self._checked_at = time.monotonic()
+            logger.error(f"Error loading settings: {str(e)}")
+            return False
+        finally:
+            self._release(conn)
+
+        with self._lock:
+            self._values = values
+            self._version = version
+            self._loaded = True
+            self._stale = False
+            self._checked_at = time.monotonic()
+            self._metrics['reloads'] += 1
+
+        logger.debug(f"Loaded {len(values)} settings at version {version}")
+        return True
+
+    # Bulk preload at startup is just the first reload
+    preload = reload
+
+    @staticmethod
+    def _read_version(conn):
+        """Current version stamp, or None if the stamp table is missing
+
+        Runs inside a savepoint so a missing table only undoes this read,
+        never a write the caller has made earlier in the same transaction.
+        """
+        cursor = conn.cursor()
+        cursor.execute("SAVEPOINT settings_version_read")
+        try:
+            cursor.execute("SELECT version FROM settings_version WHERE id = 1")
+            row = cursor.fetchone()
+        except Exception:
+            cursor.execute("ROLLBACK TO SAVEPOINT settings_version_read")
+            return None
+        cursor.execute("RELEASE SAVEPOINT settings_version_read")
+        return row[0] if row else None
+
+    def invalidate(self):
+        """Reload on the next lookup"""
+        self._stale = True
+
+    def _refresh_if_needed(self):
+        """Reload if invalidated, or if the version stamp moved since the last poll"""
+        if self._stale:
+            self.reload()
+            return
+
+        checked_at = self._checked_at
+        # While the LISTEN thread is up, notifications drive reloads and the
+        # poll is only a slow safety net
+        interval = self.poll_interval * (12 if self._listening else 1)
+        if checked_at is not None and time.monotonic() - checked_at <= interval:
+            return
+
+        try:
+            conn = self._connect()
+        except Exception as e:
+            logger.error(f"Error checking settings version: {str(e)}")
+            self._checked_at = time.monotonic()
+            return
+        try:
+            version = self._read_version(conn)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error checking settings version: {str(e)}")
+            self._checked_at = time.monotonic()
+            return
+        finally:
+            self._release(conn)
+
+        with self._lock:
+            self._metrics['version_checks'] += 1
+            self._checked_at = time.monotonic()
+            # No stamp table means no way to detect changes; reload each interval
+            changed = version is None or version != self._version or not self._loaded
+
+        if changed:
+            self.reload()
+
+    def get(self, key, default=None):
+        """
+        Get a setting as a string
+
+        Args:
+            key: Setting key
+            default: Returned when the setting is missing or empty
+
+        Returns:
+            Setting value or default
+        """
+        self._refresh_if_needed()
+        value = self._values.get(key)
+        return value if value else default
+
+    def get_bool(self, key, default=False):
+        """Get a setting as a boolean ("true", "yes", "1", "t", "y" and "on" are true)"""
+        value = self.get(key)
+        if value is None:
+            return default
+        return str(value).strip().lower() in TRUE_VALUES
+
+    def get_int(self, key, default=None):
+        """Get a setting as an int, or default if missing or not a number"""
+        value = self.get(key)
+        try:
+            return int(value) if value is not None else default
+        except (TypeError, ValueError):
+            logger.warning(f"Setting {key} is not an integer: {value!r}")
+            return default
+
+    def get_float(self, key, default=None):
+        """Get a setting as a float, or default if missing or not a number"""
+        value = self.get(key)
+        try:
+            return float(value) if value is not None else default
+        except (TypeError, ValueError):
+            logger.warning(f"Setting {key} is not a number: {value!r}")
+            return default
+
+    def get_json(self, key, default=None):
+        """Get a JSON-encoded setting, or default if missing or invalid"""
+        value = self.get(key)
+        if value is None:
+            return default
+        try:
+            return json.loads(value)
+        except (TypeError, ValueError):
+            logger.warning(f"Setting {key} is not valid JSON")
+            return default
+
+    def all(self):
+        """Copy of every setting"""
+        self._refresh_if_needed()
+        return dict(self._values)
+
+    def set(self, key, value, description=None, updated_by=None):
+        """
+        Write a setting through to the database and the local cache
+
+        Args:
+            key: Setting key
+            value: Setting value
+            description: Optional description
+            updated_by: Optional username of updater
+
+        Returns:
+            True if successful, False otherwise
+        """
+        # Older settings tables have no updated_by column, so optional
+        # columns are only written when given
+        columns = {'key': key, 'value': value}
+        if description:
+            columns['description'] = description
+        if updated_by:
+            columns['updated_by'] = updated_by
+        updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in columns if column != 'key')
+
+        try:
+            conn = self._connect()
+        except Exception as e:
+            logger.error(f"Error saving setting '{key}': {str(e)}")
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                INSERT INTO settings ({', '.join(columns)}, updated_at)
+                VALUES ({', '.join(['%s'] * len(columns))}, CURRENT_TIMESTAMP)
+                ON CONFLICT (key) DO UPDATE SET {updates}, updated_at = EXCLUDED.updated_at
+            """, list(columns.values()))
+            if cursor.rowcount != 1:
+                conn.rollback()
+                logger.error(f"Error saving setting '{key}': no row written")
+                return False
+            version = self._read_version(conn)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error saving setting '{key}': {str(e)}")
+            return False
+        finally:
+            self._release(conn)
+
+        with self._lock:
+            self._values[key] = value
+            self._metrics['writes'] += 1
+            # Another worker may have written in between; only skip the
+            # reload when our write is the only change since the last load
+            if version is not None and self._version is not None and version == self._version + 1:
+                self._version = version
+            else:
+                self._stale = True
+        return True
+
+    def start_listener(self, db_url):
+        """Start a thread that reloads as soon as any worker changes a setting
+
+        Args:
+            db_url: Database URL for the dedicated LISTEN connection
+        """
+        if self._listener is not None:
+            return
+        self._listener = threading.Thread(target=self._listen, args=(db_url,),
+                                          name='settings-listener', daemon=True)
+        self._listener.start()
+
+    def _listen(self, db_url):
+        import psycopg2
+        from utils.database import SETTINGS_CHANGED_CHANNEL
+
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(db_url)
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {SETTINGS_CHANGED_CHANNEL}")
+                self._listening = True
+                logger.info("Listening for settings changes")
+
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        with self._lock:
+                            self._metrics['notifications'] += 1
+                        self._stale = True
+            except Exception as e:
+                self._listening = False
+                logger.warning(f"Settings listener disconnected: {str(e)}")
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(5)
+
+    def get_metrics(self):
+        """Snapshot of settings cache metrics"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['size'] = len(self._values)
+            metrics['version'] = self._version
+        metrics['listening'] = self._listening
+        return metrics
+
+
+_settings_service = SettingsService()
+
+
+def get_settings_service():
+    """Process-wide settings service shared by the ordering system and routes"""
+    return _settings_service
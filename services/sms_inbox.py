@@ -0,0 +1,341 @@
+"""
+Inbound SMS pipeline
+
+The Twilio webhook only validates and stores messages here, then returns an
+empty TwiML response. Worker threads run the ordering state machine, one
+message at a time per phone number, and send replies through the REST API.
+
+Messages are written to the sms_inbox table (migration 12 in
+utils/database.py) before the webhook acks, so a crash or restart never
+loses one Twilio considers delivered. Twilio retries webhooks it considers
+failed; UNIQUE(message_sid) turns a retry into a no-op insert, on every
+worker. A message is written as 'processing' and claimed by the inbox that
+received it; 'queued' rows and 'processing' rows whose claim has not been
+renewed within the lease are taken over with UPDATE ... FOR UPDATE SKIP
+LOCKED, as the outbox does (services/sms_outbox.py).
+"""
+import collections
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+
+logger = logging.getLogger("expresso.services.sms_inbox")
+
+DEFAULT_WORKERS = 4
+DEFAULT_LEASE_SECONDS = 600.0  # Unrenewed claims older than this are taken over
+
+
+class PostgresInboxStore:
+    """Persists inbound messages to the sms_inbox table
+
+    Args:
+        owner: Name recorded in claimed_by for rows this store claims
+            (defaults to host, pid and a random suffix)
+    """
+
+    def __init__(self, get_connection=None, release_connection=None, owner=None):
+        if get_connection is None or release_connection is None:
+            from utils.database import get_db_connection, close_connection
+            get_connection = get_connection or get_db_connection
+            release_connection = release_connection or close_connection
+        self._get_connection = get_connection
+        self._release_connection = release_connection
+        self.owner = owner or f"{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def _execute(self, query, params=None, fetch=False):
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            result = cursor.fetchall() if fetch else None
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._release_connection(conn)
+
+    def insert(self, message):
+        """
+        Persist a new message, claimed by this store
+
+        Args:
+            message: Dict with sid, from, body and sender_name
+
+        Returns:
+            Inbox message ID, or None if the MessageSid is already stored
+        """
+        rows = self._execute("""
+            INSERT INTO sms_inbox (message_sid, from_number, body, sender_name,
+                                   status, claimed_by, claimed_at)
+            VALUES (%s, %s, %s, %s, 'processing', %s, now())
+            ON CONFLICT (message_sid) DO NOTHING
+            RETURNING id
+        """, (message.get('sid') or None, message['from'], message['body'],
+              message.get('sender_name'), self.owner), fetch=True)
+        return rows[0][0] if rows else None
+
+    def mark_processed(self, message_id):
+        self._execute("""
+            UPDATE sms_inbox SET status = 'processed', processed_at = now(), last_error = NULL
+            WHERE id = %s
+        """, (message_id,))
+
+    def mark_failed(self, message_id, error):
+        self._execute("""
+            UPDATE sms_inbox SET status = 'failed', processed_at = now(), last_error = %s
+            WHERE id = %s
+        """, (error, message_id))
+
+    def mark_dropped(self, message_id, reason):
+        self._execute("""
+            UPDATE sms_inbox SET status = 'dropped', processed_at = now(), last_error = %s
+            WHERE id = %s
+        """, (reason, message_id))
+
+    def claim(self, lease_seconds):
+        """
+        Take over unprocessed messages no live inbox owns
+
+        Claims 'queued' rows and 'processing' rows whose claim is older than
+        the lease. Rows another inbox is claiming at the same moment are
+        skipped, so each row goes to exactly one caller.
+
+        Args:
+            lease_seconds: Age after which another inbox's claim has lapsed
+
+        Returns:
+            List of (id, message_sid, from_number, body, sender_name), oldest first
+        """
+        rows = self._execute("""
+            UPDATE sms_inbox
+            SET status = 'processing', claimed_by = %s, claimed_at = now(),
+                attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM sms_inbox
+                WHERE status = 'queued'
+                   OR (status = 'processing' AND claimed_at < now() - make_interval(secs => %s))
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, message_sid, from_number, body, sender_name
+        """, (self.owner, lease_seconds), fetch=True)
+        return sorted(rows)
+
+    def renew(self):
+        """Extend the lease on every message this store still owns"""
+        self._execute("""
+            UPDATE sms_inbox SET claimed_at = now()
+            WHERE claimed_by = %s AND status = 'processing'
+        """, (self.owner,))
+
+
+class SmsInbox:
+    """Per-phone ordered work queue for inbound SMS
+
+    With a store, a message is only queued once its row is committed, and
+    the row's UNIQUE(message_sid) is the dedupe for Twilio's retries.
+    Without one (load testing) messages live in memory only and are not
+    deduplicated.
+    """
+
+    def __init__(self, handler, store=None, workers=DEFAULT_WORKERS, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Initialize the inbox
+
+        Args:
+            handler: Callable taking a message dict (sid, from, body,
+                sender_name) that processes it and sends any reply
+            store: Persistence store (PostgresInboxStore), or None to keep
+                the queue in memory only
+            workers: Number of worker threads
+            lease_seconds: How long a stopped inbox's messages stay claimed
+                before another inbox takes them over
+        """
+        self.handler = handler
+        self.store = store
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+
+        self._lock = threading.Lock()
+        self._queues = {}            # phone -> deque of messages
+        self._active = set()         # phones queued for, or held by, a worker
+        self._ready = queue.Queue()
+        self._threads = []
+        self._running = False
+        self._stopped = threading.Event()
+
+        self._metrics = {
+            'received': 0,
+            'duplicates': 0,
+            'dropped': 0,
+            'recovered': 0,
+            'processed': 0,
+            'errors': 0,
+            'total_process_ms': 0.0,
+            'max_queue_delay_ms': 0.0
+        }
+
+    def start(self):
+        """Claim unprocessed messages and start the worker threads"""
+        if self._running:
+            return
+
+        if self.store is not None:
+            try:
+                self._recover()
+            except Exception as e:
+                logger.error(f"Error recovering SMS inbox messages: {str(e)}")
+
+        self._running = True
+        self._stopped.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"sms-inbox-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.store is not None:
+            thread = threading.Thread(target=self._maintain_claims, name="sms-inbox-lease", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"SMS inbox started with {self.workers} workers")
+
+    def stop(self, timeout=5.0):
+        """Stop the worker threads after their current message; the rest stay claimed until the lease lapses"""
+        self._running = False
+        self._stopped.set()
+        for _ in range(self.workers):
+            self._ready.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _recover(self):
+        """Queue messages whose owner stopped or never claimed them"""
+        recovered = self.store.claim(self.lease_seconds)
+        for message_id, sid, phone, body, sender_name in recovered:
+            self._push({'id': message_id, 'sid': sid, 'from': phone, 'body': body,
+                        'sender_name': sender_name, 'queued_at': time.monotonic()})
+        if recovered:
+            with self._lock:
+                self._metrics['recovered'] += len(recovered)
+            logger.info(f"Recovered {len(recovered)} unprocessed SMS from inbox")
+
+    def _maintain_claims(self):
+        """Renew this inbox's claims and pick up lapsed ones every half lease"""
+        while not self._stopped.wait(self.lease_seconds / 2):
+            try:
+                self.store.renew()
+                self._recover()
+            except Exception as e:
+                logger.error(f"Error renewing SMS inbox claims: {str(e)}")
+
+    def receive(self, message):
+        """
+        Persist an inbound message, claimed by this inbox
+
+        Raises if the message could not be stored, so the webhook can fail
+        and Twilio deliver it again. Pass the message to enqueue() or drop()
+        next; until then it is only recovered once the lease lapses.
+
+        Args:
+            message: Dict with sid, from, body and sender_name
+
+        Returns:
+            False if the message was a duplicate delivery, True otherwise
+        """
+        if self.store is not None:
+            message_id = self.store.insert(message)
+            if message_id is None:
+                with self._lock:
+                    self._metrics['duplicates'] += 1
+                return False
+            message['id'] = message_id
+
+        with self._lock:
+            self._metrics['received'] += 1
+        return True
+
+    def enqueue(self, message):
+        """Queue a received message for processing"""
+        message['queued_at'] = time.monotonic()
+        self._push(message)
+
+    def drop(self, message, reason):
+        """Record a received message as not processed, e.g. throttled"""
+        with self._lock:
+            self._metrics['dropped'] += 1
+        self._persist('mark_dropped', message, reason)
+
+    def _push(self, message):
+        """Append to the number's FIFO and make the number ready if idle"""
+        phone = message['from']
+        with self._lock:
+            self._queues.setdefault(phone, collections.deque()).append(message)
+            if phone in self._active:
+                return
+            self._active.add(phone)
+        self._ready.put(phone)
+
+    def _worker(self):
+        while self._running:
+            phone = self._ready.get()
+            if phone is None:
+                break
+
+            with self._lock:
+                message = self._queues[phone].popleft()
+
+            queue_delay_ms = (time.monotonic() - message['queued_at']) * 1000
+            started = time.perf_counter()
+            try:
+                self.handler(message)
+                outcome = 'processed'
+                self._persist('mark_processed', message)
+            except Exception as e:
+                logger.error(f"Error processing SMS {message.get('sid')} from {phone}: {str(e)}", exc_info=True)
+                outcome = 'errors'
+                self._persist('mark_failed', message, str(e))
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            with self._lock:
+                self._metrics[outcome] += 1
+                self._metrics['total_process_ms'] += elapsed_ms
+                self._metrics['max_queue_delay_ms'] = max(self._metrics['max_queue_delay_ms'], queue_delay_ms)
+
+                # Hand the phone back, or keep it if more messages arrived meanwhile
+                if self._queues[phone]:
+                    requeue = True
+                else:
+                    del self._queues[phone]
+                    self._active.discard(phone)
+                    requeue = False
+
+            if requeue:
+                self._ready.put(phone)
+
+    def _persist(self, method, message, *args):
+        """Record a processing outcome; failures here must not stop the worker"""
+        if self.store is None:
+            return
+        try:
+            getattr(self.store, method)(message['id'], *args)
+        except Exception as e:
+            logger.error(f"Error updating SMS inbox ({method}): {str(e)}")
+
+    def get_metrics(self):
+        """Snapshot of inbox metrics"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['pending'] = sum(len(q) for q in self._queues.values())
+            metrics['active_numbers'] = len(self._active)
+        handled = metrics['processed'] + metrics['errors']
+        metrics['avg_process_ms'] = round(metrics['total_process_ms'] / handled, 3) if handled else 0.0
+        metrics['total_process_ms'] = round(metrics['total_process_ms'], 3)
+        metrics['max_queue_delay_ms'] = round(metrics['max_queue_delay_ms'], 3)
+        metrics['workers'] = self.workers
+        return metrics
@@ -0,0 +1,473 @@
+"""
+Outbound SMS queue
+
+Request handlers enqueue messages and return straight away; a pool of worker
+threads delivers them through a transport (Twilio, or a local fake for load
+testing) with per-number ordering, rate limiting and exponential retry.
+Queued messages are persisted to the sms_outbox table (migration 10 in
+utils/database.py) so a restart resumes delivery instead of dropping them.
+
+Every row in the table is owned by one outbox at a time. A message is
+written as 'sending' and claimed by the outbox that queued it; 'queued' rows
+and 'sending' rows whose claim has not been renewed within the lease are
+taken over with UPDATE ... FOR UPDATE SKIP LOCKED, so workers and restarts
+never deliver the same row twice. A live outbox renews its claims every
+half lease.
+"""
+import collections
+import itertools
+import logging
+import os
+import queue
+import random
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+
+logger = logging.getLogger("expresso.services.sms_outbox")
+
+DEFAULT_WORKERS = 4
+DEFAULT_RATE_LIMIT = 10.0     # Messages per second across all workers
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BASE_DELAY = 2.0
+MAX_RETRY_DELAY = 300.0
+DEFAULT_LEASE_SECONDS = 600.0  # Unrenewed claims older than this are taken over
+
+
+class TwilioTransport:
+    """Delivers messages through a Twilio REST client"""
+
+    def __init__(self, client, from_number):
+        self.client = client
+        self.from_number = from_number
+
+    def send(self, to, body):
+        """Send one message and return its SID; raises on failure"""
+        message = self.client.messages.create(body=body, from_=self.from_number, to=to)
+        return message.sid
+
+
+class FakeTwilioTransport:
+    """Offline stand-in for Twilio used for load testing the outbox
+
+    Args:
+        latency: Seconds each send takes, or a (min, max) range
+        failure_rate: Fraction of sends that raise a retryable error
+    """
+
+    class FakeError(Exception):
+        """Simulated transient Twilio failure"""
+        status = 503
+
+    def __init__(self, latency=0.05, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent = []
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+
+    def send(self, to, body):
+        """Pretend to send a message, recording it in self.sent"""
+        delay = random.uniform(*self.latency) if isinstance(self.latency, tuple) else self.latency
+        if delay:
+            time.sleep(delay)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise self.FakeError("Simulated Twilio 503")
+        sid = f"SMFAKE{next(self._counter):010d}"
+        with self._lock:
+            self.sent.append((to, body, sid, time.monotonic()))
+        return sid
+
+
+class RateLimiter:
+    """Token bucket shared by all outbox workers"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a send is allowed"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class PostgresOutboxStore:
+    """Persists outbox messages to the sms_outbox table
+
+    Args:
+        owner: Name recorded in claimed_by for rows this store claims
+            (defaults to host, pid and a random suffix)
+    """
+
+    def __init__(self, get_connection=None, release_connection=None, owner=None):
+        if get_connection is None or release_connection is None:
+            from utils.database import get_db_connection, close_connection
+            get_connection = get_connection or get_db_connection
+            release_connection = release_connection or close_connection
+        self._get_connection = get_connection
+        self._release_connection = release_connection
+        self.owner = owner or f"{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def _execute(self, query, params=None, fetch=False):
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            result = cursor.fetchall() if fetch else None
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._release_connection(conn)
+
+    def insert(self, to, body):
+        """Persist a new message, claimed by this store, and return its ID"""
+        rows = self._execute("""
+            INSERT INTO sms_outbox (to_number, body, status, claimed_by, claimed_at)
+            VALUES (%s, %s, 'sending', %s, now())
+            RETURNING id
+        """, (to, body, self.owner), fetch=True)
+        return rows[0][0]
+
+    def insert_many(self, messages):
+        """Persist claimed messages in one statement and return their IDs in order"""
+        rows = self._execute("""
+            INSERT INTO sms_outbox (to_number, body, status, claimed_by, claimed_at)
+            SELECT to_number, body, 'sending', %s, now()
+            FROM unnest(%s::text[], %s::text[]) WITH ORDINALITY AS m(to_number, body, position)
+            ORDER BY position
+            RETURNING id
+        """, (self.owner, [to for to, _ in messages], [body for _, body in messages]), fetch=True)
+        return sorted(row[0] for row in rows)
+
+    def mark_sent(self, message_id, message_sid, attempts):
+        self._execute("""
+            UPDATE sms_outbox
+            SET status = 'sent', message_sid = %s, attempts = %s, sent_at = %s, last_error = NULL
+            WHERE id = %s
+        """, (message_sid, attempts, datetime.now(), message_id))
+
+    def mark_retry(self, message_id, attempts, error):
+        self._execute("""
+            UPDATE sms_outbox SET attempts = %s, last_error = %s, claimed_at = now() WHERE id = %s
+        """, (attempts, error, message_id))
+
+    def mark_failed(self, message_id, attempts, error):
+        self._execute("""
+            UPDATE sms_outbox SET status = 'failed', attempts = %s, last_error = %s WHERE id = %s
+        """, (attempts, error, message_id))
+
+    def claim(self, lease_seconds):
+        """
+        Take over undelivered messages no live outbox owns
+
+        Claims 'queued' rows and 'sending' rows whose claim is older than the
+        lease. Rows another outbox is claiming at the same moment are skipped,
+        so each row goes to exactly one caller.
+
+        Args:
+            lease_seconds: Age after which another outbox's claim has lapsed
+
+        Returns:
+            List of (id, to_number, body, attempts), oldest first
+        """
+        rows = self._execute("""
+            UPDATE sms_outbox
+            SET status = 'sending', claimed_by = %s, claimed_at = now()
+            WHERE id IN (
+                SELECT id FROM sms_outbox
+                WHERE status = 'queued'
+                   OR (status = 'sending' AND claimed_at < now() - make_interval(secs => %s))
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, to_number, body, attempts
+        """, (self.owner, lease_seconds), fetch=True)
+        return sorted(rows)
+
+    def renew(self):
+        """Extend the lease on every message this store still owns"""
+        self._execute("""
+            UPDATE sms_outbox SET claimed_at = now()
+            WHERE claimed_by = %s AND status = 'sending'
+        """, (self.owner,))
+
+
+class SmsOutbox:
+    """Asynchronous outbound SMS queue with a worker pool
+
+    Each phone number has its own FIFO, and at most one worker handles a
+    number at a time, so a customer's messages arrive in the order they were
+    queued. Different numbers are delivered in parallel.
+    """
+
+    def __init__(self, transport, store=None, workers=DEFAULT_WORKERS, rate_limit=DEFAULT_RATE_LIMIT,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, retry_base_delay=DEFAULT_RETRY_BASE_DELAY,
+                 lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Initialize the outbox
+
+        Args:
+            transport: Object with send(to, body) -> SID, raising on failure
+            store: Persistence store (PostgresOutboxStore), or None to keep
+                the queue in memory only
+            workers: Number of delivery worker threads
+            rate_limit: Maximum sends per second across all workers (0 = unlimited)
+            max_attempts: Attempts before a message is marked failed
+            retry_base_delay: Seconds before the first retry; doubles each attempt
+            lease_seconds: How long a stopped outbox's messages stay claimed
+                before another outbox takes them over
+        """
+        self.transport = transport
+        self.store = store
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.lease_seconds = lease_seconds
+        self.rate_limiter = RateLimiter(rate_limit)
+
+        self._lock = threading.Lock()
+        self._queues = {}            # phone -> deque of pending messages
+        self._active = set()         # phones queued for, or held by, a worker
+        self._ready = queue.Queue()  # phones with a message ready to send
+        self._threads = []
+        self._running = False
+        self._stopped = threading.Event()
+        self._memory_ids = itertools.count(1)
+
+        self._metrics = {
+            'enqueued': 0,
+            'recovered': 0,
+            'sent': 0,
+            'retries': 0,
+            'failed': 0,
+            'total_send_ms': 0.0,
+            'max_queue_delay_ms': 0.0
+        }
+
+    def start(self):
+        """Claim undelivered messages and start workers"""
+        if self._running:
+            return
+
+        if self.store is not None:
+            try:
+                self._recover()
+            except Exception as e:
+                logger.error(f"Error recovering SMS outbox messages: {str(e)}")
+
+        self._running = True
+        self._stopped.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"sms-outbox-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.store is not None:
+            thread = threading.Thread(target=self._maintain_claims, name="sms-outbox-lease", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"SMS outbox started with {self.workers} workers")
+
+    def stop(self, timeout=5.0):
+        """Stop the workers; undelivered messages stay claimed until the lease lapses"""
+        self._running = False
+        self._stopped.set()
+        for _ in range(self.workers):
+            self._ready.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _recover(self):
+        """Queue messages whose owner stopped or never claimed them"""
+        recovered = self.store.claim(self.lease_seconds)
+        for message_id, to, body, attempts in recovered:
+            self._push({'id': message_id, 'to': to, 'body': body,
+                        'attempts': attempts, 'queued_at': time.monotonic()})
+        if recovered:
+            with self._lock:
+                self._metrics['recovered'] += len(recovered)
+            logger.info(f"Recovered {len(recovered)} undelivered SMS from outbox")
+
+    def _maintain_claims(self):
+        """Renew this outbox's claims and pick up lapsed ones every half lease"""
+        while not self._stopped.wait(self.lease_seconds / 2):
+            try:
+                self.store.renew()
+                self._recover()
+            except Exception as e:
+                logger.error(f"Error renewing SMS outbox claims: {str(e)}")
+
+    def enqueue(self, to, body):
+        """
+        Queue a message for delivery
+
+        Args:
+            to: Recipient phone number
+            body: Message body
+
+        Returns:
+            Outbox message ID
+        """
+        if self.store is not None:
+            message_id = self.store.insert(to, body)
+        else:
+            message_id = next(self._memory_ids)
+
+        self._push({'id': message_id, 'to': to, 'body': body, 'attempts': 0, 'queued_at': time.monotonic()})
+        with self._lock:
+            self._metrics['enqueued'] += 1
+        return message_id
+
+    def enqueue_many(self, messages):
+        """
+        Queue several messages with one write to the store
+
+        Args:
+            messages: List of (to, body) tuples
+
+        Returns:
+            List of outbox message IDs, in the order given
+        """
+        if not messages:
+            return []
+        if self.store is not None:
+            message_ids = self.store.insert_many(messages)
+        else:
+            message_ids = [next(self._memory_ids) for _ in messages]
+
+        queued_at = time.monotonic()
+        for message_id, (to, body) in zip(message_ids, messages):
+            self._push({'id': message_id, 'to': to, 'body': body, 'attempts': 0, 'queued_at': queued_at})
+        with self._lock:
+            self._metrics['enqueued'] += len(messages)
+        return message_ids
+
+    def _push(self, message):
+        """Append to the number's FIFO and make the number ready if idle"""
+        phone = message['to']
+        with self._lock:
+            self._queues.setdefault(phone, collections.deque()).append(message)
+            if phone in self._active:
+                return
+            self._active.add(phone)
+        self._ready.put(phone)
+
+    def _release(self, phone):
+        """Hand the number back: requeue if more messages are waiting"""
+        with self._lock:
+            pending = self._queues.get(phone)
+            if not pending:
+                self._queues.pop(phone, None)
+                self._active.discard(phone)
+                return
+        self._ready.put(phone)
+
+    def _retry_delay(self, attempts):
+        """Exponential backoff with jitter"""
+        delay = min(MAX_RETRY_DELAY, self.retry_base_delay * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    @staticmethod
+    def _is_retryable(error):
+        """Twilio 4xx errors (bad number, opted out) won't succeed on retry"""
+        status = getattr(error, 'status', None)
+        return status is None or status == 429 or status >= 500
+
+    def _worker(self):
+        while self._running:
+            phone = self._ready.get()
+            if phone is None:
+                break
+            try:
+                self._deliver_next(phone)
+            except Exception as e:
+                logger.error(f"SMS outbox worker error for {phone}: {str(e)}")
+                self._release(phone)
+
+    def _deliver_next(self, phone):
+        with self._lock:
+            message = self._queues[phone][0]
+
+        self.rate_limiter.acquire()
+        message['attempts'] += 1
+        started = time.perf_counter()
+        try:
+            message_sid = self.transport.send(message['to'], message['body'])
+        except Exception as e:
+            error = str(e)
+            if self._is_retryable(e) and message['attempts'] < self.max_attempts:
+                delay = self._retry_delay(message['attempts'])
+                logger.warning(f"SMS to {phone} failed (attempt {message['attempts']}), retrying in {delay:.1f}s: {error}")
+                with self._lock:
+                    self._metrics['retries'] += 1
+                self._persist('mark_retry', message['id'], message['attempts'], error)
+                # Keep the message at the head of the FIFO so later ones wait behind it
+                timer = threading.Timer(delay, self._ready.put, (phone,))
+                timer.daemon = True
+                timer.start()
+                return
+
+            logger.error(f"Giving up on SMS {message['id']} to {phone} after {message['attempts']} attempts: {error}")
+            with self._lock:
+                self._queues[phone].popleft()
+                self._metrics['failed'] += 1
+            self._persist('mark_failed', message['id'], message['attempts'], error)
+            self._release(phone)
+            return
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        queue_delay_ms = (time.monotonic() - message['queued_at']) * 1000
+        with self._lock:
+            self._queues[phone].popleft()
+            self._metrics['sent'] += 1
+            self._metrics['total_send_ms'] += elapsed_ms
+            self._metrics['max_queue_delay_ms'] = max(self._metrics['max_queue_delay_ms'], queue_delay_ms)
+        self._persist('mark_sent', message['id'], message_sid, message['attempts'])
+        logger.info(f"Sent SMS to {phone}")
+        self._release(phone)
+
+    def _persist(self, method, *args):
+        """Record a delivery outcome; failures here must not stop delivery"""
+        if self.store is None:
+            return
+        try:
+            getattr(self.store, method)(*args)
+        except Exception as e:
+            logger.error(f"Error updating SMS outbox ({method}): {str(e)}")
+
+    def pending_count(self):
+        """Messages queued in memory and not yet delivered or failed"""
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def get_metrics(self):
+        """Snapshot of outbox metrics"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['pending'] = sum(len(q) for q in self._queues.values())
+            metrics['active_numbers'] = len(self._active)
+        metrics['avg_send_ms'] = round(metrics['total_send_ms'] / metrics['sent'], 3) if metrics['sent'] else 0.0
+        metrics['total_send_ms'] = round(metrics['total_send_ms'], 3)
+        metrics['max_queue_delay_ms'] = round(metrics['max_queue_delay_ms'], 3)
+        metrics['workers'] = self.workers
+        metrics['rate_limit'] = self.rate_limiter.rate
+        return metrics
@@ -0,0 +1,170 @@
+"""
+In-memory index of station capabilities and load used for order assignment
+"""
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger("expresso.services.station_index")
+
+# Minimal defaults for stations the organizer hasn't configured yet
+DEFAULT_CAPABILITIES = {
+    'milk_types': ['full cream', 'skim'],
+    'coffee_types': ['espresso', 'latte', 'cappuccino'],
+    'capacity': 10,
+    'high_volume': False,
+    'vip_service': False
+}
+
+ALT_MILKS = ['soy', 'almond', 'oat', 'lactose free', 'coconut']
+
+# Reload from station_stats at least this often so loads changed outside
+# CoffeeOrderSystem (direct SQL in routes, other workers) are picked up
+STATION_INDEX_MAX_AGE = 60
+
+
+class StationIndex:
+    """Cached view of active stations keyed by milk, coffee type and VIP service
+
+    Station capabilities only change through the station management endpoints,
+    which call invalidate(), so assignment can be decided in process without
+    re-reading and re-parsing station_stats for every order. Load counters are
+    adjusted in memory as orders are assigned and finished.
+    """
+
+    def __init__(self, max_age=STATION_INDEX_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._stations = {}
+        self._by_milk = {}
+        self._by_coffee = {}
+        self._vip = set()
+        self._loaded_at = None
+
+    def invalidate(self):
+        """Drop the cached stations so the next lookup reloads them"""
+        with self._lock:
+            self._loaded_at = None
+        logger.info("Station index invalidated")
+
+    def is_stale(self):
+        """Whether the index needs to be reloaded before use"""
+        loaded_at = self._loaded_at
+        return loaded_at is None or (time.monotonic() - loaded_at) > self.max_age
+
+    def load(self, db):
+        """Rebuild the index from station_stats
+
+        Args:
+            db: Database connection
+        """
+        cursor = db.cursor()
+        cursor.execute("""
+            SELECT station_id, COALESCE(current_load, 0),
+                   COALESCE(equipment_notes, '{}') as capabilities,
+                   COALESCE(status, 'active') as current_status
+            FROM station_stats
+            WHERE status IN ('active', 'open') OR status IS NULL
+        """)
+        rows = cursor.fetchall()
+
+        stations = {}
+        by_milk = {}
+        by_coffee = {}
+        vip = set()
+
+        for station_id, load, capabilities_json, status in rows:
+            try:
+                capabilities = json.loads(capabilities_json) if capabilities_json and capabilities_json != '{}' else {}
+            except (json.JSONDecodeError, TypeError):
+                capabilities = {}
+
+            if not capabilities:
+                capabilities = dict(DEFAULT_CAPABILITIES)
+                logger.warning(f"Station {station_id} has no capabilities configured. Using minimal defaults.")
+
+            milk_types = capabilities.get('milk_types', ['full cream', 'skim'])
+            coffee_types = capabilities.get('coffee_types', [])
+
+            for milk in milk_types:
+                by_milk.setdefault(milk, []).append(station_id)
+            for coffee in coffee_types:
+                by_coffee.setdefault(coffee, []).append(station_id)
+            if capabilities.get('vip_service', False):
+                vip.add(station_id)
+
+            stations[station_id] = {
+                'id': station_id,
+                'load': load,
+                'capacity': capabilities.get('capacity', 10),
+                'status': status,
+                'capabilities': capabilities,
+                'milk_types': milk_types,
+                'coffee_types': coffee_types,
+                'alt_milk_available': any(m in milk_types for m in ALT_MILKS),
+                'high_volume': capabilities.get('high_volume', False),
+                'vip_service': capabilities.get('vip_service', False)
+            }
+
+        with self._lock:
+            self._stations = stations
+            self._by_milk = by_milk
+            self._by_coffee = by_coffee
+            self._vip = vip
+            self._loaded_at = time.monotonic()
+
+        logger.debug(f"Station index loaded with {len(stations)} stations")
+
+    def ensure_loaded(self, db):
+        """Reload the index if it has been invalidated or is too old"""
+        if self.is_stale():
+            self.load(db)
+
+    def stations(self, db):
+        """Active stations ordered by current load
+
+        Args:
+            db: Database connection, only used when the index must be reloaded
+
+        Returns:
+            List of station dicts (copies, safe for the caller to sort or filter)
+        """
+        self.ensure_loaded(db)
+        with self._lock:
+            stations = [dict(s) for s in self._stations.values()]
+        stations.sort(key=lambda s: s['load'])
+        return stations
+
+    def stations_for_milk(self, milk_type):
+        """IDs of stations stocking the given milk"""
+        with self._lock:
+            return list(self._by_milk.get(milk_type, []))
+
+    def stations_for_coffee(self, coffee_type):
+        """IDs of stations able to make the given coffee"""
+        with self._lock:
+            return list(self._by_coffee.get(coffee_type, []))
+
+    def vip_stations(self):
+        """IDs of stations offering VIP service"""
+        with self._lock:
+            return set(self._vip)
+
+    def station_load(self, station_id):
+        """Cached load for a station, or None if it is not active"""
+        with self._lock:
+            station = self._stations.get(station_id)
+            return station['load'] if station is not None else None
+
+    def adjust_load(self, station_id, delta):
+        """Apply a load change to the cached counter for a station
+
+        Args:
+            station_id: Station ID
+            delta: Change in load (+1 when assigned, -1 when completed/cancelled)
+        """
+        with self._lock:
+            station = self._stations.get(station_id)
+            if station is not None:
+                station['load'] = max(0, station['load'] + delta)
@@ -0,0 +1,233 @@
+"""
+Per-worker cache of the users behind authenticated requests
+
+flask_jwt_extended resolves the user for every protected request. Serving
+that from memory means a tablet polling several endpoints costs no queries
+once its user is cached: one query (user row plus permissions) per user per
+USER_CACHE_TTL seconds.
+
+Entries are keyed by user id and checked against the token's token_version
+claim. revoke_all_user_tokens bumps users.token_version (schema migration 8),
+and a token newer than the cached row forces a reload.
+
+A trigger on users and user_permissions (schema migration 9) announces every
+committed change on USERS_CHANGED_CHANNEL. Each worker's listener drops the
+user's entry, so a revocation or role change takes effect on every worker
+within moments, whoever wrote it. The writing worker also drops its own
+entry straight away. While the listener is down, entries expire after
+USER_CACHE_TTL as before, and the whole cache is cleared when it reconnects.
+"""
+import logging
+import select
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("expresso.services.user_cache")
+
+USER_CACHE_TTL = 30.0        # Seconds an entry is trusted without a query
+USER_CACHE_MAX_ENTRIES = 1000
+
+USER_QUERY = '''
+    SELECT u.id, u.username, u.email, u.role, u.full_name, u.token_version,
+           COALESCE(array_agg(p.permission_name) FILTER (WHERE p.permission_name IS NOT NULL),
+                    '{}') AS permissions
+    FROM users u
+    LEFT JOIN user_permissions p ON p.user_id = u.id
+    WHERE u.id = %s
+    GROUP BY u.id
+'''
+USER_COLUMNS = ('id', 'username', 'email', 'role', 'full_name', 'token_version', 'permissions')
+
+
+class UserCache:
+    """TTL cache of user rows and permissions, keyed by user id"""
+
+    def __init__(self, get_connection=None, release_connection=None,
+                 ttl=USER_CACHE_TTL, max_entries=USER_CACHE_MAX_ENTRIES):
+        """
+        Initialize the cache
+
+        Args:
+            get_connection: Callable returning a database connection
+                (defaults to the shared pool)
+            release_connection: Callable returning a connection to the pool
+            ttl: Seconds an entry is served before it is reloaded
+            max_entries: Most users kept; the least recently loaded go first
+        """
+        self._get_connection = get_connection
+        self._release_connection = release_connection
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # user id -> (loaded_at, user dict or None)
+        self._generation = 0            # Bumped by every invalidation
+
+        self._listener = None
+        self._listening = False
+
+        self._metrics = {
+            'hits': 0,
+            'misses': 0,
+            'loads': 0,
+            'revoked': 0,
+            'invalidations': 0,
+            'notifications': 0,
+            'errors': 0
+        }
+
+    def _connect(self):
+        if self._get_connection is None:
+            from utils.database import get_db_connection, close_connection
+            self._get_connection = get_db_connection
+            self._release_connection = close_connection
+        return self._get_connection()
+
+    def _load(self, key):
+        """Read one user and their permissions; None if there is no such user"""
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(USER_QUERY, (key,))
+            row = cursor.fetchone()
+            cursor.close()
+        finally:
+            self._release_connection(conn)
+        self._metrics['loads'] += 1
+        if row is None:
+            return None
+        user = dict(row) if isinstance(row, dict) else dict(zip(USER_COLUMNS, row))
+        user['permissions'] = list(user['permissions'] or [])
+        return user
+
+    def get(self, user_id, token_version=0):
+        """
+        User for a token's identity
+
+        Args:
+            user_id: The token's sub claim
+            token_version: The token's token_version claim (0 for tokens
+                issued without one)
+
+        Returns:
+            Dict with id, username, email, role, full_name, token_version
+            and permissions, or None if the user does not exist or the
+            token has been revoked
+        """
+        key = str(user_id)
+        token_version = token_version or 0
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and now - entry[0] < self.ttl:
+            user = entry[1]
+            if user is None or token_version <= user['token_version']:
+                self._metrics['hits'] += 1
+                return self._check_version(user, token_version)
+            # Token is newer than the cached row; the row is stale
+
+        self._metrics['misses'] += 1
+        generation = self._generation
+        try:
+            user = self._load(key)
+        except Exception as e:
+            self._metrics['errors'] += 1
+            logger.error(f"Error loading user {key}: {str(e)}")
+            return None
+        with self._lock:
+            # An invalidation during the read may mean it saw the old row;
+            # use it for this request but don't cache it
+            if generation == self._generation:
+                self._entries[key] = (now, user)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return self._check_version(user, token_version)
+
+    def _check_version(self, user, token_version):
+        if user is None:
+            return None
+        if token_version < user['token_version']:
+            self._metrics['revoked'] += 1
+            return None
+        return dict(user)
+
+    def invalidate(self, user_id):
+        """Drop a user so their next request reads the database"""
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+            self._generation += 1
+            self._metrics['invalidations'] += 1
+
+    def clear(self):
+        """Drop every cached user"""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self._metrics['invalidations'] += 1
+
+    def start_listener(self, db_url):
+        """Start a thread that drops users as soon as any worker changes them
+
+        Args:
+            db_url: Database URL for the dedicated LISTEN connection
+        """
+        if self._listener is not None:
+            return
+        self._listener = threading.Thread(target=self._listen, args=(db_url,),
+                                          name='user-cache-listener', daemon=True)
+        self._listener.start()
+
+    def _listen(self, db_url):
+        import psycopg2
+        from utils.database import USERS_CHANGED_CHANNEL
+
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(db_url)
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {USERS_CHANGED_CHANNEL}")
+                # Changes made while we were not listening were never heard
+                self.clear()
+                self._listening = True
+                logger.info("Listening for user changes")
+
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        with self._lock:
+                            self._metrics['notifications'] += 1
+                        self.invalidate(notify.payload)
+            except Exception as e:
+                self._listening = False
+                logger.warning(f"User cache listener disconnected: {str(e)}")
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(5)
+
+    def get_metrics(self):
+        """Snapshot of cache metrics"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['entries'] = len(self._entries)
+        lookups = metrics['hits'] + metrics['misses']
+        metrics['hit_rate'] = round(metrics['hits'] / lookups, 3) if lookups else None
+        metrics['listening'] = self._listening
+        return metrics
+
+
+_user_cache = UserCache()
+
+
+def get_user_cache():
+    """Process-wide user cache"""
+    return _user_cache
@@ -0,0 +1,332 @@
+"""
+Queue-aware wait time estimates from each station's recent throughput
+
+Every completion heard on the order event stream adds one sample per station:
+the time the station spent on that order, from when it could start it (the
+later of the previous completion and the order's arrival) to when it was
+marked ready. Samples are scaled by the station's barista count, so adding a
+second barista halves the estimate straight away. Gaps longer than
+IDLE_GAP are breaks, not work, and are skipped.
+
+The model keeps running sums over a rolling window, so an estimate for N
+orders is O(1): N times the mean time per order, plus a normal-approximation
+margin for the requested percentile. Until a station has a few samples the
+estimate is pulled towards DEFAULT_ORDER_SECONDS.
+
+Workers that are not hearing order events rebuild the model from the orders
+table every UNTRACKED_MAX_AGE seconds instead. Rebuilds run on a connection
+of the predictor's own, and completions heard while one is running are
+replayed into the new model before it replaces the old one.
+"""
+import json
+import logging
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from statistics import NormalDist
+
+from services.order_events import get_order_event_stream
+
+logger = logging.getLogger("expresso.services.wait_time_predictor")
+
+WINDOW_SECONDS = 2 * 60 * 60     # Completions older than this stop counting
+MAX_SAMPLES = 200                # Per station
+IDLE_GAP = 10 * 60               # Seconds; a longer gap between orders was a break
+DEFAULT_ORDER_SECONDS = 150      # Barista time per order before any are observed
+DEFAULT_ORDER_CV = 0.5           # Spread of that prior, as stdev / mean
+PRIOR_WEIGHT = 5                 # Observed orders before data outweighs the prior
+QUOTE_PERCENTILE = 0.8           # Customers are quoted a wait most orders beat
+TRACKED_MAX_AGE = 15 * 60        # Seconds between reloads while events are heard
+UNTRACKED_MAX_AGE = 60           # Seconds between reloads otherwise
+
+RECENT_COMPLETIONS_QUERY = f'''
+    SELECT id, station_id, created_at, completed_at
+    FROM orders
+    WHERE completed_at >= LOCALTIMESTAMP - INTERVAL '{WINDOW_SECONDS} seconds'
+      AND station_id IS NOT NULL
+    ORDER BY completed_at, id
+'''
+
+
+def _timestamp(value):
+    """Seconds since the epoch for a datetime or ISO string (None passes through)"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.timestamp()
+
+
+class _StationModel:
+    """Rolling per-order work samples for one station
+
+    Samples are [completed_at, work_seconds, orders]; orders finished in the
+    same instant (a batch completion) share one sample.
+    """
+
+    def __init__(self, max_samples):
+        self.samples = deque()
+        self.max_samples = max_samples
+        self.work = 0.0        # Sum of work_seconds
+        self.work_sq = 0.0     # Sum of work_seconds^2 / orders, for the variance
+        self.orders = 0
+        self.baristas = 1
+        self.last_completed_at = None
+        self.last_order_ids = set()   # Orders completed at last_completed_at
+
+    def record(self, order_id, created_at, completed_at, window):
+        """Add one completion; returns True if it produced a sample"""
+        last = self.last_completed_at
+        if last is not None and completed_at < last:
+            return False   # Out of order or replayed
+        if completed_at == last:
+            if order_id in self.last_order_ids:
+                return False
+            self.last_order_ids.add(order_id)
+            if self.samples and self.samples[-1][0] == completed_at:
+                sample = self.samples[-1]
+                self.work_sq -= sample[1] ** 2 / sample[2]
+                sample[2] += 1
+                self.work_sq += sample[1] ** 2 / sample[2]
+                self.orders += 1
+                return True
+            return False
+
+        self.last_completed_at = completed_at
+        self.last_order_ids = {order_id}
+        if last is None:
+            return False   # No previous completion to measure from
+        started = max(last, created_at) if created_at is not None else last
+        gap = completed_at - started
+        if gap <= 0 or gap > IDLE_GAP:
+            return False
+
+        work = gap * self.baristas
+        self.samples.append([completed_at, work, 1])
+        self.work += work
+        self.work_sq += work ** 2
+        self.orders += 1
+        while self.samples and (len(self.samples) > self.max_samples
+                                or self.samples[0][0] < completed_at - window):
+            _, old_work, old_orders = self.samples.popleft()
+            self.work -= old_work
+            self.work_sq -= old_work ** 2 / old_orders
+            self.orders -= old_orders
+        return True
+
+    def per_order(self):
+        """Mean and standard deviation of barista seconds per order, prior included"""
+        prior_sq = DEFAULT_ORDER_SECONDS ** 2 * (1 + DEFAULT_ORDER_CV ** 2)
+        weight = self.orders + PRIOR_WEIGHT
+        mean = (self.work + PRIOR_WEIGHT * DEFAULT_ORDER_SECONDS) / weight
+        variance = (self.work_sq + PRIOR_WEIGHT * prior_sq) / weight - mean ** 2
+        return mean, math.sqrt(max(variance, 0.0))
+
+
+class WaitTimePredictor:
+    """Per-station throughput model fed by completion events"""
+
+    def __init__(self, window=WINDOW_SECONDS, max_samples=MAX_SAMPLES,
+                 get_connection=None, release_connection=None):
+        """
+        Initialize the predictor
+
+        Args:
+            window: Seconds of completions each station's model covers
+            max_samples: Most samples kept per station
+            get_connection: Callable returning a database connection
+                (defaults to the shared pool)
+            release_connection: Callable returning a connection to the pool
+        """
+        self.window = window
+        self.max_samples = max_samples
+        self._get_connection = get_connection
+        self._release_connection = release_connection
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()   # One rebuild at a time
+        self._stations = {}
+        self._loaded_at = None
+        self._heard_during_load = None       # Completions to replay, while a rebuild runs
+
+        self._metrics = {
+            'completions': 0,
+            'samples': 0,
+            'estimates': 0,
+            'loads': 0,
+            'errors': 0
+        }
+
+    def _connect(self):
+        if self._get_connection is None:
+            from utils.database import get_db_connection, close_connection
+            self._get_connection = get_db_connection
+            self._release_connection = close_connection
+        return self._get_connection()
+
+    def _station(self, station_id):
+        model = self._stations.get(station_id)
+        if model is None:
+            model = self._stations[station_id] = _StationModel(self.max_samples)
+        return model
+
+    def record_completion(self, station_id, order_id, created_at, completed_at):
+        """
+        Add a completed order to its station's model
+
+        Args:
+            station_id: Station that made the order
+            order_id: Order ID (repeats are ignored)
+            created_at: When the order arrived (datetime, ISO string or epoch seconds)
+            completed_at: When it was marked ready (same types)
+        """
+        if station_id is None or completed_at is None:
+            return
+        if not isinstance(created_at, (int, float)):
+            created_at = _timestamp(created_at)
+        if not isinstance(completed_at, (int, float)):
+            completed_at = _timestamp(completed_at)
+        with self._lock:
+            self._metrics['completions'] += 1
+            if self._heard_during_load is not None:
+                self._heard_during_load.append((station_id, order_id, created_at, completed_at))
+            if self._station(station_id).record(order_id, created_at, completed_at, self.window):
+                self._metrics['samples'] += 1
+
+    def observe(self, event):
+        """Order event stream subscriber: records 'complete' events"""
+        if event['type'] != 'complete':
+            return
+        order = event['order']
+        try:
+            self.record_completion(order.get('station_id'), order.get('id'),
+                                   order.get('created_at'), order.get('completed_at'))
+        except (TypeError, ValueError) as e:
+            self._metrics['errors'] += 1
+            logger.error(f"Unusable completion event for order {order.get('id')}: {str(e)}")
+
+    def set_baristas(self, station_id, baristas):
+        """Set how many baristas are working a station (at least 1)"""
+        with self._lock:
+            self._station(station_id).baristas = max(1, int(baristas or 1))
+
+    def _read_history(self):
+        """Barista counts and recent completions; runs on its own connection
+        so it never joins (or aborts) a caller's transaction"""
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT station_id, COALESCE(equipment_notes, '{}') FROM station_stats")
+            stations = cursor.fetchall()
+            cursor.execute(RECENT_COMPLETIONS_QUERY)
+            completions = cursor.fetchall()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._release_connection(conn)
+
+        baristas = {}
+        for station_id, capabilities_json in stations:
+            try:
+                capabilities = json.loads(capabilities_json) if capabilities_json else {}
+            except (json.JSONDecodeError, TypeError):
+                capabilities = {}
+            baristas[station_id] = capabilities.get('baristas', 1)
+        return baristas, completions
+
+    def load(self):
+        """Rebuild every station's model from recent completions"""
+        if not self._load_lock.acquire(blocking=False):
+            return   # Another thread is already rebuilding
+        try:
+            with self._lock:
+                self._heard_during_load = []
+            try:
+                baristas, completions = self._read_history()
+            except Exception as e:
+                with self._lock:
+                    self._heard_during_load = None
+                    self._metrics['errors'] += 1
+                    self._loaded_at = time.monotonic()   # Retry after the usual interval
+                logger.error(f"Error loading wait time history: {str(e)}")
+                return
+
+            rebuilt = WaitTimePredictor(self.window, self.max_samples)
+            for station_id, count in baristas.items():
+                rebuilt.set_baristas(station_id, count)
+            for order_id, station_id, created_at, completed_at in completions:
+                rebuilt.record_completion(station_id, order_id, created_at, completed_at)
+
+            with self._lock:
+                # Completions heard since the read started may have committed
+                # after it; replaying ones it did see is a no-op
+                for station_id, order_id, created_at, completed_at in self._heard_during_load:
+                    rebuilt.record_completion(station_id, order_id, created_at, completed_at)
+                self._heard_during_load = None
+                self._stations = rebuilt._stations
+                self._loaded_at = time.monotonic()
+                self._metrics['loads'] += 1
+            logger.debug(f"Wait time model loaded from {len(completions)} completions")
+        finally:
+            self._load_lock.release()
+
+    def ensure_loaded(self):
+        """Reload from the database if the model has never been loaded, or
+        is old enough that completions may have been missed"""
+        max_age = TRACKED_MAX_AGE if get_order_event_stream().listening else UNTRACKED_MAX_AGE
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > max_age:
+            self.load()
+
+    def estimate(self, station_id, orders, percentile=QUOTE_PERCENTILE):
+        """
+        Minutes until a station has finished a number of orders
+
+        Args:
+            station_id: Station ID
+            orders: Orders to finish, counting the customer's own; 0 (an
+                idle station) is quoted as a single order
+            percentile: Share of waits the estimate should cover; 0.5 for
+                the median
+
+        Returns:
+            Whole minutes, at least 1
+        """
+        orders = max(1, orders)
+        with self._lock:
+            self._metrics['estimates'] += 1
+            model = self._stations.get(station_id)
+            if model is None:
+                mean, stdev, baristas = DEFAULT_ORDER_SECONDS, DEFAULT_ORDER_SECONDS * DEFAULT_ORDER_CV, 1
+            else:
+                mean, stdev = model.per_order()
+                baristas = model.baristas
+        seconds = orders * mean + NormalDist().inv_cdf(percentile) * math.sqrt(orders) * stdev
+        return max(1, math.ceil(seconds / baristas / 60))
+
+    def get_metrics(self):
+        """Snapshot of predictor metrics, with each station's current model"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            stations = {}
+            for station_id, model in self._stations.items():
+                mean, stdev = model.per_order()
+                stations[str(station_id)] = {
+                    'orders': model.orders,
+                    'baristas': model.baristas,
+                    'mean_seconds': round(mean / model.baristas, 1),
+                    'stdev_seconds': round(stdev / model.baristas, 1)
+                }
+        metrics['stations'] = stations
+        return metrics
+
+
+_wait_time_predictor = WaitTimePredictor()
+
+
+def get_wait_time_predictor():
+    """Process-wide wait time predictor"""
+    return _wait_time_predictor
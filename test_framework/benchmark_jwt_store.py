@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+JWT Blacklist and Session Store Benchmark
+Simulates days of logins, authenticated requests and logouts against
+jwt_security's TokenBlacklist and SessionManager on a simulated clock, and
+reports per-request cost (blacklist check plus activity update) and store
+size at the end of each day. Both should stay flat: blacklist entries leave
+when their token would have expired, sessions when they go idle.
+
+Runs offline on the in-process ExpiringStore by default. --redis-url runs
+the same calls against a Redis server; its clock is real, so nothing expires
+during the run and only the per-request cost is comparable.
+
+    python test_framework/benchmark_jwt_store.py
+    python test_framework/benchmark_jwt_store.py --days 14 --logins-per-hour 500
+"""
+
+import argparse
+import logging
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from jwt_security import TokenBlacklist, SessionManager
+from utils.expiring_store import ExpiringStore
+
+TOKEN_LIFETIME = timedelta(hours=1)   # JWT_ACCESS_TOKEN_EXPIRES default
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run(days, logins_per_hour, requests_per_hour, logout_share, users, redis_url, seed):
+    rng = random.Random(seed)
+    clock = SimulatedClock()
+    blacklist = TokenBlacklist(redis_url)
+    sessions = SessionManager(redis_url)
+    if not redis_url:
+        blacklist.store = ExpiringStore(clock=clock)
+        sessions.store = ExpiringStore(clock=clock)
+
+    live = []            # jtis of sessions that have not logged out
+    blacklisted = 0
+    step = 3600.0 / (logins_per_hour + requests_per_hour)
+    daily = []
+    request_times = []
+
+    print(f"{'day':>4}{'req us p50':>12}{'req us p99':>12}{'blacklist':>11}{'sessions':>10}"
+          f"{'heap':>8}{'revoked so far':>16}")
+    for hour in range(days * 24):
+        events = ['login'] * logins_per_hour + ['request'] * requests_per_hour
+        rng.shuffle(events)
+        for event in events:
+            clock.now += step
+            if event == 'login' or not live:
+                jti = f"{hour}-{clock.now:.3f}"
+                sessions.create_session(rng.randrange(users), jti)
+                live.append(jti)
+                continue
+
+            jti = live[rng.randrange(len(live))]
+            t0 = time.perf_counter()
+            if not blacklist.is_blacklisted(jti):
+                sessions.update_activity(jti)
+            request_times.append((time.perf_counter() - t0) * 1e6)
+
+            if rng.random() < logout_share:
+                blacklist.blacklist_token(jti, datetime.utcnow() + TOKEN_LIFETIME)
+                sessions.destroy_session(jti)
+                live.remove(jti)
+                blacklisted += 1
+
+        # Clients that never log out just stop using their token
+        if len(live) > logins_per_hour:
+            live = live[-logins_per_hour:]
+
+        if (hour + 1) % 24 == 0:
+            request_times.sort()
+            p50 = statistics.median(request_times)
+            p99 = request_times[int(0.99 * (len(request_times) - 1))]
+            if redis_url:
+                blacklist_keys = session_keys = heap = '-'
+            else:
+                blacklist_keys = blacklist.store.get_metrics()['keys']
+                session_metrics = sessions.store.get_metrics()
+                session_keys, heap = session_metrics['keys'], session_metrics['heap']
+            print(f"{(hour + 1) // 24:>4}{p50:>12.1f}{p99:>12.1f}{blacklist_keys:>11}{session_keys:>10}"
+                  f"{heap:>8}{blacklisted:>16}")
+            daily.append(p50)
+            request_times = []
+    return daily
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-request cost of the JWT blacklist and session store over time")
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--logins-per-hour', type=int, default=200)
+    parser.add_argument('--requests-per-hour', type=int, default=5000)
+    parser.add_argument('--logout-share', type=float, default=0.02, help="Chance a request is followed by logout")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--redis-url', help="Run against Redis instead of the memory store")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    # Every create/destroy logs at INFO; keep the report readable
+    logging.getLogger("jwt_security").setLevel(logging.WARNING)
+
+    daily = run(args.days, args.logins_per_hour, args.requests_per_hour, args.logout_share,
+                args.users, args.redis_url, args.seed)
+    if len(daily) > 1:
+        print(f"\nlast day / first day p50: {daily[-1] / daily[0]:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+NLP Order Parser Micro-benchmark
+Times NLPService.parse_order over a corpus of SMS orders with the compiled
+matchers, and against the original loop-per-variation extractors kept below
+as LegacyNLPService. Every message must parse to the same result with both.
+
+    python test_framework/benchmark_nlp_parser.py
+    python test_framework/benchmark_nlp_parser.py --corpus messages.txt --rounds 200
+
+A corpus file has one SMS body per line.
+"""
+
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.nlp import NLPService, TYPO_CORRECTIONS
+
+# SMS orders as customers send them, taken from event logs and the simulator
+DEFAULT_CORPUS = [
+    "Large flat white with skim milk please",
+    "Small latte with almond milk, extra hot, 2 sugars",
+    "cap",
+    "Medium cap soy",
+    "2 shot oat latte",
+    "fw oat",
+    "lb",
+    "long black no sugar",
+    "hi can i get a large cappacino with full cream and 1 sugar",
+    "expresso",
+    "double shot skinny flat white",
+    "Large chai tea latte with soy",
+    "iced latte with oat milk",
+    "hot choc for my daughter",
+    "Medium latte with soy",
+    "lrg decaf cap lactose free",
+    "mocha latte extra hot",
+    "usual please",
+    "the usual",
+    "Can I get a piccolo",
+    "machiato with a dash of almond",
+    "sm fw 1/2 sugar",
+    "Group order for conference room A: 5 flat whites, 3 lattes",
+    "Large flat white for Sarah",
+    "matcha latte with coconut milk, not too sweet",
+    "Cold brew no milk",
+    "black coffee",
+    "reg latte, weak, 2 sugars",
+    "flat white allergic to nuts",
+    "Long black with a splash of milk, special instructions: in a mug",
+    "Tea please, white with one",
+    "Medium hot chocolate with marshmallows",
+    "☕ Café latte s'il vous plaît 🥛",
+    "vip large latte asap",
+    "8oz cap lf 2s",
+    "16 oz mocha almond",
+    "venti latte",
+    "grande flat white skim",
+    "cortado",
+    "affogato",
+    "ristretto",
+    "pour over",
+    "filter coffee with soy",
+    "Can i use my loyalty points for a free coffee? latte",
+    "hey! large oat fw, extra hot, no sugar thx",
+    "caps x2 one soy one full cream",
+    "Americano",
+    "short black",
+    "macadamia latte",
+    "chai",
+]
+
+
+class LegacyNLPService(NLPService):
+    """The extractors as they were before the compiled matchers, for comparison"""
+
+    def _normalize_message(self, message):
+        normalized = message.lower()
+        for typo, correction in TYPO_CORRECTIONS.items():
+            normalized = re.sub(r'\b' + typo + r'\b', correction, normalized)
+        return normalized
+
+    def _extract_coffee_type(self, message):
+        if self.is_asking_for_usual(message):
+            return None
+        for canonical, variations in self.coffee_types.items():
+            if canonical in message:
+                return canonical
+            for variation in variations:
+                if re.search(r'\b' + re.escape(variation) + r'\b', message.lower()):
+                    return canonical
+        multi_word_types = ["flat white", "long black", "hot chocolate", "chai latte", "matcha latte", "cold brew", "pour over", "filter coffee"]
+        for coffee_type in multi_word_types:
+            if all(word in message for word in coffee_type.split()):
+                return coffee_type
+        return None
+
+    def _match_vocabulary(self, vocabulary, message):
+        for canonical, variations in vocabulary.items():
+            if canonical in message:
+                return canonical
+            for variation in variations:
+                if re.search(r'\b' + re.escape(variation) + r'\b', message):
+                    return canonical
+        return None
+
+    def _extract_size(self, message):
+        return self._match_vocabulary(self.sizes, message)
+
+    def _extract_milk_type(self, message):
+        for variation in self.milks["no milk"]:
+            if re.search(r'\b' + re.escape(variation) + r'\b', message):
+                return "no milk"
+        other_milks = {k: v for k, v in self.milks.items() if k != "no milk"}
+        return self._match_vocabulary(other_milks, message)
+
+    def _extract_sugar(self, message):
+        num_sugar_match = re.search(r'(\d+)\s*(?:sugar|sugars|sweetener)', message)
+        if num_sugar_match:
+            num = int(num_sugar_match.group(1))
+            return "no sugar" if num <= 0 else f"{num} sugar"
+        return self._match_vocabulary(self.sugars, message)
+
+    def _extract_strength(self, message):
+        shot_match = re.search(r'(\d+)\s*shots?', message)
+        if shot_match:
+            num_shots = int(shot_match.group(1))
+            return {1: "single shot", 2: "double shot", 3: "triple shot"}.get(num_shots, f"{num_shots} shots")
+        return self._match_vocabulary(self.strengths, message)
+
+    def _extract_temperature(self, message):
+        return self._match_vocabulary(self.temperatures, message)
+
+
+def time_parser(parser, corpus, rounds):
+    """Microseconds per parse_order call over the corpus"""
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for message in corpus:
+            parser.parse_order(message)
+    elapsed = time.perf_counter() - started
+    return elapsed / (rounds * len(corpus)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark for NLPService.parse_order")
+    parser.add_argument('--corpus', help="File with one SMS body per line")
+    parser.add_argument('--rounds', type=int, default=100)
+    args = parser.parse_args()
+
+    corpus = DEFAULT_CORPUS
+    if args.corpus:
+        with open(args.corpus, encoding='utf-8') as f:
+            corpus = [line.strip() for line in f if line.strip()]
+
+    compiled = NLPService()
+    legacy = LegacyNLPService()
+    # No database here: pin an empty menu so both parse with the built-in types
+    compiled.set_menu(None)
+
+    mismatches = 0
+    for message in corpus:
+        expected, actual = legacy.parse_order(message), compiled.parse_order(message)
+        if expected != actual:
+            mismatches += 1
+            print(f"MISMATCH {message!r}\n  legacy   {expected}\n  compiled {actual}")
+
+    legacy_us = time_parser(legacy, corpus, args.rounds)
+    compiled_us = time_parser(compiled, corpus, args.rounds)
+
+    print(f"corpus            {len(corpus)} messages x {args.rounds} rounds")
+    print(f"legacy            {legacy_us:.1f} us/parse")
+    print(f"compiled          {compiled_us:.1f} us/parse ({legacy_us / compiled_us:.1f}x)")
+    print(f"mismatches        {mismatches}")
+    sys.exit(0 if mismatches == 0 else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Order Queue Benchmark
+Compares the old per-order customer name lookup against the joined
+Order.get_queue query on 1k and 10k queued orders.
+
+Runs against DATABASE_URL inside a throwaway schema, so live data is untouched:
+    DATABASE_URL=postgresql://localhost/expresso python test_framework/benchmark_order_queue.py
+"""
+
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import psycopg2
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from models.orders import Order
+from utils.database import SCHEMA_MIGRATIONS
+
+SCHEMA = 'queue_benchmark'
+QUEUE_SIZES = [1000, 10000]
+ROUNDS = 5
+
+
+class CountingCursor:
+    """Cursor wrapper that counts executed statements"""
+
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, query, params=None):
+        self._counter['queries'] += 1
+        return self._cursor.execute(query, params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class CountingConnection:
+    """Connection wrapper handing out CountingCursors"""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.counter = {'queries': 0}
+
+    def cursor(self, *args, **kwargs):
+        return CountingCursor(self._conn.cursor(*args, **kwargs), self.counter)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def seed(conn, size):
+    """Create the scratch schema and fill it with `size` pending orders"""
+    cursor = conn.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+    cursor.execute(f"SET search_path TO {SCHEMA}")
+    cursor.execute('''
+        CREATE TABLE orders (
+            id SERIAL PRIMARY KEY,
+            order_number VARCHAR(20) UNIQUE NOT NULL,
+            phone VARCHAR(20) NOT NULL,
+            order_details JSONB NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            station_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            queue_priority INTEGER NOT NULL DEFAULT 5,
+            completed_at TIMESTAMP,
+            picked_up_at TIMESTAMP
+        )
+    ''')
+    # get_queue reads the promoted order_details columns
+    for version, name, statements in SCHEMA_MIGRATIONS:
+        if name == 'orders_detail_columns':
+            for statement in statements:
+                cursor.execute(statement)
+    cursor.execute('''
+        CREATE TABLE customer_preferences (
+            phone VARCHAR(20) PRIMARY KEY,
+            name VARCHAR(100)
+        )
+    ''')
+
+    customers = max(1, size // 3)
+    cursor.executemany(
+        "INSERT INTO customer_preferences (phone, name) VALUES (%s, %s)",
+        [(f"+6140000{i:04d}", f"Customer {i}") for i in range(customers)]
+    )
+
+    now = datetime.now()
+    rows = []
+    for i in range(size):
+        details = {
+            'name': f"Customer {i % customers}",
+            'type': random.choice(['latte', 'cappuccino', 'flat white', 'long black']),
+            'milk': random.choice(['full cream', 'oat', 'soy', 'skim']),
+            'size': 'medium',
+            'sugar': 'no sugar'
+        }
+        rows.append((
+            f"B{i:07d}", f"+6140000{i % customers:04d}", json.dumps(details), 'pending',
+            random.randint(1, 3), now - timedelta(seconds=i), random.choice([1, 5, 6, 7])
+        ))
+    cursor.executemany('''
+        INSERT INTO orders (order_number, phone, order_details, status, station_id, created_at, queue_priority)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ''', rows)
+    cursor.execute("ANALYZE orders")
+    cursor.execute("ANALYZE customer_preferences")
+    conn.commit()
+
+
+def legacy_pending(conn):
+    """The old /api/orders/pending loop: one name lookup per order"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, order_number, status, station_id,
+               created_at, phone, order_details, queue_priority
+        FROM orders
+        WHERE status = 'pending'
+        ORDER BY queue_priority, created_at DESC
+    ''')
+    result = []
+    for order in cursor.fetchall():
+        order_id, order_number, status, station_id, created_at, phone, details, priority = order
+        cursor.execute("SELECT name FROM customer_preferences WHERE phone = %s", (phone,))
+        customer = cursor.fetchone()
+        result.append((order_number, customer[0] if customer else details.get('name')))
+    return result
+
+
+def joined_pending(conn):
+    """The new path: one joined query plus the shared serializer"""
+    orders = Order.get_queue(conn, 'pending', ordering='priority_newest')
+    return [Order.to_queue_json(order, camel_case=True) for order in orders]
+
+
+def measure(conn, fn):
+    """Run fn ROUNDS times and return (queries per call, best ms, mean ms)"""
+    counting = CountingConnection(conn)
+    timings = []
+    for _ in range(ROUNDS):
+        counting.counter['queries'] = 0
+        started = time.perf_counter()
+        fn(counting)
+        timings.append((time.perf_counter() - started) * 1000)
+    return counting.counter['queries'], min(timings), sum(timings) / len(timings)
+
+
+def main():
+    conn = psycopg2.connect(os.getenv('DATABASE_URL', 'postgresql://localhost/expresso'))
+    try:
+        print(f"{'orders':>8} {'path':>8} {'queries':>8} {'best ms':>10} {'mean ms':>10}")
+        for size in QUEUE_SIZES:
+            seed(conn, size)
+            for label, fn in (('legacy', legacy_pending), ('joined', joined_pending)):
+                queries, best, mean = measure(conn, fn)
+                print(f"{size:>8} {label:>8} {queries:>8} {best:>10.1f} {mean:>10.1f}")
+    finally:
+        conn.rollback()
+        conn.cursor().execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Sliding-Window Counter Benchmark
+Replays a credential-stuffing spike (every attempt a new username, from a
+pool of addresses) plus steady per-phone SMS traffic through the shared
+SlidingWindowCounters on a simulated clock, the way login throttling and
+the /sms webhook use it. Reports cost per hit and live keys each simulated
+minute; keys should level off at the cap during the spike and fall back as
+windows empty.
+
+    python test_framework/benchmark_rate_counters.py
+    python test_framework/benchmark_rate_counters.py --attempts-per-minute 50000 --max-keys 20000
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.rate_counters import SlidingWindowCounters
+
+
+def run(minutes, spike_minutes, attempts_per_minute, addresses, sms_per_minute, phones, max_keys, seed):
+    rng = random.Random(seed)
+    now = [0.0]
+    engine = SlidingWindowCounters(max_keys=max_keys, clock=lambda: now[0])
+    failed_logins = engine.counter('failed_logins', window_minutes=60)
+    inbound_sms = engine.counter('inbound_sms', window_minutes=10)
+
+    print(f"{'minute':>6}{'hits':>9}{'us/hit p50':>12}{'us/hit p99':>12}{'keys':>8}{'evicted':>9}{'expired':>9}")
+    for minute in range(minutes):
+        events = [('sms', rng.randrange(phones)) for _ in range(sms_per_minute)]
+        if minute < spike_minutes:
+            events += [('login', minute * attempts_per_minute + i) for i in range(attempts_per_minute)]
+        rng.shuffle(events)
+
+        step = 60.0 / max(len(events), 1)
+        times = []
+        for kind, key in events:
+            now[0] += step
+            t0 = time.perf_counter()
+            if kind == 'sms':
+                inbound_sms.hit(f"+614{key:08d}")
+            else:
+                failed_logins.hit(f"user:stuffed{key}")
+                failed_logins.hit(f"ip:10.0.{key % addresses // 256}.{key % addresses % 256}")
+            times.append((time.perf_counter() - t0) * 1e6)
+        now[0] = (minute + 1) * 60.0
+
+        if times:
+            times.sort()
+            metrics = engine.get_metrics()
+            print(f"{minute + 1:>6}{len(times):>9}{statistics.median(times):>12.2f}"
+                  f"{times[int(0.99 * (len(times) - 1))]:>12.2f}{metrics['keys']:>8}"
+                  f"{metrics['evicted']:>9}{metrics['expired']:>9}")
+    return engine.get_metrics()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory and cost of the shared sliding-window counters under a spike")
+    parser.add_argument('--minutes', type=int, default=90)
+    parser.add_argument('--spike-minutes', type=int, default=15)
+    parser.add_argument('--attempts-per-minute', type=int, default=10000)
+    parser.add_argument('--addresses', type=int, default=500)
+    parser.add_argument('--sms-per-minute', type=int, default=200)
+    parser.add_argument('--phones', type=int, default=300)
+    parser.add_argument('--max-keys', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    metrics = run(args.minutes, args.spike_minutes, args.attempts_per_minute, args.addresses,
+                  args.sms_per_minute, args.phones, args.max_keys, args.seed)
+    print(f"\nfinal keys per counter: {metrics['counters']}")
+
+
+if __name__ == '__main__':
+    main()
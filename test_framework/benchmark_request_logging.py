@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Request Logging Overhead Benchmark
+Times requests through a bare Flask app three ways and reports the logging
+overhead per request:
+    none    - no request logging
+    before  - the previous pipeline: an MD5 fingerprint and a JSON entry on
+              the way in, a second entry with response.get_data() on the way
+              out, an INFO line per response, all written synchronously
+    after   - security_monitoring's sampled single entry, with log files
+              written by utils.log_queue's listener thread
+
+Log files go to a temporary directory. The endpoint mimics a polling call
+(/api/orders/pending, sampled) with a JSON body of --body-kb kilobytes.
+
+    python test_framework/benchmark_request_logging.py
+    python test_framework/benchmark_request_logging.py --requests 20000 --body-kb 64
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from flask import Flask, jsonify, request
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import security_monitoring
+from utils.log_queue import LogQueue
+
+PATH = '/api/orders/pending'
+
+
+def make_app(body_kb):
+    app = Flask(__name__)
+    orders = [{'id': i, 'customer_name': f"Customer {i}", 'coffee_type': 'Flat White',
+               'milk_type': 'Oat', 'status': 'pending'} for i in range(body_kb * 1024 // 100 + 1)]
+
+    @app.route(PATH)
+    def pending():
+        return jsonify({'success': True, 'orders': orders})
+
+    return app
+
+
+def add_legacy_logging(app, api_logger, app_logger):
+    """The request logging this benchmark compares against, as it was"""
+
+    @app.before_request
+    def log_api_request():
+        request_data = {
+            'method': request.method,
+            'path': request.path,
+            'query_string': request.query_string.decode(),
+            'content_length': request.content_length or 0,
+            'user_agent': request.headers.get('User-Agent', '')[:200],
+        }
+        fingerprint = hashlib.md5(json.dumps(request_data, sort_keys=True).encode()).hexdigest()
+        api_logger.info(json.dumps({
+            'timestamp': datetime.utcnow().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'query_params': dict(request.args),
+            'user_id': None,
+            'ip_address': request.remote_addr,
+            'user_agent': request.headers.get('User-Agent', 'Unknown')[:200],
+            'content_length': request.content_length or 0,
+            'fingerprint': fingerprint
+        }))
+
+    @app.after_request
+    def log_api_response(response):
+        api_logger.info(json.dumps({
+            'timestamp': datetime.utcnow().isoformat(),
+            'status_code': response.status_code,
+            'user_id': None,
+            'ip_address': request.remote_addr,
+            'path': request.path,
+            'response_size': len(response.get_data()),
+        }))
+        app_logger.info(f"Added CORS headers to response for: {request.path}")
+        return response
+
+
+def point_loggers_at(directory):
+    """File handlers for api_access and the app logger in a temp directory"""
+    loggers = {}
+    for name, filename in (('api_access', 'api_access.log'), ('expresso', 'expresso.log')):
+        target = logging.getLogger(name)
+        for handler in list(target.handlers):
+            target.removeHandler(handler)
+        handler = logging.FileHandler(Path(directory) / filename)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        target.addHandler(handler)
+        target.setLevel(logging.INFO)
+        target.propagate = False
+        loggers[name] = target
+    return loggers
+
+
+def time_requests(app, requests):
+    client = app.test_client()
+    for _ in range(min(200, requests)):   # Warm up
+        client.get(PATH)
+    times = []
+    for _ in range(requests):
+        t0 = time.perf_counter()
+        client.get(PATH, headers={'User-Agent': 'BaristaTablet/1.0'})
+        times.append((time.perf_counter() - t0) * 1e6)
+    times.sort()
+    return statistics.median(times), times[int(0.99 * (len(times) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-request cost of API request logging, before and after")
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--body-kb', type=int, default=16)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        loggers = point_loggers_at(directory)
+        results = {}
+
+        results['none'] = time_requests(make_app(args.body_kb), args.requests)
+
+        app = make_app(args.body_kb)
+        add_legacy_logging(app, loggers['api_access'], loggers['expresso'])
+        results['before'] = time_requests(app, args.requests)
+
+        app = make_app(args.body_kb)
+        security_monitoring.init_security_monitoring(app)
+        log_queue = LogQueue()
+        log_queue.start(('api_access', 'expresso'))
+        try:
+            results['after'] = time_requests(app, args.requests)
+        finally:
+            log_queue.stop()
+        dropped = log_queue.get_metrics()['dropped']
+
+    baseline = results['none'][0]
+    print(f"{args.requests} requests to {PATH}, {args.body_kb} KB response\n")
+    print(f"{'pipeline':<10}{'p50 us':>10}{'p99 us':>10}{'overhead us':>13}")
+    for name, (p50, p99) in results.items():
+        print(f"{name:<10}{p50:>10.1f}{p99:>10.1f}{p50 - baseline:>13.1f}")
+    print(f"\nrecords dropped by the queue: {dropped}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+SMS Outbox Load Test
+Pushes a burst of messages through SmsOutbox using the fake Twilio transport,
+so it runs fully offline. Reports enqueue latency (what a request handler
+waits for), drain time, retries, and checks per-number ordering.
+
+    python test_framework/benchmark_sms_outbox.py
+    python test_framework/benchmark_sms_outbox.py --messages 5000 --latency 0.2 --failure-rate 0.05
+"""
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.sms_outbox import SmsOutbox, FakeTwilioTransport
+
+
+def run(messages, phones, workers, rate_limit, latency, failure_rate):
+    transport = FakeTwilioTransport(latency=latency, failure_rate=failure_rate)
+    outbox = SmsOutbox(transport, store=None, workers=workers, rate_limit=rate_limit,
+                       retry_base_delay=0.05)
+    outbox.start()
+
+    enqueue_times = []
+    started = time.perf_counter()
+    for i in range(messages):
+        phone = f"+6140000{i % phones:04d}"
+        t0 = time.perf_counter()
+        outbox.enqueue(phone, f"seq={i}")
+        enqueue_times.append((time.perf_counter() - t0) * 1000)
+
+    while outbox.pending_count():
+        time.sleep(0.01)
+    drained = time.perf_counter() - started
+    outbox.stop()
+
+    # Every number must have received its messages in the order they were queued
+    last_seen = {}
+    out_of_order = 0
+    for to, body, _, _ in transport.sent:
+        seq = int(body.split('=')[1])
+        if seq < last_seen.get(to, -1):
+            out_of_order += 1
+        last_seen[to] = seq
+
+    enqueue_times.sort()
+    metrics = outbox.get_metrics()
+    print(f"messages          {messages} to {phones} numbers, {workers} workers, rate limit {rate_limit}/s")
+    print(f"enqueue p50/p99   {enqueue_times[len(enqueue_times) // 2]:.3f} / {enqueue_times[int(len(enqueue_times) * 0.99)]:.3f} ms")
+    print(f"drain time        {drained:.2f} s ({metrics['sent'] / drained:.1f} msg/s)")
+    print(f"sent/failed       {metrics['sent']} / {metrics['failed']} ({metrics['retries']} retries)")
+    print(f"max queue delay   {metrics['max_queue_delay_ms']:.1f} ms")
+    print(f"out of order      {out_of_order}")
+    return out_of_order == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the SMS outbox")
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--phones', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rate-limit', type=float, default=0, help="Messages per second, 0 for unlimited")
+    parser.add_argument('--latency', type=float, default=0.05, help="Simulated Twilio latency in seconds")
+    parser.add_argument('--failure-rate', type=float, default=0.02)
+    args = parser.parse_args()
+
+    # Retries are expected with a non-zero failure rate; keep the report readable
+    logging.getLogger("expresso.services.sms_outbox").setLevel(logging.ERROR)
+
+    ok = run(args.messages, args.phones, args.workers, args.rate_limit, args.latency, args.failure_rate)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Orders Index Regression Check
+Seeds a throwaway schema with a month of orders (1M rows by default), applies
+SCHEMA_MIGRATIONS and checks with EXPLAIN that each hot orders query is served
+by the expected index rather than a sequential scan.
+
+Runs against DATABASE_URL inside a throwaway schema, so live data is untouched:
+    DATABASE_URL=postgresql://localhost/expresso python test_framework/explain_orders_indexes.py
+    python test_framework/explain_orders_indexes.py --rows 200000
+
+Exits non-zero if any checked query loses its index.
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import psycopg2
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from utils.database import SCHEMA_MIGRATIONS, apply_schema_migrations, day_range
+
+SCHEMA = 'index_regression'
+STATIONS = 4
+PENDING = 200
+IN_PROGRESS = 40
+AWAITING_PICKUP = 30
+
+
+def seed(conn, rows):
+    """Create the scratch schema and fill orders with `rows` orders over ~30 days
+
+    The newest orders are the active ones, as at a live event: PENDING
+    pending, IN_PROGRESS in progress and AWAITING_PICKUP completed but not
+    collected. Everything older has been picked up.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+    # public stays on the path for extension operator classes (pg_trgm)
+    cursor.execute(f"SET search_path TO {SCHEMA}, public")
+    cursor.execute('''
+        CREATE TABLE orders (
+            id SERIAL PRIMARY KEY,
+            order_number VARCHAR(20) UNIQUE NOT NULL,
+            phone VARCHAR(20) NOT NULL,
+            order_details JSONB NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            station_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            queue_priority INTEGER NOT NULL DEFAULT 5,
+            completed_at TIMESTAMP,
+            picked_up_at TIMESTAMP
+        )
+    ''')
+    # The indexes create_tables makes before any migration runs
+    cursor.execute('CREATE INDEX idx_orders_phone ON orders(phone)')
+    cursor.execute('CREATE INDEX idx_orders_status ON orders(status)')
+    cursor.execute('CREATE INDEX idx_orders_station ON orders(station_id)')
+    # Other create_tables tables that later migrations alter
+    cursor.execute('CREATE TABLE chat_messages (id SERIAL PRIMARY KEY)')
+    cursor.execute('CREATE TABLE station_stats (station_id INTEGER PRIMARY KEY)')
+
+    spacing = 30 * 24 * 3600.0 / rows
+    cursor.execute('''
+        INSERT INTO orders (order_number, phone, order_details, status, station_id,
+                            created_at, queue_priority, completed_at, picked_up_at)
+        SELECT 'R' || lpad(i::text, 7, '0'),
+               '+614' || lpad((i %% 50000)::text, 8, '0'),
+               jsonb_build_object('name', 'Customer ' || (i %% 50000),
+                                  'type', (ARRAY['latte', 'cappuccino', 'flat white', 'long black'])[1 + i %% 4],
+                                  'milk', (ARRAY['full cream', 'oat', 'soy', 'skim'])[1 + i %% 4]),
+               CASE WHEN i <= %(pending)s THEN 'pending'
+                    WHEN i <= %(in_progress)s THEN 'in-progress'
+                    ELSE 'completed' END,
+               1 + i %% %(stations)s,
+               now() - make_interval(secs => i * %(spacing)s),
+               (ARRAY[1, 5, 5, 5, 6, 7])[1 + i %% 6],
+               CASE WHEN i > %(in_progress)s THEN now() - make_interval(secs => i * %(spacing)s - 240) END,
+               CASE WHEN i > %(awaiting)s THEN now() - make_interval(secs => i * %(spacing)s - 300) END
+        FROM generate_series(1, %(rows)s) AS i
+    ''', {
+        'rows': rows,
+        'spacing': spacing,
+        'stations': STATIONS,
+        'pending': PENDING,
+        'in_progress': PENDING + IN_PROGRESS,
+        'awaiting': PENDING + IN_PROGRESS + AWAITING_PICKUP
+    })
+    conn.commit()
+
+    applied = apply_schema_migrations(conn)
+
+    conn.autocommit = True
+    conn.cursor().execute("VACUUM ANALYZE orders")
+    conn.autocommit = False
+    return applied
+
+
+def hot_queries():
+    """(label, query, params, indexes any of which may serve it) as the app issues them"""
+    today_start, today_end = day_range(datetime.now())
+    week_start = day_range(datetime.now() - timedelta(days=7))[0]
+    return [
+        ('station pending queue', '''
+            SELECT o.id FROM orders o
+            WHERE o.status = ANY(%s) AND o.station_id = %s
+            ORDER BY o.queue_priority, o.created_at
+         ''', (['pending'], 2), {'idx_orders_station_queue', 'idx_orders_active_queue'}),
+        ('station active orders', '''
+            SELECT * FROM orders
+            WHERE station_id = %s AND status IN ('pending', 'in-progress')
+            ORDER BY queue_priority, created_at
+         ''', (3,), {'idx_orders_station_queue', 'idx_orders_active_queue'}),
+        ('pending queue, all stations', '''
+            SELECT o.id FROM orders o
+            WHERE o.status = ANY(%s)
+            ORDER BY o.queue_priority, o.created_at DESC
+         ''', (['pending'],), {'idx_orders_active_queue'}),
+        ('in-progress, oldest first', '''
+            SELECT o.id FROM orders o
+            WHERE o.status = ANY(%s)
+            ORDER BY o.created_at
+         ''', (['in-progress'],), {'idx_orders_active_queue'}),
+        ('display ready for pickup', '''
+            SELECT id FROM orders
+            WHERE status = 'completed' AND picked_up_at IS NULL
+            ORDER BY completed_at DESC NULLS LAST
+            LIMIT 10
+         ''', (), {'idx_orders_ready_for_pickup'}),
+        ('recently completed', '''
+            SELECT o.id FROM orders o
+            WHERE o.status = ANY(%s)
+            ORDER BY o.completed_at DESC NULLS LAST
+            LIMIT 20
+         ''', (['completed'],), {'idx_orders_completed_recent'}),
+        ('STATUS command', '''
+            SELECT id FROM orders
+            WHERE phone = %s AND status IN ('pending', 'in-progress', 'completed')
+            ORDER BY created_at DESC
+            LIMIT 1
+         ''', ('+61400001234',), {'idx_orders_phone_recent'}),
+        ("today's orders", '''
+            SELECT COUNT(*) FROM orders
+            WHERE created_at >= %s AND created_at < %s
+         ''', (today_start, today_end), {'idx_orders_created_id'}),
+        ('station hourly, today', '''
+            SELECT EXTRACT(HOUR FROM created_at) AS hour, COUNT(*)
+            FROM orders
+            WHERE station_id = %s AND created_at >= %s AND created_at < %s
+            GROUP BY hour
+         ''', (1, today_start, today_end), {'idx_orders_created_id', 'idx_orders_station_queue'}),
+        ('history page, last week', '''
+            SELECT id FROM orders
+            WHERE created_at >= %s
+            ORDER BY created_at DESC
+            LIMIT 50
+         ''', (week_start,), {'idx_orders_created_id'}),
+        ('history page, from a cursor', '''
+            SELECT id FROM orders
+            WHERE TRUE AND (created_at, id) < (%s, %s)
+            ORDER BY created_at DESC, id DESC
+            LIMIT 50
+         ''', (week_start, 500000), {'idx_orders_created_id'}),
+        ('history name search', '''
+            SELECT id FROM orders
+            WHERE (customer_name ILIKE %s OR customer_name ILIKE %s)
+            ORDER BY created_at DESC, id DESC
+            LIMIT 50
+         ''', ('Customer 4242%', '% Customer 4242%'), {'idx_orders_customer_name_trgm'}),
+    ]
+
+
+def plan_nodes(plan):
+    """Yield every node of an EXPLAIN (FORMAT JSON) plan"""
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def explain(conn, query, params):
+    cursor = conn.cursor()
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + query, params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+def check(conn, label, query, params, expected):
+    """Return (ok, summary) for one query's plan"""
+    nodes = list(plan_nodes(explain(conn, query, params)))
+    seq_scans = [n for n in nodes if n['Node Type'] == 'Seq Scan' and n.get('Relation Name') == 'orders']
+    used = {n['Index Name'] for n in nodes if 'Index Name' in n}
+    ok = not seq_scans and bool(used & expected)
+    summary = ', '.join(sorted(used)) or ('Seq Scan' if seq_scans else nodes[0]['Node Type'])
+    return ok, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN regression check for the orders indexes")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.getenv('DATABASE_URL', 'postgresql://localhost/expresso'))
+    failures = 0
+    try:
+        print(f"Seeding {args.rows} orders into {SCHEMA}...")
+        applied = seed(conn, args.rows)
+        print(f"Applied migrations {applied} of {[version for version, _, _ in SCHEMA_MIGRATIONS]}\n")
+
+        for label, query, params, expected in hot_queries():
+            ok, summary = check(conn, label, query, params, expected)
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {label:<30} {summary}")
+
+        # For contrast: the old predicate cannot use the created_at index
+        today = datetime.now().date()
+        _, summary = check(conn, 'legacy', 'SELECT COUNT(*) FROM orders WHERE DATE(created_at) = %s',
+                           (today,), {'idx_orders_created_id'})
+        print(f"\n     DATE(created_at) = today       {summary}")
+    finally:
+        conn.rollback()
+        conn.cursor().execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+
+    print(f"\n{failures} queries without their index")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Station Counter Concurrency Check
+Hammers order transitions from many threads and checks that station_stats
+stays consistent with the orders table: current_load equals the number of
+active orders and total_orders the number of orders ever completed, per
+station. order_rollups must match a fresh GROUP BY over orders as well.
+
+Half the threads complete or cancel orders one at a time through
+update_order_status_with_time, the other half in small batches through
+bulk_update_order_status. Every order gets two transitions, on different
+threads: mostly a duplicate completion, sometimes a cancel racing a
+completion. Either way it is completed exactly once.
+
+Runs against DATABASE_URL inside a throwaway schema built by create_tables and
+every SCHEMA_MIGRATIONS entry, so the generated columns and the rollup and
+order event triggers fire as they do in production. The scratch copy of the
+order event trigger notifies its own channel, so live data and live screens
+are untouched:
+    DATABASE_URL=postgresql://localhost/expresso python test_framework/station_counter_concurrency.py
+    python test_framework/station_counter_concurrency.py --orders 5000 --threads 32
+
+Exits non-zero if any station's counters drift.
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+import psycopg2
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from utils.database import (update_order_status_with_time, bulk_update_order_status, create_tables,
+                            ORDER_EVENTS_CHANNEL, ORDER_EVENTS_DDL)
+
+SCHEMA = 'station_counter_concurrency'
+STATIONS = 4
+
+
+def connect(db_url):
+    conn = psycopg2.connect(db_url)
+    conn.cursor().execute(f"SET search_path TO {SCHEMA}, public")
+    conn.commit()
+    return conn
+
+
+def seed(conn, orders):
+    """Create the scratch schema with `orders` pending orders spread over STATIONS"""
+    cursor = conn.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+    cursor.execute(f"SET search_path TO {SCHEMA}, public")
+    conn.commit()
+    create_tables(conn)
+    cursor.execute(ORDER_EVENTS_DDL[0].replace(f"'{ORDER_EVENTS_CHANNEL}'", f"'{SCHEMA}'"))
+    cursor.execute('''
+        INSERT INTO orders (order_number, phone, order_details, status, station_id, created_at)
+        SELECT 'C' || lpad(i::text, 6, '0'), '+614' || lpad(i::text, 8, '0'),
+               jsonb_build_object('name', 'Customer ' || i, 'type', 'latte',
+                                  'milk', CASE WHEN i %% 2 = 0 THEN 'oat' ELSE 'full cream' END),
+               CASE WHEN i %% 3 = 0 THEN 'in-progress' ELSE 'pending' END,
+               1 + i %% %(stations)s,
+               LOCALTIMESTAMP - make_interval(secs => 60 + i %% 600)
+        FROM generate_series(1, %(orders)s) AS i
+    ''', {'orders': orders, 'stations': STATIONS})
+    cursor.execute('''
+        INSERT INTO station_stats (station_id, current_load, total_orders)
+        SELECT station_id, COUNT(*), 0 FROM orders GROUP BY station_id
+    ''')
+    cursor.execute('SELECT id, order_number FROM orders ORDER BY id')
+    rows = cursor.fetchall()
+    conn.commit()
+    return rows
+
+
+def worker(db_url, index, plan, batch_size, errors):
+    """Apply one thread's share of transitions"""
+    conn = connect(db_url)
+    try:
+        if index % 2 == 0:
+            for (order_id, _), status in plan:
+                result = update_order_status_with_time(conn, order_id, status, f'thread-{index}')
+                if not result['success']:
+                    errors.append(result['error'])
+        else:
+            # One status per batch, as /orders/batch sends
+            batches = []
+            for status in ('completed', 'cancelled'):
+                numbers = [number for (_, number), planned in plan if planned == status]
+                batches += [(status, numbers[i:i + batch_size]) for i in range(0, len(numbers), batch_size)]
+            random.shuffle(batches)
+            for status, numbers in batches:
+                result = bulk_update_order_status(conn, numbers, status, f'thread-{index}')
+                if not result['success']:
+                    errors.append(result['error'])
+    finally:
+        conn.close()
+
+
+def check(conn):
+    """Return (station, field, counter, actual) for every counter that disagrees"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT s.station_id, s.current_load, s.total_orders,
+               COUNT(o.id) FILTER (WHERE o.status IN ('pending', 'in-progress')),
+               COUNT(o.id) FILTER (WHERE o.completed_at IS NOT NULL),
+               s.avg_completion_time, MIN(o.completion_time), MAX(o.completion_time)
+        FROM station_stats s
+        LEFT JOIN orders o ON o.station_id = s.station_id
+        GROUP BY s.station_id
+        ORDER BY s.station_id
+    ''')
+    drift = []
+    for station_id, load, total, active, completed, avg_time, min_time, max_time in cursor.fetchall():
+        print(f"station {station_id}: load {load} (active {active}), "
+              f"total_orders {total} (completed {completed}), avg {avg_time}s")
+        if load != active:
+            drift.append((station_id, 'current_load', load, active))
+        if total != completed:
+            drift.append((station_id, 'total_orders', total, completed))
+        if completed and not (min_time <= avg_time <= max_time):
+            drift.append((station_id, 'avg_completion_time', avg_time, f"{min_time}..{max_time}"))
+    conn.commit()
+    return drift
+
+
+def check_rollups(conn):
+    """Return (station, field, rollup, actual) for every order_rollups cell that
+    disagrees with a GROUP BY over orders"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        WITH actual AS (
+            SELECT date_trunc('hour', COALESCE(created_at, 'epoch'::timestamp)) AS hour,
+                   COALESCE(station_id, 0) AS station_id, COALESCE(coffee_type, '') AS coffee_type,
+                   COALESCE(milk_type, '') AS milk_type, status,
+                   COUNT(*) AS order_count, COALESCE(SUM(completion_time), 0) AS completion_time_total,
+                   COUNT(completion_time) AS completion_time_count
+            FROM orders
+            GROUP BY 1, 2, 3, 4, 5
+        ),
+        rollups AS (
+            SELECT hour, station_id, coffee_type, milk_type, status,
+                   order_count, completion_time_total, completion_time_count
+            FROM order_rollups
+            WHERE order_count <> 0 OR completion_time_total <> 0 OR completion_time_count <> 0
+        )
+        SELECT station_id, hour, coffee_type, milk_type, status,
+               r.order_count, a.order_count, r.completion_time_total, a.completion_time_total,
+               r.completion_time_count, a.completion_time_count
+        FROM actual a
+        FULL JOIN rollups r USING (hour, station_id, coffee_type, milk_type, status)
+        ORDER BY station_id, hour, coffee_type, milk_type, status
+    ''')
+    drift = []
+    cells = 0
+    for station_id, hour, coffee_type, milk_type, status, *pairs in cursor.fetchall():
+        cells += 1
+        cell = f"{hour:%H:00} {coffee_type}/{milk_type} {status}"
+        for field, rollup, actual in zip(('order_count', 'completion_time_total', 'completion_time_count'),
+                                         pairs[0::2], pairs[1::2]):
+            if (rollup or 0) != (actual or 0):
+                drift.append((station_id, f"rollup {cell} {field}", rollup or 0, actual or 0))
+    print(f"order_rollups: {cells} cells checked")
+    conn.commit()
+    return drift
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrency check for station_stats counters")
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--batch', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    db_url = os.getenv('DATABASE_URL', 'postgresql://localhost/expresso')
+    rng = random.Random(args.seed)
+    conn = connect(db_url)
+    try:
+        print(f"Seeding {args.orders} orders into {SCHEMA}...")
+        orders = seed(conn, args.orders)
+
+        # Two racing transitions per order: a duplicate completion, or one
+        # time in ten a cancel against a completion
+        transitions = []
+        for order in orders:
+            first = 'cancelled' if rng.random() < 0.1 else 'completed'
+            transitions += [(order, first), (order, 'completed')]
+        rng.shuffle(transitions)
+        plans = [transitions[i::args.threads] for i in range(args.threads)]
+
+        errors = []
+        threads = [threading.Thread(target=worker, args=(db_url, i, plan, args.batch, errors))
+                   for i, plan in enumerate(plans)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        print(f"{len(transitions)} transitions on {args.threads} threads in {elapsed:.2f}s, "
+              f"{len(errors)} errors\n")
+        for error in errors[:5]:
+            print(f"  error: {error}")
+
+        drift = check(conn) + check_rollups(conn)
+    finally:
+        conn.rollback()
+        conn.cursor().execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+
+    for station_id, field, counter, actual in drift:
+        print(f"FAIL station {station_id} {field}: {counter}, expected {actual}")
+    print(f"\n{len(drift)} counters drifted")
+    sys.exit(1 if drift or errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Wait Time Replay Benchmark
+Replays completed orders from the database in time order and scores the wait
+each customer would have been quoted against the wait they actually had
+(created_at to completed_at).
+
+At every arrival the station's queue is the replayed orders that arrived
+before it and were not yet ready. Compared:
+    fixed      - station_stats.wait_time as quoted before (15 unless set by hand)
+    load x avg - current_load * avg_completion_time, capped at 30 minutes,
+                 with the average moved as ORDER_TRANSITION_QUERY moves it
+    p50, p80   - WaitTimePredictor, trained only on completions seen so far
+
+Cancelled orders never complete, so they are left out of the queues.
+
+Reads DATABASE_URL and never writes to it:
+    DATABASE_URL=postgresql://localhost/expresso python test_framework/wait_time_replay_benchmark.py
+    python test_framework/wait_time_replay_benchmark.py --days 3 --station 2
+"""
+
+import argparse
+import heapq
+import json
+import os
+import statistics
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+import psycopg2
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.wait_time_predictor import WaitTimePredictor
+
+FIXED_WAIT = 15   # station_stats.wait_time default
+
+
+def load_orders(conn, days, station_id=None):
+    """Completed orders from the last `days` days, oldest first"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, station_id, created_at, completed_at
+        FROM orders
+        WHERE completed_at IS NOT NULL
+          AND completed_at >= created_at
+          AND station_id IS NOT NULL
+          AND created_at >= LOCALTIMESTAMP - make_interval(days => %(days)s)
+          AND (%(station)s::int IS NULL OR station_id = %(station)s)
+        ORDER BY created_at, id
+    ''', {'days': days, 'station': station_id})
+    return [(order_id, station, created.timestamp(), completed.timestamp())
+            for order_id, station, created, completed in cursor.fetchall()]
+
+
+def load_baristas(conn):
+    """Barista count per station, as WaitTimePredictor.load reads it"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT station_id, COALESCE(equipment_notes, '{}') FROM station_stats")
+    baristas = {}
+    for station_id, capabilities_json in cursor.fetchall():
+        try:
+            baristas[station_id] = json.loads(capabilities_json).get('baristas', 1)
+        except (ValueError, TypeError, AttributeError):
+            baristas[station_id] = 1
+    return baristas
+
+
+def replay(orders, baristas):
+    """Quote every order as it arrives; returns {method: [(quoted, actual)]} in minutes"""
+    predictor = WaitTimePredictor()
+    for station_id, count in baristas.items():
+        predictor.set_baristas(station_id, count)
+
+    # Completions sort before arrivals at the same instant
+    timeline = []
+    for order in orders:
+        order_id, _, created_at, completed_at = order
+        timeline.append((created_at, 1, order_id, order))
+        timeline.append((completed_at, 0, order_id, order))
+    heapq.heapify(timeline)
+
+    queue = defaultdict(int)
+    avg_completion = {}
+    quotes = defaultdict(list)
+    while timeline:
+        _, arriving, _, (order_id, station_id, created_at, completed_at) = heapq.heappop(timeline)
+        if not arriving:
+            queue[station_id] -= 1
+            predictor.record_completion(station_id, order_id, created_at, completed_at)
+            completion_time = int(completed_at - created_at)
+            previous = avg_completion.get(station_id)
+            avg_completion[station_id] = (completion_time if previous is None
+                                          else int(previous * 0.3 + completion_time * 0.7))
+            continue
+
+        queue[station_id] += 1
+        actual = (completed_at - created_at) / 60
+        load_formula = min(max(1, queue[station_id] * avg_completion.get(station_id, 180) // 60), 30)
+        quotes['fixed'].append((FIXED_WAIT, actual))
+        quotes['load x avg'].append((load_formula, actual))
+        quotes['p50'].append((predictor.estimate(station_id, queue[station_id], 0.5), actual))
+        quotes['p80'].append((predictor.estimate(station_id, queue[station_id], 0.8), actual))
+    return quotes
+
+
+def score(pairs):
+    errors = [quoted - actual for quoted, actual in pairs]
+    absolute = sorted(abs(error) for error in errors)
+    return {
+        'mae': statistics.fmean(absolute),
+        'median': statistics.median(absolute),
+        'p90': absolute[int(0.9 * (len(absolute) - 1))],
+        'bias': statistics.fmean(errors),
+        'covered': sum(1 for quoted, actual in pairs if actual <= quoted) / len(pairs)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay historical orders against wait time estimates")
+    parser.add_argument('--days', type=int, default=7, help="How far back to replay")
+    parser.add_argument('--station', type=int, help="Only replay one station")
+    args = parser.parse_args()
+
+    db_url = os.getenv('DATABASE_URL', 'postgresql://localhost/expresso')
+    conn = psycopg2.connect(db_url)
+    try:
+        orders = load_orders(conn, args.days, args.station)
+        baristas = load_baristas(conn)
+    finally:
+        conn.close()
+
+    if not orders:
+        print("No completed orders to replay")
+        sys.exit(1)
+
+    print(f"Replaying {len(orders)} completed orders from the last {args.days} days\n")
+    print(f"{'method':<12}{'MAE':>8}{'median':>8}{'p90':>8}{'bias':>8}{'covered':>10}")
+    for method, pairs in replay(orders, baristas).items():
+        s = score(pairs)
+        print(f"{method:<12}{s['mae']:>8.1f}{s['median']:>8.1f}{s['p90']:>8.1f}"
+              f"{s['bias']:>+8.1f}{s['covered']:>10.0%}")
+    print("\nErrors in minutes; bias is quoted minus actual; covered is the share "
+          "of orders ready within their quote")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,9 @@ PostgreSQL database connection and utility functions with SQLite fallback
 import logging
 import os
 import sys
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 import sqlite3
 import getpass
 
@@ -24,9 +26,579 @@ logger = logging.getLogger("expresso.database")
 # Database connection pool
 connection_pool = None
 
+# Pool sizing - mirrors DB_POOL_* in config.py
+DB_POOL_MIN_CONNECTIONS = int(os.environ.get('DB_POOL_MIN_CONNECTIONS', 1))
+DB_POOL_MAX_CONNECTIONS = int(os.environ.get('DB_POOL_MAX_CONNECTIONS', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+
+# Hourly order counts kept current by a trigger on orders, so statistics cost
+# O(hours in range) rather than a scan of every order. Key columns are never
+# NULL: missing drink or milk is stored as '' and a missing station as 0
+ORDER_ROLLUPS_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS order_rollups (
+        hour TIMESTAMP NOT NULL,
+        station_id INTEGER NOT NULL,
+        coffee_type TEXT NOT NULL,
+        milk_type TEXT NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        order_count INTEGER NOT NULL DEFAULT 0,
+        completion_time_total BIGINT NOT NULL DEFAULT 0,
+        completion_time_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, station_id, coffee_type, milk_type, status)
+    )
+    """,
+    """
+    CREATE OR REPLACE FUNCTION order_rollups_add(
+        p_created_at TIMESTAMP, p_station_id INTEGER, p_coffee_type TEXT,
+        p_milk_type TEXT, p_status TEXT, p_completion_time INTEGER, p_sign INTEGER
+    ) RETURNS void AS $$
+    BEGIN
+        INSERT INTO order_rollups AS r (hour, station_id, coffee_type, milk_type, status,
+                                        order_count, completion_time_total, completion_time_count)
+        VALUES (date_trunc('hour', COALESCE(p_created_at, 'epoch'::timestamp)),
+                COALESCE(p_station_id, 0), COALESCE(p_coffee_type, ''), COALESCE(p_milk_type, ''),
+                p_status, p_sign, p_sign * COALESCE(p_completion_time, 0),
+                CASE WHEN p_completion_time IS NULL THEN 0 ELSE p_sign END)
+        ON CONFLICT (hour, station_id, coffee_type, milk_type, status) DO UPDATE SET
+            order_count = r.order_count + EXCLUDED.order_count,
+            completion_time_total = r.completion_time_total + EXCLUDED.completion_time_total,
+            completion_time_count = r.completion_time_count + EXCLUDED.completion_time_count;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION order_rollups_track() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'TRUNCATE' THEN
+            DELETE FROM order_rollups;
+            RETURN NULL;
+        END IF;
+        IF TG_OP = 'UPDATE' THEN
+            -- Most updates (notes, notifications, pickup) don't move the order
+            IF NEW.created_at IS NOT DISTINCT FROM OLD.created_at
+               AND NEW.station_id IS NOT DISTINCT FROM OLD.station_id
+               AND NEW.coffee_type IS NOT DISTINCT FROM OLD.coffee_type
+               AND NEW.milk_type IS NOT DISTINCT FROM OLD.milk_type
+               AND NEW.status IS NOT DISTINCT FROM OLD.status
+               AND NEW.completion_time IS NOT DISTINCT FROM OLD.completion_time THEN
+                RETURN NULL;
+            END IF;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM order_rollups_add(OLD.created_at, OLD.station_id, OLD.coffee_type,
+                                      OLD.milk_type, OLD.status, OLD.completion_time, -1);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM order_rollups_add(NEW.created_at, NEW.station_id, NEW.coffee_type,
+                                      NEW.milk_type, NEW.status, NEW.completion_time, 1);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'order_rollups_row'
+                       AND tgrelid = 'orders'::regclass) THEN
+            CREATE TRIGGER order_rollups_row
+            AFTER INSERT OR UPDATE OR DELETE ON orders
+            FOR EACH ROW EXECUTE PROCEDURE order_rollups_track();
+        END IF;
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'order_rollups_truncate'
+                       AND tgrelid = 'orders'::regclass) THEN
+            CREATE TRIGGER order_rollups_truncate
+            AFTER TRUNCATE ON orders
+            FOR EACH STATEMENT EXECUTE PROCEDURE order_rollups_track();
+        END IF;
+    END
+    $$
+    """
+]
+
+# Rebuild order_rollups from orders. Writers wait on the lock until the
+# rebuild commits, so no transition is counted twice or lost
+ORDER_ROLLUPS_BACKFILL = [
+    "LOCK TABLE orders IN SHARE ROW EXCLUSIVE MODE",
+    "DELETE FROM order_rollups",
+    """
+    INSERT INTO order_rollups (hour, station_id, coffee_type, milk_type, status,
+                               order_count, completion_time_total, completion_time_count)
+    SELECT date_trunc('hour', COALESCE(created_at, 'epoch'::timestamp)),
+           COALESCE(station_id, 0), COALESCE(coffee_type, ''), COALESCE(milk_type, ''),
+           status, COUNT(*), COALESCE(SUM(completion_time), 0), COUNT(completion_time)
+    FROM orders
+    GROUP BY 1, 2, 3, 4, 5
+    """
+]
+
+# Order fields carried by live order events and sync snapshots; both are built
+# from this list so a client applies a delta to a snapshot row field for field
+ORDER_EVENT_FIELDS = (
+    'id', 'order_number', 'status', 'station_id', 'queue_priority',
+    'customer_name', 'coffee_type', 'milk_type', 'size',
+    'created_at', 'completed_at', 'picked_up_at'
+)
+ORDER_EVENTS_CHANNEL = 'order_events'
+
+
+def order_event_json(row):
+    """SQL json_build_object() of ORDER_EVENT_FIELDS for a row alias (e.g. NEW)"""
+    return 'json_build_object(' + ', '.join(f"'{field}', {row}.{field}" for field in ORDER_EVENT_FIELDS) + ')'
+
+
+# Every committed order change that a queue or display shows is announced on
+# ORDER_EVENTS_CHANNEL, whichever code path wrote it. Postgres delivers
+# notifications in commit order, after the writing transaction commits
+ORDER_EVENTS_DDL = [
+    f"""
+    CREATE OR REPLACE FUNCTION order_events_notify() RETURNS trigger AS $$
+    DECLARE
+        event_type TEXT;
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            event_type := 'create';
+        ELSIF TG_OP = 'DELETE' THEN
+            PERFORM pg_notify('{ORDER_EVENTS_CHANNEL}', json_build_object(
+                'type', 'remove', 'order', json_build_object('id', OLD.id),
+                'previous', json_build_object('status', OLD.status, 'station_id', OLD.station_id))::text);
+            RETURN NULL;
+        ELSIF NEW.status IS DISTINCT FROM OLD.status THEN
+            event_type := CASE NEW.status
+                WHEN 'pending' THEN 'requeue'
+                WHEN 'in-progress' THEN 'start'
+                WHEN 'completed' THEN 'complete'
+                WHEN 'cancelled' THEN 'cancel'
+                ELSE 'update' END;
+        ELSIF NEW.picked_up_at IS NOT NULL AND OLD.picked_up_at IS NULL THEN
+            event_type := 'pickup';
+        ELSIF NEW.station_id IS DISTINCT FROM OLD.station_id THEN
+            event_type := 'assign';
+        ELSIF NEW.queue_priority IS DISTINCT FROM OLD.queue_priority
+              OR NEW.order_details IS DISTINCT FROM OLD.order_details THEN
+            event_type := 'update';
+        ELSE
+            -- Notes, notifications, payment: nothing a queue shows
+            RETURN NULL;
+        END IF;
+        PERFORM pg_notify('{ORDER_EVENTS_CHANNEL}', json_build_object(
+            'type', event_type, 'order', {order_event_json('NEW')},
+            'previous', CASE WHEN TG_OP = 'UPDATE'
+                             THEN json_build_object('status', OLD.status, 'station_id', OLD.station_id) END)::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'order_events_row'
+                       AND tgrelid = 'orders'::regclass) THEN
+            CREATE TRIGGER order_events_row
+            AFTER INSERT OR UPDATE OR DELETE ON orders
+            FOR EACH ROW EXECUTE PROCEDURE order_events_notify();
+        END IF;
+    END
+    $$
+    """
+]
+
+# Every committed change to a user or their permissions is announced on
+# USERS_CHANGED_CHANNEL with the user's id, so each worker's user cache drops
+# the entry (services/user_cache.py). The trigger argument names the column
+# holding the user id
+USERS_CHANGED_CHANNEL = 'users_changed'
+USERS_CHANGED_DDL = [
+    f"""
+    CREATE OR REPLACE FUNCTION users_changed_notify() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM pg_notify('{USERS_CHANGED_CHANNEL}', to_jsonb(OLD) ->> TG_ARGV[0]);
+        ELSE
+            PERFORM pg_notify('{USERS_CHANGED_CHANNEL}', to_jsonb(NEW) ->> TG_ARGV[0]);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'users_changed_row'
+                       AND tgrelid = 'users'::regclass) THEN
+            CREATE TRIGGER users_changed_row
+            AFTER UPDATE OR DELETE ON users
+            FOR EACH ROW EXECUTE PROCEDURE users_changed_notify('id');
+        END IF;
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'users_changed_row'
+                       AND tgrelid = 'user_permissions'::regclass) THEN
+            CREATE TRIGGER users_changed_row
+            AFTER INSERT OR UPDATE OR DELETE ON user_permissions
+            FOR EACH ROW EXECUTE PROCEDURE users_changed_notify('user_id');
+        END IF;
+    END
+    $$
+    """
+]
+
+# Every write to settings, including raw SQL, bumps the single-row version
+# stamp and announces the new version on SETTINGS_CHANGED_CHANNEL, so each
+# worker's settings cache reloads (services/settings_service.py)
+SETTINGS_CHANGED_CHANNEL = 'settings_changed'
+SETTINGS_VERSION_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS settings_version (
+        id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        version BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    INSERT INTO settings_version (id, version) VALUES (1, 0)
+    ON CONFLICT (id) DO NOTHING
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION bump_settings_version() RETURNS trigger AS $$
+    DECLARE
+        new_version BIGINT;
+    BEGIN
+        UPDATE settings_version SET version = version + 1 WHERE id = 1
+        RETURNING version INTO new_version;
+        PERFORM pg_notify('{SETTINGS_CHANGED_CHANNEL}', new_version::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'settings_version_bump'
+                       AND tgrelid = 'settings'::regclass) THEN
+            CREATE TRIGGER settings_version_bump
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON settings
+            FOR EACH STATEMENT EXECUTE PROCEDURE bump_settings_version();
+        END IF;
+    END
+    $$
+    """
+]
+
+# Order numbers handed out per order_number_seq value; see migration 6
+ORDER_NUMBER_BLOCK = 20
+
+# Versioned schema changes as (version, name, statements). Each runs once per
+# database, in order, inside its own transaction; see apply_schema_migrations()
+SCHEMA_MIGRATIONS = [
+    (1, 'orders_queue_indexes', [
+        # Barista queues: station + status, served in priority then arrival order.
+        # Leads with station_id, so it also replaces idx_orders_station
+        '''CREATE INDEX IF NOT EXISTS idx_orders_station_queue
+           ON orders (station_id, status, queue_priority, created_at)''',
+        # Queues across all stations only ever look at the handful of active orders
+        '''CREATE INDEX IF NOT EXISTS idx_orders_active_queue
+           ON orders (status, queue_priority, created_at)
+           WHERE status IN ('pending', 'in-progress')''',
+        # Display board: completed but not yet collected, newest first
+        '''CREATE INDEX IF NOT EXISTS idx_orders_ready_for_pickup
+           ON orders (completed_at DESC NULLS LAST)
+           WHERE status = 'completed' AND picked_up_at IS NULL''',
+        """CREATE INDEX IF NOT EXISTS idx_orders_completed_recent
+           ON orders (completed_at DESC NULLS LAST)
+           WHERE status = 'completed'""",
+        # STATUS command and order history for a phone number.
+        # Leads with phone, so it also replaces idx_orders_phone
+        '''CREATE INDEX IF NOT EXISTS idx_orders_phone_recent
+           ON orders (phone, created_at DESC)''',
+        # Date range filters for history and statistics (see day_range).
+        # Replaced by idx_orders_created_id in migration 4
+        '''CREATE INDEX IF NOT EXISTS idx_orders_created_at
+           ON orders (created_at)''',
+        'DROP INDEX IF EXISTS idx_orders_phone',
+        'DROP INDEX IF EXISTS idx_orders_station',
+        'ANALYZE orders'
+    ]),
+    (2, 'orders_detail_columns', [
+        # The order_details fields every listing, display and statistics
+        # query reads, as real columns. Generated columns (PostgreSQL 12+)
+        # are backfilled when added and stay in step with every write and
+        # edit, including raw SQL inserts from scripts
+        """ALTER TABLE orders ADD COLUMN IF NOT EXISTS customer_name TEXT
+           GENERATED ALWAYS AS (order_details->>'name') STORED""",
+        """ALTER TABLE orders ADD COLUMN IF NOT EXISTS coffee_type TEXT
+           GENERATED ALWAYS AS (order_details->>'type') STORED""",
+        """ALTER TABLE orders ADD COLUMN IF NOT EXISTS milk_type TEXT
+           GENERATED ALWAYS AS (order_details->>'milk') STORED""",
+        """ALTER TABLE orders ADD COLUMN IF NOT EXISTS size TEXT
+           GENERATED ALWAYS AS (order_details->>'size') STORED""",
+        """ALTER TABLE orders ADD COLUMN IF NOT EXISTS sugar TEXT
+           GENERATED ALWAYS AS (order_details->>'sugar') STORED""",
+        'ANALYZE orders'
+    ]),
+    # Needs the detail columns from migration 2
+    (3, 'order_rollups', ORDER_ROLLUPS_DDL + ORDER_ROLLUPS_BACKFILL),
+    (4, 'orders_history_keyset', [
+        # Order history pages on (created_at, id); this also serves every
+        # plain created_at range, so it replaces idx_orders_created_at
+        """CREATE INDEX IF NOT EXISTS idx_orders_created_id
+           ON orders (created_at, id)""",
+        'DROP INDEX IF EXISTS idx_orders_created_at',
+        # Customer name search uses ILIKE with a leading wildcard. pg_trgm
+        # needs CREATE privilege on the database; without it the search
+        # still works, just without the index
+        """
+        DO $$
+        BEGIN
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        EXCEPTION WHEN OTHERS THEN
+            RAISE WARNING 'pg_trgm unavailable, customer name search will not be indexed: %', SQLERRM;
+        END
+        $$
+        """,
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                CREATE INDEX IF NOT EXISTS idx_orders_customer_name_trgm
+                ON orders USING gin (customer_name gin_trgm_ops);
+            END IF;
+        END
+        $$
+        """
+    ]),
+    (5, 'order_events_notify', ORDER_EVENTS_DDL),
+    (6, 'order_number_sequence', [
+        # Each nextval reserves a block of ORDER_NUMBER_BLOCK order numbers
+        # for one worker (services/order_numbers.py). Starting at 32^5 keeps
+        # every code six base32 characters long
+        f"""CREATE SEQUENCE IF NOT EXISTS order_number_seq
+            START WITH {32 ** 5} MINVALUE {32 ** 5} INCREMENT BY {ORDER_NUMBER_BLOCK}"""
+    ]),
+    # Tables and columns that request handlers used to create on first use,
+    # with the definitions those handlers used. Handlers now assume them
+    (7, 'request_path_tables', [
+        'ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS station_id INTEGER',
+        """CREATE TABLE IF NOT EXISTS order_messages (
+            id SERIAL PRIMARY KEY,
+            order_number VARCHAR(50) NOT NULL,
+            phone VARCHAR(50) NOT NULL,
+            message TEXT NOT NULL,
+            message_sid VARCHAR(100),
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        """CREATE TABLE IF NOT EXISTS sms_messages (
+            id SERIAL PRIMARY KEY,
+            phone_number VARCHAR(20) NOT NULL,
+            message_body TEXT NOT NULL,
+            sender_name VARCHAR(100),
+            station_id INTEGER,
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed BOOLEAN DEFAULT FALSE,
+            response_sent TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS sms_status_logs (
+            id SERIAL PRIMARY KEY,
+            message_sid TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        # As InventoryItem.create_tables defines it (it runs later at
+        # startup and owns the rest of the inventory schema); the
+        # consolidated API's inventory tables below reference it
+        """CREATE TABLE IF NOT EXISTS inventory_items (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            category VARCHAR(50) NOT NULL,
+            amount DECIMAL(10,2) DEFAULT 0,
+            unit VARCHAR(20) NOT NULL,
+            capacity DECIMAL(10,2) NOT NULL,
+            minimum_threshold DECIMAL(10,2),
+            notes TEXT,
+            station_id INTEGER,
+            last_updated TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_by INTEGER
+        )""",
+        """CREATE TABLE IF NOT EXISTS inventory_adjustments (
+            id SERIAL PRIMARY KEY,
+            item_id INTEGER REFERENCES inventory_items(id),
+            previous_quantity DECIMAL(10, 2) NOT NULL,
+            new_quantity DECIMAL(10, 2) NOT NULL,
+            adjustment_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            reason VARCHAR(50) NOT NULL,
+            notes TEXT,
+            user_id INTEGER
+        )""",
+        """CREATE TABLE IF NOT EXISTS inventory_low_stock_reports (
+            id SERIAL PRIMARY KEY,
+            item_id INTEGER REFERENCES inventory_items(id),
+            reporter_id INTEGER,
+            reporter_name VARCHAR(100),
+            report_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            urgency VARCHAR(20) DEFAULT 'normal',
+            notes TEXT,
+            status VARCHAR(20) DEFAULT 'open'
+        )""",
+        """CREATE TABLE IF NOT EXISTS inventory_restock_requests (
+            id SERIAL PRIMARY KEY,
+            request_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            requester_id INTEGER,
+            requester_name VARCHAR(100),
+            status VARCHAR(20) DEFAULT 'pending',
+            notes TEXT,
+            delivery_expected_date DATE
+        )""",
+        """CREATE TABLE IF NOT EXISTS inventory_restock_request_items (
+            id SERIAL PRIMARY KEY,
+            request_id INTEGER REFERENCES inventory_restock_requests(id),
+            item_id INTEGER REFERENCES inventory_items(id),
+            quantity_requested DECIMAL(10, 2) NOT NULL,
+            quantity_received DECIMAL(10, 2) DEFAULT 0
+        )""",
+        """CREATE TABLE IF NOT EXISTS stock_items (
+            id SERIAL PRIMARY KEY,
+            category VARCHAR(50) NOT NULL,
+            name VARCHAR(100) NOT NULL,
+            notes TEXT,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_by INTEGER
+        )""",
+        """CREATE TABLE IF NOT EXISTS schedule_shifts (
+            id SERIAL PRIMARY KEY,
+            barista_id INTEGER,
+            barista_name VARCHAR(100),
+            station_id INTEGER,
+            date DATE,
+            start_time TIME,
+            end_time TIME,
+            status VARCHAR(20) DEFAULT 'upcoming',
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        """CREATE TABLE IF NOT EXISTS schedule_breaks (
+            id SERIAL PRIMARY KEY,
+            barista_id INTEGER,
+            barista_name VARCHAR(100),
+            date DATE,
+            start_time TIME,
+            end_time TIME,
+            break_type VARCHAR(20),
+            status VARCHAR(20) DEFAULT 'upcoming',
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        """CREATE TABLE IF NOT EXISTS schedule_rush_periods (
+            id SERIAL PRIMARY KEY,
+            date DATE,
+            start_time TIME,
+            end_time TIME,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        """CREATE TABLE IF NOT EXISTS event_breaks (
+            id SERIAL PRIMARY KEY,
+            title VARCHAR(100) NOT NULL,
+            day_of_week INTEGER NOT NULL,
+            start_time TIME NOT NULL,
+            end_time TIME NOT NULL,
+            stations JSONB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        # Stations that predate the capabilities column get the defaults
+        # CoffeeOrderSystem used to give them when it added the column
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                           WHERE table_schema = current_schema()
+                             AND table_name = 'station_stats' AND column_name = 'capabilities') THEN
+                ALTER TABLE station_stats
+                    ADD COLUMN capabilities JSONB DEFAULT '{}',
+                    ADD COLUMN IF NOT EXISTS capacity INTEGER DEFAULT 10;
+                UPDATE station_stats
+                SET capabilities = json_build_object(
+                    'alt_milk', TRUE,
+                    'high_volume', station_id = 1,
+                    'vip_service', station_id = 3
+                );
+            END IF;
+        END
+        $$
+        """
+    ]),
+    # Bumped by revoke_all_user_tokens; tokens carry the version they were
+    # issued under and the user cache rejects older ones
+    (8, 'users_token_version', [
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS token_version INTEGER NOT NULL DEFAULT 0'
+    ]),
+    (9, 'users_changed_notify', USERS_CHANGED_DDL),
+    # Outbound SMS queue (services/sms_outbox.py). Tables created before
+    # messages were claimed get the claim columns
+    (10, 'sms_outbox', [
+        """CREATE TABLE IF NOT EXISTS sms_outbox (
+            id SERIAL PRIMARY KEY,
+            to_number VARCHAR(20) NOT NULL,
+            body TEXT NOT NULL,
+            status VARCHAR(10) NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            message_sid VARCHAR(64),
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP,
+            claimed_by VARCHAR(64),
+            claimed_at TIMESTAMP
+        )""",
+        """ALTER TABLE sms_outbox
+            ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(64),
+            ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP""",
+        "CREATE INDEX IF NOT EXISTS idx_sms_outbox_queued ON sms_outbox (id) WHERE status = 'queued'",
+        "CREATE INDEX IF NOT EXISTS idx_sms_outbox_sending ON sms_outbox (claimed_at) WHERE status = 'sending'"
+    ]),
+    (11, 'settings_version', SETTINGS_VERSION_DDL),
+    # Inbound SMS, stored before the webhook acks Twilio
+    # (services/sms_inbox.py). UNIQUE(message_sid) is the dedupe for
+    # Twilio's retries
+    (12, 'sms_inbox', [
+        """CREATE TABLE IF NOT EXISTS sms_inbox (
+            id SERIAL PRIMARY KEY,
+            message_sid VARCHAR(64) UNIQUE,
+            from_number VARCHAR(20) NOT NULL,
+            body TEXT NOT NULL,
+            sender_name VARCHAR(100),
+            status VARCHAR(10) NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP,
+            claimed_by VARCHAR(64),
+            claimed_at TIMESTAMP
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_sms_inbox_queued ON sms_inbox (id) WHERE status = 'queued'",
+        "CREATE INDEX IF NOT EXISTS idx_sms_inbox_processing ON sms_inbox (claimed_at) WHERE status = 'processing'"
+    ])
+]
+
+# ThreadedConnectionPool raises as soon as it is exhausted, so checkouts first
+# wait on this semaphore; it is sized to the pool when the pool is created
+_pool_slots = None
+
+# Pool checkout metrics, guarded by _metrics_lock
+_metrics_lock = threading.Lock()
+pool_metrics = {
+    'checkouts': 0,
+    'returns': 0,
+    'timeouts': 0,
+    'in_use': 0,
+    'peak_in_use': 0,
+    'total_wait_ms': 0.0,
+    'max_wait_ms': 0.0,
+    'request_checkouts': 0
+}
+
 def init_db_pool(db_url=None):
     """Initialize the database connection pool"""
-    global connection_pool
+    global connection_pool, _pool_slots
     
     # Get system username upfront so it's available throughout the function
     system_username = getpass.getuser()
@@ -84,10 +656,10 @@ def init_db_pool(db_url=None):
         
         logger.info(f"Connecting to PostgreSQL as {user}@{host}:{port}/{dbname}")
         
-        # Create a connection pool
-        connection_pool = pool.SimpleConnectionPool(
-            minconn=1,
-            maxconn=10,
+        # Create a thread-safe connection pool shared by every request
+        connection_pool = pool.ThreadedConnectionPool(
+            minconn=DB_POOL_MIN_CONNECTIONS,
+            maxconn=DB_POOL_MAX_CONNECTIONS,
             user=user,
             password=password,
             host=host,
@@ -95,7 +667,9 @@ def init_db_pool(db_url=None):
             dbname=dbname
         )
         
-        logger.info(f"PostgreSQL connection pool initialized, connected to {host}:{port}/{dbname}")
+        _pool_slots = threading.BoundedSemaphore(DB_POOL_MAX_CONNECTIONS)
+        
+        logger.info(f"PostgreSQL connection pool initialized ({DB_POOL_MIN_CONNECTIONS}-{DB_POOL_MAX_CONNECTIONS} connections), connected to {host}:{port}/{dbname}")
         
         # Test connection
         conn = connection_pool.getconn()
@@ -104,8 +678,9 @@ def init_db_pool(db_url=None):
         version = cursor.fetchone()
         logger.info(f"PostgreSQL version: {version[0]}")
         
-        # Create necessary tables
+        # Create necessary tables, then record what the schema looks like
         create_tables(conn)
+        get_schema_capabilities().load(conn)
         
         # Return connection to pool
         connection_pool.putconn(conn)
@@ -149,7 +724,7 @@ def get_db_connection(db_url=None):
         init_db_pool(db_url)
     
     try:
-        conn = connection_pool.getconn()
+        conn = _checkout_pooled_connection()
         return conn
     except Exception as e:
         logger.error(f"Error getting database connection: {str(e)}")
@@ -189,10 +764,112 @@ def close_connection(conn):
             conn.close()
         elif connection_pool:
             # Return PostgreSQL connection to the pool
-            connection_pool.putconn(conn)
+            _return_pooled_connection(conn)
     except Exception as e:
         logger.error(f"Error closing connection: {str(e)}")
 
+def _checkout_pooled_connection():
+    """Take a connection from the pool, waiting up to DB_POOL_TIMEOUT for a free slot"""
+    started = time.monotonic()
+    
+    if _pool_slots is not None and not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        with _metrics_lock:
+            pool_metrics['timeouts'] += 1
+        raise pool.PoolError(f"Timed out after {DB_POOL_TIMEOUT}s waiting for a pooled connection")
+    
+    try:
+        conn = connection_pool.getconn()
+    except Exception:
+        if _pool_slots is not None:
+            _pool_slots.release()
+        raise
+    
+    wait_ms = (time.monotonic() - started) * 1000
+    with _metrics_lock:
+        pool_metrics['checkouts'] += 1
+        pool_metrics['in_use'] += 1
+        pool_metrics['peak_in_use'] = max(pool_metrics['peak_in_use'], pool_metrics['in_use'])
+        pool_metrics['total_wait_ms'] += wait_ms
+        pool_metrics['max_wait_ms'] = max(pool_metrics['max_wait_ms'], wait_ms)
+    
+    return conn
+
+def _return_pooled_connection(conn):
+    """Put a connection back in the pool and free its slot"""
+    try:
+        connection_pool.putconn(conn)
+    finally:
+        with _metrics_lock:
+            pool_metrics['returns'] += 1
+            pool_metrics['in_use'] = max(0, pool_metrics['in_use'] - 1)
+        if _pool_slots is not None:
+            try:
+                _pool_slots.release()
+            except ValueError:
+                # Connection did not come through _checkout_pooled_connection
+                pass
+
+def get_pool_metrics():
+    """Return a snapshot of connection pool usage for health/monitoring endpoints"""
+    with _metrics_lock:
+        metrics = dict(pool_metrics)
+    
+    metrics['min_connections'] = DB_POOL_MIN_CONNECTIONS
+    metrics['max_connections'] = DB_POOL_MAX_CONNECTIONS
+    metrics['avg_wait_ms'] = round(metrics['total_wait_ms'] / metrics['checkouts'], 3) if metrics['checkouts'] else 0.0
+    metrics['total_wait_ms'] = round(metrics['total_wait_ms'], 3)
+    metrics['max_wait_ms'] = round(metrics['max_wait_ms'], 3)
+    metrics['initialized'] = connection_pool is not None
+    return metrics
+
+def get_request_connection():
+    """Get the connection bound to the current Flask request
+    
+    The first call in a request checks a connection out of the pool and every
+    later call in the same request reuses it. It is handed back by the
+    teardown hook registered in init_app, so handlers never share a
+    connection (or an aborted transaction) with other requests. Background
+    workers get the same behaviour by running each job in its own
+    app.app_context().
+    
+    Returns:
+        Database connection, or None when called outside an app context
+    """
+    from flask import g, has_app_context
+    
+    if not has_app_context():
+        return None
+    
+    conn = g.get('_db_conn')
+    if conn is None:
+        conn = get_db_connection()
+        g._db_conn = conn
+        with _metrics_lock:
+            pool_metrics['request_checkouts'] += 1
+    
+    return conn
+
+def release_request_connection(exception=None):
+    """Teardown hook: roll back anything left open and return the request connection"""
+    from flask import g
+    
+    conn = g.pop('_db_conn', None)
+    if conn is None:
+        return
+    
+    try:
+        # Never hand a half-finished or aborted transaction to the next request
+        if not isinstance(conn, sqlite3.Connection):
+            conn.rollback()
+    except Exception as e:
+        logger.error(f"Error rolling back request connection: {str(e)}")
+    
+    close_connection(conn)
+
+def init_app(app):
+    """Register the per-request connection teardown on a Flask app"""
+    app.teardown_appcontext(release_request_connection)
+
 def execute_query(conn, query, params=None, fetch_all=False, fetch_one=False):
     """
     Execute a query with parameters and optionally fetch results
@@ -503,10 +1180,9 @@ def create_tables(conn):
     )
     ''')
     
-    # Create indexes for commonly queried fields
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_phone ON orders(phone);')
+    # Create indexes for commonly queried fields (queue and date indexes
+    # are added by SCHEMA_MIGRATIONS)
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_station ON orders(station_id);')
     
     # Check if completed_at column exists, add it if not
     try:
@@ -536,7 +1212,160 @@ def create_tables(conn):
         logger.error(f"Error checking for wait_time column: {str(e)}")
     
     conn.commit()
+    
+    apply_schema_migrations(conn)
     logger.info("Database tables and indexes created successfully")
+
+def apply_schema_migrations(conn):
+    """
+    Apply any SCHEMA_MIGRATIONS not yet recorded in the schema_migrations table
+    
+    Workers starting at the same time serialize on an advisory lock, so each
+    migration runs exactly once.
+    
+    Args:
+        conn: Database connection
+        
+    Returns:
+        List of migration versions applied
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.commit()
+    
+    applied = []
+    for version, name, statements in SCHEMA_MIGRATIONS:
+        try:
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))")
+            cursor.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+            if cursor.fetchone():
+                conn.commit()
+                continue
+            
+            logger.info(f"Applying schema migration {version}: {name}")
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (version, name)
+            )
+            conn.commit()
+            applied.append(version)
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Schema migration {version} ({name}) failed: {str(e)}")
+            raise
+    
+    return applied
+
+class SchemaCapabilities:
+    """
+    Tables and columns in the database, read once after migrations
+    
+    Handlers ask this instead of querying information_schema per request.
+    Until it is loaded (scripts that never start the pool) every table and
+    column the migrations define is assumed to exist.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._columns = {}
+        self.version = None
+        self.loaded_at = None
+    
+    @property
+    def loaded(self):
+        return self.loaded_at is not None
+    
+    def load(self, conn):
+        """
+        Read the schema version and every table's columns
+        
+        Args:
+            conn: Database connection
+        """
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(version) FROM schema_migrations")
+        row = cursor.fetchone()
+        version = row['max'] if isinstance(row, dict) else row[0]
+        cursor.execute("""
+            SELECT table_name, column_name
+            FROM information_schema.columns
+            WHERE table_schema = current_schema()
+        """)
+        columns = {}
+        for row in cursor.fetchall():
+            table, column = (row['table_name'], row['column_name']) if isinstance(row, dict) else row
+            columns.setdefault(table, set()).add(column)
+        conn.commit()
+        
+        with self._lock:
+            self._columns = {table: frozenset(names) for table, names in columns.items()}
+            self.version = version
+            self.loaded_at = datetime.now()
+        logger.info(f"Schema version {version}: {len(columns)} tables")
+    
+    def has_table(self, table):
+        """Whether a table exists"""
+        return not self.loaded or table in self._columns
+    
+    def has_column(self, table, column):
+        """Whether a table has a column"""
+        return not self.loaded or column in self._columns.get(table, ())
+    
+    @property
+    def tables(self):
+        """Sorted table names"""
+        return sorted(self._columns)
+    
+    def get_metrics(self):
+        """Schema version and size for the health endpoint"""
+        return {
+            'version': self.version,
+            'latest_version': SCHEMA_MIGRATIONS[-1][0],
+            'tables': len(self._columns),
+            'loaded_at': self.loaded_at.isoformat() if self.loaded_at else None
+        }
+
+_schema_capabilities = SchemaCapabilities()
+
+def get_schema_capabilities():
+    """Process-wide view of the database schema"""
+    return _schema_capabilities
+
+def day_range(start_date, end_date=None):
+    """
+    Half-open datetime bounds covering whole days
+    
+    Filter with created_at >= start AND created_at < end rather than
+    DATE(created_at) = day: the range can use the created_at index, the
+    function call cannot.
+    
+    Args:
+        start_date: First day, as a date, datetime or 'YYYY-MM-DD' string
+        end_date: Last day included (defaults to start_date)
+        
+    Returns:
+        Tuple of (start, end) datetimes
+    """
+    def as_date(value):
+        if isinstance(value, str):
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        if isinstance(value, datetime):
+            return value.date()
+        return value
+    
+    first = as_date(start_date)
+    last = as_date(end_date) if end_date is not None else first
+    start = datetime.combine(first, datetime.min.time())
+    end = datetime.combine(last + timedelta(days=1), datetime.min.time())
+    return start, end
     
 def create_sqlite_tables(conn):
     """Create necessary tables for SQLite"""
@@ -616,175 +1445,351 @@ def create_sqlite_tables(conn):
     logger.info("SQLite tables and indexes created successfully")
 
 # Function to update a completed order status with accurate completion time
+# One order transition and its station counters in a single statement. The
+# order row is locked first, then its station_stats row (even when the
+# counters don't move), and order_rollups last, when the orders trigger fires
+# at the end of the statement; bulk_update_order_status takes the same locks
+# in the same order, so the two never deadlock. station_stats is changed with
+# UPDATE ... SET x = x + delta, which Postgres re-evaluates against the latest
+# row version, so concurrent completions never lose a count or an average step.
+# Load drops when an order leaves the active queue (completed/cancelled) and
+# rises again if it is put back; each completion moves avg_completion_time
+# 70% of the way to its completion time
+ORDER_TRANSITION_QUERY = """
+    WITH current AS (
+        SELECT id, status, created_at, station_id
+        FROM orders
+        WHERE id = %(order_id)s
+        FOR UPDATE
+    ),
+    station_lock AS (
+        SELECT s.station_id
+        FROM station_stats s
+        JOIN current c ON s.station_id = c.station_id
+        FOR UPDATE OF s
+    ),
+    updated AS (
+        UPDATE orders o
+        SET status = %(status)s,
+            last_modified_by = %(editor)s,
+            updated_at = %(now)s,
+            completion_time = CASE WHEN t.completing
+                                   THEN EXTRACT(EPOCH FROM (%(now)s - c.created_at))::int
+                                   ELSE o.completion_time END,
+            completed_at = CASE WHEN t.completing THEN %(now)s ELSE o.completed_at END
+        FROM current c
+             LEFT JOIN station_lock l ON l.station_id = c.station_id
+             CROSS JOIN LATERAL (SELECT %(status)s = 'completed' AND c.status IS DISTINCT FROM 'completed' AS completing,
+                                        CASE WHEN %(status)s IN ('completed', 'cancelled')
+                                                  AND c.status NOT IN ('completed', 'cancelled') THEN -1
+                                             WHEN %(status)s NOT IN ('completed', 'cancelled')
+                                                  AND c.status IN ('completed', 'cancelled') THEN 1
+                                             ELSE 0 END AS load_delta) t
+        WHERE o.id = c.id
+        RETURNING o.id, o.order_number, o.phone, o.station_id, c.status AS previous_status,
+                  o.completion_time, t.completing, t.load_delta
+    ),
+    station AS (
+        UPDATE station_stats s
+        SET current_load = GREATEST(0, s.current_load + u.load_delta),
+            total_orders = s.total_orders + u.completing::int,
+            avg_completion_time = CASE
+                WHEN NOT u.completing OR u.completion_time IS NULL THEN s.avg_completion_time
+                WHEN COALESCE(s.total_orders, 0) = 0 OR s.avg_completion_time IS NULL THEN u.completion_time
+                ELSE (s.avg_completion_time * 0.3 + u.completion_time * 0.7)::int
+            END,
+            last_updated = %(now)s
+        FROM updated u
+        WHERE s.station_id = u.station_id AND (u.completing OR u.load_delta <> 0)
+        RETURNING s.current_load, s.total_orders, s.avg_completion_time
+    )
+    SELECT u.id, u.order_number, u.phone, u.station_id, u.previous_status,
+           u.completion_time, u.completing, u.load_delta,
+           st.current_load, st.total_orders, st.avg_completion_time
+    FROM updated u
+    LEFT JOIN station st ON TRUE
+"""
+
+def transition_order(cursor, order_id, status, editor=None):
+    """
+    Run ORDER_TRANSITION_QUERY for one order; the caller commits
+
+    Args:
+        cursor: Database cursor
+        order_id: Order ID
+        status: New status (pending, in-progress, completed, cancelled)
+        editor: Who made the change
+
+    Returns:
+        Dictionary with the order's number, phone, station_id,
+        previous_status, completion_time (if it completed now), load_delta
+        and the station's counters after the change, or None if the order
+        does not exist
+    """
+    cursor.execute(ORDER_TRANSITION_QUERY, {
+        'order_id': order_id,
+        'status': status,
+        'editor': editor or 'system',
+        'now': datetime.now()
+    })
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    if not isinstance(row, dict):
+        row = dict(zip(('id', 'order_number', 'phone', 'station_id', 'previous_status',
+                        'completion_time', 'completing', 'load_delta', 'current_load',
+                        'total_orders', 'avg_completion_time'), row))
+    if not row['completing']:
+        row['completion_time'] = None
+    return row
+
+def insert_order(cursor, columns):
+    """
+    Insert an order and add it to its station's load in one statement;
+    the caller commits
+
+    Args:
+        cursor: Database cursor
+        columns: Dictionary of orders column -> value (station_id included)
+
+    Returns:
+        New order ID
+    """
+    cursor.execute(f"""
+        WITH new_order AS (
+            INSERT INTO orders ({', '.join(columns)})
+            VALUES ({', '.join(['%s'] * len(columns))})
+            RETURNING id, station_id
+        ),
+        station AS (
+            INSERT INTO station_stats (station_id, current_load, last_updated)
+            SELECT station_id, 1, LOCALTIMESTAMP FROM new_order WHERE station_id IS NOT NULL
+            ON CONFLICT (station_id) DO UPDATE SET
+                current_load = station_stats.current_load + 1,
+                last_updated = EXCLUDED.last_updated
+        )
+        SELECT id FROM new_order
+    """, list(columns.values()))
+    row = cursor.fetchone()
+    return row['id'] if isinstance(row, dict) else row[0]
+
 def update_order_status_with_time(conn, order_id, status, editor=None):
     """
     Update order status and record accurate completion time for analytics
-    
+
+    The order and its station's load, total_orders and avg_completion_time
+    change together in one statement (ORDER_TRANSITION_QUERY).
+
     Args:
         conn: Database connection
         order_id: Order ID
         status: New status (pending, in-progress, completed, cancelled)
         editor: Who made the change
-        
+
     Returns:
         Dictionary with updated order info
     """
     cursor = None
     try:
-        # Calculate completion time if changing to completed status
-        completion_time = None
-        station_id = None
-        
         cursor = conn.cursor()
-        
-        # Get current order info
-        cursor.execute('''
-            SELECT 
-                created_at, station_id, status, order_number, phone
-            FROM orders 
-            WHERE id = %s
-        ''', (order_id,))
-        
-        result = cursor.fetchone()
-        if not result:
+        result = transition_order(cursor, order_id, status, editor)
+        if result is None:
+            conn.rollback()
             return {'success': False, 'error': 'Order not found'}
-        
-        created_at, station_id, current_status, order_number, phone = result
-        
-        # Calculate accurate completion time when transitioning to completed
-        if status == 'completed' and current_status != 'completed':
-            current_time = datetime.now()
-            completion_time = int((current_time - created_at).total_seconds())
-            
-            # Update order with completion time
-            try:
-                cursor.execute('''
-                    UPDATE orders 
-                    SET 
-                        status = %s, 
-                        last_modified_by = %s,
-                        completion_time = %s,
-                        completed_at = %s,
-                        updated_at = %s
-                    WHERE id = %s
-                    RETURNING completion_time
-                ''', (
-                    status, 
-                    editor or 'system', 
-                    completion_time,
-                    current_time,
-                    current_time, 
-                    order_id
-                ))
-            except Exception as e:
-                logger.error(f"Error updating order with completed_at column: {str(e)}")
-                # Fallback in case completed_at column doesn't exist
-                cursor.execute('''
-                    UPDATE orders 
-                    SET 
-                        status = %s, 
-                        last_modified_by = %s,
-                        completion_time = %s,
-                        updated_at = %s
-                    WHERE id = %s
-                    RETURNING completion_time
-                ''', (
-                    status, 
-                    editor or 'system', 
-                    completion_time,
-                    current_time, 
-                    order_id
-                ))
-        else:
-            # Update without completion time for other status changes
+
+        conn.commit()
+
+        return {
+            'success': True,
+            'order_id': order_id,
+            'order_number': result['order_number'],
+            'status': status,
+            'station_id': result['station_id'],
+            'completion_time': result['completion_time'],
+            'phone': result['phone']
+        }
+
+    except Exception as e:
+        if conn:
+            conn.rollback()
+
+        logger.error(f"Error updating order status: {str(e)}")
+
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+    finally:
+        if cursor:
+            cursor.close()
+
+def bulk_update_order_status(conn, order_numbers, status, editor=None):
+    """
+    Move many orders to a new status in one transaction, with the same side
+    effects update_order_status_with_time applies to a single order
+
+    Orders already in the target status are left alone, so completion
+    times and station counts are never applied twice. Station load,
+    total_orders and avg_completion_time are updated once per station.
+    Load drops when an order leaves the active queue (completed/cancelled)
+    and rises again when a batch puts it back.
+
+    Args:
+        conn: Database connection
+        order_numbers: Order numbers to transition
+        status: New status (pending, in-progress, completed, cancelled)
+        editor: Who made the change
+
+    Returns:
+        Dictionary with the transitioned orders (order_number, phone,
+        station_id, previous_status, completion_time, for_friend,
+        coffee_type), the net load change per station, and the order
+        numbers not found or already in status
+    """
+    cursor = None
+    order_numbers = list(dict.fromkeys(order_numbers))
+    try:
+        cursor = conn.cursor()
+        now = datetime.now()
+        completing = status == 'completed'
+
+        # Locks go orders (by id), then station_stats (by station), then
+        # order_rollups as the orders trigger fires: the order
+        # ORDER_TRANSITION_QUERY takes them in, so batches and single
+        # transitions can't deadlock. Rollup rows are keyed by station, so
+        # holding the station locks first also serialises their upserts
+        # whatever order the UPDATE visits the orders in
+        cursor.execute('''
+            SELECT id, status, station_id,
+                   EXTRACT(EPOCH FROM (%(now)s - created_at))::int AS completion_time
+            FROM orders
+            WHERE order_number = ANY(%(order_numbers)s) AND status <> %(status)s
+            ORDER BY id
+            FOR UPDATE
+        ''', {
+            'order_numbers': order_numbers,
+            'status': status,
+            'now': now
+        })
+        targets = cursor.fetchall()
+
+        # Per-station deltas: load change, completions, completion times
+        finished = ('completed', 'cancelled')
+        deltas = {}
+        for _, previous_status, station_id, completion_time in targets:
+            if station_id is None:
+                continue
+            delta = deltas.setdefault(station_id, {'load': 0, 'completed': 0, 'times': []})
+            if status in finished and previous_status not in finished:
+                delta['load'] -= 1
+            elif status not in finished and previous_status in finished:
+                delta['load'] += 1
+            if completing:
+                delta['completed'] += 1
+                if completion_time is not None:
+                    delta['times'].append(completion_time)
+
+        if deltas:
+            # Lock every touched station in a fixed order, counters moving or not
+            station_ids = sorted(deltas)
             cursor.execute('''
-                UPDATE orders 
-                SET 
-                    status = %s, 
-                    last_modified_by = %s,
-                    updated_at = %s
-                WHERE id = %s
+                SELECT station_id FROM station_stats
+                WHERE station_id = ANY(%s)
+                ORDER BY station_id
+                FOR UPDATE
+            ''', (station_ids,))
+            # Each completion moves the average 70% of the way to its time;
+            # k completions at mean m in one step leave 0.3^k of the old average
+            cursor.execute('''
+                UPDATE station_stats s
+                SET current_load = GREATEST(0, s.current_load + d.load_delta),
+                    total_orders = s.total_orders + d.completed,
+                    avg_completion_time = CASE
+                        WHEN d.mean_time IS NULL THEN s.avg_completion_time
+                        WHEN COALESCE(s.total_orders, 0) = 0 OR s.avg_completion_time IS NULL
+                            THEN d.mean_time::int
+                        ELSE (s.avg_completion_time * power(0.3, d.completed)
+                              + d.mean_time * (1 - power(0.3, d.completed)))::int
+                    END,
+                    last_updated = %s
+                FROM unnest(%s::int[], %s::int[], %s::int[], %s::float8[])
+                     AS d(station_id, load_delta, completed, mean_time)
+                WHERE s.station_id = d.station_id
             ''', (
-                status, 
-                editor or 'system', 
-                datetime.now(), 
-                order_id
+                now,
+                station_ids,
+                [deltas[station_id]['load'] for station_id in station_ids],
+                [deltas[station_id]['completed'] for station_id in station_ids],
+                [sum(deltas[station_id]['times']) / len(deltas[station_id]['times'])
+                 if deltas[station_id]['times'] else None for station_id in station_ids]
             ))
-        
-        # Update station load if order is completed or cancelled
-        if station_id and (status == 'completed' or status == 'cancelled'):
-            # Decrement station load (with floor of 0)
+
+        transitioned = []
+        if targets:
             cursor.execute('''
-                UPDATE station_stats 
-                SET 
-                    current_load = GREATEST(0, current_load - 1),
-                    last_updated = %s
-                WHERE station_id = %s
-            ''', (datetime.now(), station_id))
-            
-            # For completed orders, update statistics
-            if status == 'completed':
-                # Increment total completed orders for station
-                cursor.execute('''
-                    UPDATE station_stats 
-                    SET 
-                        total_orders = total_orders + 1
-                    WHERE station_id = %s
-                ''', (station_id,))
-                
-                # If completion time is available, update station average
-                if completion_time:
-                    # Get current station statistics
-                    cursor.execute('''
-                        SELECT 
-                            avg_completion_time, 
-                            total_orders
-                        FROM station_stats 
-                        WHERE station_id = %s
-                    ''', (station_id,))
-                    
-                    stats_result = cursor.fetchone()
-                    if stats_result:
-                        current_avg, total_completed = stats_result
-                        
-                        # Calculate new weighted average
-                        # Give more weight to recent data (70% new, 30% historical)
-                        if total_completed <= 1:
-                            new_avg = completion_time
-                        else:
-                            new_avg = (current_avg * 0.3) + (completion_time * 0.7)
-                        
-                        # Update station's average completion time
-                        cursor.execute('''
-                            UPDATE station_stats 
-                            SET 
-                                avg_completion_time = %s
-                            WHERE station_id = %s
-                        ''', (int(new_avg), station_id))
-        
+                UPDATE orders o
+                SET status = %(status)s,
+                    last_modified_by = %(editor)s,
+                    updated_at = %(now)s,
+                    completion_time = CASE WHEN %(completing)s THEN t.completion_time
+                                           ELSE o.completion_time END,
+                    completed_at = CASE WHEN %(completing)s THEN %(now)s ELSE o.completed_at END
+                FROM unnest(%(ids)s::int[], %(times)s::int[]) AS t(id, completion_time)
+                WHERE o.id = t.id
+                RETURNING o.id, o.order_number, o.phone, o.station_id,
+                          o.completion_time, o.for_friend, o.coffee_type
+            ''', {
+                'ids': [row[0] for row in targets],
+                'times': [row[3] for row in targets],
+                'status': status,
+                'editor': editor or 'system',
+                'now': now,
+                'completing': completing
+            })
+            previous = {row[0]: row[1] for row in targets}
+            for order_id, order_number, phone, station_id, completion_time, for_friend, coffee_type \
+                    in sorted(cursor.fetchall()):
+                transitioned.append({
+                    'order_number': order_number,
+                    'phone': phone,
+                    'station_id': station_id,
+                    'previous_status': previous[order_id],
+                    'completion_time': completion_time,
+                    'for_friend': for_friend,
+                    'coffee_type': coffee_type
+                })
+
+        # Tell missing orders apart from ones already in the target status
+        moved = {order['order_number'] for order in transitioned}
+        cursor.execute('''
+            SELECT order_number FROM orders WHERE order_number = ANY(%s)
+        ''', ([number for number in order_numbers if number not in moved],))
+        existing = {row[0] for row in cursor.fetchall()}
+
         conn.commit()
-        
+
         return {
             'success': True,
-            'order_id': order_id,
-            'order_number': order_number,
             'status': status,
-            'station_id': station_id,
-            'completion_time': completion_time,
-            'phone': phone
+            'transitioned': transitioned,
+            'load_deltas': {station_id: delta['load'] for station_id, delta in deltas.items() if delta['load']},
+            'unchanged': [number for number in order_numbers if number in existing],
+            'not_found': [number for number in order_numbers
+                          if number not in moved and number not in existing]
         }
-    
+
     except Exception as e:
         if conn:
             conn.rollback()
-        
-        logger.error(f"Error updating order status: {str(e)}")
-        
+
+        logger.error(f"Error updating order statuses in bulk: {str(e)}")
+
         return {
             'success': False,
             'error': str(e)
         }
-    
+
     finally:
         if cursor:
             cursor.close()
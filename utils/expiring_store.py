@@ -0,0 +1,172 @@
+"""
+In-process key store with per-key expiry, speaking the slice of the Redis
+client API that jwt_security uses
+
+TokenBlacklist and SessionManager talk to either a redis client (created
+with decode_responses=True) or an ExpiringStore, with the same calls.
+
+Keys live in a dict, so lookups are O(1); a key past its expiry reads as
+missing even before it is purged. Expiry times also go on a min-heap, and
+every write pops whatever has expired off the top, so purging is amortized
+O(log n) per write and memory follows the live keys rather than everything
+ever written. Rewriting a key's expiry leaves its old heap entry behind; the
+heap is rebuilt from the live keys once stale entries outnumber them.
+"""
+import heapq
+import threading
+import time
+
+
+class ExpiringStore:
+    """Dict of keys with optional TTLs and an expiry heap"""
+
+    def __init__(self, clock=time.monotonic):
+        """
+        Initialize the store
+
+        Args:
+            clock: Seconds source; tests and benchmarks can pass a fake one
+        """
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._data = {}       # key -> value (str or set)
+        self._expires = {}    # key -> expiry, for keys that have one
+        self._heap = []       # (expiry, key); stale when it no longer matches _expires
+
+        self._metrics = {
+            'purged': 0,
+            'compactions': 0
+        }
+
+    def _alive(self, key, now):
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= now:
+            self._remove(key)
+            self._metrics['purged'] += 1
+            return False
+        return key in self._data
+
+    def _remove(self, key):
+        self._data.pop(key, None)
+        self._expires.pop(key, None)
+
+    def _set_expiry(self, key, seconds, now):
+        expires_at = now + seconds
+        self._expires[key] = expires_at
+        heapq.heappush(self._heap, (expires_at, key))
+
+    def _purge(self, now):
+        """Drop expired keys off the top of the heap; compact when mostly stale"""
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            if self._expires.get(key) == expires_at:
+                self._remove(key)
+                self._metrics['purged'] += 1
+        if len(heap) > 2 * len(self._expires) + 64:
+            self._heap = [(expires_at, key) for key, expires_at in self._expires.items()]
+            heapq.heapify(self._heap)
+            self._metrics['compactions'] += 1
+
+    def ping(self):
+        return True
+
+    def purge(self):
+        """Drop expired keys now rather than on the next write"""
+        with self._lock:
+            self._purge(self._clock())
+
+    def setex(self, key, seconds, value):
+        """Set a string value that expires after `seconds`"""
+        now = self._clock()
+        with self._lock:
+            self._purge(now)
+            self._data[key] = str(value)
+            self._set_expiry(key, seconds, now)
+        return True
+
+    def get(self, key):
+        """String value, or None if missing or expired"""
+        with self._lock:
+            if not self._alive(key, self._clock()):
+                return None
+            return self._data[key]
+
+    def exists(self, *keys):
+        """Number of the given keys that are present"""
+        now = self._clock()
+        with self._lock:
+            return sum(1 for key in keys if self._alive(key, now))
+
+    def delete(self, *keys):
+        """Remove keys; returns how many were present"""
+        now = self._clock()
+        with self._lock:
+            removed = sum(1 for key in keys if self._alive(key, now))
+            for key in keys:
+                self._remove(key)
+        return removed
+
+    def expire(self, key, seconds):
+        """Reset a key's TTL; returns whether the key exists"""
+        now = self._clock()
+        with self._lock:
+            self._purge(now)
+            if not self._alive(key, now):
+                return False
+            self._set_expiry(key, seconds, now)
+            return True
+
+    def ttl(self, key):
+        """Whole seconds left, -1 with no expiry, -2 if missing"""
+        now = self._clock()
+        with self._lock:
+            if not self._alive(key, now):
+                return -2
+            expires_at = self._expires.get(key)
+            return -1 if expires_at is None else int(expires_at - now)
+
+    def sadd(self, key, *members):
+        """Add to a set (created without an expiry); returns members added"""
+        now = self._clock()
+        with self._lock:
+            self._purge(now)
+            if not self._alive(key, now):
+                self._data[key] = set()
+            members_set = self._data[key]
+            before = len(members_set)
+            members_set.update(str(member) for member in members)
+            return len(members_set) - before
+
+    def srem(self, key, *members):
+        """Remove from a set; an emptied set is deleted, as in Redis"""
+        now = self._clock()
+        with self._lock:
+            if not self._alive(key, now):
+                return 0
+            members_set = self._data[key]
+            before = len(members_set)
+            members_set.difference_update(str(member) for member in members)
+            if not members_set:
+                self._remove(key)
+            return before - len(members_set)
+
+    def smembers(self, key):
+        """Copy of a set's members (empty if missing)"""
+        with self._lock:
+            if not self._alive(key, self._clock()):
+                return set()
+            return set(self._data[key])
+
+    def dbsize(self):
+        """Number of keys, counting expired ones not yet purged"""
+        with self._lock:
+            return len(self._data)
+
+    def get_metrics(self):
+        """Snapshot of store metrics"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['keys'] = len(self._data)
+            metrics['heap'] = len(self._heap)
+        return metrics
@@ -0,0 +1,142 @@
+"""
+Queue-backed logging so request threads never wait on log files or the console
+
+LogQueue.start() takes the handlers off the root logger and the
+security_monitoring file loggers and puts a QueueHandler in their place. One
+QueueListener thread formats records and writes them to the original
+handlers, each record going only to the handlers of the logger it was queued
+from, so propagation behaves as before.
+
+The queue is bounded. When the listener cannot keep up, records are dropped
+and counted rather than blocking the request that logged them.
+"""
+import atexit
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_QUEUE_SIZE = 10000
+QUEUED_LOGGERS = ('', 'api_access', 'security_audit')   # '' is the root logger
+
+
+class _RoutedQueueHandler(QueueHandler):
+    """Queues (logger name, record) so the listener knows whose handlers to use"""
+
+    def __init__(self, log_queue, route):
+        super().__init__(log_queue.queue)
+        self._log_queue = log_queue
+        self.route = route
+
+    def prepare(self, record):
+        # Merge the arguments now so later changes to them cannot leak into
+        # the message; the handlers' formatters run on the listener thread
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait((self.route, record))
+            self._log_queue._metrics['queued'] += 1
+        except queue.Full:
+            self._log_queue._metrics['dropped'] += 1
+
+
+class _RoutedQueueListener(QueueListener):
+    """Hands each queued record to the handlers of the logger it came from"""
+
+    def __init__(self, log_queue, routes):
+        super().__init__(log_queue, respect_handler_level=True)
+        self.routes = routes
+
+    def enqueue_sentinel(self):
+        # Wait for room rather than fail to stop when the queue is full
+        self.queue.put(self._sentinel)
+
+    def handle(self, item):
+        route, record = item
+        for handler in self.routes.get(route, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+class LogQueue:
+    """Moves configured loggers' handlers behind a bounded queue and one writer thread"""
+
+    def __init__(self, maxsize=LOG_QUEUE_SIZE):
+        """
+        Initialize the log queue
+
+        Args:
+            maxsize: Records held before new ones are dropped
+        """
+        self.queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._listener = None
+        self._routes = {}
+
+        self._metrics = {
+            'queued': 0,
+            'dropped': 0
+        }
+
+    @property
+    def running(self):
+        return self._listener is not None
+
+    def start(self, logger_names=QUEUED_LOGGERS):
+        """
+        Route the named loggers' handlers through the queue
+
+        Args:
+            logger_names: Loggers whose handlers move to the listener thread;
+                loggers without handlers are left alone
+        """
+        with self._lock:
+            if self._listener is not None:
+                return
+            for name in logger_names:
+                target = logging.getLogger(name)
+                handlers = [h for h in target.handlers if not isinstance(h, QueueHandler)]
+                if not handlers:
+                    continue
+                for handler in handlers:
+                    target.removeHandler(handler)
+                self._routes[name] = handlers
+                target.addHandler(_RoutedQueueHandler(self, name))
+            self._listener = _RoutedQueueListener(self.queue, self._routes)
+            self._listener.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Flush queued records and give the loggers their handlers back"""
+        with self._lock:
+            if self._listener is None:
+                return
+            self._listener.stop()
+            self._listener = None
+            for name, handlers in self._routes.items():
+                target = logging.getLogger(name)
+                for handler in list(target.handlers):
+                    if isinstance(handler, _RoutedQueueHandler):
+                        target.removeHandler(handler)
+                for handler in handlers:
+                    target.addHandler(handler)
+            self._routes = {}
+
+    def get_metrics(self):
+        """Snapshot of queue metrics"""
+        metrics = dict(self._metrics)
+        metrics['depth'] = self.queue.qsize()
+        metrics['running'] = self.running
+        return metrics
+
+
+_log_queue = LogQueue()
+
+
+def get_log_queue():
+    """Process-wide log queue"""
+    return _log_queue